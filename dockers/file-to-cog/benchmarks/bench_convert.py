@@ -0,0 +1,211 @@
+"""Benchmark NetCDF to COG conversion: single pass vs three steps.
+
+The three steps path is the former `generate_cog`: `gdal_translate` to a
+GTiff, `gdalwarp` to a second GTiff then `cog_translate`. When the GDAL
+command line tools are not installed, the same steps are run with rasterio.
+
+Peak temporary disk use is sampled in the working and temp directories.
+
+    $ python benchmarks/bench_convert.py --size 4000
+    $ python benchmarks/bench_convert.py --input file.nc --bandname corr
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+import numpy
+
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.vrt import WarpedVRT
+from rasterio.transform import from_origin
+from rio_cogeo.cogeo import cog_translate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from file_to_cog.convert import (  # noqa
+    TARGET_CRS,
+    cog_config,
+    cog_profile,
+    generate_cog,
+    get_nodata,
+    source_path,
+)
+
+
+def make_netcdf(path, width, height):
+    """Write a synthetic float32 UTM NetCDF file (variable `Band1`)."""
+    yy, xx = numpy.mgrid[0:height, 0:width]
+    data = (numpy.sin(xx / 50.0) * numpy.cos(yy / 70.0) * 100).astype("float32")
+    data[:, : width // 10] = numpy.nan
+
+    profile = dict(
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=1,
+        dtype="float32",
+        crs="EPSG:32606",
+        transform=from_origin(400000, 7000000, 240, 240),
+        nodata=numpy.nan,
+    )
+    with MemoryFile() as mem:
+        with mem.open(**profile) as dst:
+            dst.write(data, 1)
+        with mem.open() as src_dst:
+            rasterio.shutil.copy(src_dst, path, driver="netCDF")
+
+
+def three_steps(sourcefile, bandname, out_cog):
+    """Former `generate_cog` implementation."""
+    translated = f"{sourcefile}.tif"
+    reprojected = f"{sourcefile}_reprojected.tif"
+    src_path = source_path(sourcefile, bandname)
+
+    if shutil.which("gdal_translate") and shutil.which("gdalwarp"):
+        os.system(f"gdal_translate {src_path} -of GTiff {translated} -q")
+        os.system(f"gdalwarp {translated} {reprojected} -t_srs '{TARGET_CRS}' -q")
+    else:
+        rasterio.shutil.copy(src_path, translated, driver="GTiff")
+        with rasterio.open(translated) as src_dst:
+            params = dict(crs=TARGET_CRS, dtype=src_dst.dtypes[0])
+            if src_dst.nodata is not None:
+                params.update(src_nodata=src_dst.nodata, nodata=src_dst.nodata)
+            with WarpedVRT(src_dst, **params) as vrt_dst:
+                rasterio.shutil.copy(vrt_dst, reprojected, driver="GTiff")
+
+    with rasterio.open(reprojected) as src_dst:
+        nodata = get_nodata(src_dst)
+
+    cog_translate(
+        reprojected,
+        out_cog,
+        cog_profile(),
+        nodata=nodata,
+        overview_resampling="bilinear",
+        in_memory=False,
+        config=cog_config(),
+        quiet=True,
+    )
+    os.remove(translated)
+    os.remove(reprojected)
+    return out_cog
+
+
+def single_pass(sourcefile, bandname, out_cog):
+    """Current `generate_cog` implementation."""
+    return generate_cog(sourcefile, {"bandname": bandname, "output": out_cog})
+
+
+class DiskSampler(threading.Thread):
+    """Sample the size of files in `directories`, except `ignore`."""
+
+    def __init__(self, directories, ignore, interval=0.01):
+        """Initialize sampler."""
+        super().__init__(daemon=True)
+        self.directories = directories
+        self.ignore = set(os.path.abspath(p) for p in ignore)
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def size(self):
+        """Return current size of files in directories."""
+        total = 0
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.abspath(os.path.join(root, name))
+                    if path in self.ignore:
+                        continue
+                    try:
+                        total += os.path.getsize(path)
+                    except OSError:
+                        pass
+        return total
+
+    def run(self):
+        """Sample until stopped."""
+        while not self._done.is_set():
+            self.peak = max(self.peak, self.size())
+            time.sleep(self.interval)
+
+    def stop(self):
+        """Stop sampling."""
+        self._done.set()
+        self.join()
+
+
+def run(sourcefile, bandname, workdir, repeat=1):
+    """Run benchmark, return results list."""
+    tmpdir = os.path.join(workdir, "tmp")
+    os.makedirs(tmpdir, exist_ok=True)
+    tempfile.tempdir = tmpdir
+
+    results = []
+    for name, method in (("three-steps", three_steps), ("single-pass", single_pass)):
+        for _ in range(repeat):
+            out_cog = os.path.join(workdir, f"{name}.cog.tif")
+            sampler = DiskSampler(
+                [os.path.dirname(os.path.abspath(sourcefile)), tmpdir],
+                ignore=[sourcefile, out_cog],
+            )
+            sampler.start()
+            t0 = time.perf_counter()
+            method(sourcefile, bandname, out_cog)
+            elapsed = time.perf_counter() - t0
+            sampler.stop()
+
+            results.append(
+                {
+                    "method": name,
+                    "time_s": round(elapsed, 3),
+                    "peak_temp_mb": round(sampler.peak / 1e6, 2),
+                    "output_mb": round(os.path.getsize(out_cog) / 1e6, 2),
+                }
+            )
+            os.remove(out_cog)
+    return results
+
+
+def main():
+    """Parse arguments and run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", help="NetCDF file (default: synthetic file)")
+    parser.add_argument("--bandname", default="Band1", help="NetCDF variable")
+    parser.add_argument("--size", type=int, default=4000, help="synthetic width")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json", help="write results to a JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_convert_")
+    try:
+        sourcefile = args.input
+        if not sourcefile:
+            sourcefile = os.path.join(workdir, "input", "synthetic.nc")
+            os.makedirs(os.path.dirname(sourcefile))
+            make_netcdf(sourcefile, args.size, args.size * 3 // 4)
+
+        results = run(sourcefile, args.bandname, workdir, repeat=args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+    cols = ["method", "time_s", "peak_temp_mb", "output_mb"]
+    print("\t".join(cols))
+    for res in results:
+        print("\t".join(str(res[c]) for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Benchmark HDF5 to COG conversion: GDAL HDF5 driver vs chunk aligned h5py.
+
+A synthetic netCDF4-like HDF5 file (gzip compressed chunks, latitude and
+longitude dimension scales, rows stored south to north) is converted:
+
+- through the GDAL HDF5 driver, read by 1024x1024 windows (as
+  `file_to_cog.convert.convert` reads NetCDF variables) to an in-memory
+  GeoTIFF, then `cog_translate`. The driver does not read the dimension
+  scales, so the geolocation is taken from `file_to_cog.hdf5.geolocation`,
+- with `file_to_cog.hdf5.convert_hdf5`: windows of whole chunks read with
+  h5py and written straight to the in-memory GeoTIFF.
+
+The read pass (copy to an in-memory GeoTIFF) and the whole conversion are
+timed for each chunk shape, and both outputs are compared pixel by pixel.
+
+    $ python benchmarks/bench_hdf5.py --size 6000 --chunks 100x300,750x750,1x6000
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy
+import h5py
+
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from file_to_cog.convert import _translate, cog_config  # noqa
+from file_to_cog.hdf5 import convert_hdf5, geolocation, get_nodata, write_dataset  # noqa
+from file_to_cog.warp import block_windows  # noqa
+
+DATASET = "/grids/sst"
+
+
+def make_hdf5(path, width, height, chunks, compression_opts=4):
+    """Write a synthetic float32 HDF5 file with lat/lon dimension scales."""
+    res = 0.01
+    lat = -30 + res / 2 + numpy.arange(height) * res
+    lon = 10 + res / 2 + numpy.arange(width) * res
+
+    with h5py.File(path, "w") as h5:
+        group = h5.create_group("grids")
+        lat_dset = group.create_dataset("lat", data=lat)
+        lon_dset = group.create_dataset("lon", data=lon)
+        lat_dset.make_scale("lat")
+        lon_dset.make_scale("lon")
+
+        dset = group.create_dataset(
+            "sst",
+            shape=(height, width),
+            dtype="float32",
+            chunks=chunks,
+            compression="gzip",
+            compression_opts=compression_opts,
+        )
+        dset.attrs["_FillValue"] = numpy.float32(-9999)
+        dset.dims[0].attach_scale(lat_dset)
+        dset.dims[1].attach_scale(lon_dset)
+
+        for row in range(0, height, chunks[0] * 8):
+            rows = min(chunks[0] * 8, height - row)
+            yy, xx = numpy.mgrid[row : row + rows, 0:width]
+            data = (numpy.sin(xx / 50.0) * numpy.cos(yy / 70.0) * 100).astype("float32")
+            data[:, : width // 10] = -9999
+            dset[row : row + rows] = data
+
+
+def _copy_gdal(sourcefile, dst, flip):
+    """Copy the dataset through the GDAL HDF5 driver, by 1024x1024 windows."""
+    with rasterio.open(f'HDF5:"{sourcefile}":/{DATASET}') as src_dst:
+        for window in block_windows(src_dst.width, src_dst.height, 1024):
+            data = src_dst.read(window=window)
+            if flip:
+                # The driver returns the rows as stored (south to north).
+                data = data[:, ::-1]
+                window = Window(
+                    window.col_off,
+                    src_dst.height - window.row_off - window.height,
+                    window.width,
+                    window.height,
+                )
+            dst.write(data, window=window)
+
+
+def _copy_h5py(sourcefile, dst, flip):
+    """Copy the dataset by windows of whole chunks."""
+    with h5py.File(sourcefile, "r") as h5:
+        write_dataset(h5[DATASET], dst, flip)
+
+
+def _profile(sourcefile):
+    with h5py.File(sourcefile, "r") as h5:
+        dset = h5[DATASET]
+        crs, transform, flip = geolocation(dset)
+        profile = dict(
+            driver="GTiff",
+            width=dset.shape[1],
+            height=dset.shape[0],
+            count=1,
+            dtype=dset.dtype.name,
+            crs=crs,
+            transform=transform,
+            nodata=get_nodata(dset),
+            tiled=True,
+        )
+    return profile, flip
+
+
+def read_time(copy, sourcefile):
+    """Time the copy of the dataset to an in-memory GeoTIFF."""
+    profile, flip = _profile(sourcefile)
+    with MemoryFile() as mem, mem.open(**profile) as dst:
+        t0 = time.perf_counter()
+        copy(sourcefile, dst, flip)
+        return time.perf_counter() - t0
+
+
+def convert_gdal(sourcefile, out_cog):
+    """Convert through the GDAL HDF5 driver (as the NetCDF path)."""
+    profile, flip = _profile(sourcefile)
+    config = cog_config()
+    with rasterio.Env(**config), MemoryFile() as mem:
+        with mem.open(**profile) as tmp_dst:
+            _copy_gdal(sourcefile, tmp_dst, flip)
+        with mem.open() as tmp_dst:
+            _translate(tmp_dst, out_cog, None, profile["nodata"], None, config)
+    return out_cog
+
+
+def convert_h5py(sourcefile, out_cog):
+    """Convert with `file_to_cog.hdf5` (no statistics, as the GDAL path)."""
+    return convert_hdf5(sourcefile, out_cog, {"stats": False})
+
+
+METHODS = (
+    ("gdal_hdf5_driver", _copy_gdal, convert_gdal),
+    ("h5py_chunk_aligned", _copy_h5py, convert_h5py),
+)
+
+
+def main():
+    """Parse arguments and run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=6000, help="synthetic width")
+    parser.add_argument(
+        "--chunks",
+        default="100x300,750x750,1x6000",
+        help="comma separated HDF5 chunk shapes (rows x cols)",
+    )
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--json", help="write results to a JSON file")
+    args = parser.parse_args()
+
+    width, height = args.size, args.size * 3 // 4
+    results = []
+    for chunks in args.chunks.split(","):
+        chunk_shape = tuple(int(c) for c in chunks.split("x"))
+        workdir = tempfile.mkdtemp(prefix="bench_hdf5_")
+        try:
+            sourcefile = os.path.join(workdir, "synthetic.h5")
+            make_hdf5(sourcefile, width, height, chunk_shape)
+
+            outputs = []
+            for name, copy, convert in METHODS:
+                out_cog = os.path.join(workdir, f"{name}.tif")
+                read_s = min(read_time(copy, sourcefile) for _ in range(args.repeat))
+                total_s = []
+                for _ in range(args.repeat):
+                    t0 = time.perf_counter()
+                    convert(sourcefile, out_cog)
+                    total_s.append(time.perf_counter() - t0)
+
+                with rasterio.open(out_cog) as src_dst:
+                    outputs.append(src_dst.read())
+                results.append(
+                    {
+                        "method": name,
+                        "chunks": chunks,
+                        "read_s": round(read_s, 3),
+                        "read_mpixel_s": round(width * height / 1e6 / read_s, 2),
+                        "total_s": round(min(total_s), 3),
+                        "size_mb": round(os.path.getsize(out_cog) / 1e6, 2),
+                        "identical": numpy.array_equal(outputs[0], outputs[-1]),
+                    }
+                )
+        finally:
+            shutil.rmtree(workdir)
+
+    cols = [
+        "method",
+        "chunks",
+        "read_s",
+        "read_mpixel_s",
+        "total_s",
+        "size_mb",
+        "identical",
+    ]
+    print("\t".join(cols))
+    for res in results:
+        print("\t".join(str(res[c]) for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
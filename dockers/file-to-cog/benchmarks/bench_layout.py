@@ -0,0 +1,138 @@
+"""Benchmark tile read latency: geographic vs web mercator aligned COGs.
+
+The same synthetic NetCDF file is converted to a geographic COG (default
+output) and to a web mercator aligned COG (`web_optimized`). The same
+mercator tiles (native zoom and two levels above) are read from both with
+`rio_tiler.main.tile` and, when the tiler package is available, from the
+aligned COG with `tiler.aligned.tile` (block copies, no `WarpedVRT`).
+
+    $ python benchmarks/bench_layout.py --size 4000
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import tempfile
+
+import mercantile
+import rasterio
+from rasterio.warp import transform_bounds
+
+from rio_tiler import main as cogeo
+
+root = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(root, ".."))
+sys.path.insert(0, os.path.join(root, "..", "..", "..", "tiler-deployment"))
+
+from bench_convert import make_netcdf  # noqa
+from file_to_cog.convert import convert, source_path  # noqa
+from file_to_cog.mercator import native_zoom  # noqa
+
+try:
+    from tiler import aligned
+except ImportError:  # pragma: no cover
+    aligned = None
+
+
+def bench_tiles(path, per_zoom=16):
+    """Return tiles fully inside the dataset, at its native zoom and above."""
+    with rasterio.open(path) as src_dst:
+        maxzoom = native_zoom(src_dst)
+        west, south, east, north = transform_bounds(
+            src_dst.crs, "epsg:4326", *src_dst.bounds, densify_pts=21
+        )
+
+    tiles = []
+    for zoom in (maxzoom, maxzoom - 1, maxzoom - 2):
+        inside = [
+            t
+            for t in mercantile.tiles(west, south, east, north, zooms=zoom)
+            if mercantile.bounds(t).west >= west
+            and mercantile.bounds(t).east <= east
+            and mercantile.bounds(t).south >= south
+            and mercantile.bounds(t).north <= north
+        ]
+        step = max(len(inside) // per_zoom, 1)
+        tiles.extend(inside[::step][:per_zoom])
+    return tiles
+
+
+def latency(tiler, path, tiles, repeat=3):
+    """Return median and p95 tile latency in ms."""
+    timings = []
+    for _ in range(repeat):
+        for tile in tiles:
+            t0 = time.perf_counter()
+            tiler(path, tile.x, tile.y, tile.z, resampling_method="nearest")
+            timings.append((time.perf_counter() - t0) * 1000)
+    timings.sort()
+    return (
+        round(statistics.median(timings), 3),
+        round(timings[int(len(timings) * 0.95) - 1], 3),
+    )
+
+
+def main():
+    """Parse arguments and run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", help="NetCDF file (default: synthetic file)")
+    parser.add_argument("--bandname", default="Band1", help="NetCDF variable")
+    parser.add_argument("--size", type=int, default=4000, help="synthetic width")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write results to a JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_layout_")
+    try:
+        sourcefile = args.input
+        if not sourcefile:
+            sourcefile = os.path.join(workdir, "synthetic.nc")
+            make_netcdf(sourcefile, args.size, args.size * 3 // 4)
+        src_path = source_path(sourcefile, args.bandname)
+
+        geographic = convert(src_path, os.path.join(workdir, "geographic.tif"))
+        mercator = convert(
+            src_path, os.path.join(workdir, "mercator.tif"), {"web_optimized": True}
+        )
+        tiles = bench_tiles(geographic)
+
+        runs = [
+            ("geographic", "rio_tiler.main.tile", cogeo.tile, geographic),
+            ("mercator", "rio_tiler.main.tile", cogeo.tile, mercator),
+        ]
+        if aligned:
+            runs.append(("mercator", "tiler.aligned.tile", aligned.tile, mercator))
+
+        results = []
+        for layout, reader, tiler, path in runs:
+            p50, p95 = latency(tiler, path, tiles, args.repeat)
+            results.append(
+                {
+                    "layout": layout,
+                    "reader": reader,
+                    "tiles": len(tiles),
+                    "p50_ms": p50,
+                    "p95_ms": p95,
+                    "size_mb": round(os.path.getsize(path) / 1e6, 2),
+                }
+            )
+    finally:
+        shutil.rmtree(workdir)
+
+    cols = ["layout", "reader", "tiles", "p50_ms", "p95_ms", "size_mb"]
+    print("\t".join(cols))
+    for res in results:
+        print("\t".join(str(res[c]) for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
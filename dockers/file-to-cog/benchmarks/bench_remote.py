@@ -0,0 +1,201 @@
+"""Benchmark remote inputs: full download vs ranged reads of one variable.
+
+A synthetic netCDF4-like file (several gzip compressed variables, latitude
+and longitude dimension scales) is served by a local HTTP range server
+(`file_to_cog.validate.RangeCountingServerProcess`, with a simulated
+latency per request), and one variable is converted:
+
+- download: the whole file is downloaded, then converted locally,
+- gdal_vsicurl: the .nc file is read through /vsicurl/ by the GDAL netCDF
+  driver (`file_to_cog.convert.convert`),
+- h5py_range_file: the .h5 file is read by h5py from a
+  `file_to_cog.remote.RangeFile` (`file_to_cog.hdf5.convert_hdf5`), with and
+  without read-ahead.
+
+Requests and bytes fetched are counted by the server and reported against
+the file size; outputs are compared to the local conversion.
+
+    $ python benchmarks/bench_remote.py --size 4000 --variables 4 --latency-ms 30
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import urllib.request
+
+import numpy
+import h5py
+
+import rasterio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from file_to_cog.convert import convert, source_path  # noqa
+from file_to_cog.hdf5 import convert_hdf5  # noqa
+from file_to_cog.remote import REMOTE_READAHEAD_BLOCKS, RangeFile  # noqa
+from file_to_cog.validate import RangeCountingServerProcess  # noqa
+from file_to_cog import hdf5  # noqa
+
+
+def make_file(path, width, height, variables, chunks=(250, 250)):
+    """Write a synthetic netCDF4-like file of `variables` float32 variables."""
+    res = 0.01
+    lat = -30 + res / 2 + numpy.arange(height) * res
+    lon = 10 + res / 2 + numpy.arange(width) * res
+    yy, xx = numpy.mgrid[0:height, 0:width]
+
+    with h5py.File(path, "w") as h5:
+        lat_dset = h5.create_dataset("lat", data=lat)
+        lon_dset = h5.create_dataset("lon", data=lon)
+        lat_dset.make_scale("lat")
+        lon_dset.make_scale("lon")
+        for ix in range(variables):
+            dset = h5.create_dataset(
+                f"v{ix}",
+                shape=(height, width),
+                dtype="float32",
+                chunks=chunks,
+                compression="gzip",
+            )
+            noise = numpy.random.RandomState(ix).rand(height, width)
+            dset[:] = (numpy.sin(xx / 50.0 + ix) * 100 + noise).astype("float32")
+            dset.dims[0].attach_scale(lat_dset)
+            dset.dims[1].attach_scale(lon_dset)
+
+
+def download(url, path):
+    """Download a whole file."""
+    with urllib.request.urlopen(url) as resp, open(path, "wb") as f:
+        shutil.copyfileobj(resp, f, 1024 * 1024)
+    return path
+
+
+class _NoReadAhead(RangeFile):
+    def __init__(self, url):
+        super().__init__(url, readahead=0)
+
+
+def run(name, func, server, read_id, size):
+    """Run a conversion, return its time and the server requests."""
+    t0 = time.perf_counter()
+    out_cog = func(f"{server.url}/_read/{read_id}")
+    elapsed = time.perf_counter() - t0
+    requests = server.requests().get(read_id, [])
+    fetched = sum(end - start + 1 for ranges in requests for start, end in ranges)
+    return out_cog, {
+        "method": name,
+        "time_s": round(elapsed, 3),
+        "requests": len(requests),
+        "fetched_mb": round(fetched / 1e6, 2),
+        "size_mb": round(size / 1e6, 2),
+        "fetched_ratio": round(fetched / float(size), 3),
+    }
+
+
+def main():
+    """Parse arguments and run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=4000, help="synthetic width")
+    parser.add_argument("--variables", type=int, default=4)
+    parser.add_argument(
+        "--latency-ms", type=float, default=30, help="simulated latency per request"
+    )
+    parser.add_argument("--json", help="write results to a JSON file")
+    args = parser.parse_args()
+
+    width, height = args.size, args.size * 3 // 4
+    options = {"stats": False}
+    workdir = tempfile.mkdtemp(prefix="bench_remote_")
+    try:
+        make_file(os.path.join(workdir, "synthetic.nc"), width, height, args.variables)
+        os.link(
+            os.path.join(workdir, "synthetic.nc"), os.path.join(workdir, "synthetic.h5")
+        )
+        size = os.path.getsize(os.path.join(workdir, "synthetic.nc"))
+        out = os.path.join(workdir, "out")
+        os.makedirs(out)
+
+        reference = os.path.join(out, "local.tif")
+        convert(
+            source_path(os.path.join(workdir, "synthetic.nc"), "v0"), reference, options
+        )
+
+        def _download(url):
+            local = download(f"{url}/synthetic.nc", os.path.join(out, "synthetic.nc"))
+            return convert(
+                source_path(local, "v0"), os.path.join(out, "download.tif"), options
+            )
+
+        def _gdal(url):
+            return convert(
+                source_path(f"{url}/synthetic.nc", "v0"),
+                os.path.join(out, "gdal.tif"),
+                options,
+            )
+
+        def _h5py(url):
+            return convert_hdf5(
+                f"{url}/synthetic.h5",
+                os.path.join(out, "h5py.tif"),
+                dict(options, bandname="v0"),
+            )
+
+        def _h5py_no_readahead(url):
+            hdf5.RangeFile = _NoReadAhead
+            try:
+                return convert_hdf5(
+                    f"{url}/synthetic.h5",
+                    os.path.join(out, "h5py_no_readahead.tif"),
+                    dict(options, bandname="v0"),
+                )
+            finally:
+                hdf5.RangeFile = RangeFile
+
+        methods = (
+            ("download", _download),
+            ("gdal_vsicurl", _gdal),
+            ("h5py_range_file", _h5py),
+            ("h5py_range_file_no_readahead", _h5py_no_readahead),
+        )
+
+        with rasterio.open(reference) as src_dst:
+            expected = src_dst.read()
+
+        results = []
+        with RangeCountingServerProcess(workdir, args.latency_ms / 1000.0) as server:
+            for read_id, (name, func) in enumerate(methods):
+                out_cog, result = run(name, func, server, str(read_id), size)
+                with rasterio.open(out_cog) as src_dst:
+                    result["identical"] = numpy.array_equal(
+                        src_dst.read(), expected, equal_nan=True
+                    )
+                results.append(result)
+    finally:
+        shutil.rmtree(workdir)
+
+    print(f"read-ahead: {REMOTE_READAHEAD_BLOCKS} blocks")
+    cols = [
+        "method",
+        "time_s",
+        "requests",
+        "fetched_mb",
+        "size_mb",
+        "fetched_ratio",
+        "identical",
+    ]
+    print("\t".join(cols))
+    for res in results:
+        print("\t".join(str(res[c]) for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
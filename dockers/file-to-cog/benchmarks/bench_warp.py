@@ -0,0 +1,179 @@
+"""Benchmark reprojection: whole dataset `WarpedVRT` vs windowed process pool.
+
+Each run (and the synthetic input creation) is executed in a fresh process,
+so the peak RSS reported (the maximum of the run process and of its worker
+processes) is not polluted by previous runs: Linux keeps the peak RSS of a
+process across `exec`.
+
+    $ python benchmarks/bench_warp.py --sizes 2000,4000,8000 --workers 1,2,4
+    $ python benchmarks/bench_warp.py --sizes 8000 --memory-mb 64
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+import rasterio
+from rasterio.vrt import WarpedVRT
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from file_to_cog.convert import TARGET_CRS, get_nodata, source_path  # noqa
+from file_to_cog.warp import BLOCKSIZE, WARP_MEMORY_MB, warp  # noqa
+
+
+def warp_vrt(src_path, dst_path):
+    """Reproject the whole dataset through a `WarpedVRT` (single process)."""
+    with rasterio.open(src_path) as src_dst:
+        nodata = get_nodata(src_dst)
+        params = dict(crs=TARGET_CRS, dtype=src_dst.dtypes[0])
+        if nodata is not None:
+            params.update(src_nodata=nodata, nodata=nodata)
+        with WarpedVRT(src_dst, **params) as vrt_dst:
+            rasterio.shutil.copy(
+                vrt_dst,
+                dst_path,
+                driver="GTiff",
+                tiled=True,
+                blockxsize=BLOCKSIZE,
+                blockysize=BLOCKSIZE,
+            )
+
+
+def warp_windowed(src_path, dst_path, workers, memory_mb):
+    """Reproject the dataset window by window (`file_to_cog.warp`)."""
+    with rasterio.open(src_path) as src_dst:
+        nodata = get_nodata(src_dst)
+    warp(
+        src_path,
+        dst_path,
+        TARGET_CRS,
+        nodata=nodata,
+        workers=workers,
+        memory_mb=memory_mb,
+    )
+
+
+def peak_rss_mb():
+    """Return the peak RSS of this process and of its children, in MB."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak / 1024.0
+
+
+def child(args):
+    """Run one reprojection and print its result."""
+    dst_path = f"{args.input}.warped.tif"
+    src_path = source_path(args.input, "Band1")
+    t0 = time.perf_counter()
+    if args.method == "vrt":
+        warp_vrt(src_path, dst_path)
+    else:
+        warp_windowed(src_path, dst_path, args.run_workers, args.memory_mb)
+    elapsed = time.perf_counter() - t0
+    os.remove(dst_path)
+    print(
+        json.dumps({"time_s": round(elapsed, 3), "peak_rss_mb": round(peak_rss_mb(), 1)})
+    )
+
+
+def make_input(sourcefile, size):
+    """Write the synthetic input in a fresh process."""
+    code = (
+        "import sys; sys.path.insert(0, sys.argv[1]); "
+        "from bench_convert import make_netcdf; "
+        "make_netcdf(sys.argv[2], int(sys.argv[3]), int(sys.argv[3]) * 3 // 4)"
+    )
+    cmd = [sys.executable, "-c", code, os.path.dirname(__file__), sourcefile, str(size)]
+    subprocess.run(cmd, check=True)
+
+
+def run_one(sourcefile, method, workers, memory_mb):
+    """Run one reprojection in a fresh process, return its result."""
+    cmd = [
+        sys.executable,
+        __file__,
+        "--child",
+        "--input",
+        sourcefile,
+        "--method",
+        method,
+        "--run-workers",
+        str(workers),
+        "--memory-mb",
+        str(memory_mb),
+    ]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    """Parse arguments and run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="2000,4000", help="synthetic widths")
+    parser.add_argument(
+        "--workers", help="comma separated worker counts (default: 1 to cpu count)"
+    )
+    parser.add_argument("--memory-mb", type=int, default=WARP_MEMORY_MB)
+    parser.add_argument("--json", help="write results to a JSON file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    parser.add_argument("--method", help=argparse.SUPPRESS)
+    parser.add_argument("--run-workers", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    cpus = multiprocessing.cpu_count()
+    if args.workers:
+        workers = [int(w) for w in args.workers.split(",")]
+    else:
+        workers = sorted(set([1, 2, 4, cpus]) & set(range(1, cpus + 1)))
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="bench_warp_")
+    try:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            sourcefile = os.path.join(workdir, f"synthetic_{size}.nc")
+            make_input(sourcefile, size)
+            mb = os.path.getsize(sourcefile) / 1e6
+
+            runs = [("vrt", 1)] + [("windowed", w) for w in workers]
+            for method, n in runs:
+                res = run_one(sourcefile, method, n, args.memory_mb)
+                res.update(
+                    size=size,
+                    input_mb=round(mb, 1),
+                    method=method,
+                    workers=n,
+                    mpix_s=round(size * size * 3 / 4 / 1e6 / res["time_s"], 2),
+                )
+                results.append(res)
+            os.remove(sourcefile)
+    finally:
+        shutil.rmtree(workdir)
+
+    cols = ["size", "input_mb", "method", "workers", "time_s", "mpix_s", "peak_rss_mb"]
+    print("\t".join(cols))
+    for res in results:
+        print("\t".join(str(res[c]) for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
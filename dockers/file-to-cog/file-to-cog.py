@@ -1,81 +1,174 @@
-import multiprocessing
-import numpy
-import os
-import rasterio
-from rio_cogeo.cogeo import cog_translate
-from rio_cogeo.profiles import cog_profiles
+import sys
+import json
 import argparse
 
-def generate_cog(sourcefile, options = {}):
-    try: 
-        # Create GTiff from source
-        gtiff_translate_output = f"{sourcefile}.tif"
-        sourcefile_format = 'NETCDF'
-        sourcefile_bandname = options.get('bandname')
-        command = "gdal_translate"
-        input_arg = f"{sourcefile_format}:{sourcefile}:{sourcefile_bandname}"
-        output_arg = f"-of GTiff {gtiff_translate_output}"
-        os.system(f"{command} {input_arg} {output_arg}")
-
-        # Reproject GeoTiff
-        reprojected_geotiff = f"{sourcefile}_reprojected.tif"
-        command = "gdalwarp"
-        input_arg = gtiff_translate_output
-        target_spatial_reference = '+proj=longlat +ellps=WGS84'
-        output_arg = f"{reprojected_geotiff} -t_srs '{target_spatial_reference}'"
-        os.system(f"{command} {input_arg} {output_arg}")
-
-        # Create Cloud-Optimized GTiff
-        MAX_THREADS = int(os.environ.get("MAX_THREADS", multiprocessing.cpu_count() * 5))
-        in_tif = os.path.join(reprojected_geotiff)
-        out_cog = os.path.join(f"{sourcefile}.cog.tif")
-
-        config = dict(
-            NUM_THREADS=MAX_THREADS,
-            GDAL_TIFF_OVR_BLOCKSIZE=os.environ.get("GDAL_TIFF_OVR_BLOCKSIZE", "128"),
-        )
-
-        source = rasterio.open(in_tif)
-        profile = cog_profiles.get("deflate")
-        profile.update({"blockxsize": 256, "blockysize": 256})
-
-        nodatavalue = numpy.nan if numpy.isnan(source.nodatavals[0]) else source.nodatavals[0]
-        cog_translate(
-            in_tif,
-            out_cog,
-            profile,
-            nodata=nodatavalue,
-            overview_resampling="bilinear",
-            config=config,
-            quiet=True
-        )
-
-        # Cleanup
-        os.system(f"rm {gtiff_translate_output}")
-        os.system(f"rm {reprojected_geotiff}")
-        return out_cog
-    except Exception as err:
-        print(f"Caught exception {err}\n")
-        return None
+from file_to_cog.convert import generate_cog, generate_cogs
+from file_to_cog.stack import stack
+from file_to_cog.report import METRICS_LOG, ConversionReport
+from file_to_cog.validate import validate_output
+from file_to_cog.upload import output_target
 
 if __name__ == "__main__":
     """
     args:
-    filename - file to use in generating cog
-    --src_fmt - optional, default NETCDF
-    --bandnames - required, comma-seperated list of bands
-    --reproject - optional, default 'True'
+    filename - file to use in generating cog (several files with --stack),
+               local path or http(s):// / s3:// url (read with ranged requests)
+    --bandname - required, name of the NetCDF variable (or HDF5 dataset),
+                 comma-separated list of variables or "all"
+    --output - optional, default {filename}.cog.tif (single variable), local
+               path or s3:// url
+    --outdir - optional, default filename directory (several variables),
+               local directory or s3:// prefix
+    --workers - optional, default cpu count (several variables)
     --nodata - nodata value, default numpy.nan or source.nodatavals[0]
+    --windowed - optional, reproject window by window in a process pool
+                 (default: datasets larger than IN_MEMORY_MAX_MB)
+    --memory-mb - optional, windowed reprojection memory budget per process
+    --autotune - optional, select the COG settings by benchmarking candidates
+                 on a sample of each variable
+    --web-optimized - optional, write EPSG:3857 COGs aligned on the mercator
+                      tile grid
+    --no-stats - optional, do not store band statistics (metadata and sidecar)
+    --attribute - optional, shapefile numeric field to burn (default: mask)
+    --resolution - optional, shapefile output pixel size (projection units)
+    --stack - optional, stack the files (one per date) into one multi-band
+              COG, bands ordered by date (default output
+              {first filename}.stack.cog.tif)
+    --metrics-log - optional, JSON lines file conversion reports are appended
+                    to (default: CONVERSION_METRICS_LOG)
+    --validate - optional, "flag" or "reject": check the COG structure and
+                 its range requests per tile and point read after conversion
+                 (default: COG_VALIDATE, no validation)
+    --part-size-mb - optional, S3 multipart upload part size (s3:// outputs,
+                     default: UPLOAD_PART_SIZE_MB or 16)
+    --upload-concurrency - optional, parallel part uploads (default:
+                           UPLOAD_CONCURRENCY or 8)
+    --endpoint-url - optional, S3 compatible endpoint (default: S3_ENDPOINT_URL
+                     or AWS)
+    --catalog - optional, tiler catalog database to add the COGs to (default:
+                COG_CATALOG)
+
+    Conversion reports (per-stage time and memory, output size, failure
+    reason) are printed as JSON.
     """
-    parser = argparse.ArgumentParser(description='Process some integers.')
-    parser.add_argument('filename', type=str, help='file for generating cog')
-    parser.add_argument('--bandname', help='required, name of band to generate cog')
+    parser = argparse.ArgumentParser(
+        description='Convert NetCDF variables or shapefiles to COG.'
+    )
+    parser.add_argument(
+        'filename', type=str, nargs='+', help='file for generating cog'
+    )
+    parser.add_argument(
+        '--bandname',
+        help='required, name of band to generate cog, comma-separated names or "all"',
+    )
+    parser.add_argument('--output', help='output COG path (single variable)')
+    parser.add_argument('--outdir', help='output directory (several variables)')
+    parser.add_argument('--workers', type=int, help='number of processes')
+    parser.add_argument('--nodata', type=float, help='custom nodata value')
+    parser.add_argument(
+        '--windowed',
+        action='store_true',
+        default=None,
+        help='reproject window by window in a process pool',
+    )
+    parser.add_argument(
+        '--memory-mb', type=int, help='windowed reprojection memory budget per process'
+    )
+    parser.add_argument(
+        '--autotune', action='store_true', help='select COG settings per variable'
+    )
+    parser.add_argument(
+        '--web-optimized',
+        action='store_true',
+        help='write EPSG:3857 COGs aligned on the mercator tile grid',
+    )
+    parser.add_argument(
+        '--no-stats', action='store_true', help='do not store band statistics'
+    )
+    parser.add_argument(
+        '--attribute', help='shapefile numeric field to burn (default: mask)'
+    )
+    parser.add_argument('--resolution', type=float, help='shapefile output pixel size')
+    parser.add_argument(
+        '--stack', action='store_true', help='stack the files into one COG by date'
+    )
+    parser.add_argument(
+        '--metrics-log', help='JSON lines file conversion reports are appended to'
+    )
+    parser.add_argument(
+        '--validate',
+        choices=['flag', 'reject'],
+        help='validate the COG layout and read cost after conversion',
+    )
+    parser.add_argument(
+        '--part-size-mb', type=int, help='S3 multipart upload part size, in MB'
+    )
+    parser.add_argument(
+        '--upload-concurrency', type=int, help='number of parallel part uploads'
+    )
+    parser.add_argument('--endpoint-url', help='S3 compatible endpoint')
+    parser.add_argument(
+        '--catalog', help='tiler catalog database to add the COGs to'
+    )
 
     args = parser.parse_args()
     options = {
-      'bandname': args.bandname
+      'bandname': args.bandname,
+      'output': args.output,
+      'outdir': args.outdir,
+      'nodata': args.nodata,
+      'windowed': args.windowed,
+      'memory_mb': args.memory_mb,
+      'autotune': args.autotune,
+      'web_optimized': args.web_optimized,
+      'stats': not args.no_stats,
+      'attribute': args.attribute,
+      'resolution': args.resolution,
+      'metrics_log': args.metrics_log,
+      'validate': args.validate,
+      'part_size_mb': args.part_size_mb,
+      'upload_concurrency': args.upload_concurrency,
+      'endpoint_url': args.endpoint_url,
+      'catalog': args.catalog,
     }
-    generate_cog(args.filename, options)
+
+    if args.stack:
+        output = args.output or f'{args.filename[0]}.stack.cog.tif'
+        report = ConversionReport(','.join(args.filename), output)
+        try:
+            with output_target(output, options, report) as local_output:
+                dates = stack(
+                    args.filename,
+                    local_output,
+                    options,
+                    max_workers=args.workers,
+                    report=report,
+                )
+                validate_output(local_output, options, report)
+            report.finish()
+        except Exception as err:
+            report.fail(err)
+            dates = None
+        print(json.dumps(dict(report.to_dict(), dates=dates)))
+        report.append(args.metrics_log or METRICS_LOG)
+        sys.exit(0 if report.status == 'ok' else 1)
+
+    if len(args.filename) > 1:
+        parser.error('several files can only be converted with --stack')
+    filename = args.filename[0]
+
+    if args.bandname and (args.bandname == 'all' or ',' in args.bandname):
+        results = generate_cogs(
+            filename, args.bandname, options, max_workers=args.workers
+        )
+        for result in results:
+            print(json.dumps(result))
+        sys.exit(0 if all(r['status'] == 'ok' for r in results) else 1)
+
+    sys.exit(0 if generate_cog(filename, options) else 1)
 
 # # For testing
 # python file-to-cog.py 'L8_001_004_016_2014_080_2014_096_v1.1.nc' --bandname corr
+# python file-to-cog.py 'MUR-JPL-L4_GHRSST-SSTfnd-v02.0-fv04.1.nc' --bandname all
+# python file-to-cog.py 'traj57438_LVIS_SHP.zip' --resolution 0.0001
+# python file-to-cog.py 2019*-MUR-*.nc --bandname analysed_sst --stack --output sst.tif
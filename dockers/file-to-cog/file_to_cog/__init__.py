@@ -0,0 +1 @@
+"""file_to_cog: convert NetCDF files to Cloud Optimized GeoTIFFs."""
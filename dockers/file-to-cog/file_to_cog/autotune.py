@@ -0,0 +1,337 @@
+"""file_to_cog.autotune: select COG creation settings per dataset.
+
+A sample window of the reprojected dataset is converted with candidate
+settings (compression, predictor, block size and overview block size). For
+each candidate the write time, the file size and the latency of
+`rio_tiler.main.tile` over a standard set of tiles are measured, and the
+candidates are ranked by a weighted score.
+
+    $ python -m file_to_cog.autotune file.nc --bandname analysed_sst
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import statistics
+import tempfile
+import warnings
+
+import numpy
+
+import mercantile
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.vrt import WarpedVRT
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.warp import transform_bounds
+from rio_cogeo.cogeo import cog_translate
+
+from .convert import TARGET_CRS, cog_config, cog_profile, get_nodata, source_path
+
+COMPRESSIONS = ("deflate", "zstd", "lzw", "webp", "lerc")
+BLOCKSIZES = (256, 512)
+OVERVIEW_BLOCKSIZES = (128, 256)
+
+# Score weights of the normalized (1 = best candidate) measures.
+WEIGHTS = {"read": 2.0, "size": 1.0, "write": 0.5}
+
+
+def candidates(dtype, count, compressions=COMPRESSIONS):
+    """
+    Return the candidate settings for a data type and band count.
+
+    WEBP only supports 3 or 4 bands 8 bit data. Predictors (2 for integers,
+    3 for floating point) are tried with deflate, zstd and lzw.
+
+    """
+    floating = numpy.issubdtype(numpy.dtype(dtype), numpy.floating)
+    settings = []
+    for compress in compressions:
+        if compress == "webp" and (dtype != "uint8" or count not in (3, 4)):
+            continue
+        predictors = [None]
+        if compress in ("deflate", "zstd", "lzw"):
+            predictors.append(3 if floating else 2)
+
+        for predictor, blocksize, overview_blocksize in itertools.product(
+            predictors, BLOCKSIZES, OVERVIEW_BLOCKSIZES
+        ):
+            settings.append(
+                {
+                    "compress": compress,
+                    "predictor": predictor,
+                    "blocksize": blocksize,
+                    "overview_blocksize": overview_blocksize,
+                }
+            )
+    return settings
+
+
+def sample(src_path, mem, options={}, size=2048):
+    """
+    Write the reprojected center window of a dataset to a MemoryFile.
+
+    Attributes
+    ----------
+    src_path : str
+        GDAL dataset path.
+    mem : rasterio.io.MemoryFile
+        Output memory file.
+    options : dict, optional
+        nodata and dst_crs, as `file_to_cog.convert.convert`.
+    size : int, optional
+        Sample window side, in output pixels (default: 2048).
+
+    Returns
+    -------
+    nodata : int or float
+        Sample nodata value.
+
+    """
+    with rasterio.open(src_path) as src_dst:
+        nodata = get_nodata(src_dst, options.get("nodata"))
+        vrt_params = dict(
+            crs=options.get("dst_crs", TARGET_CRS),
+            resampling=Resampling.nearest,
+            dtype=src_dst.dtypes[0],
+        )
+        if nodata is not None:
+            vrt_params.update(src_nodata=nodata, nodata=nodata)
+        if src_dst.crs is None:
+            vrt_params["src_crs"] = TARGET_CRS
+
+        with WarpedVRT(src_dst, **vrt_params) as vrt_dst:
+            width = min(size, vrt_dst.width)
+            height = min(size, vrt_dst.height)
+            col_off = (vrt_dst.width - width) // 2
+            row_off = (vrt_dst.height - height) // 2
+            window = Window(col_off, row_off, width, height)
+            profile = dict(
+                driver="GTiff",
+                width=width,
+                height=height,
+                count=vrt_dst.count,
+                dtype=vrt_dst.dtypes[0],
+                crs=vrt_dst.crs,
+                transform=vrt_dst.window_transform(window),
+                nodata=nodata,
+            )
+            with mem.open(**profile) as dst:
+                dst.write(vrt_dst.read(window=window))
+
+    return nodata
+
+
+def sample_tiles(src_dst, per_zoom=4):
+    """
+    Return the standard tiles of a dataset.
+
+    Up to `per_zoom` tiles evenly spread over the dataset, at its maximum
+    zoom, one level above and its minimum zoom (or the tile of the dataset
+    center, when no tile center is inside the dataset).
+
+    """
+    from rio_tiler.utils import get_zooms
+
+    minzoom, maxzoom = get_zooms(src_dst)
+    bounds = transform_bounds(src_dst.crs, "epsg:4326", *src_dst.bounds, densify_pts=21)
+    tiles = []
+    for zoom in sorted(set([maxzoom, max(maxzoom - 1, minzoom), minzoom])):
+        inside = [
+            tile
+            for tile in mercantile.tiles(*bounds, zooms=zoom)
+            if _center_inside(tile, bounds)
+        ]
+        if not inside:
+            lng, lat = (bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2
+            inside = [mercantile.tile(lng, lat, zoom)]
+        step = max(len(inside) // per_zoom, 1)
+        tiles.extend(inside[::step][:per_zoom])
+    return tiles
+
+
+def _center_inside(tile, bounds):
+    west, south, east, north = mercantile.bounds(tile)
+    lng, lat = (west + east) / 2, (south + north) / 2
+    return bounds[0] < lng < bounds[2] and bounds[1] < lat < bounds[3]
+
+
+def read_latency(path, tiles, repeat=3):
+    """Return the median `rio_tiler.main.tile` latency (ms) over tiles."""
+    from rio_tiler import main as cogeo
+
+    timings = []
+    for _ in range(repeat):
+        for tile in tiles:
+            t0 = time.perf_counter()
+            cogeo.tile(path, tile.x, tile.y, tile.z)
+            timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings)
+
+
+def evaluate(sample_dst, nodata, settings, tiles, workdir, repeat=3):
+    """Convert the sample with `settings`, return the candidate measures."""
+    path = os.path.join(workdir, "candidate.tif")
+    result = dict(settings)
+    try:
+        t0 = time.perf_counter()
+        with warnings.catch_warnings():
+            # rio-cogeo warns about non standard compressions and block sizes.
+            warnings.simplefilter("ignore")
+            cog_translate(
+                sample_dst,
+                path,
+                cog_profile(settings),
+                nodata=nodata,
+                overview_resampling="bilinear",
+                in_memory=True,
+                config=cog_config(settings=settings),
+                quiet=True,
+            )
+        result["write_s"] = round(time.perf_counter() - t0, 4)
+        result["size_mb"] = round(os.path.getsize(path) / 1e6, 3)
+        result["read_ms"] = round(read_latency(path, tiles, repeat), 3)
+        result["error"] = None
+    except Exception as err:
+        # e.g codecs not available in this GDAL build.
+        result["error"] = f"{type(err).__name__}: {err}"
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return result
+
+
+def rank(results, weights=WEIGHTS):
+    """
+    Score and sort candidate results (lower is better).
+
+    Each measure is divided by the best candidate measure, so the score of
+    a candidate best on every measure is the sum of the weights.
+
+    """
+    valid = [r for r in results if not r["error"]]
+    if not valid:
+        return []
+
+    keys = {"read": "read_ms", "size": "size_mb", "write": "write_s"}
+    best = {name: min(r[key] for r in valid) or 1e-9 for name, key in keys.items()}
+    for res in valid:
+        res["score"] = round(
+            sum(
+                weight * res[keys[name]] / best[name]
+                for name, weight in weights.items()
+            ),
+            3,
+        )
+    return sorted(valid, key=lambda r: r["score"])
+
+
+def autotune(
+    src_path,
+    options={},
+    sample_size=2048,
+    compressions=COMPRESSIONS,
+    weights=WEIGHTS,
+    repeat=3,
+):
+    """
+    Benchmark COG creation settings on a sample of a dataset.
+
+    Attributes
+    ----------
+    src_path : str
+        GDAL dataset path (e.g NETCDF:file.nc:variable).
+    options : dict, optional
+        nodata and dst_crs, as `file_to_cog.convert.convert`.
+    sample_size : int, optional
+        Sample window side, in output pixels (default: 2048).
+    compressions : tuple, optional
+        Candidate compressions (default: deflate, zstd, lzw, webp, lerc).
+    weights : dict, optional
+        Score weights of read latency, file size and write time.
+    repeat : int, optional
+        Tile reads per tile (default: 3).
+
+    Returns
+    -------
+    best : dict
+        Best settings, to use as `convert` "settings" option (None if no
+        candidate succeeded).
+    results : list
+        All candidate results (settings, write_s, size_mb, read_ms, score or
+        error), best first.
+
+    """
+    with MemoryFile() as mem:
+        nodata = sample(src_path, mem, options, sample_size)
+        with mem.open() as sample_dst, tempfile.TemporaryDirectory() as workdir:
+            tiles = sample_tiles(sample_dst)
+            results = [
+                evaluate(sample_dst, nodata, settings, tiles, workdir, repeat)
+                for settings in candidates(
+                    sample_dst.dtypes[0], sample_dst.count, compressions
+                )
+            ]
+
+    ranked = rank(results, weights)
+    failed = [r for r in results if r["error"]]
+    best = None
+    if ranked:
+        best = {
+            key: ranked[0][key]
+            for key in ("compress", "predictor", "blocksize", "overview_blocksize")
+        }
+    return best, ranked + failed
+
+
+def main():
+    """Parse arguments and print the candidates ranking."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("filename", help="NetCDF file")
+    parser.add_argument("--bandname", help="NetCDF variable")
+    parser.add_argument("--nodata", type=float, help="custom nodata value")
+    parser.add_argument("--sample-size", type=int, default=2048)
+    parser.add_argument("--compress", help="comma separated candidate compressions")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    compressions = COMPRESSIONS
+    if args.compress:
+        compressions = tuple(c.strip() for c in args.compress.split(","))
+
+    best, results = autotune(
+        source_path(args.filename, args.bandname),
+        {"nodata": args.nodata},
+        sample_size=args.sample_size,
+        compressions=compressions,
+    )
+    if args.json:
+        print(json.dumps({"best": best, "results": results}))
+        return
+
+    cols = [
+        "compress",
+        "predictor",
+        "blocksize",
+        "overview_blocksize",
+        "write_s",
+        "size_mb",
+        "read_ms",
+        "score",
+    ]
+    print("\t".join(cols))
+    for res in results:
+        if res["error"]:
+            print("\t".join(str(res[c]) for c in cols[:4]) + f"\t{res['error']}")
+        else:
+            print("\t".join(str(res[c]) for c in cols))
+    print(f"best: {json.dumps(best)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
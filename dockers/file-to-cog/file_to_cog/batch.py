@@ -0,0 +1,320 @@
+"""file_to_cog.batch: resumable batch conversion.
+
+Inputs (a directory, a glob pattern or a manifest file listing one path per
+line) are converted concurrently by a bounded process pool. Every result is
+recorded in a local SQLite checkpoint database. On restart, inputs whose
+content hash and conversion parameters match a successful conversion with
+an existing output are skipped.
+
+    $ python -m file_to_cog.batch 'staging/*.nc' --bandname analysed_sst \\
+        --outdir cogs/ --checkpoint batch.db --workers 4
+
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import multiprocessing
+from concurrent import futures
+
+from .convert import _convert_variable, list_variables, source_path
+
+# Bump when the conversion output changes, to invalidate previous results.
+CONVERTER_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    hash TEXT
+);
+CREATE TABLE IF NOT EXISTS conversions (
+    hash TEXT,
+    params TEXT,
+    input TEXT,
+    variable TEXT,
+    output TEXT,
+    status TEXT,
+    error TEXT,
+    time_s REAL,
+    finished REAL,
+    PRIMARY KEY (hash, params, output)
+);
+"""
+
+
+def collect_inputs(source, pattern="*.nc"):
+    """
+    Return the input files of a directory, glob pattern or manifest file.
+
+    Manifest files list one path per line, lines starting with # are
+    ignored and relative paths are relative to the manifest.
+
+    """
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "**", pattern), recursive=True))
+
+    if os.path.isfile(source):
+        root = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            lines = [line.strip() for line in f]
+        return [
+            os.path.join(root, line)
+            for line in lines
+            if line and not line.startswith("#")
+        ]
+
+    return sorted(glob.glob(source, recursive=True))
+
+
+def file_hash(path, blocksize=1 << 20):
+    """Return the sha256 of a file content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def conversion_params(variable, options):
+    """Return the canonical (JSON) parameters of a conversion."""
+    params = {
+        "variable": variable,
+        "nodata": options.get("nodata"),
+        "dst_crs": options.get("dst_crs"),
+        "settings": options.get("settings"),
+        "autotune": bool(options.get("autotune")),
+        "web_optimized": bool(options.get("web_optimized")),
+        "stats": options.get("stats", True),
+        "version": CONVERTER_VERSION,
+    }
+    return json.dumps(params, sort_keys=True)
+
+
+class Checkpoint(object):
+    """
+    SQLite record of input hashes and conversion results.
+
+    Attributes
+    ----------
+    path : str
+        Database path.
+
+    """
+
+    def __init__(self, path):
+        """Open (or create) the database."""
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def hash(self, path):
+        """Return a file content hash, reusing it if size and mtime did not change."""
+        stat = os.stat(path)
+        row = self.db.execute(
+            "SELECT size, mtime_ns, hash FROM hashes WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = file_hash(path)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, digest),
+            )
+        return digest
+
+    def done(self, digest, params, output):
+        """Check if a successful conversion wrote `output` and it still exists."""
+        row = self.db.execute(
+            "SELECT 1 FROM conversions "
+            "WHERE hash = ? AND params = ? AND output = ? AND status = 'ok'",
+            (digest, params, output),
+        ).fetchone()
+        return bool(row) and os.path.exists(output)
+
+    def record(self, digest, params, path, output, result):
+        """Record a conversion result."""
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    digest,
+                    params,
+                    path,
+                    result["variable"],
+                    output,
+                    result["status"],
+                    result["error"],
+                    result["time_s"],
+                    time.time(),
+                ),
+            )
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+
+class Progress(object):
+    """Print throughput and ETA of a batch."""
+
+    def __init__(self, total, out=sys.stderr):
+        """Initialize progress."""
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.out = out
+        self.start = time.perf_counter()
+
+    def update(self, result):
+        """Count a finished job and print progress."""
+        self.done += 1
+        if result["status"] != "ok":
+            self.failed += 1
+
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        print(
+            f"[{self.done}/{self.total}] {rate:.2f} files/s, ETA {eta:.0f}s, "
+            f"{self.failed} failed - {result['variable']} {result['status']}",
+            file=self.out,
+            flush=True,
+        )
+
+
+def run_batch(inputs, variables, options={}, checkpoint=None, max_workers=None):
+    """
+    Convert input files, skipping the conversions already done.
+
+    Attributes
+    ----------
+    inputs : list
+        NetCDF file paths.
+    variables : str
+        Variable name, comma separated names or "all".
+    options : dict, optional
+        outdir : str
+            Output directory (default: each input directory). COGs are named
+            {input name}.{variable}.cog.tif.
+        Other options are passed to `file_to_cog.convert.convert`.
+    checkpoint : Checkpoint, optional
+        Checkpoint database (default: no resume).
+    max_workers : int, optional
+        Number of processes (default: cpu count).
+
+    Returns
+    -------
+    results : list
+        One record per conversion, with `skipped` set for conversions found
+        in the checkpoint.
+
+    """
+    outdir = options.get("outdir")
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+
+    jobs = []
+    results = []
+    for path in inputs:
+        path = os.path.abspath(path)
+        if variables == "all":
+            paths = list_variables(path)
+        else:
+            names = [v.strip() for v in variables.split(",") if v.strip()]
+            paths = {name: source_path(path, name) for name in names}
+
+        digest = checkpoint.hash(path) if checkpoint else None
+        for variable, src_path in paths.items():
+            params = conversion_params(variable, options)
+            name = f"{os.path.basename(path)}.{variable}.cog.tif"
+            out_cog = os.path.join(outdir or os.path.dirname(path), name)
+            if checkpoint and checkpoint.done(digest, params, out_cog):
+                results.append(
+                    {
+                        "variable": variable,
+                        "output": out_cog,
+                        "error": None,
+                        "status": "ok",
+                        "time_s": 0.0,
+                        "input": path,
+                        "skipped": True,
+                    }
+                )
+                continue
+
+            jobs.append((path, variable, src_path, out_cog, digest, params))
+
+    cpus = multiprocessing.cpu_count()
+    workers = max(min(max_workers or cpus, len(jobs)), 1)
+    options = dict(options, threads=options.get("threads") or max(cpus // workers, 1))
+
+    progress = Progress(len(jobs))
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        for path, variable, src_path, out_cog, digest, params in jobs:
+            job = executor.submit(_convert_variable, variable, src_path, out_cog, options)
+            running[job] = (path, out_cog, digest, params)
+
+        for job in futures.as_completed(running):
+            path, out_cog, digest, params = running[job]
+            result = job.result()
+            result.update(input=path, skipped=False)
+            if checkpoint:
+                checkpoint.record(digest, params, path, out_cog, result)
+            progress.update(result)
+            results.append(result)
+
+    return results
+
+
+def main():
+    """Parse arguments and run batch."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory, glob pattern or manifest file")
+    parser.add_argument(
+        "--bandname", required=True, help='variable, comma separated names or "all"'
+    )
+    parser.add_argument("--pattern", default="*.nc", help="directory file pattern")
+    parser.add_argument("--outdir", help="output directory")
+    parser.add_argument("--checkpoint", default="file-to-cog.db", help="SQLite path")
+    parser.add_argument("--workers", type=int, help="number of processes")
+    parser.add_argument("--nodata", type=float, help="custom nodata value")
+    args = parser.parse_args()
+
+    inputs = collect_inputs(args.source, args.pattern)
+    options = {"outdir": args.outdir, "nodata": args.nodata}
+
+    checkpoint = Checkpoint(args.checkpoint)
+    try:
+        t0 = time.perf_counter()
+        results = run_batch(
+            inputs, args.bandname, options, checkpoint, max_workers=args.workers
+        )
+        elapsed = time.perf_counter() - t0
+    finally:
+        checkpoint.close()
+
+    for result in results:
+        print(json.dumps(result))
+
+    skipped = sum(1 for r in results if r["skipped"])
+    failed = sum(1 for r in results if r["status"] != "ok")
+    print(
+        f"{len(inputs)} files: {len(results) - skipped - failed} converted, "
+        f"{skipped} skipped, {failed} failed in {elapsed:.1f}s",
+        file=sys.stderr,
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
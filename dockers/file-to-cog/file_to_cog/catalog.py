@@ -0,0 +1,64 @@
+"""file_to_cog.catalog: register converted COGs in the tiler dataset catalog.
+
+With the `catalog` option (`--catalog`) or COG_CATALOG set, the metadata of
+every COG written (bounds, zooms, band names, dtype, nodata, statistics and
+datetimes, see `tiler.headers.dataset_info`) is added to the tiler SQLite
+catalog (`tiler.catalog`) under its output path or url, so the tiler can
+search it and answer its tilejson without reading it.
+
+Needs the tiler package (tiler-deployment) to be installed.
+
+"""
+
+import os
+
+import rasterio
+
+from .report import stage
+
+COG_CATALOG = os.environ.get("COG_CATALOG") or None
+
+
+def register_output(local_cog, url, options={}, report=None):
+    """
+    Add a COG to the catalog, if one is configured.
+
+    Attributes
+    ----------
+    local_cog : str
+        Local COG the metadata is read from.
+    url : str
+        Dataset url in the catalog (output path or s3:// url).
+    options : dict, optional
+        catalog: catalog database (default: COG_CATALOG).
+    report : file_to_cog.report.ConversionReport, optional
+        Report recording the catalog stage.
+
+    Returns
+    -------
+    path : str
+        Catalog database, None if no catalog is configured.
+
+    """
+    path = options.get("catalog") or COG_CATALOG
+    if not path:
+        return None
+
+    try:
+        from tiler.catalog import Catalog
+        from tiler.headers import dataset_info
+    except ImportError as err:
+        raise ImportError(
+            "Registering COGs in a catalog needs the tiler package "
+            "(pip install tiler-deployment/)"
+        ) from err
+
+    with stage(report, "catalog"):
+        with rasterio.open(local_cog) as src_dst:
+            info = dataset_info(src_dst)
+        catalog = Catalog(path)
+        try:
+            catalog.add(url, info)
+        finally:
+            catalog.close()
+    return path
@@ -0,0 +1,561 @@
+"""file_to_cog.convert: NetCDF to COG conversion."""
+
+import os
+import json
+import time
+import tempfile
+import multiprocessing
+from concurrent import futures
+from urllib.parse import urlparse
+
+import numpy
+
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.vrt import WarpedVRT
+from rasterio.enums import Resampling
+from rio_cogeo.cogeo import cog_translate
+from rio_cogeo.profiles import cog_profiles
+
+from .warp import WARP_MEMORY_MB, block_windows, warp
+from .mercator import MERCATOR_CRS, mercator_grid
+from .stats import StatisticsAccumulator, sidecar_path
+from .report import ConversionReport, METRICS_LOG, stage
+
+SOURCE_FORMAT = "NETCDF"
+
+# Output projection (same as the former `gdalwarp -t_srs` step).
+TARGET_CRS = "+proj=longlat +ellps=WGS84"
+
+# Datasets larger than this (in MB, uncompressed) are reprojected window by
+# window to a temporary tiled GeoTIFF instead of in memory.
+IN_MEMORY_MAX_MB = int(os.environ.get("IN_MEMORY_MAX_MB", 1024))
+
+# NetCDF time coverage attributes (as the GDAL netCDF driver names them),
+# copied to the COG metadata for the catalog time search (see
+# `tiler.headers.dataset_times`).
+TIME_TAGS = ("NC_GLOBAL#time_coverage_start", "NC_GLOBAL#time_coverage_end")
+
+# COG creation settings (see `file_to_cog.autotune` to select them per dataset).
+DEFAULT_SETTINGS = {
+    "compress": "deflate",
+    "predictor": None,
+    "blocksize": 256,
+    "overview_blocksize": int(os.environ.get("GDAL_TIFF_OVR_BLOCKSIZE", 128)),
+}
+
+
+def source_path(sourcefile, bandname=None, sourcefile_format=SOURCE_FORMAT):
+    """
+    Return the GDAL path of a NetCDF variable (e.g NETCDF:file.nc:var).
+
+    Remote inputs (http(s):// or s3:// urls) are read through /vsicurl/ or
+    /vsis3/ (see `file_to_cog.remote`).
+
+    """
+    from .remote import gdal_path
+
+    sourcefile = gdal_path(sourcefile)
+    if not bandname:
+        return sourcefile
+    if ":" in sourcefile:
+        sourcefile = f'"{sourcefile}"'
+    return f"{sourcefile_format}:{sourcefile}:{bandname}"
+
+
+def get_nodata(src_dst, nodata=None):
+    """Return the nodata value to use for the output COG."""
+    if nodata is None:
+        nodata = src_dst.nodatavals[0]
+    if nodata is None:
+        return None
+    return numpy.nan if numpy.isnan(nodata) else nodata
+
+
+def time_tags(src_dst):
+    """Return the time coverage tags of a dataset (see TIME_TAGS)."""
+    tags = src_dst.tags()
+    return {key: tags[key] for key in TIME_TAGS if tags.get(key)}
+
+
+def cog_config(threads=None, settings=None):
+    """GDAL configuration for the COG creation (and remote input reads)."""
+    from .remote import gdal_config
+
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    if threads is None:
+        threads = int(os.environ.get("MAX_THREADS", multiprocessing.cpu_count()))
+    return dict(
+        gdal_config(),
+        NUM_THREADS=threads,
+        GDAL_TIFF_OVR_BLOCKSIZE=str(settings["overview_blocksize"]),
+    )
+
+
+def cog_profile(settings=None):
+    """Output COG creation options."""
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    profile = cog_profiles.get(settings["compress"])
+    profile.update(
+        {"blockxsize": settings["blocksize"], "blockysize": settings["blocksize"]}
+    )
+    if settings["predictor"]:
+        profile["predictor"] = settings["predictor"]
+    return profile
+
+
+def dataset_size_mb(src_dst):
+    """Return the uncompressed size of a dataset in MB."""
+    itemsize = numpy.dtype(src_dst.dtypes[0]).itemsize
+    return src_dst.width * src_dst.height * src_dst.count * itemsize / 1024 ** 2
+
+
+def list_variables(sourcefile, sourcefile_format=SOURCE_FORMAT):
+    """
+    List the raster variables of a NetCDF file.
+
+    Attributes
+    ----------
+    sourcefile : str
+        NetCDF file path or url.
+
+    Returns
+    -------
+    variables : dict
+        Mapping of variable name to GDAL dataset path.
+
+    """
+    src_path = source_path(sourcefile)
+    with rasterio.Env(**cog_config()), rasterio.open(src_path) as src_dst:
+        subdatasets = src_dst.subdatasets
+        # Files with a single variable are opened as a raster directly.
+        if not subdatasets:
+            return {src_dst.tags(1).get("NETCDF_VARNAME", "Band1"): src_path}
+
+    # GDAL does not quote urls in the subdataset paths.
+    names = [path.rsplit(":", 1)[-1] for path in subdatasets]
+    return {name: source_path(sourcefile, name, sourcefile_format) for name in names}
+
+
+def _translate(
+    source, out_cog, settings, nodata, overview_level, config, in_memory=False
+):
+    """
+    Write the COG, with the source band metadata (statistics).
+
+    The `cog_translate` intermediate file (tiled copy of `source` and its
+    overviews) is written next to `out_cog` unless `in_memory` is set.
+
+    """
+    cog_translate(
+        source,
+        out_cog,
+        cog_profile(settings),
+        nodata=nodata,
+        overview_level=overview_level,
+        overview_resampling="bilinear",
+        in_memory=in_memory,
+        config=config,
+        forward_band_tags=True,
+        quiet=True,
+    )
+
+
+def _settings(src_path, options, report=None):
+    """COG creation settings: given, autotuned or web optimized."""
+    settings = options.get("settings")
+    if settings is None and options.get("autotune"):
+        from .autotune import autotune
+
+        with stage(report, "autotune"):
+            settings, _ = autotune(src_path, options)
+
+    if options.get("web_optimized"):
+        # Internal tiles and overview tiles must be mercator tiles.
+        settings = dict(settings or {}, blocksize=256, overview_blocksize=256)
+    return settings
+
+
+def _source(src_dst, options):
+    """Output parameters read from the source dataset."""
+    nodata = get_nodata(src_dst, options.get("nodata"))
+    # Grids without projection information are geographic.
+    src_crs = TARGET_CRS if src_dst.crs is None else None
+    grid, overview_level = None, None
+    if options.get("web_optimized"):
+        grid, overview_level = mercator_grid(src_dst, src_crs)
+
+    stats = None
+    if options.get("stats", True):
+        stats = StatisticsAccumulator(
+            src_dst.count, nodata, pixels=src_dst.width * src_dst.height
+        )
+
+    windowed = options.get("windowed")
+    if windowed is None:
+        windowed = dataset_size_mb(src_dst) > IN_MEMORY_MAX_MB
+
+    return {
+        "nodata": nodata,
+        # Dataset tags are not copied by the reprojection: forward the
+        # time coverage through the GeoTIFF handed to `cog_translate`.
+        "times": time_tags(src_dst),
+        "src_crs": src_crs,
+        "grid": grid,
+        "overview_level": overview_level,
+        "stats": stats,
+        "windowed": windowed,
+    }
+
+
+def _finish_grid(tmp_dst, source):
+    """Store the statistics and time coverage in the reprojected GeoTIFF."""
+    if source["stats"]:
+        source["stats"].write_tags(tmp_dst)
+    tmp_dst.update_tags(**source["times"])
+
+
+def _convert_in_memory(src_dst, out_cog, dst_crs, source, settings, config, report):
+    """Reproject through a `WarpedVRT` to an in-memory GeoTIFF, then translate."""
+    nodata, stats = source["nodata"], source["stats"]
+    vrt_params = dict(crs=dst_crs, resampling=Resampling.nearest, dtype=src_dst.dtypes[0])
+    if source["grid"]:
+        vrt_params.update(source["grid"])
+    if nodata is not None:
+        vrt_params.update(src_nodata=nodata, nodata=nodata)
+    if source["src_crs"]:
+        vrt_params["src_crs"] = source["src_crs"]
+
+    with WarpedVRT(src_dst, **vrt_params) as vrt_dst, MemoryFile() as mem:
+        with stage(report, "reproject"):
+            profile = dict(vrt_dst.profile, driver="GTiff", tiled=True)
+            with mem.open(**profile) as tmp_dst:
+                for window in block_windows(vrt_dst.width, vrt_dst.height, 1024):
+                    data = vrt_dst.read(window=window)
+                    tmp_dst.write(data, window=window)
+                    if stats:
+                        stats.update(data)
+                _finish_grid(tmp_dst, source)
+
+        with stage(report, "cog"), mem.open() as tmp_dst:
+            _translate(
+                tmp_dst, out_cog, settings, nodata, source["overview_level"], config
+            )
+
+
+def _convert_windowed(
+    src_path, out_cog, dst_crs, source, settings, config, options, report
+):
+    """Reproject window by window to a temporary GeoTIFF, then translate."""
+    stats = source["stats"]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with stage(report, "warp"):
+            warped = warp(
+                src_path,
+                os.path.join(tmpdir, "warped.tif"),
+                dst_crs,
+                src_crs=source["src_crs"],
+                nodata=source["nodata"],
+                workers=options.get("warp_workers"),
+                memory_mb=options.get("memory_mb") or WARP_MEMORY_MB,
+                config=config,
+                grid=source["grid"],
+                on_window=stats.update if stats else None,
+            )
+            with rasterio.open(warped, "r+") as tmp_dst:
+                _finish_grid(tmp_dst, source)
+
+        with stage(report, "cog"):
+            _translate(
+                warped,
+                out_cog,
+                settings,
+                source["nodata"],
+                source["overview_level"],
+                config,
+            )
+
+
+def convert(src_path, out_cog, options={}, report=None):
+    """
+    Convert a GDAL dataset to a COG.
+
+    Datasets up to IN_MEMORY_MAX_MB are reprojected through a `WarpedVRT`
+    to an in-memory GeoTIFF, then written by `cog_translate`, whose own
+    intermediate file goes next to the output: peak memory is about the
+    uncompressed dataset size (at most IN_MEMORY_MAX_MB) plus the GDAL
+    cache. Larger datasets are reprojected window by window in a process
+    pool (`file_to_cog.warp`) to a temporary tiled GeoTIFF, so memory use
+    does not grow with the dataset. In both cases band statistics are
+    accumulated from the reprojected windows as they are written
+    (`file_to_cog.stats`).
+
+    Attributes
+    ----------
+    src_path : str
+        GDAL dataset path (e.g NETCDF:file.nc:variable).
+    out_cog : str
+        Output COG path.
+    options : dict, optional
+        nodata : int or float
+            Custom nodata value (default: the dataset nodata value).
+        dst_crs : str
+            Output projection (default: "+proj=longlat +ellps=WGS84").
+        threads : int
+            GDAL threads (default: MAX_THREADS or cpu count).
+        windowed : bool
+            Force (or disable) windowed reprojection (default: datasets
+            larger than IN_MEMORY_MAX_MB).
+        warp_workers : int
+            Windowed reprojection processes (default: cpu count).
+        memory_mb : int
+            Windowed reprojection memory budget per process, in MB
+            (default: WARP_MEMORY_MB or 256).
+        settings : dict
+            COG creation settings: compress, predictor, blocksize and
+            overview_blocksize (default: DEFAULT_SETTINGS).
+        autotune : bool
+            Select the settings by benchmarking candidates on a sample of
+            the dataset (see `file_to_cog.autotune`).
+        web_optimized : bool
+            Write the COG in EPSG:3857, aligned on the mercator tile grid at
+            the dataset native zoom, with one overview level per zoom level
+            (see `file_to_cog.mercator`). dst_crs and the block sizes are
+            ignored.
+        stats : bool
+            Store band statistics in the COG metadata and in a
+            {out_cog}.stats.json sidecar (default: True).
+        validate : str
+            Validate the COG after conversion, "flag" or "reject" (see
+            `file_to_cog.validate.validate_output`, default: COG_VALIDATE).
+            Applied by `generate_cog` and `generate_cogs`.
+    report : file_to_cog.report.ConversionReport, optional
+        Report recording the conversion stages.
+
+    Returns
+    -------
+    out_cog : str
+        Output COG path.
+
+    """
+    settings = _settings(src_path, options, report)
+    config = cog_config(options.get("threads"), settings)
+    if options.get("web_optimized"):
+        dst_crs = MERCATOR_CRS
+    else:
+        dst_crs = options.get("dst_crs", TARGET_CRS)
+
+    with rasterio.Env(**config):
+        with stage(report, "open"):
+            src_dst = rasterio.open(src_path)
+        with src_dst:
+            source = _source(src_dst, options)
+            if not source["windowed"]:
+                _convert_in_memory(
+                    src_dst, out_cog, dst_crs, source, settings, config, report
+                )
+
+        if source["windowed"]:
+            _convert_windowed(
+                src_path, out_cog, dst_crs, source, settings, config, options, report
+            )
+
+    if source["stats"]:
+        with stage(report, "statistics"):
+            source["stats"].write_sidecar(sidecar_path(out_cog))
+
+    return out_cog
+
+
+def convert_file(sourcefile, out_cog, options={}, report=None):
+    """
+    Convert a file with the converter of its extension (see `generate_cog`).
+
+    The COG is validated if the "validate" option is set, and uploaded if
+    `out_cog` is an s3:// url (see `file_to_cog.upload`).
+
+    """
+    from .hdf5 import convert_hdf5, is_hdf5
+    from .vector import convert_vector, is_vector
+    from .validate import validate_output
+    from .upload import output_target
+
+    with output_target(out_cog, options, report) as local_cog:
+        if is_hdf5(sourcefile):
+            convert_hdf5(sourcefile, local_cog, options, report)
+        elif is_vector(sourcefile):
+            convert_vector(sourcefile, local_cog, options, report)
+        else:
+            src_path = source_path(sourcefile, options.get("bandname"))
+            convert(src_path, local_cog, options, report)
+        validate_output(local_cog, options, report)
+    return out_cog
+
+
+def generate_cog(sourcefile, options={}):
+    """
+    Convert a NetCDF variable, an HDF5 dataset or a shapefile to a COG.
+
+    Attributes
+    ----------
+    sourcefile : str
+        NetCDF file path, HDF5 (.h5, .hdf5 or .he5) file path, or shapefile
+        (.shp or zipped .zip) path. NetCDF and HDF5 inputs can be http(s)://
+        or s3:// urls, read with ranged requests (see `file_to_cog.remote`).
+    options : dict, optional
+        bandname : str
+            NetCDF variable or HDF5 dataset to convert.
+        output : str
+            Output COG path or s3:// url (default: {sourcefile}.cog.tif, in
+            the working directory for http(s):// inputs).
+        metrics_log : str
+            JSON lines file the conversion report is appended to (default:
+            CONVERSION_METRICS_LOG, if set).
+        Other options are passed to `convert` (or to
+        `file_to_cog.hdf5.convert_hdf5` for HDF5 files and
+        `file_to_cog.vector.convert_vector` for shapefiles).
+
+    The conversion report (`file_to_cog.report`) is printed as JSON.
+
+    Returns
+    -------
+    out_cog : str
+        Output COG path, None if the conversion failed.
+
+    """
+    from .remote import HTTP_SCHEMES
+
+    out_cog = options.get("output") or f"{sourcefile}.cog.tif"
+    if not options.get("output") and sourcefile.startswith(HTTP_SCHEMES):
+        out_cog = f"{os.path.basename(urlparse(sourcefile).path)}.cog.tif"
+    report = ConversionReport(sourcefile, out_cog)
+    try:
+        convert_file(sourcefile, out_cog, options, report)
+        report.finish()
+    except Exception as err:
+        report.fail(err)
+        out_cog = None
+
+    print(json.dumps(report.to_dict()))
+    report.append(options.get("metrics_log") or METRICS_LOG)
+    return out_cog
+
+
+def _convert_variable(variable, src_path, out_cog, options):
+    """Convert one variable, return its result record (with its report)."""
+    t0 = time.perf_counter()
+    result = {"variable": variable, "output": out_cog, "error": None, "reason": None}
+    report = ConversionReport(src_path, out_cog)
+    try:
+        from .validate import validate_output
+        from .upload import output_target
+
+        with output_target(out_cog, options, report) as local_cog:
+            convert(src_path, local_cog, options, report)
+            validate_output(local_cog, options, report)
+        report.finish()
+        result["status"] = "ok"
+    except Exception as err:
+        report.fail(err)
+        result.update(
+            status="error",
+            output=None,
+            error=f"{type(err).__name__}: {err}",
+            reason=report.error["reason"],
+        )
+    result["time_s"] = round(time.perf_counter() - t0, 3)
+    result["report"] = report.to_dict()
+    report.append(options.get("metrics_log") or METRICS_LOG)
+    return result
+
+
+def generate_cogs(sourcefile, variables="all", options={}, max_workers=None):
+    """
+    Convert several NetCDF variables to COGs in parallel.
+
+    The file variables are listed once, then each variable is converted in
+    a process pool sized to the machine (GDAL threads are split between the
+    workers).
+
+    Attributes
+    ----------
+    sourcefile : str
+        NetCDF file path or url.
+    variables : str or list, optional
+        Variable names, comma separated names or "all" (default: "all").
+    options : dict, optional
+        outdir : str
+            Output directory or s3:// prefix (default: the source file
+            directory, or the working directory for http(s):// inputs). COGs
+            are named {sourcefile name}.{variable}.cog.tif.
+        Other options are passed to `convert`.
+    max_workers : int, optional
+        Number of processes (default: cpu count).
+
+    Returns
+    -------
+    results : list
+        One record per variable: variable, status ("ok" or "error"),
+        output, error, reason (machine-readable failure reason), time_s and
+        report (`file_to_cog.report`).
+
+    """
+    available = list_variables(sourcefile)
+    if isinstance(variables, str):
+        variables = (
+            list(available)
+            if variables == "all"
+            else [v.strip() for v in variables.split(",") if v.strip()]
+        )
+
+    from .remote import is_remote
+
+    outdir = options.get("outdir")
+    if not outdir:
+        if sourcefile.startswith("s3://"):
+            outdir = sourcefile.rsplit("/", 1)[0]
+        elif is_remote(sourcefile):
+            outdir = os.getcwd()
+        else:
+            outdir = os.path.dirname(os.path.abspath(sourcefile))
+    s3_outdir = outdir.startswith("s3://")
+    if not s3_outdir:
+        os.makedirs(outdir, exist_ok=True)
+    name = os.path.basename(
+        urlparse(sourcefile).path if is_remote(sourcefile) else sourcefile
+    )
+
+    cpus = multiprocessing.cpu_count()
+    workers = max(min(max_workers or cpus, len(variables)), 1)
+    options = dict(options, threads=options.get("threads") or max(cpus // workers, 1))
+
+    results = {}
+    jobs = {}
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for variable in variables:
+            if variable not in available:
+                results[variable] = {
+                    "variable": variable,
+                    "output": None,
+                    "error": f"Variable '{variable}' not found in {sourcefile}",
+                    "reason": "invalid_input",
+                    "status": "error",
+                    "time_s": 0.0,
+                }
+                continue
+
+            out_name = f"{name}.{variable}.cog.tif"
+            out_cog = (
+                f"{outdir.rstrip('/')}/{out_name}"
+                if s3_outdir
+                else os.path.join(outdir, out_name)
+            )
+            job = executor.submit(
+                _convert_variable, variable, available[variable], out_cog, options
+            )
+            jobs[job] = variable
+
+        for job in futures.as_completed(jobs):
+            results[jobs[job]] = job.result()
+
+    return [results[variable] for variable in variables]
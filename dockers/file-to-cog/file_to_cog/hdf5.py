@@ -0,0 +1,394 @@
+"""file_to_cog.hdf5: HDF5 to COG conversion with chunk aligned reads.
+
+HDF5 datasets are read with h5py in windows made of whole HDF5 chunks, so
+each chunk is read and decompressed exactly once, and the windows are
+written straight to the GeoTIFF handed to `cog_translate` (statistics are
+accumulated on the way). Through the GDAL HDF5 driver, read windows do not
+follow the chunk layout: chunks cut by several windows are decompressed
+several times (see benchmarks/bench_hdf5.py).
+
+Geolocation comes from the dataset dimension scales (netCDF4/HDF5 files) or
+from 1D latitude/longitude (or y/x) datasets of the same group, which must
+be regular. Projected grids use the CF `grid_mapping` variable (`crs_wkt`
+or `spatial_ref` attributes).
+
+"""
+
+import os
+import math
+import tempfile
+import contextlib
+
+import numpy
+import h5py
+
+import rasterio
+from rasterio.crs import CRS
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+from affine import Affine
+
+from .warp import BLOCKSIZE
+from .stats import StatisticsAccumulator, sidecar_path
+from .convert import IN_MEMORY_MAX_MB, TIME_TAGS, _translate, cog_config, convert
+from .report import stage
+from .remote import RangeFile, is_remote
+
+HDF5_EXTENSIONS = (".h5", ".hdf5", ".he5")
+
+LATITUDE_NAMES = ("lat", "latitude", "nav_lat")
+LONGITUDE_NAMES = ("lon", "longitude", "nav_lon")
+Y_NAMES = ("y", "northing")
+X_NAMES = ("x", "easting")
+
+# Memory budget (in MB) of a read window.
+READ_WINDOW_MB = int(os.environ.get("HDF5_READ_WINDOW_MB", 64))
+
+
+def is_hdf5(sourcefile):
+    """Return True for HDF5 files."""
+    return sourcefile.lower().endswith(HDF5_EXTENSIONS)
+
+
+def _decode(value):
+    if isinstance(value, (numpy.ndarray, numpy.generic)) and value.size == 1:
+        value = value.item()
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+def _is_coordinate(dset):
+    return dset.ndim == 1 or dset.attrs.get("CLASS") == b"DIMENSION_SCALE"
+
+
+def _time_tags(h5):
+    """Return the file time coverage attributes, tagged as `convert` forwards them."""
+    tags = {}
+    for key in TIME_TAGS:
+        value = h5.attrs.get(key.split("#", 1)[1])
+        if value is not None:
+            tags[key] = value.decode() if isinstance(value, bytes) else str(value)
+    return tags
+
+
+@contextlib.contextmanager
+def open_hdf5(sourcefile, report=None):
+    """
+    Open an HDF5 file, or a url through a `file_to_cog.remote.RangeFile`.
+
+    The requests and bytes fetched from a url are set as the report `remote`
+    entry.
+
+    """
+    if not is_remote(sourcefile):
+        with h5py.File(sourcefile, "r") as h5:
+            yield h5
+        return
+
+    with RangeFile(sourcefile) as f:
+        try:
+            with h5py.File(f, "r") as h5:
+                yield h5
+        finally:
+            if report:
+                report.remote = f.stats()
+
+
+def list_datasets(sourcefile):
+    """
+    List the raster datasets (2D, or 3D with bands first) of an HDF5 file.
+
+    Returns
+    -------
+    datasets : dict
+        Mapping of dataset name to shape, dtype, chunks and compression.
+
+    """
+    with open_hdf5(sourcefile) as h5:
+        return _list_datasets(h5)
+
+
+def _list_datasets(h5):
+    datasets = {}
+
+    def _visit(name, obj):
+        if not isinstance(obj, h5py.Dataset) or obj.ndim not in (2, 3):
+            return
+        if obj.dtype.kind not in "iuf" or _is_coordinate(obj):
+            return
+        datasets[f"/{name}"] = {
+            "shape": obj.shape,
+            "dtype": obj.dtype.name,
+            "chunks": obj.chunks,
+            "compression": obj.compression,
+        }
+
+    h5.visititems(_visit)
+    return datasets
+
+
+def _coordinates(dset, axis, names):
+    """Return the 1D coordinates of a dataset axis, or None."""
+    size = dset.shape[axis]
+    for scale in dset.dims[axis].values():
+        if scale.ndim == 1 and scale.shape[0] == size:
+            name = scale.name.rsplit("/", 1)[-1].lower()
+            if name in names:
+                return scale[:]
+
+    for name, obj in dset.parent.items():
+        if (
+            name.lower() in names
+            and isinstance(obj, h5py.Dataset)
+            and obj.ndim == 1
+            and obj.shape[0] == size
+        ):
+            return obj[:]
+    return None
+
+
+def _resolution(coords, name):
+    steps = numpy.diff(coords.astype("float64"))
+    if not steps.size or not numpy.allclose(steps, steps[0], rtol=1e-5, atol=0):
+        raise ValueError(f"Irregular {name} coordinates are not supported")
+    return float(steps[0])
+
+
+def _grid_mapping_crs(dset):
+    """Return the CF grid mapping projection of a dataset, or None."""
+    grid_mapping = _decode(dset.attrs.get("grid_mapping"))
+    if not grid_mapping:
+        return None
+    mapping = dset.parent.get(grid_mapping)
+    if mapping is None:
+        return None
+    for attr in ("crs_wkt", "spatial_ref"):
+        wkt = _decode(mapping.attrs.get(attr))
+        if wkt:
+            return CRS.from_wkt(wkt)
+    epsg = _decode(mapping.attrs.get("epsg_code"))
+    return CRS.from_user_input(epsg) if epsg else None
+
+
+def geolocation(dset):
+    """
+    Return the projection and transform of a dataset.
+
+    Returns
+    -------
+    crs : rasterio.crs.CRS
+    transform : affine.Affine
+        Transform of the north-up grid.
+    flip : bool
+        True if rows are stored south to north.
+
+    """
+    crs = _grid_mapping_crs(dset)
+    y = _coordinates(dset, dset.ndim - 2, LATITUDE_NAMES + Y_NAMES)
+    x = _coordinates(dset, dset.ndim - 1, LONGITUDE_NAMES + X_NAMES)
+    if x is None or y is None:
+        raise ValueError(f"No geolocation found for {dset.name}")
+
+    if crs is None:
+        crs = CRS.from_epsg(4326)
+
+    xres, yres = _resolution(x, "x"), _resolution(y, "y")
+    if xres < 0:
+        raise ValueError("East to west grids are not supported")
+
+    flip = yres > 0
+    top = float(y[-1] if flip else y[0]) + abs(yres) / 2
+    left = float(x[0]) - xres / 2
+    return crs, Affine(xres, 0, left, 0, -abs(yres), top), flip
+
+
+def get_nodata(dset, nodata=None):
+    """Return the nodata value (_FillValue or missing_value attributes)."""
+    if nodata is None:
+        for attr in ("_FillValue", "missing_value", "fillvalue"):
+            if attr in dset.attrs:
+                nodata = _decode(dset.attrs[attr])
+                break
+    if nodata is None and dset.dtype.kind == "f":
+        nodata = numpy.nan
+    if nodata is None:
+        return None
+    return numpy.nan if numpy.isnan(nodata) else nodata
+
+
+def chunk_windows(shape, chunks, itemsize, memory_mb=READ_WINDOW_MB):
+    """
+    Yield read windows made of whole chunks, fitting the memory budget.
+
+    Windows are strips of chunk rows as wide as the budget allows, so every
+    chunk belongs to exactly one window. Contiguous datasets are read in
+    strips of BLOCKSIZE rows.
+
+    Attributes
+    ----------
+    shape : tuple
+        Dataset shape (bands, rows, cols) or (rows, cols).
+    chunks : tuple or None
+        HDF5 chunk shape.
+    itemsize : int
+        Bytes per pixel, for all bands.
+
+    """
+    height, width = shape[-2:]
+    chunk_rows, chunk_cols = chunks[-2:] if chunks else (BLOCKSIZE, width)
+    budget = max(memory_mb * 1024 * 1024 // itemsize, chunk_rows * chunk_cols)
+
+    cols = max(budget // (chunk_rows * chunk_cols), 1) * chunk_cols
+    cols = min(cols, math.ceil(width / chunk_cols) * chunk_cols)
+    rows = max(budget // (cols * chunk_rows), 1) * chunk_rows
+
+    for row in range(0, height, rows):
+        for col in range(0, width, cols):
+            yield Window(col, row, min(cols, width - col), min(rows, height - row))
+
+
+def read_window(dset, window):
+    """Read a window of a dataset, as a (bands, rows, cols) array."""
+    rows = slice(window.row_off, window.row_off + window.height)
+    cols = slice(window.col_off, window.col_off + window.width)
+    if dset.ndim == 2:
+        return dset[rows, cols][numpy.newaxis]
+    return dset[:, rows, cols]
+
+
+def _dataset_name(h5, name=None):
+    if name:
+        return name if name.startswith("/") else f"/{name}"
+    datasets = _list_datasets(h5)
+    if len(datasets) != 1:
+        raise ValueError(
+            f"Set the dataset to convert (bandname), one of: {', '.join(datasets)}"
+        )
+    return next(iter(datasets))
+
+
+def write_dataset(dset, dst, flip=False, on_window=None, memory_mb=READ_WINDOW_MB):
+    """Copy a dataset to an opened GeoTIFF, chunk aligned window by window."""
+    itemsize = dset.dtype.itemsize * dst.count
+    for window in chunk_windows(dset.shape, dset.chunks, itemsize, memory_mb):
+        data = read_window(dset, window)
+        if flip:
+            data = data[:, ::-1]
+            window = Window(
+                window.col_off,
+                dst.height - window.row_off - window.height,
+                window.width,
+                window.height,
+            )
+        dst.write(data, window=window)
+        if on_window:
+            on_window(data)
+
+
+def convert_hdf5(sourcefile, out_cog, options={}, report=None):
+    """
+    Convert an HDF5 dataset to a COG.
+
+    Geographic grids are written straight to the GeoTIFF handed to
+    `cog_translate` (in memory up to IN_MEMORY_MAX_MB). Projected grids, or
+    `web_optimized` and `dst_crs` conversions, are written to a temporary
+    GeoTIFF in the dataset grid, then converted with
+    `file_to_cog.convert.convert`.
+
+    Attributes
+    ----------
+    sourcefile : str
+        HDF5 file path or url (read with ranged requests, see
+        `file_to_cog.remote`).
+    out_cog : str
+        Output COG path.
+    options : dict, optional
+        bandname : str
+            Dataset name (default: the only raster dataset of the file).
+        Other options as `file_to_cog.convert.convert`.
+    report : file_to_cog.report.ConversionReport, optional
+        Report recording the conversion stages.
+
+    Returns
+    -------
+    out_cog : str
+        Output COG path.
+
+    """
+    with open_hdf5(sourcefile, report) as h5:
+        with stage(report, "open"):
+            dset = h5[_dataset_name(h5, options.get("bandname"))]
+            crs, transform, flip = geolocation(dset)
+            times = _time_tags(h5)
+
+        nodata = get_nodata(dset, options.get("nodata"))
+        count = dset.shape[0] if dset.ndim == 3 else 1
+        height, width = dset.shape[-2:]
+        profile = dict(
+            driver="GTiff",
+            width=width,
+            height=height,
+            count=count,
+            dtype=dset.dtype.name,
+            crs=crs,
+            transform=transform,
+            nodata=nodata,
+            tiled=True,
+            blockxsize=BLOCKSIZE,
+            blockysize=BLOCKSIZE,
+            BIGTIFF="IF_SAFER",
+        )
+
+        direct = (
+            crs.is_geographic
+            and not options.get("web_optimized")
+            and not options.get("dst_crs")
+        )
+        if not direct:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                tmp_path = os.path.join(tmpdir, "grid.tif")
+                with stage(report, "read"):
+                    with rasterio.open(tmp_path, "w", **profile) as tmp_dst:
+                        write_dataset(dset, tmp_dst, flip)
+                        tmp_dst.update_tags(**times)
+                return convert(tmp_path, out_cog, dict(options, nodata=nodata), report)
+
+        settings = options.get("settings")
+        stats = None
+        if options.get("stats", True):
+            stats = StatisticsAccumulator(count, nodata, pixels=width * height)
+
+        size_mb = width * height * count * dset.dtype.itemsize / 1024 ** 2
+        in_memory = size_mb <= IN_MEMORY_MAX_MB
+        with tempfile.TemporaryDirectory() as tmpdir, MemoryFile() as mem:
+            with stage(report, "read"):
+                if in_memory:
+                    tmp_dst = mem.open(**profile)
+                else:
+                    tmp_path = os.path.join(tmpdir, "grid.tif")
+                    tmp_dst = rasterio.open(tmp_path, "w", **profile)
+                with tmp_dst:
+                    write_dataset(
+                        dset, tmp_dst, flip, on_window=stats.update if stats else None
+                    )
+                    if stats:
+                        stats.write_tags(tmp_dst)
+                    tmp_dst.update_tags(**times)
+                    tmp_path = tmp_dst.name
+
+            if settings is None and options.get("autotune"):
+                from .autotune import autotune
+
+                with stage(report, "autotune"):
+                    settings, _ = autotune(tmp_path, options)
+
+            config = cog_config(options.get("threads"), settings)
+            with stage(report, "cog"), rasterio.Env(**config):
+                _translate(tmp_path, out_cog, settings, nodata, None, config)
+
+    if stats:
+        with stage(report, "statistics"):
+            stats.write_sidecar(sidecar_path(out_cog))
+
+    return out_cog
@@ -0,0 +1,112 @@
+"""file_to_cog.mercator: web mercator aligned output grid.
+
+The output grid is in EPSG:3857 at the resolution of the dataset native
+zoom, and its origin and size are multiples of the tiles of the lowest
+overview zoom. Every internal tile of the full resolution image and of each
+overview level (one per zoom level) is then exactly one mercator tile, so
+tiles are read as block copies without resampling.
+
+"""
+
+import math
+
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.warp import calculate_default_transform
+
+import mercantile
+
+MERCATOR_CRS = CRS.from_epsg(3857)
+
+# Web mercator extent (meters) and latitude limit.
+MERCATOR_SIZE = 2 * math.pi * 6378137
+MAX_LAT = 85.0511287798066
+
+
+def zoom_resolution(zoom, tilesize=256):
+    """Return the pixel size (meters) of a web mercator zoom level."""
+    return MERCATOR_SIZE / (tilesize * 2 ** zoom)
+
+
+def native_zoom(src_dst, src_crs=None, tilesize=256):
+    """Return the lowest zoom level with pixels finer than the dataset pixels."""
+    transform, _, _ = calculate_default_transform(
+        src_crs or src_dst.crs,
+        MERCATOR_CRS,
+        src_dst.width,
+        src_dst.height,
+        *src_dst.bounds,
+    )
+    resolution = transform.a
+    return max(int(math.ceil(math.log2(MERCATOR_SIZE / (tilesize * resolution)))), 0)
+
+
+def tile_range(west, south, east, north, zoom):
+    """
+    Return the (xmin, ymin, xmax, ymax) indexes of the tiles covering bounds.
+
+    Same tiles as `mercantile.tiles`, from the two corner tiles only: tiles
+    whose edge is on the east or south bound are excluded.
+
+    """
+    upper_left = mercantile.tile(west, north, zoom)
+    lower_right = mercantile.tile(
+        east - mercantile.LL_EPSILON, south + mercantile.LL_EPSILON, zoom
+    )
+    return upper_left.x, upper_left.y, lower_right.x, lower_right.y
+
+
+def mercator_grid(src_dst, src_crs=None, tilesize=256):
+    """
+    Return the aligned web mercator grid of a dataset.
+
+    Attributes
+    ----------
+    src_dst : rasterio.io.DatasetReader
+        Opened dataset.
+    src_crs : str, optional
+        Source projection, if not set in the dataset.
+    tilesize : int, optional
+        Mercator tile and internal tile size (default: 256).
+
+    Returns
+    -------
+    grid : dict
+        crs, transform, width and height of the output (`WarpedVRT` and
+        `file_to_cog.warp.warp` parameters).
+    overview_level : int
+        Number of overview levels: the lowest overview zoom is
+        native zoom - overview_level.
+
+    """
+    maxzoom = native_zoom(src_dst, src_crs, tilesize)
+
+    transform, width, height = calculate_default_transform(
+        src_crs or src_dst.crs,
+        "epsg:4326",
+        src_dst.width,
+        src_dst.height,
+        *src_dst.bounds,
+    )
+    west, north = transform * (0, 0)
+    east, south = transform * (width, height)
+    south, north = max(south, -MAX_LAT), min(north, MAX_LAT)
+
+    # Overview levels until the image fits in one tile.
+    xmin, ymin, xmax, ymax = tile_range(west, south, east, north, maxzoom)
+    columns, rows = xmax - xmin + 1, ymax - ymin + 1
+    overview_level = min(int(math.ceil(math.log2(max(columns, rows, 1)))), maxzoom)
+
+    minzoom = maxzoom - overview_level
+    xmin, ymin, xmax, ymax = tile_range(west, south, east, north, minzoom)
+
+    left, _, _, top = mercantile.xy_bounds(xmin, ymin, minzoom)
+    resolution = zoom_resolution(maxzoom, tilesize)
+    size = tilesize * 2 ** overview_level
+    grid = dict(
+        crs=MERCATOR_CRS,
+        transform=Affine(resolution, 0, left, 0, -resolution, top),
+        width=(xmax - xmin + 1) * size,
+        height=(ymax - ymin + 1) * size,
+    )
+    return grid, overview_level
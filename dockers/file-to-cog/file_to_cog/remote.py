@@ -0,0 +1,285 @@
+"""file_to_cog.remote: ranged reads of remote (http(s):// and s3://) inputs.
+
+Remote inputs are not downloaded before the conversion: only the byte
+ranges the converted variables need are read.
+
+- NetCDF (and other GDAL) inputs are opened through /vsicurl/ or /vsis3/
+  (`source_path`), with REMOTE_BLOCK_KB blocks, a REMOTE_CACHE_MB block
+  cache and no directory listing (`gdal_config`, part of
+  `file_to_cog.convert.cog_config`). GDAL reads ahead on its own: the size
+  of consecutive downloads doubles while a file is read sequentially.
+- HDF5 inputs are read by h5py from a `RangeFile`: ranged GET requests of
+  whole blocks, an LRU block cache and a read-ahead of
+  REMOTE_READAHEAD_BLOCKS blocks fetched by background threads while h5py
+  decompresses the previous ones. Its requests and bytes fetched (against
+  the file size) are added to the conversion report.
+
+s3:// inputs use the S3_ENDPOINT_URL endpoint (see `file_to_cog.upload`).
+
+"""
+
+import io
+import os
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent import futures
+from urllib.parse import urlparse
+
+from .upload import S3_ENDPOINT_URL, parse_s3_url, s3_client
+
+REMOTE_BLOCK_KB = int(os.environ.get("REMOTE_BLOCK_KB", 1024))
+REMOTE_CACHE_MB = int(os.environ.get("REMOTE_CACHE_MB", 256))
+REMOTE_READAHEAD_BLOCKS = int(os.environ.get("REMOTE_READAHEAD_BLOCKS", 4))
+
+# Threads fetching blocks (read-ahead and cache misses).
+READ_THREADS = 4
+
+# Attempts of a ranged request.
+READ_ATTEMPTS = 3
+
+HTTP_SCHEMES = ("http://", "https://")
+
+
+def is_remote(path):
+    """Return True for http(s):// and s3:// urls."""
+    return str(path).startswith(HTTP_SCHEMES + ("s3://",))
+
+
+def gdal_path(path):
+    """Return the GDAL path of a url (/vsicurl/ or /vsis3/), or the path."""
+    if str(path).startswith(HTTP_SCHEMES):
+        return f"/vsicurl/{path}"
+    if str(path).startswith("s3://"):
+        return f"/vsis3/{path[len('s3://'):]}"
+    return path
+
+
+def gdal_config(block_kb=REMOTE_BLOCK_KB, cache_mb=REMOTE_CACHE_MB):
+    """GDAL configuration for /vsicurl/ and /vsis3/ reads."""
+    config = dict(
+        GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR",
+        # GDAL caps the block size to 10 MB.
+        CPL_VSIL_CURL_CHUNK_SIZE=min(block_kb, 10 * 1024) * 1024,
+        CPL_VSIL_CURL_CACHE_SIZE=cache_mb * 1024 * 1024,
+        GDAL_HTTP_MERGE_CONSECUTIVE_RANGES=True,
+        GDAL_HTTP_MAX_RETRY=READ_ATTEMPTS - 1,
+    )
+    if S3_ENDPOINT_URL:
+        endpoint = urlparse(S3_ENDPOINT_URL)
+        config.update(
+            AWS_S3_ENDPOINT=endpoint.netloc,
+            AWS_HTTPS=endpoint.scheme == "https",
+            AWS_VIRTUAL_HOSTING=False,
+        )
+    return config
+
+
+class RangeFile(io.RawIOBase):
+    """
+    Read-only file object reading a url with ranged requests.
+
+    The file is read by blocks of `block_kb`, kept in an LRU cache of
+    `cache_mb`. Sequential reads (each starting where the previous one
+    ended) fetch the next `readahead` blocks in the background.
+    Consecutive missing blocks are fetched in a single request.
+
+    Usage
+    -----
+    with RangeFile("https://host/file.h5") as f, h5py.File(f, "r") as h5:
+        ...
+    f.stats()
+
+    Attributes
+    ----------
+    url : str
+        http(s):// or s3:// url.
+    block_kb : int, optional
+        Block size, in KB (default: REMOTE_BLOCK_KB).
+    cache_mb : int, optional
+        Block cache size, in MB (default: REMOTE_CACHE_MB).
+    readahead : int, optional
+        Blocks read ahead (default: REMOTE_READAHEAD_BLOCKS).
+
+    """
+
+    def __init__(
+        self,
+        url,
+        block_kb=REMOTE_BLOCK_KB,
+        cache_mb=REMOTE_CACHE_MB,
+        readahead=REMOTE_READAHEAD_BLOCKS,
+    ):
+        """Initialize file and read its size."""
+        super().__init__()
+        self.url = url
+        self.block_size = block_kb * 1024
+        self.readahead = readahead
+        self.max_blocks = max(cache_mb * 1024 // block_kb, readahead + 1)
+        self.requests = 0
+        self.fetched_bytes = 0
+        self._client = None
+        if url.startswith("s3://"):
+            self._bucket, self._key = parse_s3_url(url)
+            self._client = s3_client(max_connections=READ_THREADS)
+        self.size = self._size()
+        self._pos = 0
+        self._last_end = None
+        self._blocks = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(max_workers=READ_THREADS)
+
+    def _size(self):
+        if self._client:
+            head = self._client.head_object(Bucket=self._bucket, Key=self._key)
+            return head["ContentLength"]
+        request = urllib.request.Request(self.url, method="HEAD")
+        with urllib.request.urlopen(request) as resp:
+            return int(resp.headers["Content-Length"])
+
+    def _get(self, start, end):
+        """Return bytes start to end (inclusive)."""
+        for attempt in range(READ_ATTEMPTS):
+            try:
+                if self._client:
+                    resp = self._client.get_object(
+                        Bucket=self._bucket, Key=self._key, Range=f"bytes={start}-{end}"
+                    )
+                    return resp["Body"].read()
+                request = urllib.request.Request(
+                    self.url, headers={"Range": f"bytes={start}-{end}"}
+                )
+                with urllib.request.urlopen(request) as resp:
+                    data = resp.read()
+                # Servers ignoring the Range header return the whole file.
+                return data if resp.status == 206 else data[start : end + 1]
+            except (urllib.error.URLError, OSError):
+                if attempt == READ_ATTEMPTS - 1:
+                    raise
+
+    def _fetch(self, first, last):
+        """Fetch blocks first to last, cache and return them."""
+        try:
+            start = first * self.block_size
+            end = min((last + 1) * self.block_size, self.size) - 1
+            data = self._get(start, end)
+            blocks = {}
+            for ix in range(first, last + 1):
+                offset = (ix - first) * self.block_size
+                blocks[ix] = data[offset : offset + self.block_size]
+            with self._lock:
+                self.requests += 1
+                self.fetched_bytes += len(data)
+                for ix, block in blocks.items():
+                    self._blocks[ix] = block
+                    self._blocks.move_to_end(ix)
+                while len(self._blocks) > self.max_blocks:
+                    self._blocks.popitem(last=False)
+            return blocks
+        finally:
+            with self._lock:
+                for ix in range(first, last + 1):
+                    self._inflight.pop(ix, None)
+
+    def _schedule(self, indexes):
+        """Fetch the missing blocks in the background, return block futures."""
+        missing = [
+            ix for ix in indexes if ix not in self._blocks and ix not in self._inflight
+        ]
+        runs = []
+        for ix in missing:
+            if runs and runs[-1][1] == ix - 1:
+                runs[-1][1] = ix
+            else:
+                runs.append([ix, ix])
+        for first, last in runs:
+            future = self._executor.submit(self._fetch, first, last)
+            for ix in range(first, last + 1):
+                self._inflight[ix] = future
+        return {ix: self._inflight[ix] for ix in indexes if ix in self._inflight}
+
+    def _read_blocks(self, first, last, sequential=False):
+        with self._lock:
+            pending = self._schedule(range(first, last + 1))
+            blocks = {
+                ix: self._blocks[ix]
+                for ix in range(first, last + 1)
+                if ix in self._blocks
+            }
+            for ix in blocks:
+                self._blocks.move_to_end(ix)
+
+            count = -(-self.size // self.block_size)
+            if sequential and self.readahead:
+                self._schedule(range(last + 1, min(last + 1 + self.readahead, count)))
+
+        for ix, future in pending.items():
+            if ix not in blocks:
+                blocks.update(future.result())
+        return blocks
+
+    def readinto(self, buffer):
+        """Read up to len(buffer) bytes at the current position."""
+        size = min(len(buffer), self.size - self._pos)
+        if size <= 0:
+            return 0
+        first = self._pos // self.block_size
+        last = (self._pos + size - 1) // self.block_size
+        # Read ahead while reads follow each other.
+        blocks = self._read_blocks(first, last, self._pos == self._last_end)
+
+        view = memoryview(buffer)
+        offset = self._pos - first * self.block_size
+        written = 0
+        for ix in range(first, last + 1):
+            chunk = blocks[ix][offset : offset + size - written]
+            view[written : written + len(chunk)] = chunk
+            written += len(chunk)
+            offset = 0
+        self._pos += written
+        self._last_end = self._pos
+        return written
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Move the current position."""
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        """Stop the read-ahead and drop the cache."""
+        if not self.closed:
+            # Drop the read-ahead not started yet (`cancel_futures` is 3.9+).
+            with self._lock:
+                inflight, self._inflight = self._inflight, {}
+            for future in set(inflight.values()):
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._blocks.clear()
+        super().close()
+
+    def stats(self):
+        """Return the requests and bytes fetched, against the file size."""
+        return {
+            "url": self.url,
+            "size": self.size,
+            "requests": self.requests,
+            "fetched_bytes": self.fetched_bytes,
+            "fetched_ratio": round(self.fetched_bytes / self.size, 4)
+            if self.size
+            else None,
+        }
@@ -0,0 +1,318 @@
+"""file_to_cog.report: per-stage conversion report.
+
+Conversions record each stage (open, reproject or warp, statistics, COG
+creation...) in a `ConversionReport`: wall and CPU time, peak RSS and bytes
+read and written. The report ends with the output size, compression ratio
+and overview count, or a machine-readable failure reason, and can be
+appended (one JSON line per conversion) to a local metrics log
+(CONVERSION_METRICS_LOG) to size containers and compare runs.
+
+Linux only measures (peak RSS reset per stage and I/O counters, from
+/proc/self) are None elsewhere. CPU time includes the worker processes (e.g
+windowed reprojection) that finished during the stage. Worker peak RSS is
+measured in the workers, around each job (`measure_worker`), and sent back
+with the job results (`add_worker_rss`); it is None for stages without
+workers. Bytes read and written are those of the converting process.
+
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import resource
+import contextlib
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy
+
+import rasterio
+from rasterio.errors import RasterioIOError
+
+# Local JSON lines log every report is appended to (default: none).
+METRICS_LOG = os.environ.get("CONVERSION_METRICS_LOG")
+
+# Failure reasons, by exception type (first match). Exceptions can also set
+# their own `failure_reason` attribute.
+FAILURE_REASONS = (
+    (MemoryError, "out_of_memory"),
+    (BrokenProcessPool, "worker_crashed"),
+    (RasterioIOError, "input_error"),
+    (KeyError, "invalid_input"),
+    (ValueError, "invalid_input"),
+)
+
+
+def failure_reason(err):
+    """Return the machine-readable reason of a conversion error."""
+    reason = getattr(err, "failure_reason", None)
+    if reason:
+        return reason
+    if isinstance(err, OSError) and err.errno == errno.ENOSPC:
+        return "disk_full"
+    for exc_type, reason in FAILURE_REASONS:
+        if isinstance(err, exc_type):
+            return reason
+    if isinstance(err, OSError):
+        return "io_error"
+    return "conversion_error"
+
+
+def _mb(kilobytes):
+    return round(kilobytes / 1024.0, 1)
+
+
+def _maxrss_kb(who):
+    maxrss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss / 1024.0 if sys.platform == "darwin" else maxrss
+
+
+def _cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _reset_peak_rss():
+    """Reset the process peak RSS (Linux 4.0+), return True if done."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb():
+    """Return the process peak RSS since the last reset."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return _maxrss_kb(resource.RUSAGE_SELF)
+
+
+def _io_bytes():
+    """Return the bytes read and written by the process, or (None, None)."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+# Worker peak RSS (KB) of the stages running in this process.
+_running_stages = []
+
+
+def measure_worker(func, *args, **kwargs):
+    """
+    Run a job in a worker process, return its result and the job peak RSS.
+
+    Returns
+    -------
+    result : object
+        `func(*args, **kwargs)`.
+    peak_rss_kb : int
+        Peak RSS of the worker during the job (since its start if the peak
+        cannot be reset).
+
+    """
+    _reset_peak_rss()
+    result = func(*args, **kwargs)
+    return result, _peak_rss_kb()
+
+
+def add_worker_rss(kilobytes):
+    """Record the peak RSS of a worker job in the running stages."""
+    for measure in _running_stages:
+        measure["peak_kb"] = max(measure["peak_kb"], kilobytes)
+
+
+def _delta(end, start):
+    return None if end is None or start is None else end - start
+
+
+def output_info(out_cog, source=None):
+    """Return the size, compression ratio and overview count of a COG."""
+    with rasterio.open(out_cog) as src_dst:
+        itemsize = numpy.dtype(src_dst.dtypes[0]).itemsize
+        uncompressed = src_dst.width * src_dst.height * src_dst.count * itemsize
+        info = {
+            "width": src_dst.width,
+            "height": src_dst.height,
+            "count": src_dst.count,
+            "dtype": src_dst.dtypes[0],
+            "overviews": len(src_dst.overviews(1)),
+            "compression": src_dst.compression.value if src_dst.compression else None,
+        }
+
+    size = os.path.getsize(out_cog)
+    info.update(
+        output_bytes=size,
+        compression_ratio=round(uncompressed / float(size), 3) if size else None,
+    )
+    if source and os.path.exists(source):
+        info["input_bytes"] = os.path.getsize(source)
+    return info
+
+
+class ConversionReport(object):
+    """
+    Per-stage timing and memory report of a conversion.
+
+    Usage
+    -----
+    report = ConversionReport("file.nc", "file.cog.tif")
+    with report.stage("warp"):
+        ...
+    report.finish()  # or report.fail(err)
+    report.to_dict()
+
+    Attributes
+    ----------
+    source : str
+        Input path (file path or GDAL dataset path).
+    output : str, optional
+        Output COG path.
+
+    """
+
+    def __init__(self, source, output=None):
+        """Initialize report."""
+        self.source = source
+        self.output = output
+        self.stages = []
+        self.status = None
+        self.error = None
+        self.output_info = {}
+        self.validation = None
+        self.upload = None
+        self.remote = None
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self._cpu0 = _cpu_time()
+        self._io0 = _io_bytes()
+        self._failed_stage = None
+        self._totals = None
+        # Stages reset the process peak RSS: keep the overall peak.
+        self._peak_kb = _peak_rss_kb()
+        self._workers_peak_kb = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure a conversion stage."""
+        self._peak_kb = max(self._peak_kb, _peak_rss_kb())
+        reset = _reset_peak_rss()
+        t0, cpu0, io0 = time.perf_counter(), _cpu_time(), _io_bytes()
+        workers = {"peak_kb": 0}
+        _running_stages.append(workers)
+        try:
+            yield
+        except BaseException:
+            # innermost stage first
+            self._failed_stage = self._failed_stage or name
+            raise
+        finally:
+            _running_stages.remove(workers)
+            read, written = _io_bytes()
+            peak = _peak_rss_kb()
+            self._peak_kb = max(self._peak_kb, peak)
+            workers_peak = workers["peak_kb"]
+            self._workers_peak_kb = max(self._workers_peak_kb, workers_peak)
+            self.stages.append(
+                {
+                    "name": name,
+                    "wall_s": round(time.perf_counter() - t0, 3),
+                    "cpu_s": round(_cpu_time() - cpu0, 3),
+                    "peak_rss_mb": _mb(peak) if reset else None,
+                    "workers_peak_rss_mb": _mb(workers_peak) if workers_peak else None,
+                    "read_bytes": _delta(read, io0[0]),
+                    "written_bytes": _delta(written, io0[1]),
+                }
+            )
+
+    def finish(self, output=None):
+        """Mark the conversion successful and read the output properties."""
+        self.output = output or self.output
+        self.status = "ok"
+        self._totals = self._measure()
+        if self.output and os.path.exists(self.output):
+            self.output_info = output_info(self.output, self._source_file())
+
+    def fail(self, err):
+        """Mark the conversion failed."""
+        self.status = "error"
+        self._totals = self._measure()
+        self.error = {
+            "reason": failure_reason(err),
+            "type": type(err).__name__,
+            "message": str(err),
+            "stage": self._failed_stage,
+        }
+
+    def _source_file(self):
+        # NETCDF:file.nc:variable -> file.nc
+        parts = self.source.split(":")
+        return parts[1].strip('"') if len(parts) == 3 else self.source
+
+    def _measure(self):
+        read, written = _io_bytes()
+        return {
+            "wall_s": round(time.perf_counter() - self._t0, 3),
+            "cpu_s": round(_cpu_time() - self._cpu0, 3),
+            "peak_rss_mb": _mb(max(self._peak_kb, _peak_rss_kb())),
+            "workers_peak_rss_mb": (
+                _mb(self._workers_peak_kb) if self._workers_peak_kb else None
+            ),
+            "read_bytes": _delta(read, self._io0[0]),
+            "written_bytes": _delta(written, self._io0[1]),
+        }
+
+    def to_dict(self):
+        """Return the report (totals are measured at finish or fail)."""
+        return {
+            "source": self.source,
+            "output": self.output,
+            "status": self.status,
+            "error": self.error,
+            "host": socket.gethostname(),
+            "started": self.started,
+            **(self._totals or self._measure()),
+            "stages": self.stages,
+            **self.output_info,
+            "validation": self.validation,
+            "upload": self.upload,
+            "remote": self.remote,
+        }
+
+    def append(self, path=None):
+        """Append the report to a JSON lines metrics log (default: METRICS_LOG)."""
+        path = path or METRICS_LOG
+        if not path:
+            return None
+        line = json.dumps(self.to_dict()) + "\n"
+        # A single O_APPEND write, so concurrent conversions do not interleave.
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+        return path
+
+
+@contextlib.contextmanager
+def _no_stage():
+    yield
+
+
+def stage(report, name):
+    """Return `report.stage(name)`, or a no-op context if there is no report."""
+    return report.stage(name) if report else _no_stage()
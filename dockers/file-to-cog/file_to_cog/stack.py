@@ -0,0 +1,319 @@
+"""file_to_cog.stack: stack a time series of files into a multi-band COG.
+
+Daily files of the same variable and grid (e.g MUR SST) are converted to a
+single COG with one band per date, ordered by date:
+
+1. input files are decoded and reprojected in a process pool, each to a
+   temporary tiled GeoTIFF on the output grid (set by the first file),
+2. the temporary files are read window by window and written to a pixel
+   interleaved GeoTIFF, so each internal tile holds every date of its
+   pixels and a single block read returns a pixel's full history,
+3. the stack is written by `cog_translate`, with the date of each band in
+   its description and DATE band metadata, and all dates (JSON) in the
+   DATES dataset metadata.
+
+Dates are read from the NetCDF time dimension (CF units), the
+`time_coverage_start` global attribute or the file name (YYYYMMDD or
+YYYY-MM-DD), in that order.
+
+"""
+
+import os
+import re
+import json
+import math
+import tempfile
+import datetime
+import multiprocessing
+from concurrent import futures
+
+import numpy
+
+import rasterio
+from rasterio.vrt import WarpedVRT
+from rasterio.enums import Resampling
+
+from .warp import BLOCKSIZE, WARP_MEMORY_MB, block_windows, output_grid
+from .stats import StatisticsAccumulator, sidecar_path
+from .convert import TARGET_CRS, _translate, cog_config, get_nodata, source_path
+from .report import add_worker_rss, measure_worker, stage
+
+CF_TIME = re.compile(
+    r"(?P<unit>\w+) since (?P<date>\d{4}-\d{1,2}-\d{1,2})"
+    r"(?:[ T](?P<time>\d{1,2}:\d{2}(?::\d{2})?))?"
+)
+
+# YYYYMMDD or YYYY-MM-DD, possibly followed by a time (e.g MUR 20190601090000).
+FILENAME_DATE = re.compile(
+    r"(?<!\d)((?:19|20)\d{2})-?(\d{2})-?(\d{2})(?=\d{6}(?!\d)|\D|$)"
+)
+
+CF_UNITS = {
+    "days": "days",
+    "day": "days",
+    "hours": "hours",
+    "hour": "hours",
+    "minutes": "minutes",
+    "minute": "minutes",
+    "seconds": "seconds",
+    "second": "seconds",
+}
+
+
+def _cf_date(value, units):
+    match = CF_TIME.match(units.strip())
+    if not match or match.group("unit").lower() not in CF_UNITS:
+        return None
+    base = datetime.datetime.strptime(match.group("date"), "%Y-%m-%d")
+    if match.group("time"):
+        hms = [int(v) for v in match.group("time").split(":")]
+        base = base.replace(hour=hms[0], minute=hms[1])
+    delta = datetime.timedelta(**{CF_UNITS[match.group("unit").lower()]: float(value)})
+    return (base + delta).date()
+
+
+def _cf_time_date(src_dst):
+    """Date of the first NetCDF time value (CF `units since date`)."""
+    value = src_dst.tags(1).get("NETCDF_DIM_time")
+    units = src_dst.tags().get("time#units")
+    if value is None or not units:
+        return None
+    return _cf_date(value.split(",")[0].strip("{} "), units)
+
+
+def _coverage_date(src_dst):
+    """Date of the `time_coverage_start` global attribute."""
+    start = src_dst.tags().get("NC_GLOBAL#time_coverage_start")
+    match = FILENAME_DATE.search(start) if start else None
+    return datetime.date(*(int(v) for v in match.groups())) if match else None
+
+
+def _filename_date(sourcefile):
+    """First valid date in the file name."""
+    for match in FILENAME_DATE.finditer(os.path.basename(sourcefile)):
+        try:
+            return datetime.date(*(int(v) for v in match.groups()))
+        except ValueError:
+            continue
+    return None
+
+
+def file_date(sourcefile, src_dst=None):
+    """
+    Return the date of a file, or None.
+
+    The date is read from the NetCDF time dimension, then from the time
+    coverage attribute, then from the file name.
+
+    Attributes
+    ----------
+    sourcefile : str
+        File path (for the file name date).
+    src_dst : rasterio.io.DatasetReader, optional
+        Opened dataset (for the NetCDF time metadata).
+
+    """
+    if src_dst is not None:
+        date = _cf_time_date(src_dst) or _coverage_date(src_dst)
+        if date:
+            return date
+    return _filename_date(sourcefile)
+
+
+def _grid_signature(src_dst):
+    return (src_dst.width, src_dst.height, tuple(src_dst.transform)[:6], src_dst.crs)
+
+
+def _decode(sourcefile, bandname, tmp_path, grid, reference, options):
+    """Reproject one input file to the output grid, return its date."""
+    src_path = source_path(sourcefile, bandname)
+    with rasterio.Env(**options["config"]):
+        with rasterio.open(src_path) as src_dst:
+            if _grid_signature(src_dst) != reference:
+                raise ValueError(f"{sourcefile} grid differs from the first file")
+
+            date = file_date(sourcefile, src_dst)
+            if date is None:
+                raise ValueError(f"No date found for {sourcefile}")
+
+            nodata = options["nodata"]
+            vrt_params = dict(
+                crs=grid["crs"],
+                transform=grid["transform"],
+                width=grid["width"],
+                height=grid["height"],
+                resampling=Resampling.nearest,
+                dtype=src_dst.dtypes[0],
+            )
+            if nodata is not None:
+                vrt_params.update(src_nodata=nodata, nodata=nodata)
+            if src_dst.crs is None:
+                vrt_params["src_crs"] = TARGET_CRS
+
+            with WarpedVRT(src_dst, **vrt_params) as vrt_dst:
+                profile = dict(
+                    vrt_dst.profile,
+                    driver="GTiff",
+                    tiled=True,
+                    blockxsize=BLOCKSIZE,
+                    blockysize=BLOCKSIZE,
+                    compress="deflate",
+                    zlevel=1,
+                    BIGTIFF="IF_SAFER",
+                )
+                with rasterio.open(tmp_path, "w", **profile) as tmp_dst:
+                    for window in block_windows(vrt_dst.width, vrt_dst.height, 1024):
+                        tmp_dst.write(vrt_dst.read(window=window), window=window)
+
+    return sourcefile, date.isoformat(), tmp_path
+
+
+def stack_window_size(count, itemsize, memory_mb=WARP_MEMORY_MB):
+    """Return the side (in pixels) of the stacking windows."""
+    pixels = memory_mb * 1024 * 1024 / (2 * count * itemsize)
+    return max(int(math.sqrt(pixels)) // BLOCKSIZE * BLOCKSIZE, BLOCKSIZE)
+
+
+def _write_stack(stacked, profile, decoded, size, stats=None, bandname=None):
+    """Interleave the decoded files in `stacked`, one band per date."""
+    with rasterio.open(stacked, "w", **profile) as dst:
+        sources = [rasterio.open(tmp_path) for _, _, tmp_path in decoded]
+        try:
+            for window in block_windows(dst.width, dst.height, size):
+                data = numpy.concatenate([src.read(window=window) for src in sources])
+                dst.write(data, window=window)
+                if stats:
+                    stats.update(data)
+        finally:
+            for src in sources:
+                src.close()
+
+        dates = [date for _, date, _ in decoded]
+        for ix, (sourcefile, date, _) in enumerate(decoded, 1):
+            dst.set_band_description(ix, date)
+            dst.update_tags(ix, DATE=date, SOURCE=os.path.basename(sourcefile))
+        dst.update_tags(DATES=json.dumps(dates), VARIABLE=bandname or "")
+        if stats:
+            stats.write_tags(dst)
+
+
+def stack(sourcefiles, out_cog, options={}, max_workers=None, report=None):
+    """
+    Stack files of the same variable and grid into a multi-band COG.
+
+    Attributes
+    ----------
+    sourcefiles : list
+        NetCDF file paths or urls, one per date.
+    out_cog : str
+        Output COG path.
+    options : dict, optional
+        bandname : str
+            NetCDF variable to stack.
+        nodata : int or float
+            Custom nodata value (default: the first file nodata value).
+        dst_crs : str
+            Output projection (default: "+proj=longlat +ellps=WGS84").
+        memory_mb : int
+            Stacking memory budget, in MB (default: WARP_MEMORY_MB or 256).
+        threads, settings and stats as `file_to_cog.convert.convert`.
+    max_workers : int, optional
+        Number of decoding processes (default: cpu count).
+    report : file_to_cog.report.ConversionReport, optional
+        Report recording the conversion stages.
+
+    Returns
+    -------
+    dates : list
+        Band dates (ISO format), in band order.
+
+    """
+    if not sourcefiles:
+        raise ValueError("No file to stack")
+
+    bandname = options.get("bandname")
+    settings = options.get("settings")
+    config = cog_config(options.get("threads"), settings)
+
+    with rasterio.Env(**config), rasterio.open(
+        source_path(sourcefiles[0], bandname)
+    ) as src_dst:
+        reference = _grid_signature(src_dst)
+        nodata = get_nodata(src_dst, options.get("nodata"))
+        dtype = src_dst.dtypes[0]
+        dst_crs = options.get("dst_crs", TARGET_CRS)
+        transform, width, height = output_grid(
+            src_dst, dst_crs, TARGET_CRS if src_dst.crs is None else None
+        )
+    grid = dict(crs=dst_crs, transform=transform, width=width, height=height)
+
+    workers = max(min(max_workers or multiprocessing.cpu_count(), len(sourcefiles)), 1)
+    threads = max(config["NUM_THREADS"] // workers, 1)
+    decode_options = dict(nodata=nodata, config=dict(config, NUM_THREADS=threads))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with stage(report, "decode"), futures.ProcessPoolExecutor(
+            max_workers=workers
+        ) as executor:
+            jobs = [
+                executor.submit(
+                    measure_worker,
+                    _decode,
+                    sourcefile,
+                    bandname,
+                    os.path.join(tmpdir, f"{ix}.tif"),
+                    grid,
+                    reference,
+                    decode_options,
+                )
+                for ix, sourcefile in enumerate(sourcefiles)
+            ]
+            decoded = []
+            for job in jobs:
+                result, peak_kb = job.result()
+                add_worker_rss(peak_kb)
+                decoded.append(result)
+            decoded.sort(key=lambda d: d[1])
+
+        dates = [date for _, date, _ in decoded]
+        duplicates = sorted({d for d in dates if dates.count(d) > 1})
+        if duplicates:
+            raise ValueError(f"Several files for {', '.join(duplicates)}")
+
+        count = len(decoded)
+        stats = None
+        if options.get("stats", True):
+            stats = StatisticsAccumulator(count, nodata, pixels=width * height)
+
+        profile = dict(
+            driver="GTiff",
+            width=width,
+            height=height,
+            count=count,
+            dtype=dtype,
+            crs=dst_crs,
+            transform=transform,
+            nodata=nodata,
+            tiled=True,
+            blockxsize=BLOCKSIZE,
+            blockysize=BLOCKSIZE,
+            interleave="pixel",
+            BIGTIFF="IF_SAFER",
+        )
+        size = stack_window_size(
+            count,
+            numpy.dtype(dtype).itemsize,
+            options.get("memory_mb") or WARP_MEMORY_MB,
+        )
+        stacked = os.path.join(tmpdir, "stack.tif")
+        with stage(report, "stack"), rasterio.Env(**config):
+            _write_stack(stacked, profile, decoded, size, stats, bandname)
+
+        with stage(report, "cog"), rasterio.Env(**config):
+            _translate(stacked, out_cog, settings, nodata, None, config, in_memory=False)
+
+    if stats:
+        with stage(report, "statistics"):
+            stats.write_sidecar(sidecar_path(out_cog))
+
+    return dates
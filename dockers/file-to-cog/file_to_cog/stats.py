@@ -0,0 +1,204 @@
+"""file_to_cog.stats: per-band statistics computed while writing the COG.
+
+Statistics are accumulated window by window from the reprojected pixels, as
+they are written, and stored in the COG band metadata and in a JSON sidecar
+({cog}.stats.json). The tiler `/metadata` route returns them without reading
+pixels.
+
+Band metadata tags:
+
+- STATISTICS_MINIMUM, STATISTICS_MAXIMUM, STATISTICS_MEAN, STATISTICS_STDDEV
+  and STATISTICS_VALID_PERCENT (as `gdalinfo -stats`)
+- STATISTICS_PERCENTILES: JSON object {percentile: value}
+- STATISTICS_HISTOGRAM: JSON [counts, bin edges]
+
+Minimum, maximum, mean, standard deviation and valid percent are exact.
+Percentiles and the histogram are computed from a regular sample of at most
+STATS_SAMPLE_SIZE valid pixels (all bands together, so a stack of many dates
+does not hold more samples), histogram counts being scaled to the number of
+valid pixels.
+
+"""
+
+import os
+import json
+
+import numpy
+
+PERCENTILES = (1, 2, 5, 25, 50, 75, 95, 98, 99)
+
+HISTOGRAM_BINS = 20
+
+SAMPLE_SIZE = int(os.environ.get("STATS_SAMPLE_SIZE", 4000000))
+
+
+def sidecar_path(out_cog):
+    """Return the JSON statistics sidecar path of a COG."""
+    return f"{out_cog}.stats.json"
+
+
+class BandStatistics(object):
+    """
+    Streaming statistics of one band.
+
+    Attributes
+    ----------
+    stride : int
+        Keep one valid pixel every `stride` for percentiles and histogram.
+
+    """
+
+    def __init__(self, stride=1):
+        """Initialize accumulator."""
+        self.stride = stride
+        self.total = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+        self._samples = []
+        self._offset = 0
+
+    def update(self, values, total):
+        """Add the valid `values` (1D array) of a window of `total` pixels."""
+        self.total += total
+        if not values.size:
+            return
+
+        values = values.astype("float64")
+        count = values.size
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+
+        # Chan et al. parallel variance update.
+        delta = mean - self.mean
+        n = self.count + count
+        self.mean += delta * count / n
+        self.m2 += m2 + delta ** 2 * self.count * count / n
+        self.count = n
+
+        vmin, vmax = values.min(), values.max()
+        self.minimum = vmin if self.minimum is None else min(self.minimum, vmin)
+        self.maximum = vmax if self.maximum is None else max(self.maximum, vmax)
+        # A copy: a view would keep the whole window array.
+        self._samples.append(values[self._offset :: self.stride].copy())
+        self._offset = (self._offset - count) % self.stride
+
+    def result(self, percentiles=PERCENTILES, bins=HISTOGRAM_BINS):
+        """Return the band statistics (None values if no valid pixel)."""
+        valid_percent = 100.0 * self.count / self.total if self.total else 0.0
+        if not self.count:
+            return {
+                "min": None,
+                "max": None,
+                "mean": None,
+                "std": None,
+                "valid_percent": valid_percent,
+                "count": 0,
+                "percentiles": {},
+                "histogram": [[], []],
+            }
+
+        sample = numpy.concatenate(self._samples)
+        counts, edges = numpy.histogram(
+            sample, bins=bins, range=(self.minimum, self.maximum)
+        )
+        counts = numpy.round(counts * (self.count / float(sample.size))).astype("int64")
+        return {
+            "min": float(self.minimum),
+            "max": float(self.maximum),
+            "mean": float(self.mean),
+            "std": float(numpy.sqrt(self.m2 / self.count)),
+            "valid_percent": valid_percent,
+            "count": int(self.count),
+            "percentiles": {
+                str(p): float(v)
+                for p, v in zip(percentiles, numpy.percentile(sample, percentiles))
+            },
+            "histogram": [counts.tolist(), edges.tolist()],
+        }
+
+
+class StatisticsAccumulator(object):
+    """
+    Streaming statistics of every band of a dataset.
+
+    Usage
+    -----
+    stats = StatisticsAccumulator(count=1, nodata=-9999, pixels=width * height)
+    for window in windows:
+        stats.update(data)  # (bands, rows, cols) array
+    stats.write_tags(dataset)
+    stats.write_sidecar("cog.tif.stats.json")
+
+    Attributes
+    ----------
+    count : int
+        Number of bands.
+    nodata : int or float, optional
+        Nodata value (NaN values are never valid).
+    pixels : int, optional
+        Number of pixels of a band, to size the percentiles sample (of
+        SAMPLE_SIZE pixels across all bands).
+
+    """
+
+    def __init__(self, count, nodata=None, pixels=None):
+        """Initialize accumulator."""
+        self.nodata = nodata
+        stride = max(int(pixels * count // SAMPLE_SIZE), 1) if pixels else 1
+        self.bands = [BandStatistics(stride) for _ in range(count)]
+
+    def update(self, data):
+        """Add a (bands, rows, cols) window."""
+        for arr, band in zip(data, self.bands):
+            valid = numpy.ones(arr.shape, dtype=bool)
+            if arr.dtype.kind == "f":
+                valid &= ~numpy.isnan(arr)
+            if self.nodata is not None and not numpy.isnan(self.nodata):
+                valid &= arr != self.nodata
+            band.update(arr[valid], arr.size)
+
+    def result(self):
+        """Return statistics, by band index (str)."""
+        return {str(ix + 1): band.result() for ix, band in enumerate(self.bands)}
+
+    def tags(self):
+        """Return the band metadata tags, by band index."""
+        tags = {}
+        for ix, stats in self.result().items():
+            band_tags = {
+                "STATISTICS_VALID_PERCENT": repr(stats["valid_percent"]),
+                "STATISTICS_PERCENTILES": json.dumps(stats["percentiles"]),
+                "STATISTICS_HISTOGRAM": json.dumps(stats["histogram"]),
+            }
+            if stats["count"]:
+                band_tags.update(
+                    STATISTICS_MINIMUM=repr(stats["min"]),
+                    STATISTICS_MAXIMUM=repr(stats["max"]),
+                    STATISTICS_MEAN=repr(stats["mean"]),
+                    STATISTICS_STDDEV=repr(stats["std"]),
+                )
+            tags[int(ix)] = band_tags
+        return tags
+
+    def write_tags(self, dst):
+        """Write the band metadata tags to an opened dataset."""
+        for ix, band_tags in self.tags().items():
+            dst.update_tags(ix, **band_tags)
+
+    def write_sidecar(self, path):
+        """Write the JSON sidecar."""
+        nodata = self.nodata
+        if nodata is not None and numpy.isnan(nodata):
+            nodata = "nan"
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "nodata": nodata,
+                    "histogram_bins": HISTOGRAM_BINS,
+                    "statistics": self.result(),
+                },
+                f,
+            )
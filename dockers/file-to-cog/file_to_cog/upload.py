@@ -0,0 +1,402 @@
+"""file_to_cog.upload: parallel multipart upload of COGs to an object store.
+
+COGs written to `s3://bucket/key` outputs are converted to a temporary
+file and uploaded with S3 multipart upload to AWS or to any S3 compatible
+endpoint (S3_ENDPOINT_URL, e.g MinIO or moto server): parts of
+UPLOAD_PART_SIZE_MB are uploaded by UPLOAD_CONCURRENCY threads, each with
+its Content-MD5 (checked by the store) and its ETag checked against it.
+
+Uploads start while the COG is written: GDAL writes the COG data after the
+IFDs (in the header, rewritten with the tile offsets at the end of the
+copy) and never moves it, so every part past the first one is uploaded as
+soon as the file grew past its end. The first part is uploaded when the
+file is closed, and the parts uploaded early are checked against the final
+file (MD5) and uploaded again if their bytes changed.
+
+"""
+
+import os
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+import contextlib
+from concurrent import futures
+from urllib.parse import urlparse
+
+from .catalog import register_output
+from .report import output_info, stage
+from .stats import sidecar_path
+
+UPLOAD_PART_SIZE_MB = int(os.environ.get("UPLOAD_PART_SIZE_MB", 16))
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", 8))
+
+# S3 compatible endpoint (default: AWS).
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+
+# S3 multipart upload part size limits.
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+# Seconds between checks of the size of the file being written.
+FOLLOW_INTERVAL = 0.2
+
+
+def is_s3(path):
+    """Return True for s3:// urls."""
+    return str(path).startswith("s3://")
+
+
+def parse_s3_url(url):
+    """Return the bucket and key of an s3:// url."""
+    parsed = urlparse(url)
+    key = parsed.path.lstrip("/")
+    if not parsed.netloc or not key:
+        raise ValueError(f"Invalid S3 url: {url}")
+    return parsed.netloc, key
+
+
+def s3_client(endpoint_url=None, max_connections=UPLOAD_CONCURRENCY):
+    """Return a boto3 S3 client (S3_ENDPOINT_URL endpoint by default)."""
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url or S3_ENDPOINT_URL,
+        config=Config(max_pool_connections=max(max_connections, 10)),
+    )
+
+
+def _md5(data):
+    return hashlib.md5(data).digest()
+
+
+def _read(path, offset, size):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def part_size_for(size, part_size):
+    """Return the part size, grown so a `size` bytes file fits in MAX_PARTS."""
+    part_size = max(part_size, MIN_PART_SIZE)
+    while size and -(-size // part_size) > MAX_PARTS:
+        part_size *= 2
+    return part_size
+
+
+class MultipartUpload(object):
+    """
+    S3 multipart upload of a local file, part by part in a thread pool.
+
+    Usage
+    -----
+    upload = MultipartUpload(client, "bucket", "key.tif", "local.tif")
+    upload.submit(2)    # parts can be uploaded in any order, and again
+    upload.complete()   # uploads the missing parts (or upload.abort())
+
+    The multipart upload is created with the first part.
+
+    Attributes
+    ----------
+    client : botocore S3 client
+    bucket, key : str
+        Destination object.
+    path : str
+        Local file.
+    part_size : int, optional
+        Part size in bytes (default: UPLOAD_PART_SIZE_MB).
+    concurrency : int, optional
+        Upload threads (default: UPLOAD_CONCURRENCY).
+
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket,
+        key,
+        path,
+        part_size=UPLOAD_PART_SIZE_MB * 1024 * 1024,
+        concurrency=UPLOAD_CONCURRENCY,
+    ):
+        """Initialize upload."""
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.path = path
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.upload_id = None
+        self.parts = {}
+        self.uploads = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    def _upload_part(self, number, size):
+        data = _read(self.path, (number - 1) * self.part_size, size)
+        digest = _md5(data)
+        resp = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=data,
+            ContentMD5=base64.b64encode(digest).decode(),
+        )
+        etag = resp["ETag"].strip('"')
+        # Plain MD5 ETag (not with SSE-KMS): check it as well.
+        if len(etag) == 32 and etag != digest.hex():
+            raise IOError(f"Part {number} checksum mismatch ({etag} != {digest.hex()})")
+        with self._lock:
+            self.parts[number] = {"etag": resp["ETag"], "md5": digest, "size": len(data)}
+            self.uploads += 1
+            self.bytes += len(data)
+        return number
+
+    def submit(self, number, size=None):
+        """Upload a part (of `part_size` bytes, but the last) in the background."""
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )["UploadId"]
+        future = self._executor.submit(self._upload_part, number, size or self.part_size)
+        self._pending[number] = future
+        return future
+
+    def wait(self):
+        """Wait for the submitted parts, raise the first upload error."""
+        pending, self._pending = self._pending, {}
+        for future in futures.as_completed(pending.values()):
+            future.result()
+
+    def complete(self):
+        """
+        Upload the missing parts and the changed ones, then complete the upload.
+
+        Returns
+        -------
+        reuploaded : int
+            Parts uploaded again because the file changed since.
+
+        """
+        self.wait()
+        size = os.path.getsize(self.path)
+        count = max(-(-size // self.part_size), 1)
+        reuploaded = 0
+        for number in range(1, count + 1):
+            part_bytes = min(self.part_size, size - (number - 1) * self.part_size)
+            part = self.parts.get(number)
+            if part is not None:
+                if part["size"] == part_bytes and part["md5"] == _md5(
+                    _read(self.path, (number - 1) * self.part_size, part_bytes)
+                ):
+                    continue
+                reuploaded += 1
+            self.submit(number, part_bytes)
+        self.wait()
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": n, "ETag": self.parts[n]["etag"]}
+                    for n in range(1, count + 1)
+                ]
+            },
+        )
+        self._executor.shutdown(wait=True)
+        return reuploaded
+
+    def abort(self):
+        """Abort the upload (the store drops the uploaded parts)."""
+        # Parts not started yet are dropped (`cancel_futures` is Python 3.9+).
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        if self.upload_id is None:
+            return
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+
+
+class FollowingUpload(object):
+    """
+    Upload a file while it is written, as parts past its header are final.
+
+    A thread watches the file size and submits every full part but the
+    first one. `finish` (once the file is closed) uploads the rest, checks
+    the early parts against the final file and completes the upload.
+
+    """
+
+    def __init__(self, upload, interval=FOLLOW_INTERVAL):
+        """Start following `upload.path`."""
+        self.upload = upload
+        self.interval = interval
+        self.streamed = 0
+        self._next = 2
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._follow, daemon=True)
+        self._thread.start()
+
+    def _follow(self):
+        part_size = self.upload.part_size
+        try:
+            while not self._stop.wait(self.interval):
+                if not os.path.exists(self.upload.path):
+                    continue
+                # Parts written and followed by data (the next part started).
+                size = os.path.getsize(self.upload.path)
+                while size > self._next * part_size:
+                    self.upload.submit(self._next)
+                    self._next += 1
+                    self.streamed += 1
+        except Exception as err:
+            self._error = err
+
+    def finish(self):
+        """Upload the remaining parts and complete the upload."""
+        self._stop.set()
+        self._thread.join()
+        if self._error:
+            raise self._error
+        return self.upload.complete()
+
+    def abort(self):
+        """Stop following and abort the upload."""
+        self._stop.set()
+        self._thread.join()
+        self.upload.abort()
+
+
+def upload_file(
+    path,
+    url,
+    client=None,
+    part_size=UPLOAD_PART_SIZE_MB * 1024 * 1024,
+    concurrency=UPLOAD_CONCURRENCY,
+):
+    """
+    Upload a local file to an s3:// url (multipart above one part).
+
+    Returns
+    -------
+    info : dict
+        url, bytes, parts and time_s.
+
+    """
+    bucket, key = parse_s3_url(url)
+    client = client or s3_client(max_connections=concurrency)
+    size = os.path.getsize(path)
+    part_size = part_size_for(size, part_size)
+
+    t0 = time.perf_counter()
+    if size <= part_size:
+        with open(path, "rb") as f:
+            data = f.read()
+        client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=data,
+            ContentMD5=base64.b64encode(_md5(data)).decode(),
+        )
+        parts = 1
+    else:
+        upload = MultipartUpload(client, bucket, key, path, part_size, concurrency)
+        try:
+            upload.complete()
+        except BaseException:
+            upload.abort()
+            raise
+        parts = len(upload.parts)
+
+    return {
+        "url": url,
+        "bytes": size,
+        "parts": parts,
+        "time_s": round(time.perf_counter() - t0, 3),
+    }
+
+
+@contextlib.contextmanager
+def output_target(out_cog, options={}, report=None):
+    """
+    Yield the local path to write a COG to, upload it on exit for s3:// urls.
+
+    For s3:// outputs the COG is written to a temporary file, uploaded while
+    it is written (see `FollowingUpload`), completed on exit with its
+    statistics sidecar, or aborted if the conversion failed. Local outputs
+    are yielded as is. Written COGs are then added to the dataset catalog,
+    if one is configured (see `file_to_cog.catalog`).
+
+    Attributes
+    ----------
+    out_cog : str
+        Output path or s3:// url.
+    options : dict, optional
+        part_size_mb, upload_concurrency and endpoint_url (default:
+        UPLOAD_PART_SIZE_MB, UPLOAD_CONCURRENCY and S3_ENDPOINT_URL), and
+        catalog (default: COG_CATALOG).
+    report : file_to_cog.report.ConversionReport, optional
+        Report recording the upload stage and its parts.
+
+    """
+    if not is_s3(out_cog):
+        yield out_cog
+        register_output(out_cog, out_cog, options, report)
+        return
+
+    bucket, key = parse_s3_url(out_cog)
+    concurrency = options.get("upload_concurrency") or UPLOAD_CONCURRENCY
+    part_size = (options.get("part_size_mb") or UPLOAD_PART_SIZE_MB) * 1024 * 1024
+    client = s3_client(options.get("endpoint_url"), concurrency)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        local_cog = os.path.join(tmpdir, os.path.basename(key))
+        follower = FollowingUpload(
+            MultipartUpload(client, bucket, key, local_cog, part_size, concurrency)
+        )
+        try:
+            yield local_cog
+        except BaseException:
+            follower.abort()
+            raise
+
+        with stage(report, "upload"):
+            size = os.path.getsize(local_cog)
+            if size <= follower.upload.part_size:
+                # Single part: a plain PUT.
+                follower.abort()
+                upload_file(local_cog, out_cog, client, part_size, concurrency)
+                reuploaded = 0
+            else:
+                try:
+                    reuploaded = follower.finish()
+                except BaseException:
+                    follower.upload.abort()
+                    raise
+
+            stats = sidecar_path(local_cog)
+            if os.path.exists(stats):
+                upload_file(stats, sidecar_path(out_cog), client)
+
+        if report:
+            report.output_info = output_info(local_cog)
+            report.upload = {
+                "url": out_cog,
+                "bytes": size,
+                "part_size": follower.upload.part_size,
+                "parts": max(len(follower.upload.parts), 1),
+                "streamed_parts": follower.streamed,
+                "reuploaded_parts": reuploaded,
+            }
+        register_output(local_cog, out_cog, options, report)
@@ -0,0 +1,622 @@
+"""file_to_cog.validate: check that a COG is well optimized for remote reads.
+
+Validation runs in two steps:
+
+1. structure: `rio_cogeo.cogeo.cog_validate` (IFD ordering, IFDs before
+   data, tiling, internal overviews), plus overview count against the image
+   size (as rio-cogeo: down to one block on the shortest side) and mask
+   handling (no external .msk or .ovr file, no nodata value and mask
+   together),
+2. reads: a standard set of `rio_tiler.main.tile` reads (the tiles of
+   `file_to_cog.autotune.sample_tiles`) and point reads (dataset and test tile
+   centers) over HTTP, from a local range server run in a subprocess, which
+   counts the requests, ranges and bytes served for each read. Every read
+   uses its own url, so each one is measured with cold GDAL caches.
+
+Structure errors and reads above the thresholds (requests, header requests
+or MB per read) flag the file, or reject it in "reject" mode. Flagged files
+are only reported.
+
+    $ python -m file_to_cog.validate file.cog.tif --mode reject
+
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import urllib.request
+from functools import partial
+from collections import defaultdict
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import mercantile
+import rasterio
+from rasterio import warp
+from rasterio.enums import MaskFlags
+from rio_cogeo.cogeo import cog_validate
+from rio_cogeo.utils import get_maximum_overview_level
+
+from .autotune import sample_tiles
+from .stats import sidecar_path
+from .report import stage
+
+# Read thresholds, per (cold) tile or point read.
+# GDAL fetches each block in its own request: a tile of a well optimized COG
+# reads up to 4x4 blocks of one level, in one header request.
+MAX_READ_REQUESTS = int(os.environ.get("COG_VALIDATE_MAX_READ_REQUESTS", 32))
+MAX_HEADER_REQUESTS = int(os.environ.get("COG_VALIDATE_MAX_HEADER_REQUESTS", 2))
+MAX_READ_MB = float(os.environ.get("COG_VALIDATE_MAX_READ_MB", 8))
+
+# "flag" (keep the file, report the failures) or "reject".
+MODES = ("flag", "reject")
+
+# Default validation mode of the conversions (default: no validation).
+VALIDATE = os.environ.get("COG_VALIDATE") or None
+
+# GDAL settings of the tiler (tiler-api.tf). Directory listing is disabled:
+# read urls carry a query string and sidecar files are checked locally.
+READ_CONFIG = {
+    "GDAL_CACHEMAX": 512,
+    "VSI_CACHE": True,
+    "VSI_CACHE_SIZE": 536870912,
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+}
+
+range_expr = re.compile(r"(\d*)-(\d*)")
+read_expr = re.compile(r"^/_read/([^/]+)(?=/)")
+
+
+class InvalidCOGError(Exception):
+    """COG rejected by the validation."""
+
+    failure_reason = "invalid_output"
+
+    def __init__(self, path, validation):
+        """Initialize error."""
+        self.validation = validation
+        problems = validation["errors"] + validation["read_errors"]
+        super().__init__(f"{path} rejected: {'; '.join(problems)}")
+
+
+class RangeCountingHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler serving byte ranges and recording them per read.
+
+    Urls prefixed by /_read/{read id}/ serve the same files, and their
+    requests are recorded under the read id. Responses are the same as the
+    tiler range server (tiler-deployment `tiler.rangeserver`): ETag and
+    If-None-Match, 416 for malformed or unsatisfiable ranges and
+    multipart/byteranges for several ranges.
+
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Silence request logging."""
+
+    def _parse_ranges(self, header, size):
+        ranges = []
+        for part in header.split("=", 1)[1].split(","):
+            match = range_expr.match(part.strip())
+            if not match:
+                return None
+            start, end = match.groups()
+            if start == "":
+                start, end = max(size - int(end), 0), size - 1
+            else:
+                start = int(start)
+                end = min(int(end), size - 1) if end else size - 1
+            if start > end or start >= size:
+                return None
+            ranges.append((start, end))
+        return ranges
+
+    def _send_headers(self, status, headers):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def _body(self, f, ranges, size):
+        """Return the status, headers and body of a file response."""
+        if not ranges:
+            headers = {
+                "Content-Type": "application/octet-stream",
+                "Accept-Ranges": "bytes",
+            }
+            return 200, headers, f.read()
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            f.seek(start)
+            headers = {
+                "Content-Type": "application/octet-stream",
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Accept-Ranges": "bytes",
+            }
+            return 206, headers, f.read(end - start + 1)
+
+        boundary = "VALIDATERANGEBOUNDARY"
+        parts = []
+        for start, end in ranges:
+            f.seek(start)
+            parts.append(
+                (
+                    f"\r\n--{boundary}\r\n"
+                    "Content-Type: application/octet-stream\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode()
+                + f.read(end - start + 1)
+            )
+        parts.append(f"\r\n--{boundary}--\r\n".encode())
+        headers = {"Content-Type": f"multipart/byteranges; boundary={boundary}"}
+        return 206, headers, b"".join(parts)
+
+    def _send(self, head=False):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        match = read_expr.match(self.path)
+        read_id = match.group(1) if match else ""
+        path = self.translate_path(self.path[match.end() :] if match else self.path)
+        if not os.path.isfile(path):
+            self.server.record(read_id, [])
+            self.send_error(404, "File not found")
+            return
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.record(read_id, [])
+            self._send_headers(304, {"ETag": etag, "Content-Length": "0"})
+            return
+
+        header = self.headers.get("Range")
+        ranges = self._parse_ranges(header, size) if header else None
+        if header and ranges is None:
+            self.server.record(read_id, [])
+            self._send_headers(
+                416, {"Content-Range": f"bytes */{size}", "Content-Length": "0"}
+            )
+            return
+
+        self.server.record(read_id, [] if head else ranges or [(0, size - 1)])
+        with open(path, "rb") as f:
+            status, headers, body = self._body(f, ranges, size)
+        headers.update({"Content-Length": str(len(body)), "ETag": etag})
+        self._send_headers(status, headers)
+        if not head:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        """Get requests."""
+        if self.path == "/_stats":
+            body = json.dumps(self.server.snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send()
+
+    def do_HEAD(self):
+        """Head requests."""
+        self._send(head=True)
+
+
+class RangeCountingServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server serving `directory`, recording requests per read.
+
+    Requests can be delayed by `latency` seconds, to simulate a remote store.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory, host="127.0.0.1", latency=0):
+        """Initialize server."""
+        super().__init__(
+            (host, 0), partial(RangeCountingHandler, directory=directory)
+        )
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.requests = defaultdict(list)
+
+    def record(self, read_id, ranges):
+        """Record a request and the byte ranges served (none for HEAD or 404)."""
+        with self._lock:
+            self.requests[read_id].append(ranges)
+
+    def snapshot(self):
+        """Return the requests (lists of byte ranges) of each read."""
+        with self._lock:
+            return {read_id: list(reqs) for read_id, reqs in self.requests.items()}
+
+
+def serve(directory, latency=0):
+    """Serve `directory` forever, printing the server url on stdout."""
+    server = RangeCountingServer(directory, latency=float(latency))
+    host, port = server.server_address[:2]
+    print(f"http://{host}:{port}", flush=True)
+    server.serve_forever()
+
+
+class RangeCountingServerProcess(object):
+    """
+    Run a `RangeCountingServer` in a subprocess.
+
+    GDAL can hold the GIL during HTTP requests, so the server must not run in
+    the process reading the file.
+
+    Usage
+    -----
+    with RangeCountingServerProcess("cogs/") as server:
+        main.tile(f"{server.url}/_read/1/file.tif", x, y, z)
+        server.requests()["1"]
+
+    """
+
+    def __init__(self, directory, latency=0):
+        """Initialize process."""
+        self.directory = directory
+        self.latency = latency
+        self.url = None
+        self._proc = None
+
+    def start(self):
+        """Start server and wait for its url."""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        pythonpath = filter(None, [root, os.environ.get("PYTHONPATH")])
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(pythonpath))
+        self._proc = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from file_to_cog.validate import serve; "
+                "serve(*sys.argv[1:])",
+                os.path.abspath(self.directory),
+                str(self.latency),
+            ],
+            stdout=subprocess.PIPE,
+            env=env,
+            universal_newlines=True,
+        )
+        self.url = self._proc.stdout.readline().strip()
+        if not self.url:
+            self.stop()
+            raise RuntimeError("Range counting server failed to start")
+        return self
+
+    def stop(self):
+        """Stop server."""
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.wait()
+            self._proc.stdout.close()
+            self._proc = None
+
+    def requests(self):
+        """Return the requests (lists of byte ranges) of each read."""
+        with urllib.request.urlopen(f"{self.url}/_stats") as resp:
+            return json.loads(resp.read())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def data_offset(src_dst):
+    """Return the offset of the first data block (IFDs and tags are before)."""
+    offsets = []
+    for ovr in [None] + list(range(len(src_dst.overviews(1)))):
+        kwargs = {} if ovr is None else {"ovr": ovr}
+        offset = src_dst.get_tag_item("BLOCK_OFFSET_0_0", "TIFF", bidx=1, **kwargs)
+        if offset:
+            offsets.append(int(offset))
+    return min(offsets) if offsets else 0
+
+
+def check_structure(path):
+    """
+    Check the COG layout of a file.
+
+    Returns
+    -------
+    errors : list
+    warnings : list
+    structure : dict
+        Size, block shape, overview decimations, IFD and mask properties.
+
+    """
+    _, errors, warnings = cog_validate(path, quiet=True)
+
+    with rasterio.open(path) as src_dst:
+        block_height, block_width = src_dst.block_shapes[0]
+        overviews = src_dst.overviews(1)
+        flags = src_dst.mask_flag_enums[0]
+        files = [os.path.basename(f) for f in src_dst.files]
+        structure = {
+            "width": src_dst.width,
+            "height": src_dst.height,
+            "count": src_dst.count,
+            "dtype": src_dst.dtypes[0],
+            "blocksize": [block_width, block_height],
+            "tiled": src_dst.is_tiled,
+            "overviews": overviews,
+            "data_offset": data_offset(src_dst),
+            "nodata": src_dst.nodata,
+            "mask": [flag.name for flag in flags],
+            "files": files,
+        }
+
+    largest = max(structure["width"], structure["height"])
+    if not structure["tiled"] and largest > block_width:
+        errors.append(
+            f"The file is striped ({block_width}x{block_height} blocks), "
+            "it should be tiled"
+        )
+
+    # Overviews down to one block on the shortest side, as rio-cogeo builds
+    # them (blocks are shrunk to the image size for small images).
+    blocksize = min(block_width, block_height) if structure["tiled"] else 256
+    needed = get_maximum_overview_level(
+        structure["width"], structure["height"], minsize=blocksize
+    )
+    if len(overviews) < needed:
+        errors.append(
+            f"{len(overviews)} overview levels for a {structure['width']}x"
+            f"{structure['height']} image, at least {needed} are needed"
+        )
+    if any(b != 2 * a for a, b in zip(overviews, overviews[1:])):
+        warnings.append(
+            f"Overview decimations {overviews} are not successive powers of 2"
+        )
+
+    name = os.path.basename(path)
+    for ext in (".msk", ".ovr"):
+        if f"{name}{ext}" in files:
+            errors.append(f"External {ext} file, it should be internal")
+
+    if MaskFlags.per_dataset in flags and structure["nodata"] is not None:
+        warnings.append("The file has both a nodata value and an internal mask")
+
+    return errors, warnings, structure
+
+
+def test_points(src_dst, tiles):
+    """Return the dataset center and the test tiles centers, as lon, lat."""
+    bounds = warp.transform_bounds(
+        src_dst.crs, "epsg:4326", *src_dst.bounds, densify_pts=21
+    )
+    points = [((bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2)]
+    for tile in tiles:
+        west, south, east, north = mercantile.bounds(tile)
+        points.append(((west + east) / 2, (south + north) / 2))
+    return points
+
+
+def _read_point(url, lon, lat):
+    """Read the pixel values at a point (as the tiler /point route)."""
+    with rasterio.open(url) as src_dst:
+        xs, ys = warp.transform("EPSG:4326", src_dst.crs, [lon], [lat])
+        return list(src_dst.sample([(xs[0], ys[0])]))[0]
+
+
+def check_reads(path, thresholds=None):
+    """
+    Run the standard tile and point reads against a COG over HTTP.
+
+    Attributes
+    ----------
+    path : str
+        COG path.
+    thresholds : dict, optional
+        max_requests, max_header_requests and max_mb per read (default:
+        MAX_READ_REQUESTS, MAX_HEADER_REQUESTS and MAX_READ_MB).
+
+    Returns
+    -------
+    errors : list
+        Reads exceeding a threshold.
+    reads : list
+        One record per read: kind, target, requests, header_requests
+        (requests starting before the first data block), ranges, bytes and
+        time_ms.
+
+    """
+    from rio_tiler import main as cogeo
+
+    thresholds = dict(
+        {
+            "max_requests": MAX_READ_REQUESTS,
+            "max_header_requests": MAX_HEADER_REQUESTS,
+            "max_mb": MAX_READ_MB,
+        },
+        **(thresholds or {}),
+    )
+    with rasterio.open(path) as src_dst:
+        tiles = sample_tiles(src_dst)
+        points = test_points(src_dst, tiles)
+        header_end = data_offset(src_dst)
+
+    name = os.path.basename(path)
+    jobs = [
+        (
+            "tile",
+            f"{t.z}/{t.x}/{t.y}",
+            partial(cogeo.tile, tile_x=t.x, tile_y=t.y, tile_z=t.z),
+        )
+        for t in tiles
+    ]
+    jobs += [
+        ("point", f"{lon:.6f},{lat:.6f}", partial(_read_point, lon=lon, lat=lat))
+        for lon, lat in points
+    ]
+
+    reads = []
+    with RangeCountingServerProcess(os.path.dirname(os.path.abspath(path))) as server:
+        with rasterio.Env(**READ_CONFIG):
+            for ix, (kind, target, read) in enumerate(jobs):
+                # A url per read: GDAL caches are keyed by url.
+                t0 = time.perf_counter()
+                try:
+                    read(f"{server.url}/_read/{ix}/{name}")
+                    error = None
+                except Exception as err:
+                    # e.g tiles outside the dataset bounds
+                    error = f"{type(err).__name__}: {err}"
+                elapsed = time.perf_counter() - t0
+                reads.append(
+                    {
+                        "kind": kind,
+                        "target": target,
+                        "time_ms": round(elapsed * 1000, 2),
+                        "error": error,
+                    }
+                )
+        served = server.requests()
+
+    errors = []
+    for ix, res in enumerate(reads):
+        requests = served.get(str(ix), [])
+        res.update(
+            requests=len(requests),
+            header_requests=sum(1 for r in requests if r and r[0][0] < header_end),
+            ranges=sum(len(r) for r in requests),
+            bytes=sum(end - start + 1 for r in requests for start, end in r),
+        )
+        if res["error"]:
+            errors.append(f"{res['kind']} {res['target']} failed: {res['error']}")
+            continue
+        over = []
+        if res["requests"] > thresholds["max_requests"]:
+            over.append(f"{res['requests']} requests > {thresholds['max_requests']}")
+        if res["header_requests"] > thresholds["max_header_requests"]:
+            over.append(
+                f"{res['header_requests']} header requests > "
+                f"{thresholds['max_header_requests']}"
+            )
+        if res["bytes"] > thresholds["max_mb"] * 1024 * 1024:
+            over.append(f"{res['bytes'] / 1024 ** 2:.1f} MB > {thresholds['max_mb']} MB")
+        if over:
+            errors.append(f"{res['kind']} {res['target']}: {', '.join(over)}")
+    return errors, reads
+
+
+def validate_cog(path, mode="flag", thresholds=None):
+    """
+    Validate the structure and the remote read cost of a COG.
+
+    Attributes
+    ----------
+    path : str
+        COG path.
+    mode : str, optional
+        "flag" (default) or "reject": status of files with structure errors
+        or reads exceeding the thresholds. Rejected files are not read when
+        their structure is broken.
+    thresholds : dict, optional
+        Read thresholds, see `check_reads`.
+
+    Returns
+    -------
+    validation : dict
+        status ("ok", "flagged" or "rejected"), errors, warnings (structure),
+        read_errors, structure, reads and a reads summary (max requests,
+        header requests and bytes per read).
+
+    """
+    if mode not in MODES:
+        raise ValueError(f"Invalid validation mode '{mode}', one of: {', '.join(MODES)}")
+
+    errors, warnings, structure = check_structure(path)
+    if errors and mode == "reject":
+        # Rejected anyway: do not pay for the (slow) reads of a broken layout.
+        read_errors, reads = [], []
+    else:
+        read_errors, reads = check_reads(path, thresholds)
+
+    if not errors and not read_errors:
+        status = "ok"
+    elif mode == "reject":
+        status = "rejected"
+    else:
+        status = "flagged"
+
+    summary = {
+        key: max((r.get(key, 0) for r in reads), default=0)
+        for key in ("requests", "header_requests", "bytes")
+    }
+    return {
+        "status": status,
+        "errors": errors,
+        "warnings": warnings,
+        "read_errors": read_errors,
+        "structure": structure,
+        "reads": reads,
+        "max_per_read": summary,
+    }
+
+
+def validate_output(out_cog, options, report=None):
+    """
+    Validate a converted COG if the "validate" option (or COG_VALIDATE) is set.
+
+    Rejected files ("reject" mode) are removed (with their statistics
+    sidecar) and an `InvalidCOGError` is raised; flagged files are kept. The
+    validation is added to the report.
+
+    """
+    mode = options.get("validate") or VALIDATE
+    if not mode:
+        return None
+
+    with stage(report, "validate"):
+        validation = validate_cog(out_cog, mode, options.get("validate_thresholds"))
+        if report:
+            report.validation = validation
+
+        if validation["status"] == "rejected":
+            for rejected in (out_cog, sidecar_path(out_cog)):
+                if os.path.exists(rejected):
+                    os.remove(rejected)
+            raise InvalidCOGError(out_cog, validation)
+    return validation
+
+
+def main():
+    """Parse arguments and print the validation."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("filename", help="COG file")
+    parser.add_argument("--mode", choices=MODES, default="flag")
+    parser.add_argument("--max-requests", type=int, default=MAX_READ_REQUESTS)
+    parser.add_argument("--max-header-requests", type=int, default=MAX_HEADER_REQUESTS)
+    parser.add_argument("--max-mb", type=float, default=MAX_READ_MB)
+    args = parser.parse_args()
+
+    validation = validate_cog(
+        args.filename,
+        args.mode,
+        {
+            "max_requests": args.max_requests,
+            "max_header_requests": args.max_header_requests,
+            "max_mb": args.max_mb,
+        },
+    )
+    print(json.dumps(validation))
+    sys.exit(0 if validation["status"] != "rejected" else 1)
+
+
+if __name__ == "__main__":
+    main()
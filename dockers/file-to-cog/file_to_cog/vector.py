@@ -0,0 +1,362 @@
+"""file_to_cog.vector: shapefile to COG conversion.
+
+Shapefiles (or zipped shapefiles, e.g LVIS flight tracks) are rasterized one
+output block at a time:
+
+1. the shapes are streamed once to build a grid index: the output grid is
+   split in block aligned windows and each window lists the features whose
+   bounding box intersects it (only feature numbers are kept in memory),
+2. each window is rasterized in a process pool, the worker reading only the
+   features listed for the window (random access through the .shx index),
+3. windows are written to a temporary tiled GeoTIFF, then to the COG with
+   the same profile, settings and statistics as the raster conversion.
+
+Memory use depends on the window size and on the features of a window, not
+on the number of features.
+
+"""
+
+import os
+import math
+import zipfile
+import tempfile
+import multiprocessing
+from array import array
+from collections import defaultdict
+from concurrent import futures
+
+import numpy
+import shapefile
+
+import rasterio
+from rasterio.crs import CRS
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+from rasterio.windows import transform as window_transform
+
+from .warp import BLOCKSIZE, block_windows
+from .stats import StatisticsAccumulator, sidecar_path
+from .convert import _translate, cog_config
+from .report import add_worker_rss, measure_worker, stage
+
+VECTOR_EXTENSIONS = (".shp", ".zip")
+
+# Shapefiles without .prj are geographic.
+DEFAULT_CRS = "EPSG:4326"
+
+# Output size (largest side, in pixels) when no resolution is given.
+DEFAULT_SIZE = 4096
+
+# Output window side, in pixels (a multiple of the COG block size).
+WINDOW_SIZE = 4 * BLOCKSIZE
+
+_reader = None
+
+
+def is_vector(sourcefile):
+    """Return True for shapefiles and zipped shapefiles."""
+    return sourcefile.lower().endswith(VECTOR_EXTENSIONS)
+
+
+def vector_crs(sourcefile):
+    """Return the shapefile projection (.prj), default to EPSG:4326."""
+    root, ext = os.path.splitext(sourcefile)
+    if ext.lower() == ".zip":
+        with zipfile.ZipFile(sourcefile) as archive:
+            prj = [n for n in archive.namelist() if n.lower().endswith(".prj")]
+            if prj:
+                return CRS.from_wkt(archive.read(prj[0]).decode("utf-8"))
+        return CRS.from_user_input(DEFAULT_CRS)
+
+    for prj in (f"{root}.prj", f"{root}.PRJ"):
+        if os.path.exists(prj):
+            with open(prj) as f:
+                return CRS.from_wkt(f.read())
+    return CRS.from_user_input(DEFAULT_CRS)
+
+
+def vector_grid(bounds, resolution=None, size=DEFAULT_SIZE):
+    """
+    Return the output transform, width and height covering `bounds`.
+
+    Attributes
+    ----------
+    bounds : tuple
+        Shapefile bounds (xmin, ymin, xmax, ymax).
+    resolution : float, optional
+        Pixel size in the shapefile projection units (default: the largest
+        side of the bounds divided by `size`).
+
+    """
+    xmin, ymin, xmax, ymax = bounds
+    if not resolution:
+        resolution = max(xmax - xmin, ymax - ymin) / float(size)
+        if not resolution:
+            raise ValueError("Cannot set a resolution: the shapefile is a point")
+
+    width = max(int(math.ceil((xmax - xmin) / resolution)), 1)
+    height = max(int(math.ceil((ymax - ymin) / resolution)), 1)
+    return from_origin(xmin, ymax, resolution, resolution), width, height
+
+
+def vector_nodata(options={}):
+    """Return the output nodata value: 0 for masks, NaN for attributes."""
+    nodata = options.get("nodata")
+    if nodata is None:
+        nodata = numpy.nan if options.get("attribute") else 0
+    return nodata
+
+
+def _shape_bbox(shape):
+    if shape.shapeType in (shapefile.POINT, shapefile.POINTZ, shapefile.POINTM):
+        x, y = shape.points[0][:2]
+        return x, y, x, y
+    return tuple(shape.bbox)
+
+
+def build_index(reader, transform, width, height, size=WINDOW_SIZE):
+    """
+    Stream the shapes once and index them by output window.
+
+    Returns
+    -------
+    index : dict
+        Feature numbers (array of int) by (row, col) window offset, in
+        pixels, for windows of `size` pixels.
+
+    """
+    index = defaultdict(lambda: array("l"))
+    inverse = ~transform
+    rows = math.ceil(height / size)
+    cols = math.ceil(width / size)
+
+    for feature, shape in enumerate(reader.iterShapes()):
+        if shape is None or shape.shapeType == shapefile.NULL or not shape.points:
+            continue
+
+        xmin, ymin, xmax, ymax = _shape_bbox(shape)
+        col_min, row_min = inverse * (xmin, ymax)
+        col_max, row_max = inverse * (xmax, ymin)
+        # Features are rasterized with all touched pixels: pad by a pixel.
+        col_min, row_min, col_max, row_max = (
+            col_min - 1,
+            row_min - 1,
+            col_max + 1,
+            row_max + 1,
+        )
+        first_col = min(max(int(col_min // size), 0), cols - 1)
+        last_col = min(max(int(col_max // size), 0), cols - 1)
+        first_row = min(max(int(row_min // size), 0), rows - 1)
+        last_row = min(max(int(row_max // size), 0), rows - 1)
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                index[(row * size, col * size)].append(feature)
+
+    return index
+
+
+def _init_worker(sourcefile):
+    global _reader
+    _reader = shapefile.Reader(sourcefile)
+
+
+def _rasterize_window(window, features, transform, attribute, fill, dtype, all_touched):
+    """Rasterize the features of a window."""
+    shapes = []
+    for feature in features:
+        geometry = _reader.shape(feature).__geo_interface__
+        value = _reader.record(feature)[attribute] if attribute else 1
+        if value is None:
+            continue
+        shapes.append((geometry, value))
+
+    out = rasterize(
+        shapes,
+        out_shape=(window.height, window.width),
+        transform=window_transform(window, transform),
+        fill=fill,
+        all_touched=all_touched,
+        dtype=dtype,
+    )
+    return window, out[numpy.newaxis]
+
+
+def _rasterize_windows(
+    dst, sourcefile, index, attribute, all_touched, workers, on_window=None
+):
+    """Rasterize the windows of a feature index in a process pool, to `dst`."""
+    nodata, dtype, transform = dst.nodata, dst.dtypes[0], dst.transform
+
+    def _write(window, data):
+        dst.write(data, window=window)
+        if on_window:
+            on_window(data)
+
+    def _collect(job):
+        result, peak_kb = job.result()
+        add_worker_rss(peak_kb)
+        _write(*result)
+
+    with futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(sourcefile,)
+    ) as executor:
+        # Bound the windows in flight so the parent memory stays flat.
+        pending = set()
+        for window in block_windows(dst.width, dst.height, WINDOW_SIZE):
+            features = index.pop((window.row_off, window.col_off), None)
+            if not features:
+                data = numpy.full((1, window.height, window.width), nodata, dtype)
+                _write(window, data)
+                continue
+
+            pending.add(
+                executor.submit(
+                    measure_worker,
+                    _rasterize_window,
+                    window,
+                    features,
+                    transform,
+                    attribute,
+                    nodata,
+                    dtype,
+                    all_touched,
+                )
+            )
+            if len(pending) >= 2 * workers:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for job in done:
+                    _collect(job)
+
+        for job in futures.as_completed(pending):
+            _collect(job)
+
+
+def rasterize_shapefile(sourcefile, dst_path, options={}, on_window=None):
+    """
+    Rasterize a shapefile to a tiled GeoTIFF, window by window, in parallel.
+
+    Attributes
+    ----------
+    sourcefile : str
+        Shapefile or zipped shapefile path.
+    dst_path : str
+        Output tiled GeoTIFF path.
+    options : dict, optional
+        attribute : str
+            Numeric field to burn (default: burn 1 in a uint8 mask).
+        resolution : float
+            Pixel size in the shapefile projection units (default: the
+            largest side of the bounds divided by DEFAULT_SIZE).
+        nodata : int or float
+            Output nodata value (default: 0 for masks, NaN for attributes).
+        all_touched : bool
+            Burn all pixels touched by the features (default: True, so
+            thin tracks are not dropped).
+        warp_workers : int
+            Number of processes (default: cpu count).
+    on_window : callable, optional
+        Called with each (1, rows, cols) window array, as it is written.
+
+    Returns
+    -------
+    dst_path : str
+
+    """
+    attribute = options.get("attribute")
+    dtype = "float32" if attribute else "uint8"
+    nodata = vector_nodata(options)
+    all_touched = options.get("all_touched", True)
+    workers = options.get("warp_workers") or multiprocessing.cpu_count()
+
+    reader = shapefile.Reader(sourcefile)
+    try:
+        if attribute and attribute not in [f.name for f in reader.fields]:
+            raise ValueError(f"Field '{attribute}' not found in {sourcefile}")
+        transform, width, height = vector_grid(reader.bbox, options.get("resolution"))
+        index = build_index(reader, transform, width, height)
+    finally:
+        reader.close()
+
+    profile = dict(
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=1,
+        dtype=dtype,
+        crs=vector_crs(sourcefile),
+        transform=transform,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=BLOCKSIZE,
+        blockysize=BLOCKSIZE,
+        BIGTIFF="IF_SAFER",
+    )
+
+    with rasterio.open(dst_path, "w", **profile) as dst:
+        _rasterize_windows(
+            dst, sourcefile, index, attribute, all_touched, workers, on_window
+        )
+
+    return dst_path
+
+
+def convert_vector(sourcefile, out_cog, options={}, report=None):
+    """
+    Convert a shapefile to a COG.
+
+    Attributes
+    ----------
+    sourcefile : str
+        Shapefile or zipped shapefile path.
+    out_cog : str
+        Output COG path.
+    options : dict, optional
+        Rasterization options (see `rasterize_shapefile`), and threads,
+        settings and stats (see `file_to_cog.convert.convert`). The COG is
+        written in the shapefile projection, other `convert` options
+        (autotune, web_optimized, dst_crs) do not apply.
+    report : file_to_cog.report.ConversionReport, optional
+        Report recording the conversion stages.
+
+    Returns
+    -------
+    out_cog : str
+        Output COG path.
+
+    """
+    settings = options.get("settings")
+    config = cog_config(options.get("threads"), settings)
+    nodata = vector_nodata(options)
+
+    stats = None
+    if options.get("stats", True):
+        # The header bounds give the grid size, for the statistics sample.
+        reader = shapefile.Reader(sourcefile)
+        try:
+            _, width, height = vector_grid(reader.bbox, options.get("resolution"))
+        finally:
+            reader.close()
+        stats = StatisticsAccumulator(1, nodata, pixels=width * height)
+
+    with rasterio.Env(**config), tempfile.TemporaryDirectory() as tmpdir:
+        with stage(report, "rasterize"):
+            rasterized = rasterize_shapefile(
+                sourcefile,
+                os.path.join(tmpdir, "rasterized.tif"),
+                options,
+                on_window=stats.update if stats else None,
+            )
+            if stats:
+                with rasterio.open(rasterized, "r+") as tmp_dst:
+                    stats.write_tags(tmp_dst)
+
+        with stage(report, "cog"):
+            _translate(
+                rasterized, out_cog, settings, nodata, None, config, in_memory=False
+            )
+
+    if stats:
+        with stage(report, "statistics"):
+            stats.write_sidecar(sidecar_path(out_cog))
+
+    return out_cog
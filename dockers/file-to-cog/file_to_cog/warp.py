@@ -0,0 +1,284 @@
+"""file_to_cog.warp: windowed, multi-process reprojection.
+
+The output grid is split in block aligned windows sized to a per-worker
+memory budget. Each worker process opens the source once, reads only the
+source pixels covering a window, reprojects them and sends the result back
+to the parent, which writes it into the tiled output. Memory use depends on
+the window size, not on the raster size.
+
+"""
+
+import os
+import math
+import multiprocessing
+from concurrent import futures
+
+import numpy
+
+import rasterio
+from rasterio import windows
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.transform import array_bounds
+from rasterio.warp import calculate_default_transform, reproject, transform_bounds
+
+from .report import add_worker_rss, measure_worker
+
+# Memory budget (in MB) of a worker.
+WARP_MEMORY_MB = int(os.environ.get("WARP_MEMORY_MB", 256))
+
+BLOCKSIZE = 256
+
+# Source pixels read around a window, for the resampling kernel.
+SOURCE_PADDING = 2
+
+_source = None
+
+
+def output_grid(src_dst, dst_crs, src_crs=None):
+    """Return the output transform, width and height (as `gdalwarp`)."""
+    return calculate_default_transform(
+        src_crs or src_dst.crs,
+        dst_crs,
+        src_dst.width,
+        src_dst.height,
+        *src_dst.bounds,
+    )
+
+
+def source_window(src_dst, window, dst_transform, dst_crs, src_crs=None):
+    """
+    Return the source window covering an output window, or None.
+
+    The window is padded by SOURCE_PADDING pixels for the resampling kernel
+    and clipped to the dataset.
+
+    """
+    win_transform = windows.transform(window, dst_transform)
+    bounds = array_bounds(window.height, window.width, win_transform)
+    left, bottom, right, top = transform_bounds(
+        dst_crs, src_crs or src_dst.crs, *bounds, densify_pts=21
+    )
+
+    src_window = windows.from_bounds(left, bottom, right, top, src_dst.transform)
+    col_off = math.floor(src_window.col_off) - SOURCE_PADDING
+    row_off = math.floor(src_window.row_off) - SOURCE_PADDING
+    src_window = Window(
+        col_off,
+        row_off,
+        math.ceil(src_window.col_off + src_window.width) + SOURCE_PADDING - col_off,
+        math.ceil(src_window.row_off + src_window.height) + SOURCE_PADDING - row_off,
+    )
+    try:
+        return src_window.intersection(Window(0, 0, src_dst.width, src_dst.height))
+    except rasterio.errors.WindowError:
+        return None
+
+
+def window_size(
+    src_dst,
+    dst_transform,
+    width,
+    height,
+    dst_crs,
+    src_crs=None,
+    memory_mb=WARP_MEMORY_MB,
+    blocksize=BLOCKSIZE,
+):
+    """
+    Return the side (in pixels) of square windows fitting the memory budget.
+
+    Window arrays (output and source pixels covering it, for every band)
+    get three quarters of the budget, the rest is left to the GDAL block
+    cache and warp buffers. The number
+    of source pixels per output pixel is probed on the output corners and
+    center, as skewed projections read more source pixels than the output
+    pixels.
+
+    """
+    itemsize = numpy.dtype(src_dst.dtypes[0]).itemsize * src_dst.count
+    side = min(max(width, height), 4 * blocksize)
+    probes = [
+        Window(col, row, min(side, width), min(side, height))
+        for col in (0, max(width - side, 0) // 2, max(width - side, 0))
+        for row in (0, max(height - side, 0) // 2, max(height - side, 0))
+    ]
+    ratio = 1.0
+    for probe in probes:
+        src_window = source_window(src_dst, probe, dst_transform, dst_crs, src_crs)
+        if src_window is not None:
+            src_pixels = src_window.width * src_window.height
+            ratio = max(ratio, src_pixels / float(probe.width * probe.height))
+
+    pixels = memory_mb * 3 / 4 * 1024 * 1024 / (itemsize * (1 + ratio))
+    side = int(math.sqrt(pixels)) // blocksize * blocksize
+    return max(side, blocksize)
+
+
+def block_windows(width, height, size):
+    """Yield block aligned windows of `size` pixels covering the output."""
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            yield Window(col, row, min(size, width - col), min(size, height - row))
+
+
+def _init_worker(src_path, config):
+    global _source
+    env = rasterio.Env(**config)
+    env.__enter__()
+    _source = rasterio.open(src_path)
+
+
+def _warp_window(
+    window, dst_transform, dst_crs, src_crs, nodata, resampling, memory_mb
+):
+    """Reproject the source pixels covering `window` of the output grid."""
+    src_dst = _source
+    fill = 0 if nodata is None else nodata
+    out = numpy.full(
+        (src_dst.count, window.height, window.width), fill, dtype=src_dst.dtypes[0]
+    )
+
+    src_window = source_window(src_dst, window, dst_transform, dst_crs, src_crs)
+    if src_window is None:
+        return window, out
+
+    data = src_dst.read(window=src_window)
+    reproject(
+        data,
+        out,
+        src_transform=windows.transform(src_window, src_dst.transform),
+        src_crs=src_crs or src_dst.crs,
+        src_nodata=nodata,
+        dst_transform=windows.transform(window, dst_transform),
+        dst_crs=dst_crs,
+        dst_nodata=nodata,
+        resampling=resampling,
+        warp_mem_limit=memory_mb,
+    )
+    return window, out
+
+
+def _write(dst, job, on_window=None):
+    (window, data), peak_kb = job.result()
+    add_worker_rss(peak_kb)
+    dst.write(data, window=window)
+    if on_window:
+        on_window(data)
+
+
+def warp(
+    src_path,
+    dst_path,
+    dst_crs,
+    src_crs=None,
+    nodata=None,
+    resampling=Resampling.nearest,
+    workers=None,
+    memory_mb=WARP_MEMORY_MB,
+    config={},
+    grid=None,
+    on_window=None,
+):
+    """
+    Reproject a dataset to a tiled GeoTIFF, window by window, in parallel.
+
+    Attributes
+    ----------
+    src_path : str
+        GDAL dataset path.
+    dst_path : str
+        Output tiled GeoTIFF path.
+    dst_crs : str
+        Output projection.
+    src_crs : str, optional
+        Source projection, if not set in the dataset.
+    nodata : int or float, optional
+        Source and output nodata value.
+    resampling : rasterio.enums.Resampling, optional
+        Resampling method (default: nearest, as `gdalwarp`).
+    workers : int, optional
+        Number of processes (default: cpu count).
+    memory_mb : int, optional
+        Memory budget of a worker in MB (default: WARP_MEMORY_MB or 256).
+    config : dict, optional
+        GDAL configuration options for the workers.
+    grid : dict, optional
+        Output transform, width and height (default: as `gdalwarp`).
+    on_window : callable, optional
+        Called with each (bands, rows, cols) output window array, as it is
+        written (e.g to accumulate statistics).
+
+    Returns
+    -------
+    dst_path : str
+
+    """
+    workers = workers or multiprocessing.cpu_count()
+    with rasterio.open(src_path) as src_dst:
+        if grid:
+            dst_transform, width, height = (
+                grid[k] for k in ("transform", "width", "height")
+            )
+        else:
+            dst_transform, width, height = output_grid(src_dst, dst_crs, src_crs)
+        size = window_size(
+            src_dst, dst_transform, width, height, dst_crs, src_crs, memory_mb
+        )
+        profile = dict(
+            driver="GTiff",
+            width=width,
+            height=height,
+            count=src_dst.count,
+            dtype=src_dst.dtypes[0],
+            crs=dst_crs,
+            transform=dst_transform,
+            nodata=nodata,
+            tiled=True,
+            blockxsize=BLOCKSIZE,
+            blockysize=BLOCKSIZE,
+            BIGTIFF="IF_SAFER",
+        )
+
+    # Keep each worker single threaded: parallelism comes from the processes.
+    # The GDAL block cache (default: 5% of the RAM), warp buffers and remote
+    # reads cache (see `file_to_cog.remote`) get an eighth of the budget each.
+    buffer_mb = max(memory_mb // 8, 8)
+    config = dict(config, GDAL_NUM_THREADS=1, NUM_THREADS=1, GDAL_CACHEMAX=buffer_mb)
+    if "CPL_VSIL_CURL_CACHE_SIZE" in config:
+        config["CPL_VSIL_CURL_CACHE_SIZE"] = buffer_mb * 1024 * 1024
+    with rasterio.Env(GDAL_CACHEMAX=buffer_mb), rasterio.open(
+        dst_path, "w", **profile
+    ) as dst:
+        with futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(src_path, config),
+        ) as executor:
+            # Bound the windows in flight so the parent memory stays flat.
+            pending = set()
+            for window in block_windows(width, height, size):
+                pending.add(
+                    executor.submit(
+                        measure_worker,
+                        _warp_window,
+                        window,
+                        dst_transform,
+                        dst_crs,
+                        src_crs,
+                        nodata,
+                        resampling,
+                        buffer_mb,
+                    )
+                )
+                if len(pending) >= 2 * workers:
+                    done, pending = futures.wait(
+                        pending, return_when=futures.FIRST_COMPLETED
+                    )
+                    for job in done:
+                        _write(dst, job, on_window)
+
+            for job in futures.as_completed(pending):
+                _write(dst, job, on_window)
+
+    return dst_path
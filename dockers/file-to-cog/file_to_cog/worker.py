@@ -0,0 +1,705 @@
+"""file_to_cog.worker: long-running conversion worker fed by a local queue.
+
+Jobs (one input file and its conversion options) are stored in a SQLite
+queue, standing in for S3 event notifications: they are added with
+`enqueue`, or by watching a staging directory. Workers claim jobs
+atomically (`BEGIN IMMEDIATE`) and run them on a bounded process pool:
+
+- a claimed job is invisible to other workers for the visibility timeout,
+  extended while it runs. The jobs of a dead worker become visible again
+  and are claimed by another worker,
+- failed jobs are retried with exponential backoff, up to `max_attempts`,
+  unless the failure is permanent (invalid input),
+- no job is claimed while the free temporary disk space or the available
+  memory is below its budget (back-pressure): jobs wait in the queue.
+
+Queue depth, throughput and latency (queue wait and conversion time) are
+printed periodically on stderr and by the `stats` command.
+
+    $ python -m file_to_cog.worker enqueue queue.db staging/*.nc --bandname analysed_sst
+    $ python -m file_to_cog.worker run queue.db --watch staging/ --outdir cogs/ \
+        --workers 4
+    $ python -m file_to_cog.worker stats queue.db
+
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import signal
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+
+from .convert import convert_file
+from .report import ConversionReport, METRICS_LOG
+
+# Seconds a claimed job stays invisible to other workers (extended while
+# the job runs).
+VISIBILITY_TIMEOUT = int(os.environ.get("WORKER_VISIBILITY_TIMEOUT", 600))
+
+MAX_ATTEMPTS = int(os.environ.get("WORKER_MAX_ATTEMPTS", 3))
+
+# Retry delay (seconds) after the first failure, doubled at each attempt.
+RETRY_BACKOFF = float(os.environ.get("WORKER_RETRY_BACKOFF", 30))
+
+# Back-pressure budgets: no job is claimed below these free sizes (MB).
+MIN_FREE_TMP_MB = int(os.environ.get("WORKER_MIN_FREE_TMP_MB", 2048))
+MIN_FREE_MEMORY_MB = int(os.environ.get("WORKER_MIN_FREE_MEMORY_MB", 1024))
+
+# Watched files are enqueued once unchanged for this many seconds.
+SETTLE_S = float(os.environ.get("WORKER_SETTLE_S", 5))
+
+# Failures not worth a retry.
+PERMANENT_REASONS = ("invalid_input", "input_error", "invalid_output")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    options TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    visible_at REAL NOT NULL,
+    worker TEXT,
+    enqueued REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    output TEXT,
+    reason TEXT,
+    error TEXT,
+    UNIQUE (path, size, mtime_ns, options)
+);
+CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (status, visible_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+"""
+
+STATUSES = ("queued", "running", "done", "failed")
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(q / 100.0 * len(values)), len(values) - 1)], 3)
+
+
+class JobQueue(object):
+    """
+    SQLite job queue, safe to share between processes.
+
+    Jobs are queued, running (claimed by a worker until `visible_at`), done
+    or failed. Running jobs past their visibility timeout can be claimed
+    again.
+
+    Attributes
+    ----------
+    path : str
+        Database path.
+
+    """
+
+    def __init__(self, path):
+        """Open (or create) the database."""
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def enqueue(self, path, options=None, delay=0):
+        """Add a job, return its id (None if the same file version is queued)."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        now = time.time()
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO jobs "
+            "(path, size, mtime_ns, options, visible_at, enqueued) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                path,
+                stat.st_size,
+                stat.st_mtime_ns,
+                json.dumps(options or {}, sort_keys=True),
+                now + delay,
+                now,
+            ),
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, worker, timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        """
+        Claim the next visible job.
+
+        Returns
+        -------
+        job : dict
+            id, path, size, options and attempts, or None if no job is visible.
+
+        """
+        while True:
+            now = time.time()
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT id, path, size, options, attempts FROM jobs "
+                    "WHERE status IN ('queued', 'running') AND visible_at <= ? "
+                    "ORDER BY visible_at, id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    self.db.execute("COMMIT")
+                    return None
+
+                job_id, path, size, options, attempts = row
+                if attempts >= max_attempts:
+                    # Its worker died (or hung) on the last attempt.
+                    self.db.execute(
+                        "UPDATE jobs SET status = 'failed', finished = ?, "
+                        "reason = 'visibility_timeout', "
+                        "error = 'Visibility timeout on the last attempt' WHERE id = ?",
+                        (now, job_id),
+                    )
+                    self.db.execute("COMMIT")
+                    continue
+
+                self.db.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                    "worker = ?, started = ?, visible_at = ? WHERE id = ?",
+                    (worker, now, now + timeout, job_id),
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+            return {
+                "id": job_id,
+                "path": path,
+                "size": size,
+                "options": json.loads(options),
+                "attempts": attempts + 1,
+            }
+
+    def pending(self):
+        """Return the number of queued and running jobs."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+
+    def extend(self, worker, job_ids, timeout=VISIBILITY_TIMEOUT):
+        """Extend the visibility timeout of running jobs owned by `worker`."""
+        if not job_ids:
+            return
+        marks = ",".join("?" * len(job_ids))
+        self.db.execute(
+            f"UPDATE jobs SET visible_at = ? WHERE worker = ? AND status = 'running' "
+            f"AND id IN ({marks})",
+            (time.time() + timeout, worker, *job_ids),
+        )
+
+    def complete(self, worker, job, output):
+        """Mark a job done (ignored if another worker claimed it since)."""
+        self.db.execute(
+            "UPDATE jobs SET status = 'done', finished = ?, output = ?, "
+            "reason = NULL, error = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time(), output, job["id"], worker),
+        )
+
+    def fail(
+        self,
+        worker,
+        job,
+        reason,
+        error,
+        max_attempts=MAX_ATTEMPTS,
+        backoff=RETRY_BACKOFF,
+    ):
+        """
+        Retry a failed job after a backoff, or mark it failed.
+
+        Returns
+        -------
+        retried : bool
+
+        """
+        now = time.time()
+        retry = reason not in PERMANENT_REASONS and job["attempts"] < max_attempts
+        if retry:
+            self.db.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, visible_at = ?, "
+                "reason = ?, error = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (
+                    now + backoff * 2 ** (job["attempts"] - 1),
+                    reason,
+                    error,
+                    job["id"],
+                    worker,
+                ),
+            )
+        else:
+            self.db.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, reason = ?, error = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (now, reason, error, job["id"], worker),
+            )
+        return retry
+
+    def stats(self, window=300):
+        """
+        Return queue depth, throughput and latency statistics.
+
+        Attributes
+        ----------
+        window : int, optional
+            Throughput and latency window, in seconds (default: 300).
+
+        Returns
+        -------
+        stats : dict
+            Jobs per status, visible and delayed (retry backoff) queued jobs,
+            oldest visible job age, done and failed jobs per minute, and queue
+            wait and run time percentiles (p50, p95) of the jobs finished in
+            the window.
+
+        """
+        now = time.time()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(
+            self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        )
+        visible, oldest = self.db.execute(
+            "SELECT COUNT(*), MIN(enqueued) FROM jobs "
+            "WHERE status = 'queued' AND visible_at <= ?",
+            (now,),
+        ).fetchone()
+
+        rows = self.db.execute(
+            "SELECT status, enqueued, started, finished FROM jobs WHERE finished >= ?",
+            (now - window,),
+        ).fetchall()
+        done = [r for r in rows if r[0] == "done"]
+        return {
+            "jobs": counts,
+            "depth": counts["queued"],
+            "visible": visible,
+            "delayed": counts["queued"] - visible,
+            "oldest_age_s": round(now - oldest, 1) if oldest else None,
+            "window_s": window,
+            "done_per_min": round(len(done) * 60.0 / window, 3),
+            "failed_per_min": round((len(rows) - len(done)) * 60.0 / window, 3),
+            "wait_s": {
+                "p50": _percentile([r[2] - r[1] for r in done], 50),
+                "p95": _percentile([r[2] - r[1] for r in done], 95),
+            },
+            "run_s": {
+                "p50": _percentile([r[3] - r[2] for r in done], 50),
+                "p95": _percentile([r[3] - r[2] for r in done], 95),
+            },
+        }
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+
+def watch(queue, directory, pattern="*.nc", options=None, settle=SETTLE_S):
+    """
+    Enqueue the files of a directory not modified for `settle` seconds.
+
+    Files being written (recently modified) are left for the next scan, and
+    each version (size, mtime) of a file is enqueued once.
+
+    Returns
+    -------
+    job_ids : list
+        Ids of the jobs added.
+
+    """
+    now = time.time()
+    added = []
+    for path in sorted(glob.glob(os.path.join(directory, "**", pattern), recursive=True)):
+        try:
+            if now - os.path.getmtime(path) < settle:
+                continue
+            job_id = queue.enqueue(path, options)
+        except FileNotFoundError:
+            continue
+        if job_id:
+            added.append(job_id)
+    return added
+
+
+def available_memory_mb():
+    """Return the available memory (MemAvailable, Linux), or None."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def pressure(reserved_mb=0, tmpdir=None):
+    """
+    Return the exhausted resource ("disk" or "memory"), or None.
+
+    Attributes
+    ----------
+    reserved_mb : float, optional
+        Temporary disk space the running jobs may still use (MB).
+    tmpdir : str, optional
+        Temporary directory (default: tempfile.gettempdir()).
+
+    """
+    free_tmp = shutil.disk_usage(tmpdir or tempfile.gettempdir()).free / 1024 ** 2
+    if free_tmp - reserved_mb < MIN_FREE_TMP_MB:
+        return "disk"
+    memory = available_memory_mb()
+    if memory is not None and memory < MIN_FREE_MEMORY_MB:
+        return "memory"
+    return None
+
+
+def output_path(sourcefile, options):
+    """Return the COG path of a job: {outdir}/{name}[.{bandname}].cog.tif."""
+    if options.get("output"):
+        return options["output"]
+    name = os.path.basename(sourcefile)
+    if options.get("bandname"):
+        name = f"{name}.{options['bandname']}"
+    outdir = options.get("outdir") or os.path.dirname(sourcefile)
+    return os.path.join(os.path.abspath(outdir), f"{name}.cog.tif")
+
+
+def _run_job(sourcefile, out_cog, options):
+    """Convert a file, return the conversion report."""
+    report = ConversionReport(sourcefile, out_cog)
+    try:
+        convert_file(sourcefile, out_cog, options, report)
+        report.finish()
+    except Exception as err:
+        report.fail(err)
+    report.append(options.get("metrics_log") or METRICS_LOG)
+    return report.to_dict()
+
+
+def _claim_jobs(
+    queue,
+    worker,
+    executor,
+    running,
+    workers,
+    options,
+    paused,
+    log,
+    stopping=(),
+    timeout=VISIBILITY_TIMEOUT,
+    max_attempts=MAX_ATTEMPTS,
+):
+    """
+    Claim jobs while a process is free and resources allow it.
+
+    Claimed jobs are submitted to `executor` and added to `running`.
+
+    Returns
+    -------
+    empty : bool
+        True if no job is queued (or waiting for its backoff) or running.
+    paused : str
+        Exhausted resource ("disk" or "memory"), or None.
+
+    """
+    while not stopping and len(running) < workers:
+        reserved = sum(job["size"] or 0 for job in running.values()) / 1024 ** 2
+        reason = pressure(reserved)
+        if reason != paused:
+            log({"event": "paused" if reason else "resumed", "reason": reason})
+            paused = reason
+        if reason:
+            break
+
+        job = queue.claim(worker, timeout, max_attempts)
+        if job is None:
+            return not running and not queue.pending(), paused
+        job_options = dict(options, **job["options"])
+        out_cog = output_path(job["path"], job_options)
+        future = executor.submit(_run_job, job["path"], out_cog, job_options)
+        running[future] = dict(job, output=out_cog)
+    return False, paused
+
+
+def _wait(running, poll_interval):
+    """Return the futures of the jobs finished within `poll_interval`."""
+    if not running:
+        time.sleep(poll_interval)
+        return ()
+    done, _ = futures.wait(
+        list(running), timeout=poll_interval, return_when=futures.FIRST_COMPLETED
+    )
+    return done
+
+
+def _finish_job(queue, worker, job, future, log, max_attempts=MAX_ATTEMPTS):
+    """
+    Record the result of a finished job in the queue.
+
+    Returns
+    -------
+    event : str
+        "done", "retried" or "failed".
+    broken : bool
+        True if the conversion process died (the pool must be replaced).
+
+    """
+    broken = False
+    try:
+        report = future.result()
+    except BrokenProcessPool:
+        # A worker process died (e.g killed when out of memory).
+        broken = True
+        report = {
+            "status": "error",
+            "error": {
+                "reason": "worker_crashed",
+                "message": "Conversion process terminated abruptly",
+            },
+        }
+
+    if report["status"] == "ok":
+        queue.complete(worker, job, job["output"])
+        event = "done"
+    else:
+        error = report["error"]
+        retried = queue.fail(worker, job, error["reason"], error["message"], max_attempts)
+        event = "retried" if retried else "failed"
+    log(
+        {
+            "event": event,
+            "job": job["id"],
+            "path": job["path"],
+            "output": job["output"],
+            "attempt": job["attempts"],
+            "wall_s": report.get("wall_s"),
+            "reason": (report.get("error") or {}).get("reason"),
+        }
+    )
+    return event, broken
+
+
+def _heartbeat(queue, worker, running, paused, last, log, timeout, stats_interval):
+    """Extend the running jobs visibility and log the queue statistics, when due."""
+    now = time.monotonic()
+    if now - last["extend"] > timeout / 3.0:
+        queue.extend(worker, [job["id"] for job in running.values()], timeout)
+        last["extend"] = now
+    if now - last["stats"] > stats_interval:
+        log(
+            dict(
+                queue.stats(),
+                event="stats",
+                worker=worker,
+                running=len(running),
+                paused=paused,
+            )
+        )
+        last["stats"] = now
+
+
+def run_worker(
+    queue_path,
+    options={},
+    max_workers=None,
+    watch_dir=None,
+    pattern="*.nc",
+    poll_interval=1.0,
+    stats_interval=60,
+    exit_when_empty=False,
+    timeout=VISIBILITY_TIMEOUT,
+    max_attempts=MAX_ATTEMPTS,
+    out=sys.stderr,
+):
+    """
+    Claim and convert queued jobs until stopped (SIGTERM or SIGINT).
+
+    Attributes
+    ----------
+    queue_path : str
+        SQLite queue path.
+    options : dict, optional
+        Conversion options (see `file_to_cog.convert.generate_cog`), job
+        options take precedence. outdir sets the output directory.
+    max_workers : int, optional
+        Number of processes (default: cpu count).
+    watch_dir : str, optional
+        Directory to enqueue `pattern` files from, at each poll.
+    poll_interval : float, optional
+        Seconds between polls of an empty (or paused) queue.
+    stats_interval : float, optional
+        Seconds between queue statistics lines on `out`.
+    exit_when_empty : bool, optional
+        Stop once no job is queued (including retries waiting for their
+        backoff) or running.
+
+    Returns
+    -------
+    counts : dict
+        Jobs done, retried and failed by this worker.
+
+    """
+    worker = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    queue = JobQueue(queue_path)
+    if options.get("outdir"):
+        os.makedirs(options["outdir"], exist_ok=True)
+
+    cpus = multiprocessing.cpu_count()
+    workers = max(max_workers or cpus, 1)
+    options = dict(options, threads=options.get("threads") or max(cpus // workers, 1))
+
+    stopping = []
+
+    def _stop(signum, frame):
+        stopping.append(signum)
+
+    previous = {sig: signal.signal(sig, _stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+
+    counts = {"done": 0, "retried": 0, "failed": 0}
+    running = {}
+    paused = None
+    now = time.monotonic()
+    last = {"extend": now, "stats": now}
+    executor = futures.ProcessPoolExecutor(max_workers=workers)
+
+    def _log(record):
+        print(json.dumps(record), file=out, flush=True)
+
+    try:
+        while True:
+            if watch_dir and not stopping:
+                watch(queue, watch_dir, pattern)
+
+            empty, paused = _claim_jobs(
+                queue,
+                worker,
+                executor,
+                running,
+                workers,
+                options,
+                paused,
+                _log,
+                stopping=stopping,
+                timeout=timeout,
+                max_attempts=max_attempts,
+            )
+            if not running and (stopping or (exit_when_empty and empty)):
+                break
+
+            broken = False
+            for future in _wait(running, poll_interval):
+                event, crashed = _finish_job(
+                    queue, worker, running.pop(future), future, _log, max_attempts
+                )
+                counts[event] += 1
+                broken = broken or crashed
+
+            if broken:
+                executor.shutdown(wait=False)
+                executor = futures.ProcessPoolExecutor(max_workers=workers)
+
+            _heartbeat(
+                queue, worker, running, paused, last, _log, timeout, stats_interval
+            )
+    finally:
+        executor.shutdown(wait=True)
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+        queue.close()
+
+    return counts
+
+
+def main():
+    """Parse arguments and run command."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="add files to the queue")
+    enqueue.add_argument("queue", help="SQLite queue path")
+    enqueue.add_argument("files", nargs="+", help="input files")
+    enqueue.add_argument("--bandname", help="NetCDF variable or HDF5 dataset")
+    enqueue.add_argument("--nodata", type=float, help="custom nodata value")
+
+    run = commands.add_parser("run", help="convert queued files")
+    run.add_argument("queue", help="SQLite queue path")
+    run.add_argument("--watch", help="directory to enqueue new files from")
+    run.add_argument("--pattern", default="*.nc", help="watched file pattern")
+    run.add_argument("--bandname", help="variable of the watched files")
+    run.add_argument("--outdir", help="output directory")
+    run.add_argument("--workers", type=int, help="number of processes")
+    run.add_argument("--timeout", type=int, default=VISIBILITY_TIMEOUT)
+    run.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS)
+    run.add_argument("--validate", choices=["flag", "reject"])
+    run.add_argument("--metrics-log", help="JSON lines conversion reports log")
+    run.add_argument("--stats-interval", type=float, default=60)
+    run.add_argument(
+        "--exit-when-empty", action="store_true", help="stop once the queue is drained"
+    )
+
+    stats = commands.add_parser("stats", help="print queue statistics")
+    stats.add_argument("queue", help="SQLite queue path")
+    stats.add_argument("--window", type=int, default=300, help="seconds")
+
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        queue = JobQueue(args.queue)
+        try:
+            options = {"bandname": args.bandname, "nodata": args.nodata}
+            options = {k: v for k, v in options.items() if v is not None}
+            added = [queue.enqueue(path, options) for path in args.files]
+        finally:
+            queue.close()
+        print(f"{sum(1 for a in added if a)} jobs added", file=sys.stderr)
+
+    elif args.command == "run":
+        options = {
+            "bandname": args.bandname,
+            "outdir": args.outdir,
+            "validate": args.validate,
+            "metrics_log": args.metrics_log,
+        }
+        counts = run_worker(
+            args.queue,
+            options,
+            max_workers=args.workers,
+            watch_dir=args.watch,
+            pattern=args.pattern,
+            stats_interval=args.stats_interval,
+            exit_when_empty=args.exit_when_empty,
+            timeout=args.timeout,
+            max_attempts=args.max_attempts,
+        )
+        print(json.dumps(counts))
+
+    else:
+        queue = JobQueue(args.queue)
+        try:
+            print(json.dumps(queue.stats(args.window)))
+        finally:
+            queue.close()
+
+
+if __name__ == "__main__":
+    main()
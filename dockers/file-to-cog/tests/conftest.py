@@ -0,0 +1,60 @@
+"""file-to-cog test fixtures: synthetic NetCDF files."""
+
+import os
+import sys
+
+import h5py
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+FILL_VALUE = -999.0
+
+
+def make_netcdf(
+    path, width=600, height=400, variables=("sst", "ice"), attrs=None, seed=0
+):
+    """
+    Write a synthetic netCDF4 file of float32 variables on a 0.05 degree grid.
+
+    Variables have `lat`/`lon` dimension scales (latitude descending, as
+    GDAL writes them), a `_FillValue` and a nodata strip on the left side.
+    `attrs` are written as global attributes.
+
+    """
+    res = 0.05
+    lat = 50 - res / 2 - numpy.arange(height) * res
+    lon = -10 + res / 2 + numpy.arange(width) * res
+    yy, xx = numpy.mgrid[0:height, 0:width]
+
+    with h5py.File(path, "w") as h5:
+        lat_dset = h5.create_dataset("lat", data=lat)
+        lon_dset = h5.create_dataset("lon", data=lon)
+        lat_dset.attrs["units"] = numpy.bytes_("degrees_north")
+        lon_dset.attrs["units"] = numpy.bytes_("degrees_east")
+        lat_dset.make_scale("lat")
+        lon_dset.make_scale("lon")
+        for ix, name in enumerate(variables):
+            noise = numpy.random.RandomState(seed + ix).rand(height, width)
+            data = (numpy.sin(xx / 40.0 + ix) * 10 + noise).astype("float32")
+            data[:, : width // 10] = FILL_VALUE
+            dset = h5.create_dataset(name, data=data, chunks=(100, 100))
+            dset.attrs["_FillValue"] = numpy.float32(FILL_VALUE)
+            dset.dims[0].attach_scale(lat_dset)
+            dset.dims[1].attach_scale(lon_dset)
+        for key, value in (attrs or {}).items():
+            h5.attrs[key] = numpy.bytes_(value)
+    return path
+
+
+@pytest.fixture
+def netcdf(tmpdir):
+    """NetCDF file with `sst` and `ice` variables."""
+    return make_netcdf(
+        str(tmpdir.join("20190601-sample.nc")),
+        attrs={
+            "time_coverage_start": "20190601T000000Z",
+            "time_coverage_end": "20190601T235959Z",
+        },
+    )
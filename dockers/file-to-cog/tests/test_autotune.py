@@ -0,0 +1,74 @@
+"""Test the COG settings selection."""
+
+import rasterio
+
+from conftest import make_netcdf
+from file_to_cog import autotune as tuning
+from file_to_cog.convert import convert, source_path
+
+
+def test_candidates():
+    """Should only try predictors and WEBP where they apply."""
+    floats = tuning.candidates("float32", 1)
+    assert not [c for c in floats if c["compress"] == "webp"]
+    assert {c["predictor"] for c in floats if c["compress"] == "deflate"} == {None, 3}
+    assert {c["predictor"] for c in floats if c["compress"] == "lerc"} == {None}
+
+    rgb = tuning.candidates("uint8", 3, compressions=("webp", "zstd"))
+    assert {c["compress"] for c in rgb} == {"webp", "zstd"}
+    assert {c["predictor"] for c in rgb if c["compress"] == "zstd"} == {None, 2}
+    assert len(rgb) == 3 * len(tuning.BLOCKSIZES) * len(tuning.OVERVIEW_BLOCKSIZES)
+
+
+def test_rank():
+    """Should score candidates relatively to the best measures."""
+    results = [
+        {"error": None, "read_ms": 2.0, "size_mb": 1.0, "write_s": 1.0},
+        {"error": None, "read_ms": 1.0, "size_mb": 1.0, "write_s": 1.0},
+        {"error": "CPLE_NotSupported", "compress": "lerc"},
+    ]
+    ranked = tuning.rank(results, weights={"read": 2.0, "size": 1.0, "write": 0.5})
+    assert [r["read_ms"] for r in ranked] == [1.0, 2.0]
+    assert ranked[0]["score"] == 3.5
+    assert ranked[1]["score"] == 5.5
+    assert tuning.rank([results[2]]) == []
+
+
+def test_autotune(netcdf):
+    """Should rank the candidates on a sample of the dataset."""
+    best, results = tuning.autotune(
+        source_path(netcdf, "sst"), sample_size=256, compressions=("deflate",), repeat=1
+    )
+    assert len(results) == len(tuning.candidates("float32", 1, ("deflate",)))
+    assert results[0]["score"] <= results[-1]["score"]
+    assert best == {
+        key: results[0][key]
+        for key in ("compress", "predictor", "blocksize", "overview_blocksize")
+    }
+
+
+def test_convert_autotune(tmpdir, monkeypatch):
+    """Should write the COG with the best candidate settings."""
+    # Larger than the candidate block sizes, which rio-cogeo would reduce.
+    src = make_netcdf(str(tmpdir.join("large.nc")), width=1024, height=768)
+    selected = []
+    autotune = tuning.autotune
+
+    def _autotune(src_path, options):
+        best, results = autotune(
+            src_path, options, compressions=("deflate", "lzw"), repeat=1
+        )
+        selected.append(best)
+        return best, results
+
+    monkeypatch.setattr(tuning, "autotune", _autotune)
+    out_cog = convert(
+        source_path(src, "sst"), str(tmpdir.join("sst.tif")), {"autotune": True}
+    )
+    assert len(selected) == 1
+    best = selected[0]
+    with rasterio.open(out_cog) as src_dst:
+        assert src_dst.compression.value.lower() == best["compress"]
+        assert src_dst.block_shapes[0] == (best["blocksize"], best["blocksize"])
+        predictor = src_dst.tags(ns="IMAGE_STRUCTURE").get("PREDICTOR")
+        assert predictor == (str(best["predictor"]) if best["predictor"] else None)
@@ -0,0 +1,51 @@
+"""Test resumable batch conversion."""
+
+import os
+
+from conftest import make_netcdf
+
+from file_to_cog.batch import Checkpoint, collect_inputs, run_batch
+
+
+def test_collect_inputs(tmpdir):
+    """Should list the files of a directory, a pattern or a manifest."""
+    for name in ("a.nc", "b.nc", "c.txt"):
+        tmpdir.join(name).write("")
+    root = str(tmpdir)
+    expected = [os.path.join(root, "a.nc"), os.path.join(root, "b.nc")]
+    assert collect_inputs(root) == expected
+    assert collect_inputs(os.path.join(root, "*.nc")) == expected
+
+    manifest = tmpdir.join("manifest.txt")
+    manifest.write("# inputs\nb.nc\n\na.nc\n")
+    assert collect_inputs(str(manifest)) == expected[::-1]
+
+
+def test_run_batch_resume(tmpdir):
+    """Should skip conversions done with the same input and parameters."""
+    inputs = [
+        make_netcdf(str(tmpdir.join(f"{ix}.nc")), 300, 200, ("sst",), seed=ix)
+        for ix in range(2)
+    ]
+    outdir = str(tmpdir.join("cogs"))
+    checkpoint = Checkpoint(str(tmpdir.join("batch.db")))
+    try:
+        results = run_batch(inputs, "sst", {"outdir": outdir}, checkpoint, 2)
+        assert sorted(r["status"] for r in results) == ["ok", "ok"]
+        assert not any(r["skipped"] for r in results)
+
+        results = run_batch(inputs, "sst", {"outdir": outdir}, checkpoint)
+        assert all(r["skipped"] for r in results)
+
+        # Changed input, missing output and other parameters are converted.
+        make_netcdf(inputs[0], 300, 200, ("sst",), seed=10)
+        os.remove(os.path.join(outdir, "1.nc.sst.cog.tif"))
+        results = run_batch(inputs, "sst", {"outdir": outdir}, checkpoint)
+        assert not any(r["skipped"] for r in results)
+
+        results = run_batch(inputs, "sst", {"outdir": outdir, "nodata": 0}, checkpoint)
+        assert not any(r["skipped"] for r in results)
+        results = run_batch(inputs, "sst", {"outdir": outdir, "nodata": 0}, checkpoint)
+        assert all(r["skipped"] for r in results)
+    finally:
+        checkpoint.close()
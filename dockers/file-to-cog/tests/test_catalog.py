@@ -0,0 +1,85 @@
+"""Test the catalog registration of converted COGs."""
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+import rasterio
+
+from file_to_cog.convert import TIME_TAGS, convert, source_path
+from file_to_cog.hdf5 import convert_hdf5
+
+catalog = pytest.importorskip("tiler.catalog")
+headers = pytest.importorskip("tiler.headers")
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("windowed", [False, True])
+def test_time_tags(netcdf, tmpdir, windowed):
+    """Should copy the NetCDF time coverage to the COG metadata."""
+    out_cog = convert(
+        source_path(netcdf, "sst"),
+        str(tmpdir.join("sst.tif")),
+        {"windowed": windowed, "warp_workers": 1},
+    )
+    with rasterio.open(out_cog) as src_dst:
+        assert set(TIME_TAGS) <= set(src_dst.tags())
+        start, end = headers.dataset_times(src_dst)
+    assert start.startswith("2019-06-01T00:00:00")
+    assert end.startswith("2019-06-01T23:59:59")
+
+
+def test_hdf5_time_tags(netcdf, tmpdir):
+    """Should copy the HDF5 file time coverage to the COG metadata."""
+    for options in ({}, {"dst_crs": "epsg:3857"}):
+        out_cog = convert_hdf5(
+            netcdf, str(tmpdir.join("sst.tif")), dict(options, bandname="sst")
+        )
+        with rasterio.open(out_cog) as src_dst:
+            start, _ = headers.dataset_times(src_dst)
+        assert start.startswith("2019-06-01T00:00:00")
+
+
+def test_catalog_search(netcdf, tmpdir):
+    """Should find a file-to-cog --catalog conversion by time."""
+    out_cog = str(tmpdir.join("sst.tif"))
+    db = str(tmpdir.join("catalog.db"))
+    tiler_root = os.path.dirname(os.path.dirname(os.path.abspath(catalog.__file__)))
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(
+            filter(None, [root, tiler_root, os.environ.get("PYTHONPATH")])
+        ),
+    )
+    proc = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(root, "file-to-cog.py"),
+            netcdf,
+            "--bandname",
+            "sst",
+            "--output",
+            out_cog,
+            "--catalog",
+            db,
+        ],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    report = json.loads(proc.stdout.decode().splitlines()[-1])
+    assert report["status"] == "ok"
+    assert "catalog" in [s["name"] for s in report["stages"]]
+
+    cat = catalog.Catalog(db)
+    try:
+        found = cat.search(start="2019-06-01", end="2019-06-01")
+        assert [d["url"] for d in found] == [out_cog]
+        assert cat.search(bbox=(-10, 40, 20, 50), start="2019-06-01T12:00:00Z")
+        assert cat.search(start="2019-06-02") == []
+        assert cat.search(end="2019-05-31") == []
+    finally:
+        cat.close()
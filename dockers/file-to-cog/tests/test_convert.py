@@ -0,0 +1,70 @@
+"""Test NetCDF to COG conversion."""
+
+import os
+
+import numpy
+import rasterio
+from rio_cogeo.cogeo import cog_validate
+
+from file_to_cog.convert import (
+    convert,
+    generate_cog,
+    generate_cogs,
+    list_variables,
+    source_path,
+)
+
+
+def test_list_variables(netcdf):
+    """Should list the NetCDF variables."""
+    variables = list_variables(netcdf)
+    assert sorted(variables) == ["ice", "sst"]
+    assert variables["sst"] == f"NETCDF:{netcdf}:sst"
+
+
+def test_convert(netcdf, tmpdir):
+    """Should write a valid COG in a single pass, without intermediate files."""
+    out_cog = str(tmpdir.join("sst.tif"))
+    assert convert(source_path(netcdf, "sst"), out_cog) == out_cog
+    assert cog_validate(out_cog, quiet=True)[0]
+    assert sorted(os.listdir(str(tmpdir))) == [
+        os.path.basename(netcdf),
+        "sst.tif",
+        "sst.tif.stats.json",
+    ]
+
+    with rasterio.open(source_path(netcdf, "sst")) as src, rasterio.open(
+        out_cog
+    ) as cog:
+        assert cog.nodata == -999
+        assert cog.crs.is_geographic
+        assert (cog.width, cog.height) == (src.width, src.height)
+        numpy.testing.assert_allclose(cog.bounds, src.bounds, atol=1e-6)
+        numpy.testing.assert_array_equal(cog.read(1), src.read(1))
+        assert cog.overviews(1) == [2]
+
+
+def test_generate_cog(netcdf, tmpdir):
+    """Should convert a variable, and report failures."""
+    out_cog = str(tmpdir.join("out.tif"))
+    assert generate_cog(netcdf, {"bandname": "ice", "output": out_cog}) == out_cog
+    assert os.path.exists(out_cog)
+    assert generate_cog(netcdf, {"bandname": "missing", "output": out_cog}) is None
+
+
+def test_generate_cogs(netcdf, tmpdir):
+    """Should convert several variables in a process pool."""
+    outdir = str(tmpdir.join("cogs"))
+    results = generate_cogs(netcdf, "sst,ice,missing", {"outdir": outdir}, 2)
+    assert [r["variable"] for r in results] == ["sst", "ice", "missing"]
+    assert [r["status"] for r in results] == ["ok", "ok", "error"]
+    assert results[2]["reason"] == "invalid_input"
+
+    name = os.path.basename(netcdf)
+    assert results[0]["output"] == os.path.join(outdir, f"{name}.sst.cog.tif")
+    assert results[0]["report"]["status"] == "ok"
+    for result in results[:2]:
+        assert cog_validate(result["output"], quiet=True)[0]
+
+    results = generate_cogs(netcdf, "all", {"outdir": outdir})
+    assert sorted(r["variable"] for r in results) == ["ice", "sst"]
@@ -0,0 +1,63 @@
+"""Test the web mercator aligned output."""
+
+import math
+
+import mercantile
+import rasterio
+
+from file_to_cog.convert import convert, source_path
+from file_to_cog.mercator import (
+    MERCATOR_SIZE,
+    mercator_grid,
+    native_zoom,
+    tile_range,
+    zoom_resolution,
+)
+
+
+def test_tile_range():
+    """Should return the same tiles as mercantile.tiles."""
+    bounds = mercantile.bounds(mercantile.Tile(16, 10, 5))
+    west, north = bounds.west, bounds.north
+    east, south = bounds.east + 20, bounds.south - 10
+    tiles = list(mercantile.tiles(west, south, east, north, zooms=5))
+    assert tile_range(west, south, east, north, 5) == (
+        min(t.x for t in tiles),
+        min(t.y for t in tiles),
+        max(t.x for t in tiles),
+        max(t.y for t in tiles),
+    )
+
+
+def test_web_optimized(netcdf, tmpdir):
+    """Should align the COG and its overviews on the mercator tile grid."""
+    src_path = source_path(netcdf, "sst")
+    with rasterio.open(src_path) as src_dst:
+        maxzoom = native_zoom(src_dst, "+proj=longlat +ellps=WGS84")
+        _, overview_level = mercator_grid(src_dst, "+proj=longlat +ellps=WGS84")
+    assert overview_level > 0
+
+    out_cog = convert(src_path, str(tmpdir.join("sst.tif")), {"web_optimized": True})
+    with rasterio.open(out_cog) as src_dst:
+        assert src_dst.crs.to_epsg() == 3857
+        resolution = zoom_resolution(maxzoom)
+        assert math.isclose(src_dst.res[0], resolution)
+        assert math.isclose(src_dst.res[1], resolution)
+
+        # Origin and size are whole tiles at maxzoom.
+        tile_size = 256 * resolution
+        col = (src_dst.transform.c + MERCATOR_SIZE / 2) / tile_size
+        row = (MERCATOR_SIZE / 2 - src_dst.transform.f) / tile_size
+        assert math.isclose(col, round(col), abs_tol=1e-6)
+        assert math.isclose(row, round(row), abs_tol=1e-6)
+        assert src_dst.width % 256 == 0 and src_dst.height % 256 == 0
+        assert src_dst.block_shapes[0] == (256, 256)
+
+        # One overview per zoom level down to maxzoom - overview_level.
+        factors = src_dst.overviews(1)
+        assert factors == [2 ** level for level in range(1, overview_level + 1)]
+        for level in range(1, overview_level + 1):
+            with rasterio.open(out_cog, overview_level=level - 1) as ovr_dst:
+                assert math.isclose(
+                    ovr_dst.res[0], zoom_resolution(maxzoom - level), rel_tol=1e-9
+                )
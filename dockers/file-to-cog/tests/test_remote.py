@@ -0,0 +1,124 @@
+"""Test ranged reads of remote inputs."""
+
+import io
+import os
+
+import h5py
+import numpy
+import pytest
+import rasterio
+
+from conftest import make_netcdf
+from file_to_cog.hdf5 import convert_hdf5, list_datasets
+from file_to_cog.remote import RangeFile, gdal_path, is_remote
+from file_to_cog.report import ConversionReport
+from file_to_cog.validate import RangeCountingServerProcess
+
+BLOCK_KB = 16
+
+
+@pytest.fixture(scope="module")
+def served(tmpdir_factory):
+    """Serve a random file and a netCDF4 file from a range server."""
+    directory = tmpdir_factory.mktemp("served")
+    data = numpy.random.RandomState(0).bytes(10 * BLOCK_KB * 1024 + 100)
+    with open(str(directory.join("file.bin")), "wb") as f:
+        f.write(data)
+    make_netcdf(str(directory.join("sample.nc")))
+    with RangeCountingServerProcess(str(directory)) as server:
+        yield server, str(directory), data
+
+
+def _requests(server, read_id):
+    """Return the GET requests (HEAD requests have no ranges) of a read."""
+    return [r for r in server.requests().get(read_id, []) if r]
+
+
+def test_paths():
+    """Should recognize urls and map them to GDAL paths."""
+    assert is_remote("https://host/file.nc")
+    assert is_remote("s3://bucket/file.nc")
+    assert not is_remote("/data/file.nc")
+    assert gdal_path("https://host/file.nc") == "/vsicurl/https://host/file.nc"
+    assert gdal_path("s3://bucket/file.nc") == "/vsis3/bucket/file.nc"
+
+
+def test_random_reads(served):
+    """Should read any byte range, one request per missing block run."""
+    server, _, data = served
+    url = f"{server.url}/_read/random/file.bin"
+    with RangeFile(url, block_kb=BLOCK_KB, readahead=0) as f:
+        assert f.size == len(data)
+        f.seek(3 * BLOCK_KB * 1024 - 10)
+        assert f.read(20) == data[3 * BLOCK_KB * 1024 - 10 : 3 * BLOCK_KB * 1024 + 10]
+        assert f.requests == 1
+        # Cached blocks.
+        f.seek(-BLOCK_KB * 1024, io.SEEK_CUR)
+        assert f.read(100) == data[2 * BLOCK_KB * 1024 + 10 : 2 * BLOCK_KB * 1024 + 110]
+        assert f.requests == 1
+        f.seek(-50, io.SEEK_END)
+        assert f.read(1000) == data[-50:]
+        assert f.read(10) == b""
+        stats = f.stats()
+
+    assert stats["requests"] == 2
+    assert stats["fetched_bytes"] == 2 * BLOCK_KB * 1024 + 100
+    assert len(_requests(server, "random")) == 2
+
+
+def test_readahead(served):
+    """Should fetch the next blocks of sequential reads in the background."""
+    server, _, data = served
+    chunk = BLOCK_KB * 1024 // 2
+    for read_id, readahead in (("sequential", 0), ("readahead", 4)):
+        url = f"{server.url}/_read/{read_id}/file.bin"
+        with RangeFile(url, block_kb=BLOCK_KB, readahead=readahead) as f:
+            parts = []
+            while True:
+                part = f.read(chunk)
+                if not part:
+                    break
+                parts.append(part)
+            assert b"".join(parts) == data
+            stats = f.stats()
+        assert stats["fetched_ratio"] == 1
+        assert len(_requests(server, read_id)) == stats["requests"]
+        if readahead:
+            # Consecutive blocks are fetched together.
+            assert stats["requests"] < 11
+        else:
+            assert stats["requests"] == 11
+
+
+def test_h5py(served):
+    """Should let h5py read a variable without fetching the whole file."""
+    server, directory, _ = served
+    url = f"{server.url}/_read/h5py/sample.nc"
+    with RangeFile(url, block_kb=BLOCK_KB) as f, h5py.File(f, "r") as h5:
+        remote = h5["sst"][:100, :100]
+        fetched = f.stats()["fetched_ratio"]
+    with h5py.File(os.path.join(directory, "sample.nc"), "r") as h5:
+        numpy.testing.assert_array_equal(remote, h5["sst"][:100, :100])
+    assert fetched < 0.5
+
+    assert set(list_datasets(f"{server.url}/sample.nc")) >= {"/sst", "/ice"}
+
+
+def test_convert_hdf5(served, tmpdir):
+    """Should convert a remote variable as the local file."""
+    server, directory, _ = served
+    options = {"bandname": "sst", "stats": False}
+    local = convert_hdf5(
+        os.path.join(directory, "sample.nc"), str(tmpdir.join("local.tif")), options
+    )
+    report = ConversionReport(f"{server.url}/sample.nc", "remote.tif")
+    remote = convert_hdf5(
+        f"{server.url}/_read/convert/sample.nc",
+        str(tmpdir.join("remote.tif")),
+        options,
+        report,
+    )
+    with rasterio.open(local) as loc, rasterio.open(remote) as rem:
+        numpy.testing.assert_array_equal(loc.read(), rem.read())
+    assert report.remote["requests"] == len(_requests(server, "convert"))
+    assert report.remote["fetched_bytes"] > 0
@@ -0,0 +1,63 @@
+"""Test time series stacking."""
+
+import json
+import datetime
+
+import numpy
+import pytest
+import rasterio
+from rio_cogeo.cogeo import cog_validate
+
+from conftest import make_netcdf
+
+from file_to_cog.convert import source_path
+from file_to_cog.stack import file_date, stack
+
+
+def test_file_date():
+    """Should read dates from file names."""
+    assert file_date("20190603090000-JPL-L4_GHRSST.nc") == datetime.date(2019, 6, 3)
+    assert file_date("sst_2019-06-03.nc") == datetime.date(2019, 6, 3)
+    assert file_date("sst.nc") is None
+
+
+def test_stack(tmpdir):
+    """Should stack the files into one band per date, ordered by date."""
+    sources = [
+        make_netcdf(str(tmpdir.join("sst_20190603.nc")), 300, 200, ("sst",), seed=3),
+        make_netcdf(str(tmpdir.join("sst_20190601.nc")), 300, 200, ("sst",), seed=1),
+        # Date from the global attributes.
+        make_netcdf(
+            str(tmpdir.join("sst.nc")),
+            300,
+            200,
+            ("sst",),
+            attrs={"time_coverage_start": "20190602T000000Z"},
+            seed=2,
+        ),
+    ]
+    out_cog = str(tmpdir.join("stack.tif"))
+    dates = stack(sources, out_cog, {"bandname": "sst", "memory_mb": 1}, 2)
+    assert dates == ["2019-06-01", "2019-06-02", "2019-06-03"]
+    assert cog_validate(out_cog, quiet=True)[0]
+
+    with rasterio.open(out_cog) as cog:
+        assert cog.count == 3
+        assert cog.descriptions == tuple(dates)
+        assert json.loads(cog.tags()["DATES"]) == dates
+        assert cog.tags(3)["SOURCE"] == "sst_20190603.nc"
+        assert cog.profile["interleave"] == "pixel"
+        for bidx, ix in zip((1, 2, 3), (1, 2, 0)):
+            with rasterio.open(source_path(sources[ix], "sst")) as src:
+                numpy.testing.assert_array_equal(cog.read(bidx), src.read(1))
+        assert "STATISTICS_MEAN" in cog.tags(3)
+
+
+def test_stack_duplicate_dates(tmpdir):
+    """Should refuse several files of the same date."""
+    sources = [
+        make_netcdf(str(tmpdir.join(f"{ix}_20190601.nc")), 100, 100, ("sst",))
+        for ix in range(2)
+    ]
+    with pytest.raises(ValueError):
+        stack(sources, str(tmpdir.join("stack.tif")), {"bandname": "sst"})
@@ -0,0 +1,80 @@
+"""Test band statistics and their sidecar."""
+
+import json
+
+import numpy
+import rasterio
+
+from file_to_cog import stats as stats_module
+from file_to_cog.convert import convert, source_path
+from file_to_cog.stats import BandStatistics, StatisticsAccumulator, sidecar_path
+
+
+def test_band_statistics():
+    """Should match numpy statistics, from a bounded sample."""
+    values = numpy.random.RandomState(0).normal(10, 2, 100000)
+    band = BandStatistics(stride=10)
+    for chunk in numpy.array_split(values, 37):
+        band.update(chunk, chunk.size + 10)
+
+    res = band.result()
+    assert res["count"] == 100000
+    assert res["valid_percent"] == 100.0 * 100000 / 100370
+    numpy.testing.assert_allclose(res["mean"], values.mean())
+    numpy.testing.assert_allclose(res["std"], values.std())
+    assert res["min"] == values.min() and res["max"] == values.max()
+    numpy.testing.assert_allclose(res["percentiles"]["50"], 10, atol=0.05)
+    assert sum(res["histogram"][0]) == 100000
+
+    # One pixel every `stride` across the windows, copied out of them.
+    sample = numpy.concatenate(band._samples)
+    numpy.testing.assert_array_equal(sample, values[::10])
+    assert all(s.base is None for s in band._samples)
+
+
+def test_accumulator_nodata():
+    """Should skip nodata and NaN pixels."""
+    stats = StatisticsAccumulator(2, nodata=-1)
+    data = numpy.array([[[1, -1], [3, numpy.nan]], [[-1, -1], [-1, -1]]])
+    stats.update(data)
+    res = stats.result()
+    assert res["1"]["count"] == 2 and res["1"]["mean"] == 2
+    assert res["2"]["count"] == 0 and res["2"]["min"] is None
+
+
+def test_sample_size(monkeypatch):
+    """Should keep at most STATS_SAMPLE_SIZE pixels."""
+    monkeypatch.setattr(stats_module, "SAMPLE_SIZE", 1000)
+    stats = StatisticsAccumulator(1, pixels=100 * 100)
+    stats.update(numpy.ones((1, 100, 100)))
+    assert sum(s.size for s in stats.bands[0]._samples) == 1000
+
+    # Shared by the bands (e.g one per date).
+    stats = StatisticsAccumulator(10, pixels=100 * 100)
+    stats.update(numpy.ones((10, 100, 100)))
+    assert sum(s.size for band in stats.bands for s in band._samples) == 1000
+
+
+def test_stats_sidecar(netcdf, tmpdir):
+    """Should store statistics in the COG metadata and in a sidecar."""
+    src_path = source_path(netcdf, "sst")
+    out_cog = convert(src_path, str(tmpdir.join("sst.tif")))
+    with open(sidecar_path(out_cog)) as f:
+        sidecar = json.load(f)
+    assert sidecar["nodata"] == -999
+    band = sidecar["statistics"]["1"]
+    assert band["valid_percent"] == 90.0
+
+    with rasterio.open(src_path) as src_dst:
+        data = src_dst.read(1, masked=True)
+    numpy.testing.assert_allclose(band["min"], data.min())
+    numpy.testing.assert_allclose(band["max"], data.max())
+    numpy.testing.assert_allclose(band["mean"], data.mean(), rtol=1e-6)
+
+    with rasterio.open(out_cog) as cog:
+        tags = cog.tags(1)
+    assert float(tags["STATISTICS_MINIMUM"]) == band["min"]
+    assert json.loads(tags["STATISTICS_PERCENTILES"]) == band["percentiles"]
+
+    convert(src_path, str(tmpdir.join("no-stats.tif")), {"stats": False})
+    assert not tmpdir.join("no-stats.tif.stats.json").exists()
@@ -0,0 +1,201 @@
+"""Test multipart uploads, against an in-memory S3 client."""
+
+import os
+import time
+import base64
+import hashlib
+import threading
+
+import numpy
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from file_to_cog import upload
+from file_to_cog.report import ConversionReport
+from file_to_cog.stats import sidecar_path
+from file_to_cog.upload import (
+    MIN_PART_SIZE,
+    FollowingUpload,
+    MultipartUpload,
+    output_target,
+    part_size_for,
+    upload_file,
+)
+
+
+class FakeS3(object):
+    """In-memory S3 client: the multipart upload and put_object calls."""
+
+    def __init__(self, bad_etag=False):
+        """Initialize client."""
+        self.bad_etag = bad_etag
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _check_md5(self, body, content_md5):
+        assert base64.b64decode(content_md5) == hashlib.md5(body).digest()
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        self._check_md5(Body, ContentMD5)
+        with self._lock:
+            self.calls.append(PartNumber)
+            self.uploads[UploadId][PartNumber] = Body
+        etag = hashlib.md5(b"" if self.bad_etag else Body).hexdigest()
+        return {"ETag": f'"{etag}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [p["PartNumber"] for p in MultipartUpload["Parts"]]
+        assert numbers == sorted(parts)
+        self.objects[(Bucket, Key)] = b"".join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(UploadId)
+
+    def put_object(self, Bucket, Key, Body, ContentMD5):
+        self._check_md5(Body, ContentMD5)
+        self.objects[(Bucket, Key)] = Body
+
+
+def _random_file(path, size, seed=0):
+    data = numpy.random.RandomState(seed).bytes(size)
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+
+def test_part_size_for():
+    """Should grow the part size to fit in MAX_PARTS."""
+    assert part_size_for(0, 1) == MIN_PART_SIZE
+    size = part_size_for(10000 * MIN_PART_SIZE + 1, MIN_PART_SIZE)
+    assert size == 2 * MIN_PART_SIZE
+
+
+def test_multipart_reupload(tmpdir):
+    """Should upload the changed parts again on completion."""
+    path = str(tmpdir.join("file.bin"))
+    data = _random_file(path, 2 * MIN_PART_SIZE + 1000)
+    client = FakeS3()
+
+    mpu = MultipartUpload(client, "bucket", "file.bin", path, MIN_PART_SIZE, 2)
+    mpu.submit(2)
+    mpu.wait()
+    assert mpu.parts[2]["size"] == MIN_PART_SIZE
+
+    # Part 2 changed since it was uploaded, part 3 was never uploaded.
+    data = data[:MIN_PART_SIZE] + b"x" * 10 + data[MIN_PART_SIZE + 10 :]
+    with open(path, "r+b") as f:
+        f.seek(MIN_PART_SIZE)
+        f.write(b"x" * 10)
+
+    assert mpu.complete() == 1
+    assert sorted(client.calls) == [1, 2, 2, 3]
+    assert client.objects[("bucket", "file.bin")] == data
+
+
+def test_following_upload(tmpdir):
+    """Should stream the parts past the header while the file is written."""
+    path = str(tmpdir.join("file.tif"))
+    data = numpy.random.RandomState(0).bytes(4 * MIN_PART_SIZE)
+    client = FakeS3()
+
+    follower = FollowingUpload(
+        MultipartUpload(client, "bucket", "file.tif", path, MIN_PART_SIZE, 2),
+        interval=0.01,
+    )
+    with open(path, "wb") as f:
+        # Header placeholder, rewritten once the data is written.
+        f.write(b"\0" * 1024)
+        for offset in range(1024, len(data), MIN_PART_SIZE // 4):
+            f.write(data[offset : offset + MIN_PART_SIZE // 4])
+            f.flush()
+            # Let the follower thread see the new size.
+            time.sleep(0.05)
+        f.seek(0)
+        f.write(data[:1024])
+
+    # Parts 2 and 3 are followed by data, part 4 is the last one.
+    assert follower.streamed == 2
+    assert follower.finish() == 0
+    assert client.objects[("bucket", "file.tif")] == data
+    assert client.calls.count(1) == 1
+
+
+def test_upload_file(tmpdir):
+    """Should put small files, and abort failed multipart uploads."""
+    path = str(tmpdir.join("small.json"))
+    data = _random_file(path, 100)
+    client = FakeS3()
+    info = upload_file(path, "s3://bucket/a/small.json", client)
+    assert info["parts"] == 1
+    assert client.objects[("bucket", "a/small.json")] == data
+
+    path = str(tmpdir.join("large.bin"))
+    data = _random_file(path, MIN_PART_SIZE + 1)
+    info = upload_file(path, "s3://bucket/large.bin", client, MIN_PART_SIZE)
+    assert info["parts"] == 2
+    assert client.objects[("bucket", "large.bin")] == data
+
+    client = FakeS3(bad_etag=True)
+    with pytest.raises(IOError):
+        upload_file(path, "s3://bucket/large.bin", client, MIN_PART_SIZE)
+    assert client.aborted and not client.uploads
+    assert not client.objects
+
+
+def test_output_target(tmpdir, monkeypatch):
+    """Should upload s3:// outputs and their sidecar on exit."""
+    client = FakeS3()
+    monkeypatch.setattr(upload, "s3_client", lambda *args: client)
+    out_cog = "s3://bucket/cogs/out.tif"
+    report = ConversionReport("in.nc", out_cog)
+
+    size = 3000
+    profile = dict(
+        driver="GTiff",
+        width=size,
+        height=size,
+        count=1,
+        dtype="uint8",
+        crs="epsg:4326",
+        transform=from_origin(-10, 50, 0.01, 0.01),
+    )
+    with output_target(out_cog, {"part_size_mb": 5}, report) as local_cog:
+        assert local_cog.endswith("out.tif") and local_cog != out_cog
+        with rasterio.open(local_cog, "w", **profile) as dst:
+            dst.write(
+                numpy.random.RandomState(0).randint(0, 255, (1, size, size), "uint8")
+            )
+        with open(sidecar_path(local_cog), "w") as f:
+            f.write("{}")
+        with open(local_cog, "rb") as f:
+            data = f.read()
+    assert not os.path.exists(local_cog)
+
+    assert client.objects[("bucket", "cogs/out.tif")] == data
+    assert client.objects[("bucket", sidecar_path("cogs/out.tif"))] == b"{}"
+    assert report.upload["parts"] == 2
+    assert report.output_info["width"] == size
+    assert [s["name"] for s in report.stages] == ["upload"]
+
+
+def test_output_target_abort(tmpdir, monkeypatch):
+    """Should abort the upload if the conversion fails."""
+    client = FakeS3()
+    monkeypatch.setattr(upload, "s3_client", lambda *args: client)
+    with pytest.raises(RuntimeError):
+        with output_target("s3://bucket/out.tif", {"part_size_mb": 5}) as local_cog:
+            _random_file(local_cog, 3 * MIN_PART_SIZE)
+            raise RuntimeError("conversion failed")
+    assert not client.uploads
+    assert not client.objects
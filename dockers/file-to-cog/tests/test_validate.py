@@ -0,0 +1,136 @@
+"""Test COG validation."""
+
+import os
+import urllib.request
+from urllib.error import HTTPError
+
+import numpy
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from conftest import make_netcdf
+from file_to_cog.convert import convert, source_path
+from file_to_cog.stats import sidecar_path
+from file_to_cog.validate import (
+    InvalidCOGError,
+    RangeCountingServerProcess,
+    check_structure,
+    validate_cog,
+    validate_output,
+)
+
+
+def _no_overviews(path, size=1024):
+    """Write a tiled GeoTIFF without overviews, and its statistics sidecar."""
+    profile = dict(
+        driver="GTiff",
+        width=size,
+        height=size,
+        count=1,
+        dtype="uint8",
+        crs="epsg:4326",
+        transform=from_origin(-10, 50, 0.01, 0.01),
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+    )
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(numpy.full((1, size, size), 7, "uint8"))
+    with open(sidecar_path(path), "w") as f:
+        f.write("{}")
+    return path
+
+
+def test_non_square_overviews(tmpdir):
+    """Should count the overviews from the shortest side, as rio-cogeo."""
+    src = make_netcdf(str(tmpdir.join("wide.nc")), width=697, height=214)
+    out_cog = convert(source_path(src, "sst"), str(tmpdir.join("wide.tif")))
+
+    errors, _, structure = check_structure(out_cog)
+    assert errors == []
+    assert (structure["width"], structure["height"]) == (697, 214)
+    assert structure["overviews"] == [2]
+
+    validation = validate_output(out_cog, {"validate": "reject"})
+    assert validation["status"] == "ok"
+    assert os.path.exists(out_cog)
+
+
+def test_reads(netcdf, tmpdir):
+    """Should count the requests of every read over HTTP."""
+    out_cog = convert(source_path(netcdf, "sst"), str(tmpdir.join("sst.tif")))
+
+    validation = validate_cog(out_cog)
+    assert validation["status"] == "ok"
+    assert validation["reads"]
+    assert all(r["requests"] > 0 for r in validation["reads"] if not r["error"])
+    assert validation["max_per_read"]["header_requests"] >= 1
+
+    validation = validate_cog(out_cog, "flag", {"max_requests": 0})
+    assert validation["status"] == "flagged"
+    assert validation["read_errors"]
+    validation = validate_cog(out_cog, "reject", {"max_requests": 0})
+    assert validation["status"] == "rejected"
+
+
+def _get(url, **headers):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as resp:
+            return resp.status, resp.headers, resp.read()
+    except HTTPError as err:
+        return err.code, err.headers, b""
+
+
+def test_range_server(tmpdir):
+    """Should answer as the tiler range server, and record each read."""
+    tmpdir.join("data.bin").write_binary(bytes(range(100)))
+    with RangeCountingServerProcess(str(tmpdir)) as server:
+        url = f"{server.url}/_read/a/data.bin"
+        status, headers, body = _get(url, Range="bytes=10-19")
+        assert status == 206 and body == bytes(range(10, 20))
+        assert headers["Content-Range"] == "bytes 10-19/100"
+
+        status, parts, body = _get(url, Range="bytes=0-1,98-")
+        assert status == 206
+        assert parts["Content-Type"].startswith("multipart/byteranges")
+        assert b"Content-Range: bytes 98-99/100\r\n\r\nbc" in body
+
+        assert _get(url, Range="bytes=200-")[0] == 416
+        assert _get(url, Range="bytes=x")[0] == 416
+        assert _get(url, **{"If-None-Match": headers["ETag"]})[0] == 304
+        assert _get(f"{server.url}/_read/b/missing.bin")[0] == 404
+
+        requests = server.requests()
+    assert requests["a"] == [[[10, 19]], [[0, 1], [98, 99]], [], [], []]
+    assert requests["b"] == [[]]
+
+
+def test_flag_structure(tmpdir):
+    """Should report structure errors in flag mode, and keep the file."""
+    path = _no_overviews(str(tmpdir.join("flat.tif")))
+
+    validation = validate_output(path, {"validate": "flag"})
+    assert validation["status"] == "flagged"
+    assert "0 overview levels" in validation["errors"][-1]
+    assert validation["reads"]
+    assert os.path.exists(path)
+    assert os.path.exists(sidecar_path(path))
+
+
+def test_reject_structure(tmpdir):
+    """Should remove rejected files, without reading them."""
+    path = _no_overviews(str(tmpdir.join("flat.tif")))
+
+    validation = validate_cog(path, "reject")
+    assert validation["status"] == "rejected"
+    assert validation["reads"] == []
+
+    with pytest.raises(InvalidCOGError) as err:
+        validate_output(path, {"validate": "reject"})
+    assert err.value.failure_reason == "invalid_output"
+    assert not os.path.exists(path)
+    assert not os.path.exists(sidecar_path(path))
+
+    with pytest.raises(ValueError):
+        validate_cog(path, "warn")
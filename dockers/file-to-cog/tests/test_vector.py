@@ -0,0 +1,63 @@
+"""Test shapefile rasterization."""
+
+import json
+
+import numpy
+import rasterio
+import shapefile
+from rio_cogeo.cogeo import cog_validate
+
+from file_to_cog import vector
+from file_to_cog.stats import StatisticsAccumulator, sidecar_path
+
+
+def make_shapefile(path):
+    """Write two line tracks with a numeric `elev` field."""
+    with shapefile.Writer(path, shapeType=shapefile.POLYLINE) as shp:
+        shp.field("elev", "N", decimal=2)
+        shp.line([[[0, 0], [10, 10]]])
+        shp.record(5.5)
+        shp.line([[[0, 10], [4, 6]]])
+        shp.record(2)
+    return f"{path}.shp"
+
+
+def test_convert_vector(tmpdir, monkeypatch):
+    """Should burn the tracks in a mask COG, with statistics."""
+    sizes = []
+
+    def accumulator(count, nodata=None, pixels=None):
+        sizes.append(pixels)
+        return StatisticsAccumulator(count, nodata, pixels)
+
+    monkeypatch.setattr(vector, "StatisticsAccumulator", accumulator)
+    sourcefile = make_shapefile(str(tmpdir.join("tracks")))
+    out_cog = str(tmpdir.join("tracks.tif"))
+    options = {"resolution": 0.01, "warp_workers": 2}
+    vector.convert_vector(sourcefile, out_cog, options)
+    assert cog_validate(out_cog, quiet=True)[0]
+    # The statistics sample is sized to the output grid.
+    assert sizes == [1000 * 1000]
+
+    with rasterio.open(out_cog) as cog:
+        assert (cog.width, cog.height) == (1000, 1000)
+        assert cog.dtypes[0] == "uint8" and cog.nodata == 0
+        data = cog.read(1)
+    # The diagonal track only touches the corners of the pixels it crosses.
+    assert data[500, 499:502].any() and data[-1, 0] == 1 and data[0, 0] == 1
+    assert data[-1, -1] == 0
+
+    with open(sidecar_path(out_cog)) as f:
+        stats = json.load(f)["statistics"]["1"]
+    assert stats["count"] == int((data == 1).sum())
+
+
+def test_convert_vector_attribute(tmpdir):
+    """Should burn a numeric field."""
+    sourcefile = make_shapefile(str(tmpdir.join("tracks")))
+    out_cog = str(tmpdir.join("elev.tif"))
+    vector.convert_vector(sourcefile, out_cog, {"attribute": "elev", "resolution": 0.1})
+    with rasterio.open(out_cog) as cog:
+        data = cog.read(1)
+    assert numpy.isnan(cog.nodata)
+    assert set(numpy.unique(data[~numpy.isnan(data)])) == {2, 5.5}
@@ -0,0 +1,75 @@
+"""Test windowed, multi-process reprojection."""
+
+import numpy
+import rasterio
+from rio_cogeo.cogeo import cog_validate
+
+from file_to_cog.convert import convert, source_path
+from file_to_cog.report import ConversionReport
+from file_to_cog.warp import block_windows, window_size, output_grid
+
+
+def test_block_windows():
+    """Should cover the output with block aligned windows."""
+    windows = list(block_windows(600, 300, 256))
+    assert len(windows) == 6
+    assert sum(w.width * w.height for w in windows) == 600 * 300
+    assert windows[-1].col_off == 512 and windows[-1].width == 88
+
+
+def test_window_size(netcdf):
+    """Should size the windows to the memory budget."""
+    with rasterio.open(source_path(netcdf, "sst")) as src_dst:
+        transform, width, height = output_grid(src_dst, "epsg:3857", "epsg:4326")
+        small = window_size(
+            src_dst, transform, width, height, "epsg:3857", "epsg:4326", memory_mb=1
+        )
+        large = window_size(
+            src_dst, transform, width, height, "epsg:3857", "epsg:4326", memory_mb=64
+        )
+    assert small == 256
+    assert large > small and large % 256 == 0
+
+
+def test_windowed_convert(netcdf, tmpdir):
+    """Should write the same COG as the in-memory conversion."""
+    src_path = source_path(netcdf, "sst")
+    options = {"dst_crs": "epsg:3857"}
+    in_memory = convert(src_path, str(tmpdir.join("memory.tif")), options)
+    windowed = convert(
+        src_path,
+        str(tmpdir.join("windowed.tif")),
+        dict(options, windowed=True, memory_mb=1, warp_workers=2),
+    )
+    assert cog_validate(windowed, quiet=True)[0]
+
+    with rasterio.open(in_memory) as mem, rasterio.open(windowed) as win:
+        assert win.profile["transform"].almost_equals(mem.profile["transform"])
+        assert (win.width, win.height) == (mem.width, mem.height)
+        assert win.nodata == mem.nodata
+        numpy.testing.assert_array_equal(win.read(1), mem.read(1))
+        numpy.testing.assert_allclose(
+            float(win.tags(1)["STATISTICS_MEAN"]), float(mem.tags(1)["STATISTICS_MEAN"])
+        )
+
+
+def test_workers_peak_rss(netcdf, tmpdir):
+    """Should report the peak RSS measured in the warp workers."""
+    report = ConversionReport(netcdf, str(tmpdir.join("windowed.tif")))
+    convert(
+        source_path(netcdf, "sst"),
+        str(tmpdir.join("windowed.tif")),
+        {"dst_crs": "epsg:3857", "windowed": True, "memory_mb": 1, "warp_workers": 2},
+        report,
+    )
+    report.finish()
+    stages = {s["name"]: s for s in report.stages}
+    assert stages["warp"]["workers_peak_rss_mb"] > 0
+    assert stages["cog"]["workers_peak_rss_mb"] is None
+    peak = report.to_dict()["workers_peak_rss_mb"]
+    assert peak == stages["warp"]["workers_peak_rss_mb"]
+
+    report = ConversionReport(netcdf, str(tmpdir.join("memory.tif")))
+    convert(source_path(netcdf, "sst"), str(tmpdir.join("memory.tif")), {}, report)
+    report.finish()
+    assert report.to_dict()["workers_peak_rss_mb"] is None
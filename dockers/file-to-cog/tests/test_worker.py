@@ -0,0 +1,138 @@
+"""Test the conversion worker and its job queue."""
+
+import os
+import io
+import json
+import time
+
+import rasterio
+
+from file_to_cog import worker
+from file_to_cog.worker import JobQueue, output_path, run_worker
+
+
+def _status(queue, job_id):
+    return queue.db.execute(
+        "SELECT status, attempts, reason FROM jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+
+
+def test_enqueue(netcdf, tmpdir):
+    """Should add each file version (and options) once."""
+    queue = JobQueue(str(tmpdir.join("queue.db")))
+    job_id = queue.enqueue(netcdf, {"bandname": "sst"})
+    assert job_id
+    assert queue.enqueue(netcdf, {"bandname": "sst"}) is None
+    assert queue.enqueue(netcdf, {"bandname": "ice"})
+    assert queue.pending() == 2
+    assert queue.stats()["visible"] == 2
+    queue.close()
+
+
+def test_claim_visibility(netcdf, tmpdir):
+    """Should hide claimed jobs until their visibility timeout."""
+    queue = JobQueue(str(tmpdir.join("queue.db")))
+    job_id = queue.enqueue(netcdf, {"bandname": "sst"})
+
+    job = queue.claim("a", timeout=0.2)
+    assert job["id"] == job_id
+    assert job["options"] == {"bandname": "sst"}
+    assert job["attempts"] == 1
+    assert queue.claim("b", timeout=0.2) is None
+
+    # Worker "a" died: the job is claimed again.
+    time.sleep(0.3)
+    job = queue.claim("b", timeout=60)
+    assert job["attempts"] == 2
+
+    # Late completion of the first claim is ignored.
+    queue.complete("a", job, "a.tif")
+    assert _status(queue, job_id)[0] == "running"
+    queue.complete("b", job, "b.tif")
+    assert _status(queue, job_id)[0] == "done"
+    assert queue.pending() == 0
+    queue.close()
+
+
+def test_extend(netcdf, tmpdir):
+    """Should keep running jobs invisible while their worker extends them."""
+    queue = JobQueue(str(tmpdir.join("queue.db")))
+    queue.enqueue(netcdf)
+    job = queue.claim("a", timeout=0.2)
+    queue.extend("a", [job["id"]], timeout=60)
+    time.sleep(0.3)
+    assert queue.claim("b") is None
+    queue.close()
+
+
+def test_fail_retry(netcdf, tmpdir):
+    """Should retry failures after a backoff, up to max_attempts."""
+    queue = JobQueue(str(tmpdir.join("queue.db")))
+    job_id = queue.enqueue(netcdf)
+
+    job = queue.claim("a")
+    assert queue.fail("a", job, "io_error", "timeout", max_attempts=2, backoff=60)
+    assert _status(queue, job_id) == ("queued", 1, "io_error")
+    # Waiting for its backoff.
+    assert queue.claim("a") is None
+    stats = queue.stats()
+    assert stats["delayed"] == 1 and stats["visible"] == 0
+
+    queue.db.execute("UPDATE jobs SET visible_at = 0")
+    job = queue.claim("a")
+    assert job["attempts"] == 2
+    assert not queue.fail("a", job, "io_error", "timeout", max_attempts=2)
+    assert _status(queue, job_id) == ("failed", 2, "io_error")
+    assert queue.stats()["jobs"]["failed"] == 1
+    queue.close()
+
+
+def test_fail_permanent(netcdf, tmpdir):
+    """Should not retry invalid inputs, nor jobs timing out on their last attempt."""
+    queue = JobQueue(str(tmpdir.join("queue.db")))
+    job_id = queue.enqueue(netcdf, {"bandname": "sst"})
+    job = queue.claim("a")
+    assert not queue.fail("a", job, "invalid_input", "no such variable")
+    assert _status(queue, job_id)[0] == "failed"
+
+    job_id = queue.enqueue(netcdf, {"bandname": "ice"})
+    queue.claim("a", timeout=0, max_attempts=1)
+    assert queue.claim("b", max_attempts=1) is None
+    assert _status(queue, job_id) == ("failed", 1, "visibility_timeout")
+    queue.close()
+
+
+def test_run_worker(netcdf, tmpdir, monkeypatch):
+    """Should convert the queued jobs, and fail the invalid ones."""
+    monkeypatch.setattr(worker, "pressure", lambda *args, **kwargs: None)
+    queue_path = str(tmpdir.join("queue.db"))
+    queue = JobQueue(queue_path)
+    queue.enqueue(netcdf, {"bandname": "sst"})
+    queue.enqueue(netcdf, {"bandname": "missing"})
+    queue.close()
+
+    outdir = str(tmpdir.join("cogs"))
+    out = io.StringIO()
+    counts = run_worker(
+        queue_path,
+        {"outdir": outdir},
+        max_workers=1,
+        poll_interval=0.1,
+        exit_when_empty=True,
+        out=out,
+    )
+    assert counts == {"done": 1, "retried": 0, "failed": 1}
+
+    out_cog = output_path(netcdf, {"bandname": "sst", "outdir": outdir})
+    assert out_cog == os.path.join(outdir, "20190601-sample.nc.sst.cog.tif")
+    with rasterio.open(out_cog) as src_dst:
+        assert src_dst.overviews(1)
+
+    events = [json.loads(line) for line in out.getvalue().splitlines()]
+    failed = [e for e in events if e["event"] == "failed"]
+    assert len(failed) == 1
+    assert failed[0]["reason"] in worker.PERMANENT_REASONS
+
+    queue = JobQueue(queue_path)
+    assert queue.stats()["jobs"] == {"queued": 0, "running": 0, "done": 1, "failed": 1}
+    queue.close()
@@ -0,0 +1,212 @@
+"""Benchmark tile caches behind a multi-process `tiler` server.
+
+A `tiler --workers N` server reads COGs from a local HTTP range server.
+Client threads request a set of tiles several times, over new connections
+(so the kernel spreads them over the processes), with:
+
+- no-cache: every request is rendered,
+- per-process: each process keeps its own tile cache (`TILER_PREFETCH` cache
+  without speculative renders),
+- shared: one tile cache shared by the processes (`--shared-cache-mb`).
+
+Reported: latency percentiles, throughput, tile cache hit rate (shared
+cache `X-Cache` header, or renders saved against no-cache), COG range
+requests, and the server processes memory (RSS, shared memory counted once
+per process as the kernel does).
+
+    $ python benchmarks/bench_cache.py --workers 4 --clients 8 --passes 4
+
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.request
+
+import mercantile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tiler.rangeserver import RangeServerProcess  # noqa
+
+root = os.path.join(os.path.dirname(__file__), "..")
+fixtures = os.path.join(root, "tests", "fixtures")
+
+# sar_cog.tif bounds.
+BOUNDS = (11.411, -0.384, 11.857, 0.096)
+
+CONFIGS = {
+    "no-cache": ([], {}),
+    "per-process": (
+        [],
+        {
+            "TILER_PREFETCH": "TRUE",
+            "TILER_PREFETCH_WORKERS": "0",
+            "TILER_TILE_CACHE_SIZE": "4096",
+        },
+    ),
+    "shared": (["--shared-cache-mb", "64"], {}),
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_mb(pid):
+    """Return the RSS of a process and its children, in MB."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    total = 0
+    for ppid in pids:
+        try:
+            with open(f"/proc/{ppid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total / 1024, 1)
+
+
+def start_server(port, workers, args, env):
+    """Start a tiler server, wait until it answers."""
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(root, "tiler", "scripts", "cli.py"),
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+        ]
+        + args,
+        env=dict(
+            os.environ,
+            PYTHONWARNINGS="ignore",
+            PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]),
+            **env,
+        ),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/favicon.ico").read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("tiler server did not start")
+
+
+def run(config, workers, clients, passes, tiles, range_server):
+    """Run the clients against a server, return the results."""
+    args, env = CONFIGS[config]
+    port = _free_port()
+    proc = start_server(port, workers, args, env)
+    try:
+        urls = [
+            f"http://127.0.0.1:{port}/tiles/{z}/{x}/{y}.png"
+            f"?url={range_server.url}/sar_cog.tif&rescale=-1,1"
+            for x, y, z in tiles
+        ]
+        range_server.reset()
+        latencies, hits, lock = [], [0], threading.Lock()
+
+        def client(seed):
+            rng = random.Random(seed)
+            for _ in range(passes):
+                for url in rng.sample(urls, len(urls)):
+                    t0 = time.perf_counter()
+                    with urllib.request.urlopen(url) as resp:
+                        resp.read()
+                        hit = resp.headers.get("X-Cache") == "HIT"
+                    with lock:
+                        latencies.append(time.perf_counter() - t0)
+                        hits[0] += hit
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(ix,)) for ix in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - t0
+        rss = _rss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    latencies.sort()
+    total = len(latencies)
+    return {
+        "config": config,
+        "workers": workers,
+        "requests": total,
+        "p50_ms": round(latencies[total // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(total * 0.95)] * 1000, 2),
+        "req_s": round(total / elapsed, 1),
+        "cache_hits": hits[0],
+        "range_requests": range_server.stats()["totals"]["requests"],
+        "rss_mb": rss,
+    }
+
+
+def main():
+    """Parse arguments and run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="server processes")
+    parser.add_argument("--clients", type=int, default=8, help="client threads")
+    parser.add_argument("--passes", type=int, default=4, help="passes per client")
+    parser.add_argument("--zoom", type=int, default=13)
+    parser.add_argument("--config", action="append", choices=list(CONFIGS))
+    parser.add_argument("--json", help="write results to a JSON file")
+    args = parser.parse_args()
+
+    tiles = list(mercantile.tiles(*BOUNDS, zooms=args.zoom))
+    results = []
+    with RangeServerProcess(fixtures) as range_server:
+        for config in args.config or list(CONFIGS):
+            results.append(
+                run(config, args.workers, args.clients, args.passes, tiles, range_server)
+            )
+
+    # Renders saved by the caches, against no cache at all.
+    baseline = next((r for r in results if r["config"] == "no-cache"), None)
+    for res in results:
+        if res["config"] == "per-process" and baseline:
+            saved = 1 - res["range_requests"] / float(baseline["range_requests"] or 1)
+            res["hit_rate"] = round(max(saved, 0), 3)
+        else:
+            res["hit_rate"] = round(res["cache_hits"] / float(res["requests"]), 3)
+
+    print(f"{len(tiles)} tiles, {args.clients} clients x {args.passes} passes")
+    cols = [
+        "config", "workers", "requests", "p50_ms", "p95_ms", "req_s",
+        "hit_rate", "range_requests", "rss_mb",
+    ]
+    print("\t".join(cols))
+    for res in results:
+        print("\t".join(str(res[c]) for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Benchmark COG range requests per route against a local HTTP range server.
+
+Each (profile, route) pair runs in a fresh process so GDAL caches start cold,
+then the route is called a second time to measure the warm (cached) cost.
+
+    $ python benchmarks/bench_io.py
+    $ python benchmarks/bench_io.py --profile tiler-api --json io.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tiler.rangeserver import RangeServerProcess  # noqa
+
+fixtures = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures")
+
+# GDAL settings from `tiler-api.tf`
+TILER_API_ENV = {
+    "PYTHONWARNINGS": "ignore",
+    "GDAL_CACHEMAX": "512",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": "536870912",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "GDAL_HTTP_VERSION": "2",
+    "GDAL_DISABLE_READDIR_ON_OPEN": "FALSE",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".TIF,.ovr",
+}
+
+PROFILES = {
+    "tiler-api": TILER_API_ENV,
+    "no-merge": dict(TILER_API_ENV, GDAL_HTTP_MERGE_CONSECUTIVE_RANGES="NO"),
+    "no-vsi-cache": dict(TILER_API_ENV, VSI_CACHE="FALSE"),
+    "empty-dir": dict(TILER_API_ENV, GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"),
+}
+
+ROUTES = {
+    "metadata": ("/metadata", {"url": "{server}/sar_cog.tif"}),
+    "tilejson": ("/tilejson.json", {"url": "{server}/sar_cog.tif"}),
+    "point": (
+        "/point",
+        {
+            "url": "{server}/rgb_cog.tif",
+            "coordinates": "-61.56463623161228,16.227860775481847",
+        },
+    ),
+    "tiles": ("/tiles/18/86242/119093.png", {"url": "{server}/rgb_cog.tif"}),
+    "tiles-lowzoom": (
+        "/tiles/12/2180/2049.png",
+        {"url": "{server}/sar_cog.tif", "rescale": "-1,1"},
+    ),
+    "mvt": ("/tiles/12/2161/2047.pbf", {"url": "{server}/lidar_cog.tif"}),
+    "mosaic": (
+        "/mosaic/12/2156/2041.png",
+        {"urls": "{server}/mosaic_cog1.tif,{server}/mosaic_cog2.tif"},
+    ),
+}
+
+
+def _child(route, server):
+    """Call `route` twice (cold and warm) and print I/O stats as JSON."""
+    os.environ["TILER_IO_ACCOUNTING"] = "TRUE"
+    from tiler.api import APP
+
+    path, params = ROUTES[route]
+    event = {
+        "path": path,
+        "httpMethod": "GET",
+        "headers": {"Host": "127.0.0.1"},
+        "queryStringParameters": {
+            k: v.format(server=server) for k, v in params.items()
+        },
+    }
+
+    results = []
+    for run in ("cold", "warm"):
+        t0 = time.perf_counter()
+        resp = APP(dict(event), None)
+        elapsed = time.perf_counter() - t0
+        headers = resp["headers"]
+        results.append(
+            {
+                "run": run,
+                "status": resp["statusCode"],
+                "time_ms": round(elapsed * 1000, 2),
+                "requests": int(headers.get("X-IO-Requests", 0)),
+                "bytes": int(headers.get("X-IO-Bytes", 0)),
+                "header_requests": int(headers.get("X-IO-Header-Requests", 0)),
+                "data_requests": int(headers.get("X-IO-Data-Requests", 0)),
+                "head_requests": int(headers.get("X-IO-Head-Requests", 0)),
+                "list_requests": int(headers.get("X-IO-List-Requests", 0)),
+            }
+        )
+    print(json.dumps(results))
+
+
+def run(profiles, routes):
+    """Run benchmark, return results list."""
+    results = []
+    with RangeServerProcess(fixtures) as server:
+        for profile in profiles:
+            env = dict(os.environ, **PROFILES[profile])
+            for route in routes:
+                server.reset()
+                out = subprocess.run(
+                    [sys.executable, __file__, "--child", route, server.url],
+                    env=env,
+                    stdout=subprocess.PIPE,
+                    check=True,
+                    universal_newlines=True,
+                )
+                runs = json.loads(out.stdout.strip().splitlines()[-1])
+
+                # Check the tiler accounting against what the server did serve
+                served = server.stats()["totals"]
+                verified = sum(r["requests"] for r in runs) == served["requests"] and (
+                    sum(r["bytes"] for r in runs) == served["bytes"]
+                )
+                for res in runs:
+                    res.update(profile=profile, route=route, verified=verified)
+                    results.append(res)
+    return results
+
+
+def main():
+    """Parse arguments and run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", action="append", choices=list(PROFILES))
+    parser.add_argument("--route", action="append", choices=list(ROUTES))
+    parser.add_argument("--json", help="write results to a JSON file")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return _child(*args.child)
+
+    results = run(args.profile or list(PROFILES), args.route or list(ROUTES))
+
+    cols = [
+        "profile", "route", "run", "status", "time_ms", "requests", "bytes",
+        "header_requests", "data_requests", "head_requests", "list_requests",
+        "verified",
+    ]
+    print("\t".join(cols))
+    for res in results:
+        print("\t".join(str(res[c]) for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Benchmark the tiler cold start: module import times and first response.
+
+Each route runs in a fresh process, as in a Lambda cold start, reporting the
+time to import `tiler.api`, the time to the first response and the slowest
+modules imported at startup (`python -X importtime`). Exits with an error if
+a time exceeds its budget (in milliseconds).
+
+    $ python benchmarks/bench_startup.py
+    $ python benchmarks/bench_startup.py --route point --budget budget.json
+
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+fixtures = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures")
+
+# Time budgets in milliseconds. `import` is the `import tiler.api` time,
+# routes are the time to first response (import excluded).
+BUDGET = {
+    "import": 1000,
+    "metrics": 50,
+    "point": 250,
+    "tilejson": 250,
+    "metadata": 500,
+    "tiles": 500,
+    "mvt": 750,
+    "mosaic": 750,
+}
+
+ROUTES = {
+    "metrics": ("/metrics", {}),
+    "point": (
+        "/point",
+        {
+            "url": "{fixtures}/rgb_cog.tif",
+            "coordinates": "-61.56463623161228,16.227860775481847",
+        },
+    ),
+    "tilejson": ("/tilejson.json", {"url": "{fixtures}/sar_cog.tif"}),
+    "metadata": ("/metadata", {"url": "{fixtures}/sar_cog.tif"}),
+    "tiles": ("/tiles/18/86242/119093.png", {"url": "{fixtures}/rgb_cog.tif"}),
+    "mvt": ("/tiles/12/2161/2047.pbf", {"url": "{fixtures}/lidar_cog.tif"}),
+    "mosaic": (
+        "/mosaic/12/2156/2041.png",
+        {"urls": "{fixtures}/mosaic_cog1.tif,{fixtures}/mosaic_cog2.tif"},
+    ),
+}
+
+# `import time: self [us] | cumulative | imported package`
+importtime_expr = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def _child(route):
+    """Import the API, call `route` once and print timings as JSON."""
+    t0 = time.perf_counter()
+    from tiler.api import APP
+
+    t1 = time.perf_counter()
+
+    path, params = ROUTES[route]
+    event = {
+        "path": path,
+        "httpMethod": "GET",
+        "headers": {"Host": "127.0.0.1"},
+        "queryStringParameters": {
+            k: v.format(fixtures=os.path.abspath(fixtures)) for k, v in params.items()
+        },
+    }
+    resp = APP(event, None)
+    t2 = time.perf_counter()
+
+    print(
+        json.dumps(
+            {
+                "status": resp["statusCode"],
+                "import_ms": round((t1 - t0) * 1000, 2),
+                "first_response_ms": round((t2 - t1) * 1000, 2),
+            }
+        )
+    )
+
+
+def parse_importtime(stderr, depth=1):
+    """Return {module: cumulative ms} for modules imported at `depth`."""
+    modules = {}
+    for line in stderr.splitlines():
+        match = importtime_expr.match(line)
+        if match and (len(match.group(3)) - 1) // 2 == depth:
+            modules[match.group(4)] = int(match.group(2)) / 1000
+    return modules
+
+
+def run(routes, top=10):
+    """Run benchmark, return results list."""
+    env = dict(os.environ, PYTHONWARNINGS="ignore")
+    results = []
+    for route in routes:
+        out = subprocess.run(
+            [sys.executable, "-X", "importtime", __file__, "--child", route],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        )
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        modules = parse_importtime(out.stderr)
+        res["route"] = route
+        res["modules"] = dict(
+            sorted(modules.items(), key=lambda m: m[1], reverse=True)[:top]
+        )
+        results.append(res)
+    return results
+
+
+def check_budget(results, budget):
+    """Return a list of budget violations."""
+    errors = []
+    for res in results:
+        if res["import_ms"] > budget["import"]:
+            errors.append(
+                f"{res['route']}: import {res['import_ms']}ms > {budget['import']}ms"
+            )
+        limit = budget.get(res["route"])
+        if limit is not None and res["first_response_ms"] > limit:
+            errors.append(
+                f"{res['route']}: first response {res['first_response_ms']}ms "
+                f"> {limit}ms"
+            )
+    return errors
+
+
+def main():
+    """Parse arguments and run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--route", action="append", choices=list(ROUTES))
+    parser.add_argument("--budget", help="JSON file overriding the default budget")
+    parser.add_argument("--top", type=int, default=10, help="modules to report")
+    parser.add_argument("--json", help="write results to a JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return _child(args.child)
+
+    budget = dict(BUDGET)
+    if args.budget:
+        with open(args.budget) as f:
+            budget.update(json.load(f))
+
+    results = run(args.route or list(ROUTES), top=args.top)
+
+    cols = ["route", "status", "import_ms", "first_response_ms"]
+    print("\t".join(cols))
+    for res in results:
+        print("\t".join(str(res[c]) for c in cols))
+
+    print("\nslowest imports at startup (ms, cumulative)")
+    for name, ms in results[0]["modules"].items():
+        print(f"{name}\t{ms}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    errors = check_budget(results, budget)
+    if errors:
+        print("\nover budget:\n" + "\n".join(errors))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,6 @@ from setuptools import setup, find_packages
 inst_reqs = [
     "lambda-proxy~=4.1",
     "rio-color",
-    "rio_rgbify",
     "rio-tiler>=1.2.7",
     "rio-tiler-mosaic",
     "rio-tiler-mvt",
@@ -35,5 +34,11 @@ setup(
     zip_safe=False,
     install_requires=inst_reqs,
     extras_require=extra_reqs,
-    entry_points={"console_scripts": ["tiler = tiler.scripts.cli:run"]},
+    entry_points={
+        "console_scripts": [
+            "tiler = tiler.scripts.cli:run",
+            "tiler-range-server = tiler.scripts.cli:range_server",
+            "tiler-catalog = tiler.scripts.cli:catalog",
+        ]
+    },
 )
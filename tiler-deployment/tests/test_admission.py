@@ -0,0 +1,176 @@
+"""Test admission control and load shedding."""
+
+import os
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from tiler import admission
+from tiler.admission import Gate, Overloaded, parse_limits, route_class
+from tiler.metrics import metrics
+from tiler.scripts.cli import Handler, ThreadingSimpleServer
+
+file_sar = os.path.join(os.path.dirname(__file__), "fixtures", "sar_cog.tif")
+
+
+def test_route_class():
+    """Should classify requests by cost."""
+    assert route_class("/tilejson.json") == "light"
+    assert route_class("/datasets") == "light"
+    assert route_class("/metrics") == "light"
+    assert route_class("/tiles/9/270/255.png") == "tiles"
+    assert route_class("/tiles/9/270/255@1x.png") == "tiles"
+    assert route_class("/metadata") == "tiles"
+    assert route_class("/point") == "tiles"
+    assert route_class("/tiles/9/270/255@2x.png") == "heavy"
+    assert route_class("/mosaic/9/270/255.png") == "heavy"
+    assert route_class("/mosaic/tilejson.json") == "light"
+
+
+def test_parse_limits():
+    """Should override the default limits."""
+    limits = parse_limits("heavy=1:4, tiles=3")
+    assert limits["heavy"] == (1, 4)
+    assert limits["tiles"] == (3, admission.DEFAULT_LIMITS["tiles"][1])
+    assert limits["light"] == admission.DEFAULT_LIMITS["light"]
+    assert parse_limits(None) == admission.DEFAULT_LIMITS
+
+    with pytest.raises(ValueError):
+        parse_limits("huge=1:1")
+
+
+def test_split_limits():
+    """Should divide the server limits between the processes."""
+    limits = {"light": (32, 128), "tiles": (3, 0), "heavy": (1, 9)}
+    assert admission.split_limits(limits, 4) == {
+        "light": (8, 32),
+        "tiles": (1, 0),
+        "heavy": (1, 3),
+    }
+    assert admission.split_limits(limits, 1) == limits
+
+
+def test_queue_full():
+    """Should reject at once when the queue is full."""
+    metrics.reset()
+    gate = Gate("test", concurrency=1, queue_size=0, timeout=10)
+    assert gate.acquire() == 0.0
+
+    t0 = time.perf_counter()
+    with pytest.raises(Overloaded) as err:
+        gate.acquire()
+    assert time.perf_counter() - t0 < 1
+    assert err.value.retry_after >= 1
+    gate.release(0.01)
+
+    stats = gate.stats()
+    assert stats["running"] == 0
+    assert stats["admitted"] == 1
+    assert stats["queue_full"] == 1
+
+
+def test_timeout():
+    """Should reject once the queue deadline passes."""
+    metrics.reset()
+    gate = Gate("test", concurrency=1, queue_size=4, timeout=0.1)
+    gate.acquire()
+    gate.release(3.0)
+    gate.acquire()
+
+    with pytest.raises(Overloaded) as err:
+        gate.acquire()
+    # Estimated from the service time of the class.
+    assert err.value.retry_after == 3
+    stats = gate.stats()
+    assert stats["timeout"] == 1
+    assert stats["queued"] == 0
+    assert stats["running"] == 1
+
+
+def test_fifo_handoff():
+    """Should hand slots over to the waiting requests in order."""
+    metrics.reset()
+    gate = Gate("test", concurrency=1, queue_size=4, timeout=10)
+    gate.acquire()
+
+    order, waits = [], []
+
+    def request(ix):
+        waits.append(gate.acquire())
+        order.append(ix)
+        gate.release(0.01)
+
+    threads = []
+    for ix in range(3):
+        thread = threading.Thread(target=request, args=(ix,))
+        thread.start()
+        threads.append(thread)
+        while gate.stats()["queued"] <= ix:
+            time.sleep(0.01)
+
+    time.sleep(0.1)
+    gate.release(0.01)
+    for thread in threads:
+        thread.join(10)
+
+    assert order == [0, 1, 2]
+    # Queue wait is measured apart from the service time.
+    assert min(waits) >= 0.1
+    stats = gate.stats()
+    assert stats["running"] == 0
+    assert stats["admitted"] == 4
+    assert stats["wait_ms"]["p99"] >= 100
+
+
+def test_server(monkeypatch):
+    """Should answer 503 with Retry-After when overloaded."""
+    metrics.reset()
+    gates = admission.create_gates(parse_limits("tiles=1:0"), timeout=1)
+    monkeypatch.setattr(admission, "gates", gates)
+
+    # Tiles slots in use while the responses are written.
+    writing = []
+    send = Handler._send_app_response
+
+    def _send_app_response(self, response, key, timing):
+        writing.append(gates["tiles"].running)
+        send(self, response, key, timing)
+
+    monkeypatch.setattr(Handler, "_send_app_response", _send_app_response)
+    httpd = ThreadingSimpleServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+    url = f"{base}/tiles/12/2180/2049.png?url={file_sar}&rescale=-1,1"
+    try:
+        with urllib.request.urlopen(url) as resp:
+            assert resp.status == 200
+            assert resp.headers["Server-Timing"].startswith("queue;dur=")
+        assert writing == [1]
+        # Released once the response is written.
+        deadline = time.time() + 5
+        while gates["tiles"].running and time.time() < deadline:
+            time.sleep(0.01)
+        assert gates["tiles"].running == 0
+
+        # Slot taken by another request.
+        gates["tiles"].acquire()
+        with pytest.raises(urllib.error.HTTPError) as err:
+            urllib.request.urlopen(url)
+        assert err.value.code == 503
+        assert int(err.value.headers["Retry-After"]) >= 1
+        gates["tiles"].release()
+
+        # Other route classes are still served.
+        with urllib.request.urlopen(f"{base}/metrics") as resp:
+            stats = json.loads(resp.read())["admission"]
+        assert stats["tiles"]["admitted"] == 2
+        assert stats["tiles"]["queue_full"] == 1
+        assert stats["light"]["running"] == 1
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,100 @@
+"""Test mercator aligned tile reads."""
+
+import os
+
+import numpy
+import pytest
+
+import mercantile
+import rasterio
+from affine import Affine
+
+from rio_tiler import main
+
+from tiler import aligned
+from tiler.metrics import metrics
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+file_sar = os.path.join(fixtures, "sar_cog.tif")
+
+ZOOM = 12
+ORIGIN = mercantile.Tile(x=545, y=362, z=ZOOM - 2)
+
+
+@pytest.fixture(scope="module")
+def mercator_cog(tmpdir_factory):
+    """Web mercator aligned COG: 4x4 tiles at zoom 12 with 2 overview levels."""
+    path = str(tmpdir_factory.mktemp("aligned").join("mercator.tif"))
+    left, _, _, top = mercantile.xy_bounds(ORIGIN)
+    res = mercantile.CE / (256 * 2 ** ZOOM)
+
+    yy, xx = numpy.mgrid[0:1024, 0:1024]
+    data = ((xx * 7 + yy * 13) % 251).astype("uint8") + 1
+    data[:300, :300] = 0
+
+    profile = dict(
+        driver="GTiff",
+        width=1024,
+        height=1024,
+        count=1,
+        dtype="uint8",
+        crs="epsg:3857",
+        transform=Affine(res, 0, left, 0, -res, top),
+        nodata=0,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+    )
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data, 1)
+        dst.build_overviews([2, 4], rasterio.enums.Resampling.nearest)
+    return path
+
+
+def test_aligned_window(mercator_cog):
+    """Should only align tiles on the dataset or overview pixels."""
+    with rasterio.open(mercator_cog) as src_dst:
+        tile = mercantile.children(ORIGIN, zoom=ZOOM)[5]
+        window = aligned.aligned_window(src_dst, *tile)
+        assert window.width == window.height == 256
+        assert window.col_off % 256 == 0 and window.row_off % 256 == 0
+
+        assert aligned.aligned_window(src_dst, *ORIGIN).width == 1024
+        # no overview with a decimation factor of 8
+        assert not aligned.aligned_window(src_dst, *mercantile.parent(ORIGIN))
+        # finer than the dataset resolution
+        assert not aligned.aligned_window(src_dst, *mercantile.children(tile)[0])
+
+    with rasterio.open(file_sar) as src_dst:
+        assert not aligned.aligned_window(src_dst, 2180, 2049, 12)
+
+
+def test_tile_matches_rio_tiler(mercator_cog):
+    """Should return the same pixels and mask as rio_tiler.main.tile."""
+    metrics.reset()
+    tiles = mercantile.children(ORIGIN, zoom=ZOOM) + mercantile.children(ORIGIN)
+    for tile in tiles:
+        data, mask = aligned.tile(mercator_cog, *tile)
+        expected, expected_mask = main.tile(
+            mercator_cog, *tile, resampling_method="nearest"
+        )
+        numpy.testing.assert_array_equal(data, expected)
+        numpy.testing.assert_array_equal(mask, expected_mask)
+
+    assert metrics.get("tiles.aligned") == len(tiles)
+    assert not metrics.get("tiles.warped")
+
+
+def test_tile_fallback(mercator_cog, monkeypatch):
+    """Should read not aligned tiles through rio-tiler."""
+    metrics.reset()
+    data, mask = aligned.tile(file_sar, 2180, 2049, 12)
+    expected, expected_mask = main.tile(file_sar, 2180, 2049, 12)
+    numpy.testing.assert_array_equal(data, expected)
+    numpy.testing.assert_array_equal(mask, expected_mask)
+    assert metrics.get("tiles.warped") == 1
+
+    monkeypatch.setenv("TILER_ALIGNED_READS", "FALSE")
+    aligned.tile(mercator_cog, *mercantile.children(ORIGIN, zoom=ZOOM)[0])
+    assert metrics.get("tiles.warped") == 2
+    assert not metrics.get("tiles.aligned")
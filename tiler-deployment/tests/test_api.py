@@ -48,6 +48,24 @@ def test_API_favicon(event):
     assert res == resp
 
 
+def test_API_metrics(event):
+    """Test /metrics route."""
+    event["path"] = "/tiles/18/86242/119093.jpg"
+    event["queryStringParameters"] = {"url": file_rgb}
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+
+    event["path"] = "/metrics"
+    event["queryStringParameters"] = {}
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+    headers = res["headers"]
+    assert headers["Content-Type"] == "application/json"
+    body = json.loads(res["body"])
+    assert body["coalesce"]["requests"] >= 1
+    assert "rate" in body["coalesce"]
+
+
 def test_API_bbox(event):
     """Test /bbox route."""
     event["path"] = f"/bbox"
@@ -414,6 +432,41 @@ def test_API_tiles(event):
     assert res["isBase64Encoded"]
 
 
+def test_API_tiles_terrain(event):
+    """Test /tiles route with terrain and dem options."""
+    event["path"] = f"/tiles/12/2161/2047.png"
+    event["httpMethod"] = "GET"
+    for mode in ["hillshade", "slope", "aspect"]:
+        event["queryStringParameters"] = {"url": file_lidar, "terrain": mode}
+        res = APP(event, {})
+        assert res["statusCode"] == 200
+        headers = res["headers"]
+        assert headers["Content-Type"] == "image/png"
+        assert res["body"]
+        assert res["isBase64Encoded"]
+
+    event["queryStringParameters"] = {
+        "url": file_lidar,
+        "terrain": "slope",
+        "rescale": "0,10",
+        "color_map": "cfastie",
+    }
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+
+    event["queryStringParameters"] = {"url": file_lidar, "terrain": "relief"}
+    res = APP(event, {})
+    assert res["statusCode"] == 400
+
+    for mode in ["mapbox", "mapzen"]:
+        event["queryStringParameters"] = {"url": file_lidar, "dem": mode}
+        res = APP(event, {})
+        assert res["statusCode"] == 200
+        headers = res["headers"]
+        assert headers["Content-Type"] == "image/png"
+        assert res["body"]
+
+
 def test_API_tilejson(event):
     """Test /metadata route."""
     event["path"] = f"/tilejson.json"
@@ -0,0 +1,198 @@
+"""Test the dataset catalog and the routes answering from it."""
+
+import os
+import json
+
+import pytest
+
+import rasterio
+from click.testing import CliRunner
+
+from tiler import catalog as catalog_module
+from tiler.api import APP
+from tiler.catalog import Catalog
+from tiler.headers import dataset_info
+from tiler.scripts.cli import catalog as catalog_cli
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def _info(name, **kwargs):
+    with rasterio.open(os.path.join(fixtures, name)) as src_dst:
+        return dict(dataset_info(src_dst), **kwargs)
+
+
+@pytest.fixture
+def db(tmpdir, monkeypatch):
+    """Catalog fixture, used by the api."""
+    db = Catalog(str(tmpdir.join("catalog.db")))
+    monkeypatch.setattr(catalog_module, "catalog", db)
+    yield db
+    db.close()
+
+
+def test_add_get(db):
+    """Should store and update the dataset metadata."""
+    info = _info("mosaic_cog1.tif")
+    db.add("https://host/a.tif", info)
+    assert db.get("https://host/a.tif") == info
+    assert db.get("https://host/b.tif") is None
+
+    db.add("https://host/a.tif", dict(info, minzoom=3, bounds=[40, 40, 50, 50]))
+    assert len(db) == 1
+    assert db.get("https://host/a.tif")["minzoom"] == 3
+    # The replaced row bounds are indexed once, with the new values.
+    assert db.db.execute("SELECT COUNT(*) FROM datasets_bounds").fetchone()[0] == 1
+    assert [d["url"] for d in db.search(bbox=(41, 41, 42, 42))] == ["https://host/a.tif"]
+    assert db.search(bbox=info["bounds"]) == []
+
+    assert db.remove("https://host/a.tif")
+    assert not db.remove("https://host/a.tif")
+    assert len(db) == 0
+
+
+def test_search(db):
+    """Should find datasets by bbox and time range."""
+    db.add("a", dict(_info("mosaic_cog1.tif"), bounds=[0, 0, 10, 10]))
+    db.add(
+        "b",
+        dict(
+            _info("mosaic_cog2.tif"),
+            bounds=[20, 20, 30, 30],
+            datetime="2019-06-01T00:00:00Z",
+            end_datetime="2019-06-30T23:59:59Z",
+        ),
+    )
+    db.add(
+        "c",
+        dict(
+            _info("mosaic_cog2.tif"),
+            bounds=[5, 5, 25, 25],
+            datetime="2019-07-01T00:00:00Z",
+            end_datetime="2019-07-01T00:00:00Z",
+        ),
+    )
+
+    def urls(**kwargs):
+        return [d["url"] for d in db.search(**kwargs)]
+
+    assert urls() == ["a", "b", "c"]
+    assert urls(bbox=(1, 1, 2, 2)) == ["a"]
+    assert urls(bbox=(11, 11, 21, 21)) == ["b", "c"]
+    assert urls(bbox=(40, 40, 50, 50)) == []
+    assert urls(start="2019-06-15") == ["b", "c"]
+    assert urls(end="2019-06-15") == ["b"]
+    assert urls(start="2019-06-30", end="2019-06-30") == ["b"]
+    assert urls(bbox=(0, 0, 30, 30), start="2019-07-01") == ["c"]
+    assert urls(limit=1) == ["a"]
+    assert urls(start="2019-06-15", undated=True) == ["a", "b", "c"]
+    assert urls(start="2019-07-02", undated=True) == ["a"]
+    assert urls(start="2019-07-02") == []
+
+
+def test_tilejson_without_io(db, monkeypatch):
+    """Should answer tilejson and mosaic tilejson from the catalog."""
+
+    def _read(url):
+        raise AssertionError(f"{url} read")
+
+    monkeypatch.setattr("tiler.headers.header_cache.info", _read)
+    db.add("https://host/a.tif", _info("mosaic_cog1.tif"))
+    db.add("https://host/b.tif", _info("mosaic_cog2.tif"))
+
+    event = {
+        "path": "/tilejson.json",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"url": "https://host/a.tif"},
+    }
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+    body = json.loads(res["body"])
+    assert body["bounds"] == _info("mosaic_cog1.tif")["bounds"]
+
+    event["path"] = "/mosaic/tilejson.json"
+    event["queryStringParameters"] = {"urls": "https://host/a.tif,https://host/b.tif"}
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+    body = json.loads(res["body"])
+    assert body["minzoom"] <= body["maxzoom"]
+
+
+def test_datasets_route(db):
+    """Should return the datasets intersecting bbox and datetime."""
+    db.add("a", dict(_info("mosaic_cog1.tif"), bounds=[0, 0, 10, 10]))
+    db.add(
+        "b",
+        dict(
+            _info("mosaic_cog2.tif"),
+            bounds=[5, 5, 15, 15],
+            datetime="2019-06-01T00:00:00Z",
+            end_datetime="2019-06-01T00:00:00Z",
+        ),
+    )
+    event = {
+        "path": "/datasets",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"bbox": "6,6,7,7"},
+    }
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+    assert [d["url"] for d in json.loads(res["body"])["datasets"]] == ["a", "b"]
+
+    event["queryStringParameters"] = {"bbox": "6,6,7,7", "datetime": "2019-05-01/.."}
+    res = APP(event, {})
+    assert [d["url"] for d in json.loads(res["body"])["datasets"]] == ["b"]
+
+    event["queryStringParameters"]["undated"] = "true"
+    res = APP(event, {})
+    assert [d["url"] for d in json.loads(res["body"])["datasets"]] == ["a", "b"]
+
+
+def test_datasets_invalid(db):
+    """Should fail on malformed bbox and limit parameters."""
+    event = {"path": "/datasets", "httpMethod": "GET", "headers": {}}
+    for params in (
+        {"bbox": "a,b,c,d"},
+        {"bbox": "1,2,3"},
+        {"limit": "ten"},
+        {"limit": "0"},
+    ):
+        event["queryStringParameters"] = params
+        res = APP(event, {})
+        assert res["statusCode"] == 500
+        assert "Invalid" in res["body"]
+
+
+def test_datasets_no_catalog(monkeypatch):
+    """Should fail without catalog."""
+    monkeypatch.setattr(catalog_module, "catalog", None)
+    event = {
+        "path": "/datasets",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {},
+    }
+    res = APP(event, {})
+    assert res["statusCode"] == 500
+
+
+def test_cli_scan(tmpdir):
+    """Should add the COGs of a directory with their served url."""
+    path = str(tmpdir.join("catalog.db"))
+    runner = CliRunner()
+    result = runner.invoke(
+        catalog_cli, ["--db", path, "scan", fixtures, "--base-url", "https://host/data"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "https://host/data/mosaic_cog1.tif" in result.output
+
+    db = Catalog(path)
+    assert len(db) == len(os.listdir(fixtures))
+    assert db.get("https://host/data/mosaic_cog1.tif") == _info("mosaic_cog1.tif")
+    db.close()
+
+    result = runner.invoke(catalog_cli, ["--db", path, "search", "--limit", "1"])
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output.splitlines()[0])["url"].startswith("https://host")
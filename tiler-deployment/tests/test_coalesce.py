@@ -0,0 +1,105 @@
+"""Test tiler.coalesce."""
+
+import time
+import threading
+from concurrent import futures
+
+import pytest
+
+from tiler.coalesce import CoalesceTimeout, SingleFlight, coalesce, request_key
+
+
+def test_single_flight_shares_result():
+    """Should run the function once for concurrent identical keys."""
+    group = SingleFlight(timeout=5, name="test_shared")
+    calls = []
+    started = threading.Event()
+
+    def render():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return b"tile"
+
+    def leader():
+        return group.do("key", render)
+
+    def follower():
+        started.wait()
+        return group.do("key", render)
+
+    with futures.ThreadPoolExecutor(max_workers=5) as executor:
+        tasks = [executor.submit(leader)]
+        tasks += [executor.submit(follower) for _ in range(4)]
+
+    assert [t.result() for t in tasks] == [b"tile"] * 5
+    assert len(calls) == 1
+    stats = group.stats()
+    assert stats["requests"] == 5
+    assert stats["coalesced"] == 4
+    assert stats["rate"] == 0.8
+
+    # Calls are not cached once finished
+    assert group.do("key", render) == b"tile"
+    assert len(calls) == 2
+
+
+def test_single_flight_errors_and_timeout():
+    """Should propagate errors and bound the wait."""
+    group = SingleFlight(timeout=5, name="test_error")
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("bad tile")
+
+    def follower():
+        started.wait()
+        return group.do("key", fail)
+
+    with futures.ThreadPoolExecutor(max_workers=3) as executor:
+        tasks = [executor.submit(group.do, "key", fail)]
+        tasks += [executor.submit(follower) for _ in range(2)]
+
+    for task in tasks:
+        with pytest.raises(ValueError):
+            task.result()
+
+    group = SingleFlight(timeout=0.05, name="test_timeout")
+    started.clear()
+
+    def slow():
+        started.set()
+        time.sleep(0.5)
+        return "done"
+
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(group.do, "key", slow)
+        started.wait()
+        with pytest.raises(CoalesceTimeout):
+            group.do("key", slow)
+        assert leader.result() == "done"
+    assert group.stats()["timeouts"] == 1
+
+
+def test_request_key():
+    """Should normalize default and explicit arguments."""
+
+    def tiles(z, x, y, scale=1, url=None):
+        return
+
+    assert request_key(tiles, z=1, x=2, y=3, url="a") == request_key(
+        tiles, url="a ", y=3, x=2, z=1, scale=1
+    )
+    assert request_key(tiles, z=1, x=2, y=3, url="a") != request_key(
+        tiles, z=1, x=2, y=3, url="b"
+    )
+
+    @coalesce
+    def echo(value):
+        return value
+
+    assert echo(value=1) == 1
+    with pytest.raises(TypeError):
+        echo()
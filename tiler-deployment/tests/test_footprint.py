@@ -0,0 +1,96 @@
+"""Test empty tiles rejection."""
+
+import os
+
+import numpy
+
+import mercantile
+import rasterio
+from rasterio.transform import from_origin
+
+from rio_tiler import main
+from rio_tiler.errors import TileOutsideBounds
+
+from tiler.api import APP
+from tiler.footprint import Footprint, get_footprint, tile_has_data
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+file_lidar = os.path.join(fixtures, "lidar_cog.tif")
+file_sar = os.path.join(fixtures, "sar_cog.tif")
+
+
+def test_footprint_no_false_negative():
+    """Should only reject tiles without valid data."""
+    with rasterio.open(file_lidar) as src_dst:
+        footprint = Footprint.from_dataset(src_dst)
+
+    tiles = list(mercantile.tiles(*footprint.bounds, 13))
+    rejected = [t for t in tiles if not footprint.tile_has_data(*t)]
+    assert 0 < len(rejected) < len(tiles)
+
+    for tile in rejected:
+        try:
+            _, mask = main.tile(file_lidar, *tile)
+        except TileOutsideBounds:
+            continue
+        assert not mask.any()
+
+
+def test_footprint_sparse_nodata(tmpdir):
+    """Should keep sparse valid pixels of every band with a custom nodata."""
+    path = str(tmpdir.join("sparse.tif"))
+    arr = numpy.zeros((2, 2048, 2048), dtype=numpy.uint16)
+    arr[0, 100, 1900] = 3
+    arr[1, 1500, 600] = 7
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=2048,
+        height=2048,
+        count=2,
+        dtype="uint16",
+        crs="epsg:4326",
+        transform=from_origin(10, 10, 0.001, 0.001),
+        tiled=True,
+    ) as dst:
+        dst.write(arr)
+
+    with rasterio.open(path) as src_dst:
+        footprint = Footprint.from_dataset(src_dst, nodata=0)
+        for row, col in [(100, 1900), (1500, 600)]:
+            lon, lat = src_dst.xy(row, col)
+            assert footprint.tile_has_data(*mercantile.tile(lon, lat, 14))
+        assert not footprint.tile_has_data(*mercantile.tile(10.5, 9.5, 14))
+
+
+def test_footprint_outside_bounds():
+    """Should reject tiles outside the dataset bounds."""
+    footprint = get_footprint(file_sar)
+    assert footprint.tile_has_data(2180, 2049, 12)
+    assert not footprint.tile_has_data(0, 0, 12)
+    assert get_footprint(file_sar) is footprint
+
+
+def test_footprint_disabled(monkeypatch):
+    """Should accept every tile when disabled."""
+    assert not tile_has_data(file_sar, 0, 0, 12)
+    monkeypatch.setenv("TILER_FOOTPRINT_INDEX", "FALSE")
+    assert tile_has_data(file_sar, 0, 0, 12)
+
+
+def test_API_tiles_empty():
+    """Should return an empty response for tiles without data."""
+    event = {
+        "path": "/tiles/12/0/0.png",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"url": file_sar},
+    }
+    res = APP(event, {})
+    assert res["statusCode"] == 204
+
+    event["path"] = "/tiles/12/0/0.pbf"
+    event["queryStringParameters"] = {"url": file_lidar}
+    res = APP(event, {})
+    assert res["statusCode"] == 204
@@ -0,0 +1,129 @@
+"""Test remote header prefetch and cache against the local range server."""
+
+import os
+import json
+import shutil
+
+import pytest
+
+import rasterio
+
+from tiler.api import APP
+from tiler.headers import HeaderCache, dataset_info, header_cache, prefetch_urls
+from tiler.rangeserver import RangeServerProcess
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+@pytest.fixture(scope="module")
+def server():
+    """Range server fixture."""
+    with RangeServerProcess(fixtures) as srv:
+        yield srv
+
+
+def test_info_single_request(server):
+    """Should read the dataset metadata with one request then from cache."""
+    url = f"{server.url}/mosaic_cog1.tif"
+    with rasterio.open(os.path.join(fixtures, "mosaic_cog1.tif")) as src_dst:
+        expected = dataset_info(src_dst)
+
+    cache = HeaderCache(size=16384)
+    server.reset()
+    assert cache.info(url) == expected
+    stats = server.stats()["totals"]
+    assert stats["requests"] == 1
+    assert stats["bytes"] == 16384
+
+    server.reset()
+    assert cache.info(url) == expected
+    assert server.stats()["totals"]["requests"] == 0
+    assert cache.stats()["hits"] == 1
+
+
+def test_fewer_requests_than_open(server):
+    """Should need fewer round trips than opening the dataset with GDAL."""
+    url = f"{server.url}/mosaic_cog2.tif"
+    env = dict(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR", VSI_CACHE="FALSE")
+
+    server.reset()
+    with rasterio.Env(**env):
+        with rasterio.open(url) as src_dst:
+            expected = dataset_info(src_dst)
+    opened = server.stats()["totals"]["requests"]
+
+    server.reset()
+    assert HeaderCache().info(url) == expected
+    assert server.stats()["totals"]["requests"] < opened
+
+
+def test_revalidate_etag(server):
+    """Should revalidate expired headers with a conditional request."""
+    url = f"{server.url}/mosaic_cog2.tif"
+    cache = HeaderCache(ttl=0)
+    info = cache.info(url)
+
+    server.reset()
+    assert cache.info(url) == info
+    stats = server.stats()["totals"]
+    assert stats["not_modified"] == 1
+    assert stats["bytes"] == 0
+
+
+def test_revalidate_local(tmpdir):
+    """Should reload local headers once the file changed, within the TTL."""
+    path = str(tmpdir.join("cog.tif"))
+    shutil.copy(os.path.join(fixtures, "mosaic_cog1.tif"), path)
+    cache = HeaderCache(ttl=300)
+    first = cache.info(path)
+    assert cache.info(path) is first
+
+    shutil.copy(os.path.join(fixtures, "mosaic_cog2.tif"), path)
+    os.utime(path, ns=(0, 0))
+    with rasterio.open(path) as src_dst:
+        expected = dataset_info(src_dst)
+    assert expected["bounds"] != first["bounds"]
+    assert cache.info(path) == expected
+
+
+def test_not_cog_fallback(server):
+    """Should open datasets with IFDs outside of the prefetched bytes."""
+    url = f"{server.url}/rgb_cog.tif"
+    with rasterio.open(os.path.join(fixtures, "rgb_cog.tif")) as src_dst:
+        expected = dataset_info(src_dst)
+
+    cache = HeaderCache(size=16384)
+    assert cache.info(url) == expected
+    assert cache.stats()["fallbacks"] >= 1
+
+
+def test_prefetch(server, monkeypatch):
+    """Should prefetch urls listed in the environment."""
+    urls = [f"{server.url}/mosaic_cog1.tif", f"{server.url}/missing.tif"]
+    monkeypatch.setenv("TILER_PREFETCH_URLS", ",".join(urls))
+    assert prefetch_urls() == urls
+
+    cache = HeaderCache()
+    assert cache.prefetch(prefetch_urls()) == 1
+    assert urls[0] in cache.cache
+    assert urls[1] not in cache.cache
+
+
+def test_API_mosaic_tilejson_cached(server):
+    """Should answer mosaic tilejson from prefetched headers."""
+    urls = [f"{server.url}/mosaic_cog1.tif", f"{server.url}/mosaic_cog2.tif"]
+    header_cache.clear()
+    header_cache.prefetch(urls)
+
+    event = {
+        "path": "/mosaic/tilejson.json",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"urls": ",".join(urls)},
+    }
+    server.reset()
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+    body = json.loads(res["body"])
+    assert body["bounds"] and body["minzoom"] <= body["maxzoom"]
+    assert server.stats()["totals"]["requests"] == 0
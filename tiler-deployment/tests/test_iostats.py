@@ -0,0 +1,102 @@
+"""Test I/O accounting against the local range server."""
+
+import os
+
+import pytest
+from rasterio._env import del_gdal_config
+from rasterio.env import get_gdal_config, set_gdal_config
+
+from tiler.api import APP
+from tiler.iostats import IOAccounting, parse_ranges
+from tiler.metrics import metrics
+from tiler.rangeserver import RangeServerProcess
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+@pytest.fixture(scope="module")
+def server():
+    """Range server fixture."""
+    with RangeServerProcess(fixtures) as srv:
+        yield srv
+
+
+@pytest.fixture()
+def event():
+    """event fixture"""
+    return {
+        "path": "/",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {},
+    }
+
+
+def test_parse_ranges():
+    """Should parse GDAL ranges."""
+    assert parse_ranges("0-16383") == [(0, 16383)]
+    assert parse_ranges("10-19,40-49") == [(10, 19), (40, 49)]
+
+
+def test_restore_gdal_debug():
+    """Should restore CPL_DEBUG, unset or not, once inactive."""
+    del_gdal_config("CPL_DEBUG")
+    with IOAccounting():
+        assert get_gdal_config("CPL_DEBUG") is True
+    assert get_gdal_config("CPL_DEBUG") is None
+
+    set_gdal_config("CPL_DEBUG", "OFF")
+    try:
+        with IOAccounting():
+            pass
+        assert get_gdal_config("CPL_DEBUG") is False
+    finally:
+        del_gdal_config("CPL_DEBUG")
+
+
+def test_accounting_matches_server(server):
+    """Should count the requests and bytes served."""
+    from rio_tiler import main
+
+    server.reset()
+    url = f"{server.url}/mosaic_cog1.tif"
+    with IOAccounting() as io:
+        main.tile(url, 2156, 2041, 12)
+
+    served = server.stats()["totals"]
+    assert io.stats["requests"] == served["requests"]
+    assert io.stats["bytes"] == served["bytes"]
+    assert io.stats["header_requests"] >= 1
+    assert io.stats["data_requests"] >= 1
+
+
+def test_API_io_headers(server, event, monkeypatch):
+    """Should add I/O headers and metrics when enabled."""
+    event["path"] = "/metadata"
+    event["queryStringParameters"] = {"url": f"{server.url}/rgb_cog_nodata.tif"}
+
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+    assert "X-IO-Requests" not in res["headers"]
+
+    monkeypatch.setenv("TILER_IO_ACCOUNTING", "TRUE")
+    monkeypatch.setenv("CPL_VSIL_CURL_ALLOWED_EXTENSIONS", ".tif")
+    server.reset()
+    event["path"] = "/tiles/20/219109/400917.png"
+    event["queryStringParameters"] = {
+        "url": f"{server.url}/rgb_cog_nodata.tif",
+        "rescale": "0,2000",
+    }
+    before = metrics.get("io.tiles.requests")
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+    headers = res["headers"]
+    served = server.stats()["totals"]
+    assert int(headers["X-IO-Requests"]) == served["requests"]
+    assert int(headers["X-IO-Bytes"]) == served["bytes"]
+    assert metrics.get("io.tiles.requests") - before == served["requests"]
+
+    # Header and tile data are cached by GDAL: a second request is cheaper
+    res = APP(event, {})
+    assert int(res["headers"]["X-IO-Requests"]) < served["requests"]
+    assert int(res["headers"]["X-IO-Header-Requests"]) == 0
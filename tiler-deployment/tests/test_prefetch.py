@@ -0,0 +1,137 @@
+"""Test speculative tile prefetch and the tile cache."""
+
+import os
+
+import mercantile
+import pytest
+
+from tiler import prefetch as prefetch_module
+from tiler.api import APP
+from tiler.cache import LRUCache
+from tiler.coalesce import request_key
+from tiler.metrics import metrics
+from tiler.prefetch import Prefetcher, tile_children, tile_neighbors
+
+file_sar = os.path.join(os.path.dirname(__file__), "fixtures", "sar_cog.tif")
+
+
+@pytest.fixture
+def prefetcher(monkeypatch):
+    """Enabled prefetcher fixture."""
+    metrics.reset()
+    prefetcher = Prefetcher(LRUCache(64), workers=1, enabled=True)
+    monkeypatch.setattr(prefetch_module, "tile_prefetcher", prefetcher)
+    return prefetcher
+
+
+def _event(tile, **query):
+    x, y, z = tile
+    return {
+        "path": f"/tiles/{z}/{x}/{y}.png",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": dict(url=file_sar, rescale="-1,1", **query),
+    }
+
+
+def test_tile_neighbors_children():
+    """Should return the edge neighbors and children within the grid."""
+    assert sorted(tile_neighbors(0, 0, 1)) == [(0, 1, 1), (1, 0, 1)]
+    assert len(tile_neighbors(5, 5, 4)) == 4
+    assert sorted(tile_children(1, 0, 1)) == [(2, 0, 2), (2, 1, 2), (3, 0, 2), (3, 1, 2)]
+
+
+def test_prefetch_neighbors_children(prefetcher):
+    """Should render the neighbors and children of a tile in the background."""
+    tile = tuple(mercantile.tile(11.6, -0.13, 9))
+    prefetcher.enabled = False
+    expected = [APP(_event(child), {}) for child in tile_children(*tile)]
+    prefetcher.enabled = True
+
+    res = APP(_event(tile), {})
+    assert res["statusCode"] == 200
+    assert prefetcher.join(30)
+
+    # One neighbor and the four children intersect the dataset.
+    stats = prefetcher.stats()
+    assert stats["queued"] == stats["rendered"] == 5
+
+    # Next tiles are served from the cache, as rendered on request.
+    for child, exp in zip(tile_children(*tile), expected):
+        res = APP(_event(child), {})
+        assert res["statusCode"] == exp["statusCode"]
+        assert res["body"] == exp["body"]
+    assert prefetcher.join(30)
+    stats = prefetcher.stats()
+    assert stats["hits"] == 4
+    # Children neighbors were prefetched in turn.
+    assert stats["rendered"] > 5
+    assert stats["useful_rate"] == 4 / stats["rendered"]
+
+
+def test_prefetch_disabled(monkeypatch):
+    """Should not cache nor prefetch when disabled."""
+    metrics.reset()
+    prefetcher = Prefetcher(LRUCache(64), enabled=False)
+    monkeypatch.setattr(prefetch_module, "tile_prefetcher", prefetcher)
+    tile = tuple(mercantile.tile(11.6, -0.13, 9))
+    assert APP(_event(tile), {})["statusCode"] == 200
+    assert len(prefetcher.cache) == 0
+    assert prefetcher.stats()["queued"] == 0
+
+
+def _tiles(z, x, y, url=None):
+    return ("OK", "text/plain", f"{z}/{x}/{y}")
+
+
+def test_idle_capacity_and_drop(monkeypatch):
+    """Should render only while idle, and drop the queue when overloaded."""
+    metrics.reset()
+    monkeypatch.setattr(
+        prefetch_module.catalog,
+        "dataset_info",
+        lambda url: {"bounds": [-180, -85, 180, 85], "minzoom": 0, "maxzoom": 4},
+    )
+    prefetcher = Prefetcher(LRUCache(64), workers=1, max_active=1)
+
+    # A request being rendered: speculative renders wait.
+    prefetcher.active = 1
+    res = prefetcher.serve(_tiles, z=3, x=4, y=4, url="a")
+    assert res == ("OK", "text/plain", "3/4/4")
+    assert prefetcher.stats()["queue"] == 8
+    assert not prefetcher.join(0.2)
+
+    # More requests than max_active at once: the queue is dropped.
+    prefetcher.serve(_tiles, z=3, x=1, y=1, url="a")
+    assert prefetcher.stats()["dropped"] == 8
+    assert prefetcher.stats()["queue"] == 8
+
+    # Idle: the queue (of the last request) is rendered.
+    with prefetcher._cond:
+        prefetcher.active = 0
+        prefetcher._cond.notify_all()
+    assert prefetcher.join(10)
+    assert prefetcher.stats()["rendered"] == 8
+    assert prefetcher.cache.get(request_key(_tiles, z=4, x=2, y=2, url="a"))[1] is True
+
+
+def test_queue_size(monkeypatch):
+    """Should drop the renders of the oldest requests first."""
+    metrics.reset()
+    monkeypatch.setattr(
+        prefetch_module.catalog,
+        "dataset_info",
+        lambda url: {"bounds": [-180, -85, 180, 85], "minzoom": 0, "maxzoom": 4},
+    )
+    prefetcher = Prefetcher(LRUCache(64), workers=0, queue_size=4)
+    prefetcher.schedule(_tiles, z=3, x=4, y=4, url="a")
+    prefetcher.schedule(_tiles, z=3, x=1, y=1, url="a")
+
+    stats = prefetcher.stats()
+    assert stats["queue"] == 4
+    assert stats["dropped"] == 12
+    # Neighbors of the last request first.
+    queued = sorted(
+        (job[-1]["x"], job[-1]["y"], job[-1]["z"]) for job in prefetcher._jobs
+    )
+    assert queued == sorted(tile_neighbors(1, 1, 3))
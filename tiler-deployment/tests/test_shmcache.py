@@ -0,0 +1,131 @@
+"""Test the tile cache shared by the server processes."""
+
+import os
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from tiler import shmcache
+from tiler.scripts.cli import Handler, ThreadingSimpleServer
+from tiler.shmcache import SharedTileCache
+
+file_sar = os.path.join(os.path.dirname(__file__), "fixtures", "sar_cog.tif")
+
+
+@pytest.fixture
+def cache():
+    """Shared cache fixture."""
+    cache = SharedTileCache(2, stripes=4)
+    yield cache
+    cache.close()
+
+
+def test_set_get(cache):
+    """Should return the cached responses."""
+    assert cache.get("a") is None
+    assert cache.set("a", b"meta", b"body")
+    assert cache.get("a") == (b"meta", b"body")
+    assert cache.set("a", b"meta", b"new body")
+    assert cache.get("a") == (b"meta", b"new body")
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["pages"] == {"4k": 1}
+
+
+def test_eviction(cache):
+    """Should evict the least recently read responses of a class."""
+    body = b"x" * 3000
+    cache.set("hot", b"", body)
+    for ix in range(1000):
+        cache.set(f"key{ix}", b"", body)
+        # Read since the clock hand passed: second chance.
+        assert cache.get("hot") is not None
+    assert cache.get("key0") is None
+    assert cache.get("key999") is not None
+    assert cache.stats()["evictions"] > 0
+
+
+def test_pages_move_between_classes(cache):
+    """Should give pages of the largest class to a class without pages."""
+    for ix in range(600):
+        cache.set(f"small{ix}", b"", b"x" * 3000)
+    assert cache.stats()["pages"] == {"4k": 2}
+
+    assert cache.set("large", b"", b"y" * 300000)
+    assert cache.get("large")[1] == b"y" * 300000
+    assert cache.stats()["pages"] == {"4k": 1, "512k": 1}
+
+    assert not cache.set("too large", b"", b"z" * (1 << 20))
+    assert cache.stats()["too_large"] == 1
+
+
+def test_pinned(cache):
+    """Should not evict a response being read."""
+    cache.set("pinned", b"", b"pinned body")
+    with cache.open("pinned") as entry:
+        for ix in range(1000):
+            cache.set(f"key{ix}", b"", b"x" * 3000)
+        assert bytes(entry.body) == b"pinned body"
+
+
+def test_max_stripes():
+    """Should keep the stripe counters clear of the page table."""
+    # Enough index buckets for every stripe to be used.
+    cache = SharedTileCache(4, stripes=1 << 16)
+    try:
+        assert cache.stripes == shmcache.MAX_STRIPES
+        assert cache.nbuckets > cache.stripes
+        keys = [f"key{ix}" for ix in range(300)]
+        for key in keys:
+            assert cache.set(key, b"", key.encode())
+        for key in keys * 2:
+            assert cache.get(key) == (b"", key.encode())
+        assert cache.get("missing") is None
+
+        stats = cache.stats()
+        assert stats["hits"] == 600
+        assert stats["misses"] == 1
+        assert stats["pages"] == {"4k": 2}
+    finally:
+        cache.close()
+
+
+def test_shared_across_processes(cache):
+    """Should share responses with forked processes."""
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if cache.set("child", b"", b"from child") else 1)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+    assert cache.get("child") == (b"", b"from child")
+
+
+def test_server(monkeypatch, cache):
+    """Should serve tiles from the shared cache."""
+    monkeypatch.setattr(shmcache, "shared_cache", cache)
+    httpd = ThreadingSimpleServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = (
+            f"http://127.0.0.1:{httpd.server_address[1]}"
+            f"/tiles/12/2180/2049.png?url={file_sar}&rescale=-1,1"
+        )
+        responses = []
+        for _ in range(2):
+            with urllib.request.urlopen(url) as resp:
+                responses.append((resp.headers["X-Cache"], resp.read()))
+        assert [cached for cached, _ in responses] == ["MISS", "HIT"]
+        assert responses[0][1] == responses[1][1]
+
+        base = f"http://127.0.0.1:{httpd.server_address[1]}"
+        with urllib.request.urlopen(f"{base}/metrics") as resp:
+            stats = json.loads(resp.read())["shared_cache"]
+        assert stats["hits"] == 1
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,72 @@
+"""Test route specific dependencies are imported lazily."""
+
+import os
+import sys
+import json
+import subprocess
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+
+LAZY_MODULES = ["rio_tiler_mosaic", "rio_tiler_mvt", "rio_color", "tiler.utils"]
+
+code = """
+import sys, json
+from tiler.api import APP
+event = {{
+    "path": "{path}",
+    "httpMethod": "GET",
+    "headers": {{"Host": "127.0.0.1"}},
+    "queryStringParameters": {params},
+}}
+status = APP(event, None)["statusCode"]
+print(json.dumps([status, sorted(m for m in {lazy} if m in sys.modules)]))
+"""
+
+
+def _imported_modules(path, params):
+    script = code.format(path=path, params=repr(params), lazy=repr(LAZY_MODULES))
+    out = subprocess.run(
+        [sys.executable, "-c", script],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_point_lazy_imports():
+    """Should not import tile encoders for /point."""
+    status, modules = _imported_modules(
+        "/point",
+        {
+            "url": os.path.join(fixtures, "rgb_cog.tif"),
+            "coordinates": "-61.56463623161228,16.227860775481847",
+        },
+    )
+    assert status == 200
+    assert modules == []
+
+
+def test_mvt_lazy_imports():
+    """Should only import the vector tile encoder for /tiles/{z}/{x}/{y}.pbf."""
+    status, modules = _imported_modules(
+        "/tiles/12/2161/2047.pbf", {"url": os.path.join(fixtures, "lidar_cog.tif")}
+    )
+    assert status == 200
+    assert modules == ["rio_tiler_mvt"]
+
+
+def test_cli_imports_app_after_fork():
+    """Should not open the catalog nor start the prefetch before forking."""
+    script = (
+        "import sys, json; import tiler.scripts.cli; "
+        "print(json.dumps(sorted(m for m in ('tiler.api', 'tiler.catalog', "
+        "'tiler.headers') if m in sys.modules)))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", script],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    assert json.loads(out.stdout.strip().splitlines()[-1]) == []
@@ -0,0 +1,93 @@
+"""Test precomputed statistics in /metadata."""
+
+import os
+import json
+import shutil
+
+import numpy
+import pytest
+
+import rasterio
+
+from tiler.api import APP
+from tiler.headers import header_cache
+from tiler.metrics import metrics
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+file_mosaic = os.path.join(fixtures, "mosaic_cog2.tif")
+
+
+def _statistics(arr, nodata):
+    """Full resolution statistics, as written by file-to-cog."""
+    values = arr[arr != nodata].astype("float64")
+    counts, edges = numpy.histogram(values, bins=20)
+    return {
+        "STATISTICS_MINIMUM": repr(values.min()),
+        "STATISTICS_MAXIMUM": repr(values.max()),
+        "STATISTICS_MEAN": repr(values.mean()),
+        "STATISTICS_STDDEV": repr(values.std()),
+        "STATISTICS_VALID_PERCENT": repr(100.0 * values.size / arr.size),
+        "STATISTICS_PERCENTILES": json.dumps(
+            {str(p): v for p, v in zip((2, 98), numpy.percentile(values, (2, 98)))}
+        ),
+        "STATISTICS_HISTOGRAM": json.dumps([counts.tolist(), edges.tolist()]),
+    }
+
+
+@pytest.fixture
+def cog_with_stats(tmpdir):
+    """Copy of a fixture with statistics in its band metadata."""
+    path = str(tmpdir.join("stats.tif"))
+    shutil.copy(file_mosaic, path)
+    with rasterio.open(path, "r+") as dst:
+        dst.update_tags(1, **_statistics(dst.read(1), dst.nodata))
+    header_cache.clear()
+    yield path
+    header_cache.clear()
+
+
+def _metadata(url, **params):
+    event = {
+        "path": "/metadata",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": dict(url=url, **params),
+    }
+    res = APP(event, {})
+    assert res["statusCode"] == 200
+    return json.loads(res["body"])
+
+
+def test_metadata_precomputed(cog_with_stats):
+    """Should return the stored statistics without reading pixels."""
+    metrics.reset()
+    body = _metadata(cog_with_stats)
+    assert metrics.get("metadata.precomputed") == 1
+
+    with rasterio.open(cog_with_stats) as src_dst:
+        tags = src_dst.tags(1)
+        arr = src_dst.read(1)
+
+    stats = body["statistics"]["1"]
+    assert stats["min"] == float(tags["STATISTICS_MINIMUM"])
+    assert stats["mean"] == pytest.approx(arr[arr != -9999].mean(), rel=1e-6)
+    assert stats["pc"] == list(json.loads(tags["STATISTICS_PERCENTILES"]).values())
+    assert stats["histogram"] == json.loads(tags["STATISTICS_HISTOGRAM"])
+    assert len(body["bounds"]["value"]) == 4
+
+    computed = _metadata(file_mosaic)
+    assert body["band_descriptions"] == computed["band_descriptions"]
+    assert body["minzoom"] == computed["minzoom"]
+    assert body["maxzoom"] == computed["maxzoom"]
+
+
+def test_metadata_parameters_mismatch(cog_with_stats):
+    """Should read the dataset when the stored statistics do not match."""
+    metrics.reset()
+    body = _metadata(cog_with_stats, histogram_bins="10")
+    assert len(body["statistics"]["1"]["histogram"][0]) == 10
+
+    _metadata(cog_with_stats, overview_level="0")
+    _metadata(cog_with_stats, nodata="0")
+    _metadata(file_mosaic)
+    assert not metrics.get("metadata.precomputed")
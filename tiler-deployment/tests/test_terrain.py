@@ -0,0 +1,71 @@
+"""Test tiler.terrain functions."""
+
+import os
+
+import numpy
+
+from tiler import terrain
+from tiler.cache import LRUCache
+
+file_lidar = os.path.join(os.path.dirname(__file__), "fixtures", "lidar_cog.tif")
+
+
+def test_elevation_encoders():
+    """Should match the reference Mapbox and Mapzen encodings."""
+    arr = numpy.array([[-10000.0, 0.0], [1234.6, 8848.0]])
+
+    out = numpy.zeros((3, 2, 2), dtype=numpy.uint8)
+    rgb = terrain.mapbox_elevation_rgb(arr, -10000, 0.1, out=out)
+    assert rgb is out
+    decoded = -10000 + (
+        rgb[0].astype(int) * 65536 + rgb[1].astype(int) * 256 + rgb[2]
+    ) * 0.1
+    numpy.testing.assert_allclose(decoded, arr, atol=0.05)
+
+    rgb = terrain.mapzen_elevation_rgb(arr)
+    decoded = rgb[0].astype(int) * 256 + rgb[1] + rgb[2] / 256.0 - 32768
+    numpy.testing.assert_allclose(decoded, arr, atol=1 / 256.0)
+
+
+def test_derivatives():
+    """Should compute slope/aspect/hillshade of an east-facing plane."""
+    cols = numpy.arange(6, dtype=numpy.float64)
+    arr = numpy.tile(-cols * 10, (6, 1))
+
+    slope = terrain.slope(arr, 10, 10)
+    assert slope.shape == (4, 4)
+    numpy.testing.assert_allclose(slope, 45)
+    numpy.testing.assert_allclose(terrain.aspect(arr, 10, 10), 90)
+
+    shaded = terrain.hillshade(arr, 10, 10, azimuth=90, altitude=45)
+    numpy.testing.assert_allclose(shaded, 255)
+
+
+def test_terrain_tile_cache():
+    """Should read a buffered tile once and then serve it from cache."""
+    terrain.terrain_cache.clear()
+    data, mask = terrain.terrain_tile(file_lidar, 2161, 2047, 12, mode="slope")
+    assert data.shape == (1, 256, 256)
+    assert mask.shape == (256, 256)
+    assert terrain.terrain_cache.stats()["misses"] == 1
+
+    data[:] = -1
+    cached, _ = terrain.terrain_tile(file_lidar, 2161, 2047, 12, mode="slope")
+    assert terrain.terrain_cache.stats()["hits"] == 1
+    assert cached.min() >= 0
+    assert terrain.terrain_cache.stats()["nbytes"] == 256 * 256 * 5
+
+
+def test_cache_maxbytes():
+    """Should evict terrain tiles over the cache size in bytes."""
+    cache = LRUCache(16, maxbytes=1000, sizeof=len)
+    cache.set("a", b"x" * 400)
+    cache.set("b", b"x" * 400)
+    cache.set("c", b"x" * 400)
+    assert "a" not in cache
+    assert cache.stats()["nbytes"] == 800
+
+    cache.set("b", b"x" * 100)
+    assert cache.stats()["nbytes"] == 500
+    cache.set("large", b"x" * 2000)
+    assert "large" not in cache
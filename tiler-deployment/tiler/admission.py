@@ -0,0 +1,266 @@
+"""tiler.admission: admission control and load shedding for the local server.
+
+`ThreadingSimpleServer` starts a thread per connection: under a burst every
+request is rendered at once, latency grows for all of them until they time
+out, and concurrent `@2x` mosaics can run out of memory. Requests are
+instead admitted per route class:
+
+- light: JSON routes (tilejson, datasets, metrics...),
+- tiles: `/tiles`, `/metadata`, `/point` and `/bbox`,
+- heavy: `/mosaic` tiles and tiles of scale 2 or more.
+
+Each class renders at most `concurrency` requests at once, the others wait
+in a FIFO queue of at most `queue` requests for at most
+`TILER_QUEUE_TIMEOUT` seconds (default: 2). Requests finding the queue full
+or waiting past the deadline get a fast `503` with a `Retry-After` estimated
+from the queue length and the class service time. Limits are set with
+`TILER_ADMISSION` (e.g "light=32:128,tiles=4:32,heavy=1:8", concurrency and
+queue size by class).
+
+Gates are per process: with `tiler --workers N` the limits are divided
+between the N processes (`split_limits`), so they hold for the whole server.
+A request keeps its slot until its response is written.
+
+Queue wait and service times are recorded separately (`/metrics`
+`admission`, and `Server-Timing` response headers).
+
+"""
+
+import os
+import re
+import math
+import time
+import threading
+from collections import deque
+
+from .metrics import metrics
+
+CPUS = os.cpu_count() or 1
+
+# Default (concurrency, queue size) by route class.
+DEFAULT_LIMITS = {
+    "light": (32, 128),
+    "tiles": (2 * CPUS, 8 * CPUS),
+    "heavy": (max(CPUS // 2, 1), 2 * CPUS),
+}
+
+QUEUE_TIMEOUT = float(os.environ.get("TILER_QUEUE_TIMEOUT", 2))
+
+# Recent wait and service times kept for percentiles.
+SAMPLES = 1000
+
+heavy_expr = re.compile(r"^/mosaic/\d+/\d+/\d+|^/tiles/\d+/\d+/\d+@([2-9]|\d\d+)x")
+tiles_expr = re.compile(r"^/(tiles|metadata|point|bbox)")
+
+
+def route_class(path):
+    """Return the route class of a request path."""
+    if heavy_expr.match(path):
+        return "heavy"
+    if tiles_expr.match(path):
+        return "tiles"
+    return "light"
+
+
+def parse_limits(value):
+    """
+    Parse "class=concurrency:queue,..." limits over the defaults.
+
+    Returns
+    -------
+    limits : dict
+        (concurrency, queue size) by class.
+
+    """
+    limits = dict(DEFAULT_LIMITS)
+    for item in filter(None, (value or "").split(",")):
+        name, _, limit = item.partition("=")
+        name = name.strip()
+        if name not in limits:
+            raise ValueError(f"Invalid route class: {name}")
+        concurrency, _, queue = limit.partition(":")
+        limits[name] = (
+            int(concurrency),
+            int(queue) if queue else limits[name][1],
+        )
+    return limits
+
+
+def split_limits(limits, workers):
+    """
+    Divide server-wide limits between `workers` processes.
+
+    Each process serves at least one request at once, and keeps a queue
+    unless the limit has none.
+
+    """
+    return {
+        name: (max(concurrency // workers, 1), -(-queue_size // workers))
+        for name, (concurrency, queue_size) in limits.items()
+    }
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class Overloaded(Exception):
+    """Request rejected: queue full or queue deadline passed."""
+
+    def __init__(self, message, retry_after):
+        """Initialize error."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Gate(object):
+    """
+    Concurrency limit with a bounded FIFO queue and a queue deadline.
+
+    Usage
+    -----
+    gate = Gate("heavy", concurrency=1, queue_size=8, timeout=2)
+    waited = gate.acquire()          # or raises Overloaded
+    try:
+        ...
+    finally:
+        gate.release(service_time)
+
+    Attributes
+    ----------
+    name : str
+        Route class, prefix of the metrics counters.
+    concurrency : int
+        Requests served at once.
+    queue_size : int
+        Requests waiting at most.
+    timeout : float, optional
+        Maximum queue wait, in seconds (default: QUEUE_TIMEOUT).
+
+    """
+
+    def __init__(self, name, concurrency, queue_size, timeout=QUEUE_TIMEOUT):
+        """Initialize gate."""
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.running = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self._wait_times = deque(maxlen=SAMPLES)
+        self._service_times = deque(maxlen=SAMPLES)
+        self._service_avg = None
+
+    def retry_after(self):
+        """Return the estimated time (in seconds) to drain the queue."""
+        service = self._service_avg or 1.0
+        backlog = (len(self._waiters) + 1) / float(self.concurrency)
+        return max(int(math.ceil(service * backlog)), 1)
+
+    def _reject(self, reason):
+        metrics.incr(f"admission.{self.name}.rejected")
+        metrics.incr(f"admission.{self.name}.{reason}")
+        return Overloaded(f"{self.name} requests {reason}", self.retry_after())
+
+    def acquire(self):
+        """
+        Wait for a slot.
+
+        Returns
+        -------
+        waited : float
+            Queue wait, in seconds.
+
+        Raises Overloaded when the queue is full or after `timeout`.
+
+        """
+        t0 = time.perf_counter()
+        with self._lock:
+            if self.running < self.concurrency and not self._waiters:
+                self.running += 1
+                self._admitted(0.0)
+                return 0.0
+            if len(self._waiters) >= self.queue_size:
+                raise self._reject("queue_full")
+            event = threading.Event()
+            self._waiters.append(event)
+
+        granted = event.wait(self.timeout)
+        with self._lock:
+            # Granted by `release` right after the deadline.
+            if not granted and not event.is_set():
+                self._waiters.remove(event)
+                raise self._reject("timeout")
+            waited = time.perf_counter() - t0
+            self._admitted(waited)
+        return waited
+
+    def _admitted(self, waited):
+        metrics.incr(f"admission.{self.name}.admitted")
+        metrics.incr(f"admission.{self.name}.wait_s", waited)
+        self._wait_times.append(waited)
+
+    def release(self, service_time=None):
+        """Release a slot, to the first waiting request if any."""
+        with self._lock:
+            if service_time is not None:
+                metrics.incr(f"admission.{self.name}.service_s", service_time)
+                self._service_times.append(service_time)
+                self._service_avg = (
+                    service_time
+                    if self._service_avg is None
+                    else 0.8 * self._service_avg + 0.2 * service_time
+                )
+            if self._waiters:
+                # The slot goes to the next request: `running` is unchanged.
+                self._waiters.popleft().set()
+            else:
+                self.running -= 1
+
+    def stats(self):
+        """Return gate statistics, times in milliseconds."""
+        with self._lock:
+            waits, services = list(self._wait_times), list(self._service_times)
+            running, queued = self.running, len(self._waiters)
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "running": running,
+            "queued": queued,
+            "admitted": metrics.get(f"admission.{self.name}.admitted"),
+            "rejected": metrics.get(f"admission.{self.name}.rejected"),
+            "queue_full": metrics.get(f"admission.{self.name}.queue_full"),
+            "timeout": metrics.get(f"admission.{self.name}.timeout"),
+            "wait_ms": {
+                "p50": round(_percentile(waits, 0.5) * 1000, 2),
+                "p99": round(_percentile(waits, 0.99) * 1000, 2),
+            },
+            "service_ms": {
+                "p50": round(_percentile(services, 0.5) * 1000, 2),
+                "p99": round(_percentile(services, 0.99) * 1000, 2),
+            },
+        }
+
+
+def create_gates(limits=None, timeout=QUEUE_TIMEOUT):
+    """Return gates by route class (default limits: TILER_ADMISSION)."""
+    limits = limits or parse_limits(os.environ.get("TILER_ADMISSION"))
+    return {
+        name: Gate(name, concurrency, queue_size, timeout)
+        for name, (concurrency, queue_size) in limits.items()
+    }
+
+
+# Set by the local server (`tiler`).
+gates = None
+
+
+def stats():
+    """Return admission statistics by route class (None if not enabled)."""
+    if gates is None:
+        return None
+    return {name: gate.stats() for name, gate in gates.items()}
@@ -0,0 +1,155 @@
+"""tiler.aligned: read mercator aligned COG tiles without resampling.
+
+COGs written in EPSG:3857 on the mercator tile grid (see file-to-cog
+`--web-optimized`) have internal tiles, at full resolution and for each
+overview level, matching mercator tiles. For those tiles the pixels are
+read directly from the matching level, instead of going through a
+`WarpedVRT` as `rio_tiler.main.tile` does.
+
+"""
+
+import os
+
+import numpy
+
+import mercantile
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+
+from rio_tiler import utils
+from rio_tiler.errors import TileOutsideBounds
+
+from .metrics import metrics
+
+MERCATOR_CRS = CRS.from_epsg(3857)
+
+# Maximum pixel offset (in pixels) still considered aligned.
+TOLERANCE = 1e-3
+
+
+def aligned_reads_enabled():
+    """Check if aligned tile reads are enabled (`TILER_ALIGNED_READS`)."""
+    value = os.environ.get("TILER_ALIGNED_READS", "TRUE")
+    return value.upper() in ("1", "TRUE", "YES", "ON")
+
+
+def _is_integer(value):
+    return abs(value - round(value)) < TOLERANCE
+
+
+def aligned_window(src_dst, tile_x, tile_y, tile_z, tilesize=256):
+    """
+    Return the dataset window of a mercator tile, if aligned.
+
+    A tile is aligned when the dataset is in EPSG:3857, the tile pixel size
+    is the dataset pixel size times the decimation factor of the dataset or
+    one of its overviews, and the tile falls on that level pixels, inside the
+    dataset.
+
+    Returns
+    -------
+    window : rasterio.windows.Window or None
+        Full resolution window of the tile, None if not aligned.
+
+    """
+    if src_dst.crs != MERCATOR_CRS or src_dst.transform.b or src_dst.transform.d:
+        return None
+
+    left, bottom, right, top = mercantile.xy_bounds(tile_x, tile_y, tile_z)
+    factor = (right - left) / tilesize / src_dst.transform.a
+    if not _is_integer(factor) or round(factor) < 1:
+        return None
+
+    factor = int(round(factor))
+    if factor != 1 and factor not in src_dst.overviews(1):
+        return None
+
+    col, row = ~src_dst.transform * (left, top)
+    if not (_is_integer(col / factor) and _is_integer(row / factor)):
+        return None
+
+    col, row = int(round(col)), int(round(row))
+    size = tilesize * factor
+    if col < 0 or row < 0 or col + size > src_dst.width or row + size > src_dst.height:
+        return None
+
+    return Window(col, row, size, size)
+
+
+def _aligned_read(src_dst, window, tilesize, indexes=None, nodata=None):
+    if isinstance(indexes, int):
+        indexes = [indexes]
+    indexes = list(indexes) if indexes is not None else src_dst.indexes
+
+    out_shape = (len(indexes), tilesize, tilesize)
+    # The decimation factor matches a level: GDAL copies its pixels.
+    data = src_dst.read(
+        indexes, window=window, out_shape=out_shape, resampling=Resampling.nearest
+    )
+
+    nodata = nodata if nodata is not None else src_dst.nodata
+    if nodata is not None:
+        valid = ~numpy.isnan(data) if numpy.isnan(nodata) else data != nodata
+        mask = numpy.where(valid.all(axis=0), 255, 0).astype(numpy.uint8)
+    else:
+        mask = src_dst.dataset_mask(window=window, out_shape=(tilesize, tilesize))
+    return data, mask
+
+
+def tile(address, tile_x, tile_y, tile_z, tilesize=256, **kwargs):
+    """
+    Create mercator tile, reading aligned tiles without resampling.
+
+    Same interface as `rio_tiler.main.tile`. Tiles not aligned on the
+    dataset grid are read by `rio_tiler.utils.tile_read`.
+
+    Attributes
+    ----------
+    address : str
+        file url.
+    tile_x : int
+        Mercator tile X index.
+    tile_y : int
+        Mercator tile Y index.
+    tile_z : int
+        Mercator tile ZOOM level.
+    tilesize : int, optional (default: 256)
+        Output image size.
+    kwargs: dict, optional
+        These will be passed to the 'rio_tiler.utils._tile_read' function.
+
+    Returns
+    -------
+    data : numpy ndarray
+    mask: numpy array
+
+    """
+    with rasterio.open(address) as src_dst:
+        bounds = transform_bounds(
+            src_dst.crs, "epsg:4326", *src_dst.bounds, densify_pts=21
+        )
+        if not utils.tile_exists(bounds, tile_z, tile_x, tile_y):
+            raise TileOutsideBounds(
+                f"Tile {tile_z}/{tile_x}/{tile_y} is outside image bounds"
+            )
+
+        window = None
+        if aligned_reads_enabled():
+            window = aligned_window(src_dst, tile_x, tile_y, tile_z, tilesize)
+
+        if window is not None:
+            metrics.incr("tiles.aligned")
+            return _aligned_read(
+                src_dst,
+                window,
+                tilesize,
+                indexes=kwargs.get("indexes"),
+                nodata=kwargs.get("nodata"),
+            )
+
+        metrics.incr("tiles.warped")
+        tile_bounds = mercantile.xy_bounds(tile_x, tile_y, tile_z)
+        return utils.tile_read(src_dst, tile_bounds, tilesize, **kwargs)
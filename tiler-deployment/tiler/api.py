@@ -11,26 +11,54 @@ import rasterio
 from rasterio import warp
 
 from rio_tiler import main
-from rio_tiler.utils import (
-    array_to_image,
-    get_colormap,
-    linear_rescale,
+from rio_tiler.utils import array_to_image, get_colormap, linear_rescale
+from rio_tiler.profiles import img_profiles
+
+from . import aligned
+from .metrics import metrics
+from .coalesce import coalesce, tile_requests
+from .iostats import IOAccounting, accounting_enabled, record_metrics
+from . import admission, catalog, shmcache
+from .headers import header_cache, prefetch_urls
+from .footprint import footprint_cache, tile_has_data
+from .prefetch import prefetch, tile_prefetcher
+from .statistics import precomputed_metadata
+from .terrain import (
+    TERRAIN_MODES,
+    TERRAIN_RANGES,
+    get_buffer,
+    mapbox_elevation_rgb,
     mapzen_elevation_rgb,
+    terrain_tile,
 )
-from rio_tiler.profiles import img_profiles
-from rio_tiler.mercator import get_zooms
-from rio_tiler_mosaic.mosaic import mosaic_tiler
-from rio_tiler_mvt.mvt import encoder as mvtEncoder
 
-from rio_rgbify import encoders
-from rio_color.operations import parse_operations
-from rio_color.utils import scale_dtype, to_math_type
+from lambda_proxy.proxy import API
 
-from .utils import get_area_stats
+# Route specific dependencies (rio-tiler-mosaic, rio-tiler-mvt, rio-color and
+# area statistics) are imported on first use to keep the Lambda cold start
+# short, see `benchmarks/bench_startup.py`.
 
-from lambda_proxy.proxy import API
 
-APP = API(name="tiler")
+class TilerAPI(API):
+    """lambda-proxy API with optional I/O accounting."""
+
+    def __call__(self, event, context):
+        """Handle request, adding I/O stats headers if enabled."""
+        if not accounting_enabled():
+            return super().__call__(event, context)
+
+        with IOAccounting() as io:
+            response = super().__call__(event, context)
+
+        route = (event.get("path") or "/").strip("/").split("/")[0].split(".")[0]
+        record_metrics(route or "root", io.stats)
+        response["headers"].update(io.headers())
+        return response
+
+
+APP = TilerAPI(name="tiler")
+
+header_cache.prefetch(prefetch_urls())
 
 class TilerError(Exception):
     """Base exception class."""
@@ -84,7 +112,9 @@ def meta(
     MIME type : str
         response body MIME type (e.g. image/jpeg).
     body : str
-        String encoded json statistic metadata.
+        String encoded json statistic metadata. Full resolution statistics
+        stored in the dataset metadata are returned when they match the
+        parameters (see `tiler.statistics`).
 
     """
     if indexes is not None and isinstance(indexes, str):
@@ -105,6 +135,19 @@ def meta(
     if histogram_range is not None and isinstance(histogram_range, str):
         histogram_range = tuple(map(float, histogram_range.split(",")))
 
+    info = precomputed_metadata(
+        url,
+        catalog.dataset_info(url),
+        nodata=nodata,
+        indexes=indexes,
+        overview_level=overview_level,
+        histogram_bins=histogram_bins,
+        histogram_range=histogram_range,
+    )
+    if info is not None:
+        metrics.incr("metadata.precomputed")
+        return ("OK", "application/json", json.dumps(info))
+
     info = main.metadata(
         url,
         nodata=nodata,
@@ -180,6 +223,8 @@ def bbox_stats(
     if histogram_range is not None and isinstance(histogram_range, str):
         histogram_range = tuple(map(float, histogram_range.split(",")))
 
+    from .utils import get_area_stats
+
     stats, band_descriptions = get_area_stats(
         url,
         bbox,
@@ -320,18 +365,15 @@ def tilejson(request, url, tile_format="png", **kwargs):
     if qs:
         tile_url += f"&{qs}"
 
-    with rasterio.open(url) as src_dst:
-        bounds = warp.transform_bounds(
-            *[src_dst.crs, "epsg:4326"] + list(src_dst.bounds), densify_pts=21
-        )
-        center = [(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2]
-        minzoom, maxzoom = get_zooms(src_dst)
+    info = catalog.dataset_info(url)
+    bounds = info["bounds"]
+    center = [(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2]
 
     meta = dict(
         bounds=bounds,
         center=center,
-        minzoom=minzoom,
-        maxzoom=maxzoom,
+        minzoom=info["minzoom"],
+        maxzoom=info["maxzoom"],
         name=os.path.basename(url),
         tilejson="2.1.0",
         tiles=[tile_url]
@@ -341,13 +383,7 @@ def tilejson(request, url, tile_format="png", **kwargs):
 
 
 def _get_layer_names(src_path):
-    with rasterio.open(src_path) as src_dst:
-        def _get_name(ix):
-            name = src_dst.descriptions[ix - 1]
-            if not name:
-                name = f"band{ix}"
-            return name
-        return [_get_name(ix) for ix in src_dst.indexes]
+    return catalog.dataset_info(src_path)["band_names"]
 
 
 @APP.route(
@@ -357,6 +393,7 @@ def _get_layer_names(src_path):
     payload_compression_method="gzip",
     binary_b64encode=True,
 )
+@coalesce
 def mvt(
     z,
     x,
@@ -407,7 +444,10 @@ def mvt(
 
     tilesize = 256 * scale
 
-    tile, mask = main.tile(
+    if not tile_has_data(url, x, y, z, nodata=nodata):
+        return ("EMPTY", "text/plain", "empty tiles")
+
+    tile, mask = aligned.tile(
         url,
         x,
         y,
@@ -419,6 +459,8 @@ def mvt(
 
     band_descriptions = _get_layer_names(url)
 
+    from rio_tiler_mvt.mvt import encoder as mvtEncoder
+
     return (
         "OK",
         "application/x-protobuf",
@@ -445,6 +487,9 @@ def _postprocess_tile(tile, mask, rescale=None, color_ops=None):
         tile = tile.astype(numpy.uint8)
 
     if color_ops:
+        from rio_color.operations import parse_operations
+        from rio_color.utils import scale_dtype, to_math_type
+
         # make sure one last time we don't have
         # negative value before applying color formula
         tile[tile < 0] = 0
@@ -454,6 +499,14 @@ def _postprocess_tile(tile, mask, rescale=None, color_ops=None):
     return tile, mask
 
 
+def _elevation_tile(tile, mode="mapbox"):
+    """Encode the first band of `tile` as Mapbox or Mapzen RGB elevation."""
+    out = get_buffer((3,) + tile.shape[1:])
+    if mode == "mapzen":
+        return mapzen_elevation_rgb(tile[0], out=out)
+    return mapbox_elevation_rgb(tile[0], -10000, 1, out=out)
+
+
 @APP.route(
     "/tiles/<int:z>/<int:x>/<int:y>.<ext>",
     methods=["GET"],
@@ -468,6 +521,8 @@ def _postprocess_tile(tile, mask, rescale=None, color_ops=None):
     payload_compression_method="gzip",
     binary_b64encode=True,
 )
+@prefetch
+@coalesce
 def tiles(
     z,
     x,
@@ -481,6 +536,10 @@ def tiles(
     color_ops=None,
     color_map=None,
     dem=None,
+    terrain=None,
+    azimuth=315,
+    altitude=45,
+    zfactor=1,
 ):
     """
     Handle Raster /tiles requests.
@@ -514,6 +573,15 @@ def tiles(
         Rio-tiler compatible colormap name ("cfastie" or "schwarzwald")
     dem : str, optional
         Create Mapbox or Mapzen RGBA encoded elevation image
+    terrain : str, optional
+        Create terrain derivative image ("hillshade", "slope" or "aspect")
+        from the first band in `indexes`.
+    azimuth : str, optional
+        Sun azimuth in degrees for hillshade (default: 315).
+    altitude : str, optional
+        Sun altitude in degrees for hillshade (default: 45).
+    zfactor : str, optional
+        Vertical exaggeration for terrain derivatives (default: 1).
 
     Returns
     -------
@@ -536,24 +604,43 @@ def tiles(
 
     tilesize = 256 * scale
 
-    tile, mask = main.tile(
-        url, x, y, z, indexes=indexes, tilesize=tilesize, nodata=nodata
-    )
+    if not tile_has_data(url, x, y, z, nodata=nodata):
+        return ("EMPTY", "text/plain", "empty tiles")
+
+    if terrain:
+        if terrain not in TERRAIN_MODES:
+            return ("NOK", "text/plain", 'Invalid "terrain" mode')
+
+        tile, mask = terrain_tile(
+            url,
+            x,
+            y,
+            z,
+            mode=terrain,
+            tilesize=tilesize,
+            bidx=indexes[0] if indexes else 1,
+            nodata=nodata,
+            azimuth=float(azimuth),
+            altitude=float(altitude),
+            zfactor=float(zfactor),
+        )
+        rescale = rescale or ",".join(map(str, TERRAIN_RANGES[terrain]))
+    else:
+        tile, mask = aligned.tile(
+            url, x, y, z, indexes=indexes, tilesize=tilesize, nodata=nodata
+        )
 
     if dem:
-        if dem == "mapbox":
-            tile = encoders.data_to_rgb(tile, -10000, 1)
-        elif dem == "mapzen":
-            tile = mapzen_elevation_rgb.data_to_rgb(tile)
-        else:
+        if dem not in ("mapbox", "mapzen"):
             return ("NOK", "text/plain", 'Invalid "dem" mode')
+        rtile, rmask = _elevation_tile(tile, mode=dem), mask
     else:
         rtile, rmask = _postprocess_tile(
             tile, mask, rescale=rescale, color_ops=color_ops
         )
 
-        if color_map:
-            color_map = get_colormap(color_map, format="gdal")
+    if color_map:
+        color_map = get_colormap(color_map, format="gdal")
 
     driver = "jpeg" if ext == "jpg" else ext
     options = img_profiles.get(driver, {})
@@ -565,17 +652,8 @@ def tiles(
 
 
 def _multiple_spatial_info(urls):
-    def _get_info(url):
-        with rasterio.open(url) as src_dst:
-            wgs_bounds = warp.transform_bounds(
-                *[src_dst.crs, "epsg:4326"] + list(src_dst.bounds), densify_pts=21
-            )
-            minzoom, maxzoom = get_zooms(src_dst)
-
-        return {"bounds": list(wgs_bounds), "minzoom": minzoom, "maxzoom": maxzoom}
-
     with futures.ThreadPoolExecutor() as executor:
-        all_infos = list(executor.map(_get_info, urls))
+        all_infos = list(executor.map(catalog.dataset_info, urls))
 
     minzoom = min(list(set([x["minzoom"] for x in all_infos])))
     maxzoom = max(list(set([x["maxzoom"] for x in all_infos])))
@@ -593,6 +671,16 @@ def _multiple_spatial_info(urls):
     }
 
 
+def _assets_with_data(urls, x, y, z, nodata=None):
+    def _has_data(url):
+        return tile_has_data(url, x, y, z, nodata=nodata)
+
+    with futures.ThreadPoolExecutor() as executor:
+        valid = list(executor.map(_has_data, urls))
+
+    return [url for url, ok in zip(urls, valid) if ok]
+
+
 @APP.route(
     "/mosaic/tilejson.json",
     methods=["GET"],
@@ -664,6 +752,7 @@ def mosaic_tilejson(request, urls, tile_format="png", **kwargs):
     payload_compression_method="gzip",
     binary_b64encode=True,
 )
+@coalesce
 def mosaic_tiles_mvt(
     z,
     x,
@@ -718,13 +807,19 @@ def mosaic_tiles_mvt(
     if nodata is not None and isinstance(nodata, str):
         nodata = numpy.nan if nodata == "nan" else float(nodata)
 
+    assets = _assets_with_data(urls.split(","), x, y, z, nodata=nodata)
+    if not assets:
+        return ("EMPTY", "text/plain", "empty tiles")
+
+    from rio_tiler_mosaic.mosaic import mosaic_tiler
+
     tilesize = 256 * scale
     tile, mask = mosaic_tiler(
-        urls.split(","),
+        assets,
         x,
         y,
         z,
-        main.tile,
+        aligned.tile,
         tilesize=tilesize,
         nodata=nodata,
         pixel_selection=pixel_selection,
@@ -735,6 +830,8 @@ def mosaic_tiles_mvt(
 
     band_descriptions = _get_layer_names(urls.split(",")[0])
 
+    from rio_tiler_mvt.mvt import encoder as mvtEncoder
+
     return (
         "OK",
         "application/x-protobuf",
@@ -762,6 +859,8 @@ def mosaic_tiles_mvt(
     payload_compression_method="gzip",
     binary_b64encode=True,
 )
+@prefetch
+@coalesce
 def mosaic_tiles(
     z,
     x,
@@ -831,13 +930,19 @@ def mosaic_tiles(
     if nodata is not None and isinstance(nodata, str):
         nodata = numpy.nan if nodata == "nan" else float(nodata)
 
+    assets = _assets_with_data(urls.split(","), x, y, z, nodata=nodata)
+    if not assets:
+        return ("EMPTY", "text/plain", "empty tiles")
+
+    from rio_tiler_mosaic.mosaic import mosaic_tiler
+
     tilesize = 256 * scale
     tile, mask = mosaic_tiler(
-        urls.split(","),
+        assets,
         x,
         y,
         z,
-        main.tile,
+        aligned.tile,
         indexes=indexes,
         tilesize=tilesize,
         nodata=nodata,
@@ -861,6 +966,98 @@ def mosaic_tiles(
     )
 
 
+@APP.route(
+    "/datasets",
+    methods=["GET"],
+    cors=True,
+    payload_compression_method="gzip",
+    binary_b64encode=True,
+)
+def datasets(bbox=None, datetime=None, limit=None, undated=None):
+    """
+    Handle /datasets requests.
+
+    Note: All the querystring parameters are translated to function keywords
+    and passed as string value by lambda_proxy
+
+    Attributes
+    ----------
+    bbox : str, optional
+        Comma separated WGS84 bounds (e.g "-10,-10,10,10").
+    datetime : str, optional
+        Date, datetime or interval ("start/end", ".." for an open end).
+    limit : str, optional
+        Maximum number of datasets (default: TILER_CATALOG_SEARCH_LIMIT).
+    undated : str, optional
+        "true" to also return the datasets without datetime when `datetime`
+        is set (default: they are excluded).
+
+    Returns
+    -------
+    status : str
+        Status of the request (e.g. OK, NOK).
+    MIME type : str
+        response body MIME type (e.g. application/json).
+    body : str
+        String encoded json list of the catalog datasets (url and metadata)
+        intersecting the bbox and datetime.
+
+    """
+    if catalog.catalog is None:
+        raise TilerError("No dataset catalog configured (TILER_CATALOG)")
+
+    if bbox is not None and isinstance(bbox, str):
+        try:
+            values = tuple(map(float, bbox.split(",")))
+        except ValueError:
+            values = ()
+        if len(values) != 4:
+            raise TilerError(f"Invalid bbox: {bbox}")
+        bbox = values
+
+    start = end = None
+    if datetime:
+        start, end = datetime.split("/", 1) if "/" in datetime else (datetime, datetime)
+        start = None if start == ".." else start
+        end = None if end == ".." else end
+
+    try:
+        limit = int(limit) if limit else catalog.SEARCH_LIMIT
+    except ValueError:
+        raise TilerError(f"Invalid limit: {limit}")
+    if limit < 1:
+        raise TilerError(f"Invalid limit: {limit}")
+    results = catalog.catalog.search(
+        bbox=bbox,
+        start=start,
+        end=end,
+        limit=limit,
+        undated=str(undated).lower() in ("1", "true"),
+    )
+    return ("OK", "application/json", json.dumps({"datasets": results}))
+
+
+@APP.route("/metrics", methods=["GET"], cors=True)
+def metrics_handler():
+    """Return tiler metrics."""
+    return (
+        "OK",
+        "application/json",
+        json.dumps(
+            {
+                "counters": metrics.snapshot(),
+                "coalesce": tile_requests.stats(),
+                "headers": header_cache.stats(),
+                "footprints": footprint_cache.stats(),
+                "catalog": catalog.stats(),
+                "prefetch": tile_prefetcher.stats(),
+                "shared_cache": shmcache.stats(),
+                "admission": admission.stats(),
+            }
+        ),
+    )
+
+
 @APP.route("/favicon.ico", methods=["GET"], cors=True)
 def favicon():
     """Favicon."""
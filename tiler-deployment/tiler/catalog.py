@@ -0,0 +1,292 @@
+"""tiler.catalog: persistent dataset catalog.
+
+The catalog is a SQLite database (`TILER_CATALOG`) holding the metadata of
+each COG (`tiler.headers.dataset_info`: CRS, WGS84 bounds, min/max zoom,
+band names, dtype, nodata, statistics and datetimes), with an R-tree index
+of the bounds. It is filled by `tiler-catalog scan` or by file-to-cog
+(`--catalog`), and lets the tiler:
+
+- list the datasets intersecting a bbox and a time range (`/datasets`),
+- answer `/tilejson.json`, `/mosaic/tilejson.json`, `/metadata` and the
+  vector tile layer names from the stored metadata, without any raster
+  I/O (`dataset_info`). Datasets not in the catalog fall back to the header
+  cache (`tiler.headers`).
+
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import rasterio
+
+from .headers import dataset_info as read_dataset_info
+from .headers import header_cache, normalize_datetime
+from .metrics import metrics
+
+CATALOG_PATH = os.environ.get("TILER_CATALOG")
+
+# Maximum number of datasets returned by a search.
+SEARCH_LIMIT = int(os.environ.get("TILER_CATALOG_SEARCH_LIMIT", 1000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL UNIQUE,
+    crs TEXT,
+    minzoom INTEGER,
+    maxzoom INTEGER,
+    dtype TEXT,
+    datetime TEXT,
+    end_datetime TEXT,
+    info TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS datasets_datetime ON datasets (datetime, end_datetime);
+CREATE VIRTUAL TABLE IF NOT EXISTS datasets_bounds USING rtree (
+    id, minx, maxx, miny, maxy
+);
+"""
+
+
+def _record(row):
+    url, info = row
+    return dict(json.loads(info), url=url)
+
+
+class Catalog(object):
+    """
+    SQLite dataset catalog with an R-tree index of the dataset bounds.
+
+    Usage
+    -----
+    catalog = Catalog("catalog.db")
+    catalog.add("https://host/a.tif")
+    catalog.get("https://host/a.tif")["bounds"]
+    catalog.search(bbox=(-10, -10, 10, 10), start="2019-06-01", end="2019-06-30")
+
+    Attributes
+    ----------
+    path : str
+        Database path (created if needed).
+
+    """
+
+    def __init__(self, path):
+        """Open (or create) the database."""
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def add(self, url, info=None):
+        """
+        Add or update a dataset.
+
+        Attributes
+        ----------
+        url : str
+            Dataset url, as requested to the tiler.
+        info : dict, optional
+            Dataset metadata (default: read from the dataset header, see
+            `tiler.headers.dataset_info`).
+
+        """
+        if info is None:
+            with rasterio.open(url) as src_dst:
+                info = read_dataset_info(src_dst)
+
+        left, bottom, right, top = info["bounds"]
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                # The replaced row gets a new id: drop its bounds first.
+                row = self.db.execute(
+                    "SELECT id FROM datasets WHERE url = ?", (url,)
+                ).fetchone()
+                if row:
+                    self.db.execute("DELETE FROM datasets_bounds WHERE id = ?", row)
+                cursor = self.db.execute(
+                    "INSERT OR REPLACE INTO datasets (url, crs, minzoom, maxzoom, "
+                    "dtype, datetime, end_datetime, info, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        url,
+                        info["crs"],
+                        info["minzoom"],
+                        info["maxzoom"],
+                        info["dtype"],
+                        info.get("datetime"),
+                        info.get("end_datetime"),
+                        json.dumps(info),
+                        time.time(),
+                    ),
+                )
+                dataset_id = cursor.lastrowid
+                self.db.execute(
+                    "INSERT OR REPLACE INTO datasets_bounds VALUES (?, ?, ?, ?, ?)",
+                    (dataset_id, left, right, bottom, top),
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return info
+
+    def scan(self, paths, base_url=None):
+        """
+        Add datasets from files and directories (their .tif files, recursively).
+
+        Attributes
+        ----------
+        paths : sequence
+            Files, directories or urls.
+        base_url : str, optional
+            Url the scanned directories are served from: local files are
+            registered as `base_url/relative/path` (default: their path).
+
+        Returns
+        -------
+        urls : list
+            Added dataset urls.
+
+        """
+        urls = []
+        for path in paths:
+            if os.path.isdir(path):
+                files = sorted(
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(path)
+                    for name in names
+                    if name.lower().endswith((".tif", ".tiff"))
+                )
+                root = path
+            else:
+                files, root = [path], os.path.dirname(path)
+
+            for name in files:
+                url = name
+                if base_url and os.path.exists(name):
+                    relpath = os.path.relpath(name, root).replace(os.sep, "/")
+                    url = f"{base_url.rstrip('/')}/{relpath}"
+                with rasterio.open(name) as src_dst:
+                    self.add(url, read_dataset_info(src_dst))
+                urls.append(url)
+        return urls
+
+    def get(self, url):
+        """Return the metadata of a dataset, or None."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT info FROM datasets WHERE url = ?", (url,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def remove(self, url):
+        """Remove a dataset, return True if it was in the catalog."""
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute(
+                "SELECT id FROM datasets WHERE url = ?", (url,)
+            ).fetchone()
+            if row:
+                self.db.execute("DELETE FROM datasets_bounds WHERE id = ?", row)
+                self.db.execute("DELETE FROM datasets WHERE id = ?", row)
+            self.db.execute("COMMIT")
+        return row is not None
+
+    def search(
+        self, bbox=None, start=None, end=None, limit=SEARCH_LIMIT, undated=False
+    ):
+        """
+        Return the datasets intersecting a bbox and a time range.
+
+        Attributes
+        ----------
+        bbox : sequence, optional
+            WGS84 (left, bottom, right, top).
+        start, end : str, optional
+            Time range bounds (ISO dates or datetimes, inclusive). Datasets
+            without datetime are excluded when set, unless `undated` is set.
+        limit : int, optional
+            Maximum number of datasets (default: SEARCH_LIMIT).
+        undated : bool, optional
+            Also return the datasets without datetime when a time range is
+            set (default: False).
+
+        Returns
+        -------
+        datasets : list
+            Dataset metadata (with their url), ordered by datetime then url.
+
+        """
+        query = "SELECT d.url, d.info FROM datasets AS d"
+        where, params = [], []
+        if bbox is not None:
+            left, bottom, right, top = bbox
+            query += " JOIN datasets_bounds AS b ON b.id = d.id"
+            where.append("b.minx <= ? AND b.maxx >= ? AND b.miny <= ? AND b.maxy >= ?")
+            params += [right, left, top, bottom]
+        times = []
+        if start:
+            times.append("d.end_datetime >= ?")
+            params.append(normalize_datetime(start))
+        if end:
+            times.append("d.datetime <= ?")
+            params.append(normalize_datetime(end, end=True))
+        if times and undated:
+            where.append(f"(d.datetime IS NULL OR ({' AND '.join(times)}))")
+        else:
+            where += times
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY d.datetime, d.url LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [_record(row) for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM datasets").fetchone()[0]
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+
+catalog = Catalog(CATALOG_PATH) if CATALOG_PATH else None
+
+
+def dataset_info(url):
+    """
+    Return the metadata of a dataset from the catalog, or the header cache.
+
+    See `tiler.headers.dataset_info`.
+
+    """
+    if catalog is not None:
+        info = catalog.get(url)
+        if info is not None:
+            metrics.incr("catalog.hits")
+            return info
+        metrics.incr("catalog.misses")
+    return header_cache.info(url)
+
+
+def stats():
+    """Return catalog statistics (None if no catalog is configured)."""
+    if catalog is None:
+        return None
+    return {
+        "path": catalog.path,
+        "datasets": len(catalog),
+        "hits": metrics.get("catalog.hits"),
+        "misses": metrics.get("catalog.misses"),
+    }
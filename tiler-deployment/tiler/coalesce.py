@@ -0,0 +1,132 @@
+"""tiler.coalesce: single-flight execution of identical concurrent requests."""
+
+import os
+import inspect
+import threading
+from functools import wraps
+
+from .metrics import metrics
+
+
+class CoalesceTimeout(Exception):
+    """Waited too long for an in-flight request."""
+
+
+class _Call(object):
+    """In-flight call."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Run only one call per key at a time, other callers share its result.
+
+    Attributes
+    ----------
+    timeout : float, optional
+        Maximum time (in seconds) a caller waits for an in-flight call
+        before raising `CoalesceTimeout` (default: None, wait forever).
+    name : str, optional
+        Prefix for the metrics counters (default: "coalesce").
+
+    """
+
+    def __init__(self, timeout=None, name="coalesce"):
+        """Initialize group."""
+        self.timeout = timeout
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Execute `func(*args, **kwargs)` or wait for the in-flight call on `key`.
+
+        Exceptions raised by the in-flight call are raised to every caller.
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        metrics.incr(f"{self.name}.requests")
+        if not leader:
+            metrics.incr(f"{self.name}.coalesced")
+            if not call.event.wait(self.timeout):
+                metrics.incr(f"{self.name}.timeouts")
+                raise CoalesceTimeout(
+                    f"Timed out after {self.timeout}s waiting for in-flight request"
+                )
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as err:
+            call.error = err
+            metrics.incr(f"{self.name}.errors")
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    def stats(self):
+        """Return coalescing statistics."""
+        return {
+            "requests": metrics.get(f"{self.name}.requests"),
+            "coalesced": metrics.get(f"{self.name}.coalesced"),
+            "timeouts": metrics.get(f"{self.name}.timeouts"),
+            "errors": metrics.get(f"{self.name}.errors"),
+            "rate": metrics.ratio(f"{self.name}.coalesced", f"{self.name}.requests"),
+        }
+
+
+tile_requests = SingleFlight(
+    timeout=float(os.environ.get("TILER_COALESCE_TIMEOUT", 10))
+)
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v)) for k, v in value.items()))
+    return str(value).strip()
+
+
+def request_arguments(func, *args, **kwargs):
+    """Return the arguments of a call by name, with their default values."""
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return dict(bound.arguments)
+
+
+def request_key(func, *args, **kwargs):
+    """Return a normalized key from the function name and its arguments."""
+    arguments = request_arguments(func, *args, **kwargs)
+    return (func.__name__,) + tuple(
+        sorted((k, _normalize(v)) for k, v in arguments.items())
+    )
+
+
+def coalesce(func):
+    """Decorator: coalesce concurrent calls with identical arguments."""
+
+    @wraps(func)
+    def new_func(*args, **kwargs):
+        try:
+            key = request_key(func, *args, **kwargs)
+        except TypeError:
+            # Let the function raise its own error for invalid arguments.
+            return func(*args, **kwargs)
+        return tile_requests.do(key, func, *args, **kwargs)
+
+    return new_func
@@ -0,0 +1,194 @@
+"""tiler.footprint: reject tiles without valid data before reading pixels.
+
+A `Footprint` is built once per dataset from its bounds and a low resolution
+valid data mask, read from the dataset lowest overview levels and stored in
+web mercator. It answers "does tile z/x/y contain any valid data?" with a
+bounds comparison and a lookup in a small boolean array.
+
+"""
+
+import os
+import math
+
+import numpy
+
+import mercantile
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import reproject, transform_bounds
+
+from .cache import LRUCache
+from .coalesce import SingleFlight
+from .metrics import metrics
+
+# Maximum size (in pixels) of the mask longest side.
+MASK_SIZE = int(os.environ.get("TILER_FOOTPRINT_MASK_SIZE", 512))
+
+# Web mercator latitude limit.
+MAX_LAT = 85.0511287798066
+
+
+def footprint_enabled():
+    """Check if empty tiles rejection is enabled (`TILER_FOOTPRINT_INDEX`)."""
+    value = os.environ.get("TILER_FOOTPRINT_INDEX", "TRUE")
+    return value.upper() in ("1", "TRUE", "YES", "ON")
+
+
+class Footprint(object):
+    """
+    Dataset valid data index.
+
+    Attributes
+    ----------
+    bounds : tuple
+        Dataset bounds in geographic coordinates (left, bottom, right, top).
+    transform : affine.Affine
+        Mask geotransform, in web mercator.
+    mask : numpy ndarray
+        Boolean (h, w) array, True where the dataset has valid data.
+
+    """
+
+    def __init__(self, bounds, transform, mask):
+        """Initialize index."""
+        self.bounds = bounds
+        self.transform = transform
+        self.inverse = ~transform
+        self.mask = mask
+
+    @classmethod
+    def from_dataset(cls, src_dst, nodata=None, max_size=MASK_SIZE):
+        """
+        Build the index from an opened dataset.
+
+        The valid data mask is read from the lowest overview level matching
+        `max_size`, reprojected to web mercator (keeping any valid pixel)
+        then grown by one pixel, so partially valid areas are kept.
+
+        Attributes
+        ----------
+        src_dst : rasterio.io.DatasetReader
+            Opened dataset.
+        nodata : int or float, optional
+            Custom nodata value (default: use the dataset mask).
+        max_size : int, optional
+            Maximum size of the mask longest side (default: 512).
+
+        Returns
+        -------
+        footprint : Footprint
+
+        """
+        ratio = min(max_size / max(src_dst.width, src_dst.height), 1)
+        height = max(int(round(src_dst.height * ratio)), 1)
+        width = max(int(round(src_dst.width * ratio)), 1)
+
+        if nodata is not None:
+            # A pixel is valid where any band is valid: averaging the mask
+            # keeps sparse valid pixels.
+            with WarpedVRT(src_dst, src_nodata=nodata, nodata=nodata) as vrt:
+                mask = vrt.dataset_mask(
+                    out_shape=(height, width), resampling=Resampling.average
+                ) > 0
+        else:
+            mask = src_dst.dataset_mask(
+                out_shape=(height, width), resampling=Resampling.average
+            ) > 0
+
+        src_transform = src_dst.transform * src_dst.transform.scale(
+            src_dst.width / width, src_dst.height / height
+        )
+
+        bounds = transform_bounds(
+            src_dst.crs, "epsg:4326", *src_dst.bounds, densify_pts=21
+        )
+        west, south, east, north = bounds
+        left, bottom = mercantile.xy(west, max(south, -MAX_LAT))
+        right, top = mercantile.xy(east, min(north, MAX_LAT))
+        res = max(right - left, top - bottom) / max(height, width)
+        dst_shape = (
+            max(int(numpy.ceil((top - bottom) / res)), 1),
+            max(int(numpy.ceil((right - left) / res)), 1),
+        )
+        transform = from_origin(left, top, res, res)
+
+        merc_mask = numpy.zeros(dst_shape, dtype=numpy.uint8)
+        reproject(
+            mask.astype(numpy.uint8),
+            merc_mask,
+            src_transform=src_transform,
+            src_crs=src_dst.crs,
+            dst_transform=transform,
+            dst_crs="epsg:3857",
+            resampling=Resampling.max,
+        )
+        merc_mask = merc_mask > 0
+
+        grown = merc_mask.copy()
+        grown[1:] |= merc_mask[:-1]
+        grown[:-1] |= merc_mask[1:]
+        grown[:, 1:] |= merc_mask[:, :-1]
+        grown[:, :-1] |= merc_mask[:, 1:]
+        return cls(bounds, transform, grown)
+
+    def tile_has_data(self, tile_x, tile_y, tile_z):
+        """Check if mercator tile z/x/y contains any valid data."""
+        tile = mercantile.Tile(x=tile_x, y=tile_y, z=tile_z)
+
+        west, south, east, north = mercantile.bounds(tile)
+        left, bottom, right, top = self.bounds
+        if west >= right or east <= left or south >= top or north <= bottom:
+            return False
+
+        xmin, ymin, xmax, ymax = mercantile.xy_bounds(tile)
+        col_min, row_min = self.inverse * (xmin, ymax)
+        col_max, row_max = self.inverse * (xmax, ymin)
+        row_min = max(int(math.floor(row_min)), 0)
+        row_max = min(int(math.ceil(row_max)), self.mask.shape[0])
+        col_min = max(int(math.floor(col_min)), 0)
+        col_max = min(int(math.ceil(col_max)), self.mask.shape[1])
+        if row_min >= row_max or col_min >= col_max:
+            return False
+
+        return bool(self.mask[row_min:row_max, col_min:col_max].any())
+
+
+footprint_cache = LRUCache(int(os.environ.get("TILER_FOOTPRINT_CACHE_SIZE", 512)))
+
+_builds = SingleFlight(name="footprint.builds")
+
+
+def _build(address, nodata):
+    with rasterio.open(address) as src_dst:
+        footprint = Footprint.from_dataset(src_dst, nodata=nodata)
+    footprint_cache.set((address, nodata), footprint)
+    return footprint
+
+
+def get_footprint(address, nodata=None):
+    """Return the cached `Footprint` of a dataset, building it if needed."""
+    key = (address, nodata)
+    footprint = footprint_cache.get(key)
+    if footprint is None:
+        footprint = _builds.do(key, _build, address, nodata)
+    return footprint
+
+
+def tile_has_data(address, tile_x, tile_y, tile_z, nodata=None):
+    """
+    Check if mercator tile z/x/y of a dataset contains any valid data.
+
+    Always True when `TILER_FOOTPRINT_INDEX` is disabled.
+
+    """
+    if not footprint_enabled():
+        return True
+
+    metrics.incr("footprint.checks")
+    if get_footprint(address, nodata).tile_has_data(tile_x, tile_y, tile_z):
+        return True
+
+    metrics.incr("footprint.rejected")
+    return False
@@ -0,0 +1,292 @@
+"""tiler.headers: prefetch and cache remote COG headers.
+
+For a Cloud Optimized GeoTIFF, the header and every IFD (full resolution and
+overviews) are stored at the beginning of the file. A single range request of
+the first `TILER_HEADER_SIZE` bytes is then enough to read the dataset
+metadata (bounds, zooms, band names, ...) without opening the remote file
+with GDAL, which needs a HEAD request then one or more range requests.
+
+Headers are cached by url and validated against the server `ETag` once their
+`TILER_HEADER_CACHE_TTL` has expired (conditional range request). Local files
+are validated on every lookup against their modification time and size.
+
+Only the metadata routes (tilejson, metadata, mosaic tilejson) use the cache:
+tile reads still open the files through GDAL.
+
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import urllib.request
+from urllib.error import HTTPError
+from concurrent import futures
+
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.warp import transform_bounds
+
+from rio_tiler.mercator import get_zooms
+
+from .cache import LRUCache
+from .coalesce import SingleFlight
+from .iostats import IOAccounting
+from .metrics import metrics
+from .statistics import band_statistics
+
+logger = logging.getLogger(__name__)
+
+HEADER_SIZE = int(os.environ.get("TILER_HEADER_SIZE", 65536))
+
+content_range_expr = re.compile(r"bytes \d+-\d+/(\d+)")
+
+datetime_expr = re.compile(
+    r"(\d{4})[-:]?(\d{2})[-:]?(\d{2})(?:[T ]?(\d{2}):?(\d{2})(?::?(\d{2}))?)?"
+)
+
+
+def normalize_datetime(value, end=False):
+    """
+    Return a date or datetime as a UTC ISO string (YYYY-MM-DDTHH:MM:SSZ).
+
+    Dates without time are the start of the day, or its end with `end`.
+    Returns None for values without a date.
+
+    """
+    match = datetime_expr.search(value or "")
+    if not match:
+        return None
+    year, month, day, hour, minute, second = match.groups()
+    if hour is None:
+        hour, minute, second = ("23", "59", "59") if end else ("00", "00", "00")
+    return f"{year}-{month}-{day}T{hour}:{minute}:{second or '00'}Z"
+
+
+def dataset_times(src_dst):
+    """
+    Return the (start, end) datetimes of a dataset, or (None, None).
+
+    From the band dates of file-to-cog time series (DATES), the NetCDF
+    `time_coverage_start`/`time_coverage_end` attributes or TIFFTAG_DATETIME.
+
+    """
+    tags = src_dst.tags()
+    if tags.get("DATES"):
+        dates = sorted(json.loads(tags["DATES"]))
+        if dates:
+            return normalize_datetime(dates[0]), normalize_datetime(dates[-1], end=True)
+
+    start = tags.get("NC_GLOBAL#time_coverage_start") or tags.get("TIFFTAG_DATETIME")
+    if start:
+        end = tags.get("NC_GLOBAL#time_coverage_end")
+        start = normalize_datetime(start)
+        return start, normalize_datetime(end, end=True) if end else start
+    return None, None
+
+
+def dataset_info(src_dst):
+    """
+    Return the metadata needed by the tilejson and mosaic routes.
+
+    Attributes
+    ----------
+    src_dst : rasterio.io.DatasetReader
+        Opened dataset.
+
+    Returns
+    -------
+    info : dict
+
+    """
+    bounds = transform_bounds(
+        *[src_dst.crs, "epsg:4326"] + list(src_dst.bounds), densify_pts=21
+    )
+    minzoom, maxzoom = get_zooms(src_dst)
+    start, end = dataset_times(src_dst)
+    return {
+        "bounds": list(bounds),
+        "minzoom": minzoom,
+        "maxzoom": maxzoom,
+        "crs": src_dst.crs.to_string() if src_dst.crs else None,
+        "count": src_dst.count,
+        "width": src_dst.width,
+        "height": src_dst.height,
+        "dtype": src_dst.dtypes[0],
+        "nodata": src_dst.nodata,
+        "overviews": src_dst.overviews(1),
+        "band_names": [
+            src_dst.descriptions[ix - 1] or f"band{ix}" for ix in src_dst.indexes
+        ],
+        "statistics": band_statistics(src_dst),
+        "datetime": start,
+        "end_datetime": end,
+    }
+
+
+class HeaderCache(object):
+    """
+    Bounded cache of remote dataset headers and their parsed metadata.
+
+    Remote entries are keyed on the server ETag, local ones on the file
+    (st_mtime_ns, st_size). The cached bytes are only parsed for metadata,
+    they are not used by the tile reads.
+
+    Usage
+    -----
+    headers = HeaderCache()
+    headers.prefetch(["https://host/a.tif", "https://host/b.tif"])
+    headers.info("https://host/a.tif")["bounds"]
+
+    Attributes
+    ----------
+    maxsize : int, optional
+        Maximum number of datasets to keep (default: 512).
+    ttl : float, optional
+        Time (in seconds) during which a cached header is used without
+        checking its ETag (default: 300).
+    size : int, optional
+        Number of bytes fetched at the start of each file (default: 65536).
+
+    """
+
+    def __init__(self, maxsize=512, ttl=300, size=HEADER_SIZE):
+        """Initialize cache."""
+        self.ttl = ttl
+        self.size = size
+        self.cache = LRUCache(maxsize)
+        self._flight = SingleFlight(name="headers")
+
+    def _fetch(self, url, etag=None):
+        """
+        Fetch the first bytes of `url`, conditionally on `etag`.
+
+        Returns `None` if not modified, else a (data, etag, filesize) tuple.
+
+        """
+        req = urllib.request.Request(url, headers={"Range": f"bytes=0-{self.size - 1}"})
+        if etag:
+            req.add_header("If-None-Match", etag)
+
+        try:
+            with urllib.request.urlopen(req) as resp:
+                data = resp.read()
+                headers = resp.headers
+        except HTTPError as err:
+            if err.code == 304:
+                IOAccounting.record_request()
+                metrics.incr("headers.not_modified")
+                return None
+            raise
+
+        IOAccounting.record_request([(0, len(data) - 1)])
+        metrics.incr("headers.fetches")
+        metrics.incr("headers.bytes", len(data))
+
+        match = content_range_expr.match(headers.get("Content-Range", ""))
+        filesize = int(match.group(1)) if match else len(data)
+        return data, headers.get("ETag"), filesize
+
+    def _load_local(self, url, entry):
+        try:
+            stat = os.stat(url)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            # GDAL paths (e.g s3:// or /vsi*/): only the TTL applies.
+            version = None
+
+        if entry is not None and entry["etag"] == version:
+            if version is not None or time.time() - entry["time"] < self.ttl:
+                return entry
+
+        with rasterio.open(url) as src_dst:
+            info = dataset_info(src_dst)
+        filesize = version[1] if version else None
+        entry = {"etag": version, "filesize": filesize, "info": info}
+        entry["time"] = time.time()
+        self.cache.set(url, entry)
+        return entry
+
+    def _load(self, url):
+        entry = self.cache.get(url)
+        if not url.startswith(("http://", "https://")):
+            return self._load_local(url, entry)
+
+        if entry is not None and time.time() - entry["time"] < self.ttl:
+            return entry
+
+        result = self._fetch(url, entry["etag"] if entry else None)
+        if result is None:
+            entry = dict(entry, time=time.time())
+            self.cache.set(url, entry)
+            return entry
+
+        data, etag, filesize = result
+        try:
+            with MemoryFile(data) as mem, mem.open() as src_dst:
+                info = dataset_info(src_dst)
+        except rasterio.errors.RasterioIOError:
+            # IFDs not in the first bytes (not a COG), let GDAL open the file.
+            metrics.incr("headers.fallbacks")
+            with rasterio.open(url) as src_dst:
+                info = dataset_info(src_dst)
+
+        entry = {"etag": etag, "filesize": filesize, "info": info, "time": time.time()}
+        self.cache.set(url, entry)
+        return entry
+
+    def info(self, url):
+        """Return dataset metadata (see `dataset_info`) from the cache."""
+        return self._flight.do(url, self._load, url)["info"]
+
+    def prefetch(self, urls, max_workers=None):
+        """
+        Fetch and cache the headers of `urls`, in parallel.
+
+        Returns the number of urls which failed.
+
+        """
+
+        def _prefetch(url):
+            try:
+                self.info(url)
+            except Exception as err:
+                logger.warning(f"Could not prefetch {url} header: {err}")
+                return False
+            return True
+
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_prefetch, urls)).count(False)
+
+    def clear(self):
+        """Remove all cached headers."""
+        self.cache.clear()
+
+    def stats(self):
+        """Return cache statistics."""
+        stats = self.cache.stats()
+        for key in ("fetches", "not_modified", "fallbacks", "bytes"):
+            stats[key] = metrics.get(f"headers.{key}")
+        return stats
+
+
+def prefetch_urls():
+    """
+    Return urls to prefetch at startup from `TILER_PREFETCH_URLS`.
+
+    The variable is either a comma separated list of urls or the path of
+    a file listing one url per line.
+
+    """
+    value = os.environ.get("TILER_PREFETCH_URLS", "").strip()
+    if value and os.path.isfile(value):
+        with open(value) as f:
+            return [line.strip() for line in f if line.strip()]
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
+header_cache = HeaderCache(
+    maxsize=int(os.environ.get("TILER_HEADER_CACHE_SIZE", 512)),
+    ttl=float(os.environ.get("TILER_HEADER_CACHE_TTL", 300)),
+)
@@ -0,0 +1,191 @@
+"""tiler.iostats: count GDAL range requests and bytes fetched.
+
+GDAL's network file systems (/vsicurl/, /vsis3/, ...) log every request
+when `CPL_DEBUG` is on, e.g:
+
+    VSICURL: GetFileSize(http://host/file.tif)=1045327  response_code=200
+    VSICURL: Downloading 0-16383 (http://host/file.tif)...
+    VSICURL: GetFileList(/vsicurl/http://host)
+    S3: Downloading 311296-376831,442368-507903 (https://bucket.s3...)...
+
+`IOAccounting` turns GDAL debug messages on while active and parses them
+from the `rasterio._env` logger.
+
+"""
+
+import os
+import re
+import logging
+import threading
+
+from rasterio._env import del_gdal_config
+from rasterio.env import get_gdal_config, set_gdal_config
+
+from .metrics import metrics
+
+# Ranges starting in the first bytes of a file are counted as header (IFD)
+# fetches. Default to GDAL_INGESTED_BYTES_AT_OPEN default value.
+HEADER_SIZE = int(os.environ.get("TILER_IO_HEADER_SIZE", 16384))
+
+download_expr = re.compile(r"Downloading ([\d\-,]+) \((.+?)\)")
+filesize_expr = re.compile(r"GetFileSize\((.+?)\)")
+filelist_expr = re.compile(r"GetFileList\((.+?)\)")
+
+IO_HEADERS = {
+    "requests": "X-IO-Requests",
+    "bytes": "X-IO-Bytes",
+    "header_requests": "X-IO-Header-Requests",
+    "data_requests": "X-IO-Data-Requests",
+    "head_requests": "X-IO-Head-Requests",
+    "list_requests": "X-IO-List-Requests",
+}
+
+
+def accounting_enabled():
+    """Check if I/O accounting is enabled (`TILER_IO_ACCOUNTING`)."""
+    value = os.environ.get("TILER_IO_ACCOUNTING", "")
+    return value.upper() in ("1", "TRUE", "YES", "ON")
+
+
+def parse_ranges(ranges):
+    """Parse GDAL "start-end[,start-end]" ranges string."""
+    out = []
+    for r in ranges.split(","):
+        start, end = r.split("-")
+        out.append((int(start), int(end)))
+    return out
+
+
+class IOAccounting(object):
+    """
+    Count HTTP requests and bytes done by GDAL while active.
+
+    When several accountants are active at the same time (e.g threaded
+    server), requests are attributed to the accountant started in the
+    logging thread. When only one is active, requests done in any thread
+    (e.g rio-tiler-mosaic thread pool) are attributed to it.
+
+    Usage
+    -----
+    with IOAccounting() as io:
+        main.tile(...)
+    io.stats
+
+    """
+
+    _active = []
+    _lock = threading.Lock()
+    _filter = None
+    _gdal_debug = None
+    _log_level = None
+
+    def __init__(self):
+        """Initialize counters."""
+        self.thread = threading.get_ident()
+        self.stats = dict.fromkeys(IO_HEADERS, 0)
+
+    def __enter__(self):
+        cls = type(self)
+        with cls._lock:
+            if not cls._active:
+                cls._install()
+            cls._active.append(self)
+        return self
+
+    def __exit__(self, *args):
+        cls = type(self)
+        with cls._lock:
+            cls._active.remove(self)
+            if not cls._active:
+                cls._uninstall()
+
+    def headers(self):
+        """Return stats as HTTP response headers."""
+        return {name: str(self.stats[key]) for key, name in IO_HEADERS.items()}
+
+    def record(self, message):
+        """Parse a GDAL debug message."""
+        match = download_expr.search(message)
+        if match:
+            self.add_request(parse_ranges(match.group(1)))
+        elif filesize_expr.search(message):
+            self.add_request()
+        elif filelist_expr.search(message):
+            self.stats["requests"] += 1
+            self.stats["list_requests"] += 1
+
+    def add_request(self, ranges=None):
+        """Count a request, with its byte ranges or without body (HEAD, 304)."""
+        self.stats["requests"] += 1
+        if not ranges:
+            self.stats["head_requests"] += 1
+            return
+
+        self.stats["bytes"] += sum(end - start + 1 for start, end in ranges)
+        if ranges[0][0] < HEADER_SIZE:
+            self.stats["header_requests"] += 1
+        else:
+            self.stats["data_requests"] += 1
+
+    @classmethod
+    def _targets(cls):
+        if len(cls._active) == 1:
+            return cls._active
+        thread = threading.get_ident()
+        return [a for a in cls._active if a.thread == thread]
+
+    @classmethod
+    def record_request(cls, ranges=None):
+        """Count a request done outside of GDAL (e.g. header prefetch)."""
+        with cls._lock:
+            for accountant in cls._targets():
+                accountant.add_request(ranges)
+
+    @classmethod
+    def _dispatch(cls, record):
+        message = record.getMessage()
+        if not any(k in message for k in ("Downloading", "GetFile")):
+            return
+
+        with cls._lock:
+            for accountant in cls._targets():
+                accountant.record(message)
+
+    @classmethod
+    def _install(cls):
+        log = logging.getLogger("rasterio._env")
+        level = log.getEffectiveLevel()
+
+        class _Filter(logging.Filter):
+            def filter(self, record):
+                if record.levelno == logging.DEBUG:
+                    cls._dispatch(record)
+                # Keep debug messages hidden unless they were enabled.
+                return record.levelno >= level
+
+        cls._log_level = log.level
+        cls._filter = _Filter()
+        log.addFilter(cls._filter)
+        log.setLevel(logging.DEBUG)
+
+        cls._gdal_debug = get_gdal_config("CPL_DEBUG")
+        set_gdal_config("CPL_DEBUG", "ON")
+
+    @classmethod
+    def _uninstall(cls):
+        log = logging.getLogger("rasterio._env")
+        log.removeFilter(cls._filter)
+        log.setLevel(cls._log_level)
+        if cls._gdal_debug is None:
+            # set_gdal_config would set it to "None".
+            del_gdal_config("CPL_DEBUG")
+        else:
+            set_gdal_config("CPL_DEBUG", cls._gdal_debug)
+
+
+def record_metrics(route, stats):
+    """Add request I/O stats to the global metrics."""
+    metrics.incr("io.instrumented_requests")
+    for key, value in stats.items():
+        metrics.incr(f"io.{key}", value)
+        metrics.incr(f"io.{route}.{key}", value)
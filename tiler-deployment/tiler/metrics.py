@@ -0,0 +1,42 @@
+"""tiler.metrics: in-process counters."""
+
+import threading
+from collections import defaultdict
+
+
+class Metrics(object):
+    """Thread-safe registry of named counters."""
+
+    def __init__(self):
+        """Initialize registry."""
+        self._counters = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        """Increment counter `name` by `value`."""
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name):
+        """Return counter value."""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def ratio(self, numerator, denominator):
+        """Return the ratio of two counters (0 if denominator is empty)."""
+        with self._lock:
+            total = self._counters.get(denominator, 0)
+            return self._counters.get(numerator, 0) / total if total else 0.0
+
+    def snapshot(self):
+        """Return a copy of all counters."""
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        """Reset all counters."""
+        with self._lock:
+            self._counters.clear()
+
+
+metrics = Metrics()
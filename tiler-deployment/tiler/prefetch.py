@@ -0,0 +1,274 @@
+"""tiler.prefetch: speculative prefetch of neighbor and child tiles.
+
+Map clients pan and zoom: after z/x/y, the next requests are mostly its four
+neighbors and its four children. With `TILER_PREFETCH=TRUE`, tile responses
+(`/tiles` and `/mosaic`) are kept in a response cache
+(`TILER_TILE_CACHE_SIZE` tiles) and, after serving a tile, the renders of its
+neighbors and children (within the datasets bounds and max zoom) are queued
+at low priority:
+
+- speculative renders run in `TILER_PREFETCH_WORKERS` background threads,
+  only while fewer than `TILER_PREFETCH_MAX_ACTIVE` requests are rendered
+  (default: number of CPUs); queued work is dropped as soon as more
+  requests than that are rendered at once,
+- the queue holds at most `TILER_PREFETCH_QUEUE_SIZE` renders, the most
+  recent requests first: older ones are dropped,
+- speculative renders are coalesced with identical requests
+  (`tiler.coalesce`), so a tile requested while it is prefetched is
+  rendered once.
+
+`/metrics` reports the tile cache hit rate, and the prefetched tiles that
+were requested afterwards (`hits`) against the ones rendered (`useful_rate`).
+
+Background threads only run while the process does: prefetch is meant for
+the long running server (`tiler`), not for AWS Lambda.
+
+"""
+
+import os
+import heapq
+import itertools
+import threading
+from functools import wraps
+
+import mercantile
+
+from . import catalog
+from .cache import LRUCache
+from .coalesce import request_arguments, request_key
+from .metrics import metrics
+
+PREFETCH = os.environ.get("TILER_PREFETCH", "FALSE").upper() == "TRUE"
+TILE_CACHE_SIZE = int(os.environ.get("TILER_TILE_CACHE_SIZE", 512))
+PREFETCH_WORKERS = int(os.environ.get("TILER_PREFETCH_WORKERS", 1))
+PREFETCH_QUEUE_SIZE = int(os.environ.get("TILER_PREFETCH_QUEUE_SIZE", 256))
+PREFETCH_MAX_ACTIVE = int(
+    os.environ.get("TILER_PREFETCH_MAX_ACTIVE", os.cpu_count() or 1)
+)
+
+# Response status kept in the tile cache.
+CACHED_STATUS = ("OK", "EMPTY")
+
+
+def tile_neighbors(x, y, z):
+    """Return the (x, y, z) edge neighbors of a tile."""
+    size = 2 ** z
+    return [
+        (nx, ny, z)
+        for nx, ny in ((x, y - 1), (x + 1, y), (x, y + 1), (x - 1, y))
+        if 0 <= nx < size and 0 <= ny < size
+    ]
+
+
+def tile_children(x, y, z):
+    """Return the (x, y, z) children of a tile."""
+    return [
+        (2 * x + dx, 2 * y + dy, z + 1) for dy in (0, 1) for dx in (0, 1)
+    ]
+
+
+def _datasets_info(arguments):
+    urls = arguments.get("url") or arguments.get("urls") or ""
+    return [catalog.dataset_info(url) for url in str(urls).split(",") if url]
+
+
+def _intersects(bounds, tile):
+    left, bottom, right, top = mercantile.bounds(mercantile.Tile(*tile))
+    return (
+        left < bounds[2] and right > bounds[0] and bottom < bounds[3] and top > bounds[1]
+    )
+
+
+class Prefetcher(object):
+    """
+    Tile response cache with speculative rendering of the next tiles.
+
+    Usage
+    -----
+    prefetcher = Prefetcher(LRUCache(512))
+    response = prefetcher.serve(tiles, z=12, x=2180, y=2049, url=url)
+    prefetcher.join()   # wait for the speculative renders
+
+    Attributes
+    ----------
+    cache : tiler.cache.LRUCache
+        Tile responses, by request key (see `tiler.coalesce.request_key`).
+    workers : int, optional
+        Speculative render threads (default: PREFETCH_WORKERS).
+    queue_size : int, optional
+        Maximum number of queued renders (default: PREFETCH_QUEUE_SIZE).
+    max_active : int, optional
+        Requests rendered at once from which speculative renders wait, and
+        above which they are dropped (default: PREFETCH_MAX_ACTIVE).
+    enabled : bool, optional
+        Default: TILER_PREFETCH.
+
+    """
+
+    def __init__(
+        self,
+        cache,
+        workers=PREFETCH_WORKERS,
+        queue_size=PREFETCH_QUEUE_SIZE,
+        max_active=PREFETCH_MAX_ACTIVE,
+        enabled=PREFETCH,
+    ):
+        """Initialize prefetcher, threads start with the first render queued."""
+        self.cache = cache
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_active = max_active
+        self.enabled = enabled
+        self.active = 0
+        self._jobs = []
+        self._queued = set()
+        self._running = 0
+        self._batches = itertools.count()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def serve(self, func, *args, **kwargs):
+        """Return the cached response of `func(*args, **kwargs)`, or render it."""
+        try:
+            key = request_key(func, *args, **kwargs)
+        except TypeError:
+            return func(*args, **kwargs)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            response, speculative = entry
+            if speculative:
+                metrics.incr("prefetch.hits")
+                self.cache.set(key, (response, False))
+        else:
+            with self._cond:
+                self.active += 1
+                if self.active > self.max_active:
+                    self._drop()
+            try:
+                response = func(*args, **kwargs)
+            finally:
+                with self._cond:
+                    self.active -= 1
+                    self._cond.notify_all()
+            if response[0] in CACHED_STATUS:
+                self.cache.set(key, (response, False))
+
+        self.schedule(func, *args, **kwargs)
+        return response
+
+    def schedule(self, func, *args, **kwargs):
+        """Queue the renders of the neighbors and children of a tile request."""
+        arguments = request_arguments(func, *args, **kwargs)
+        x, y, z = int(arguments["x"]), int(arguments["y"]), int(arguments["z"])
+        try:
+            infos = _datasets_info(arguments)
+        except Exception:
+            return
+        maxzoom = max((info["maxzoom"] for info in infos), default=z)
+
+        candidates = [(0, tile) for tile in tile_neighbors(x, y, z)]
+        if z < maxzoom:
+            candidates += [(1, tile) for tile in tile_children(x, y, z)]
+
+        batch = -next(self._batches)
+        with self._cond:
+            for priority, tile in candidates:
+                if not any(_intersects(info["bounds"], tile) for info in infos):
+                    continue
+                job_kwargs = dict(arguments, x=tile[0], y=tile[1], z=tile[2])
+                key = request_key(func, **job_kwargs)
+                if key in self._queued or key in self.cache:
+                    continue
+                heapq.heappush(
+                    self._jobs, (batch, priority, next(self._seq), key, func, job_kwargs)
+                )
+                self._queued.add(key)
+                metrics.incr("prefetch.queued")
+
+            while len(self._jobs) > self.queue_size:
+                # Oldest request first (largest batch key).
+                oldest = max(self._jobs)
+                self._jobs.remove(oldest)
+                self._queued.discard(oldest[3])
+                metrics.incr("prefetch.dropped")
+            heapq.heapify(self._jobs)
+
+            self._start()
+            self._cond.notify_all()
+
+    def _drop(self):
+        """Drop the queued renders (lock held)."""
+        metrics.incr("prefetch.dropped", len(self._jobs))
+        self._jobs.clear()
+        self._queued.clear()
+        self._cond.notify_all()
+
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                # Idle capacity only.
+                self._cond.wait_for(
+                    lambda: self._jobs and self.active < self.max_active
+                )
+                _, _, _, key, func, kwargs = heapq.heappop(self._jobs)
+                self._queued.discard(key)
+                self._running += 1
+
+            try:
+                if key not in self.cache:
+                    response = func(**kwargs)
+                    metrics.incr("prefetch.rendered")
+                    if response[0] in CACHED_STATUS:
+                        self.cache.set(key, (response, True))
+            except Exception:
+                metrics.incr("prefetch.errors")
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Wait until no render is queued or running, return False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._jobs and not self._running, timeout
+            )
+
+    def stats(self):
+        """Return prefetch and tile cache statistics."""
+        with self._cond:
+            queued = len(self._jobs)
+        return {
+            "enabled": self.enabled,
+            "queue": queued,
+            "queued": metrics.get("prefetch.queued"),
+            "rendered": metrics.get("prefetch.rendered"),
+            "dropped": metrics.get("prefetch.dropped"),
+            "errors": metrics.get("prefetch.errors"),
+            "hits": metrics.get("prefetch.hits"),
+            "useful_rate": metrics.ratio("prefetch.hits", "prefetch.rendered"),
+            "cache": self.cache.stats(),
+        }
+
+
+tile_prefetcher = Prefetcher(LRUCache(TILE_CACHE_SIZE))
+
+
+def prefetch(func):
+    """Decorator: serve tiles from the tile cache and prefetch the next ones."""
+
+    @wraps(func)
+    def new_func(*args, **kwargs):
+        if not tile_prefetcher.enabled:
+            return func(*args, **kwargs)
+        return tile_prefetcher.serve(func, *args, **kwargs)
+
+    return new_func
@@ -0,0 +1,293 @@
+"""tiler.rangeserver: local HTTP server supporting byte range requests.
+
+GDAL can hold the GIL while doing HTTP requests (e.g. directory listing on
+open), so the server must run in a separate process from the code reading
+datasets, see `RangeServerProcess`.
+
+"""
+
+import os
+import re
+import sys
+import json
+import threading
+import subprocess
+import urllib.request
+from collections import defaultdict
+from functools import partial
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+range_expr = re.compile(r"(\d*)-(\d*)")
+
+STATS_KEYS = ("requests", "head", "missing", "not_modified", "ranges", "bytes")
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with `Range` and `If-None-Match` support."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Silence request logging."""
+
+    def _parse_ranges(self, header, size):
+        ranges = []
+        for part in header.split("=", 1)[1].split(","):
+            match = range_expr.match(part.strip())
+            if not match:
+                return None
+            start, end = match.groups()
+            if start == "":
+                start, end = max(size - int(end), 0), size - 1
+            else:
+                start = int(start)
+                end = min(int(end), size - 1) if end else size - 1
+            if start > end or start >= size:
+                return None
+            ranges.append((start, end))
+        return ranges
+
+    def _send_file(self, head=False):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.server.record(self.path, None, 0, head, missing=True)
+            self.send_error(404, "File not found")
+            return
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.record(self.path, None, 0, not_modified=True)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        header = self.headers.get("Range")
+        ranges = self._parse_ranges(header, size) if header else None
+        self.server.record(self.path, ranges, size, head)
+
+        if header and ranges is None:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        with open(path, "rb") as f:
+            if not ranges:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(size))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", etag)
+                self.end_headers()
+                if not head:
+                    self.wfile.write(f.read())
+                return
+
+            if len(ranges) == 1:
+                start, end = ranges[0]
+                f.seek(start)
+                body = f.read(end - start + 1)
+                self.send_response(206)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", etag)
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+                return
+
+            boundary = "TILERRANGEBOUNDARY"
+            parts = []
+            for start, end in ranges:
+                f.seek(start)
+                parts.append(
+                    (
+                        f"\r\n--{boundary}\r\n"
+                        "Content-Type: application/octet-stream\r\n"
+                        f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                    ).encode()
+                    + f.read(end - start + 1)
+                )
+            parts.append(f"\r\n--{boundary}--\r\n".encode())
+            body = b"".join(parts)
+            self.send_response(206)
+            self.send_header(
+                "Content-Type", f"multipart/byteranges; boundary={boundary}"
+            )
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Get requests."""
+        if self.path == "/_stats":
+            self._send_json(self.server.snapshot())
+        elif self.path == "/_reset":
+            self.server.reset()
+            self._send_json({})
+        else:
+            self._send_file()
+
+    def do_HEAD(self):
+        """Head requests."""
+        self._send_file(head=True)
+
+
+class RangeServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server serving `directory` and recording range requests.
+
+    Attributes
+    ----------
+    directory : str
+        Directory to serve.
+    port : int, optional
+        Port to listen on (default: 0, any free port).
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory, port=0, host="127.0.0.1"):
+        """Initialize server."""
+        handler = partial(RangeRequestHandler, directory=directory)
+        super().__init__((host, port), handler)
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self):
+        """Server base url."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(
+        self, path, ranges, size, head=False, missing=False, not_modified=False
+    ):
+        """Record a request."""
+        with self._lock:
+            stats = self.requests[path]
+            stats["requests"] += 1
+            if missing:
+                stats["missing"] += 1
+            elif not_modified:
+                stats["not_modified"] += 1
+            elif head:
+                stats["head"] += 1
+            elif ranges:
+                stats["ranges"] += len(ranges)
+                stats["bytes"] += sum(end - start + 1 for start, end in ranges)
+            else:
+                stats["bytes"] += size
+
+    def reset(self):
+        """Reset request statistics."""
+        with self._lock:
+            self.requests = defaultdict(lambda: dict.fromkeys(STATS_KEYS, 0))
+
+    def totals(self):
+        """Return request statistics summed over all paths."""
+        with self._lock:
+            return {
+                k: sum(s[k] for s in self.requests.values()) for k in STATS_KEYS
+            }
+
+    def snapshot(self):
+        """Return request statistics, in total and per path."""
+        totals = self.totals()
+        with self._lock:
+            paths = {path: dict(stats) for path, stats in self.requests.items()}
+        return {"totals": totals, "paths": paths}
+
+
+def serve(directory, port=0, host="127.0.0.1"):
+    """Serve `directory` forever, printing the server url on stdout."""
+    server = RangeServer(directory, port=port, host=host)
+    print(server.url, flush=True)
+    server.serve_forever()
+
+
+class RangeServerProcess(object):
+    """
+    Run a `RangeServer` in a subprocess.
+
+    Usage
+    -----
+    with RangeServerProcess("tests/fixtures") as server:
+        with rasterio.open(f"{server.url}/rgb_cog.tif") as src_dst:
+            ...
+        server.stats()["totals"]["ranges"]
+
+    Attributes
+    ----------
+    directory : str
+        Directory to serve.
+    port : int, optional
+        Port to listen on (default: 0, any free port).
+
+    """
+
+    def __init__(self, directory, port=0):
+        """Initialize process."""
+        self.directory = directory
+        self.port = port
+        self.url = None
+        self._proc = None
+
+    def start(self):
+        """Start server and wait for its url."""
+        code = (
+            "import sys; from tiler.rangeserver import serve; "
+            "serve(sys.argv[1], int(sys.argv[2]))"
+        )
+        self._proc = subprocess.Popen(
+            [sys.executable, "-c", code, self.directory, str(self.port)],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        self.url = self._proc.stdout.readline().strip()
+        if not self.url:
+            self.stop()
+            raise RuntimeError("Range server failed to start")
+        return self
+
+    def stop(self):
+        """Stop server."""
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.wait()
+            self._proc.stdout.close()
+            self._proc = None
+
+    def stats(self):
+        """Return requests statistics recorded by the server."""
+        with urllib.request.urlopen(f"{self.url}/_stats") as resp:
+            return json.loads(resp.read())
+
+    def reset(self):
+        """Reset requests statistics."""
+        urllib.request.urlopen(f"{self.url}/_reset").close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -1,56 +1,273 @@
 """Test tiler locally."""
 
+import os
+import re
+import json
+import time
 import click
 import base64
+import signal
 
 from socketserver import ThreadingMixIn
 
 from urllib.parse import urlparse, parse_qsl
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
-from tiler.api import APP
+from tiler import admission, shmcache
+from tiler.iostats import accounting_enabled
+from tiler.rangeserver import serve
+
+CATALOG_PATH = os.environ.get("TILER_CATALOG")
+
+
+def get_app():
+    """
+    Import and return the tiler application.
+
+    `tiler.api` opens the dataset catalog (SQLite), starts the header
+    prefetch threads and opens GDAL datasets at import: none of these
+    survive fork(), so `run` imports it in each server process, after
+    forking.
+
+    """
+    from tiler.api import APP
+
+    return APP
 
 
 class ThreadingSimpleServer(ThreadingMixIn, HTTPServer):
-    pass
+    daemon_threads = True
+
+
+# Responses kept in the shared tile cache.
+CACHED_ROUTES = re.compile(r"^/(tiles|mosaic)/\d+/\d+/\d+(@\d+x)?\.\w+$")
+CACHED_STATUS = (200, 204)
 
 
 class Handler(BaseHTTPRequestHandler):
     """Requests handler."""
 
+    def _cache_key(self, path):
+        """Return the shared cache key of a tile request, or None."""
+        if shmcache.shared_cache is None or not CACHED_ROUTES.match(path):
+            return None
+        # X-IO-* headers are per request.
+        if accounting_enabled():
+            return None
+        # Responses are gzip compressed or not.
+        return f"{self.path}|{self.headers.get('Accept-Encoding', '')}"
+
+    def _send_cached(self, key):
+        """Send a response from the shared cache, return False on miss."""
+        with shmcache.shared_cache.open(key) as entry:
+            if entry is None:
+                return False
+            status, headers = json.loads(entry.meta)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("X-Cache", "HIT")
+            self.end_headers()
+            shmcache.shared_cache.send(entry, self.connection)
+        return True
+
+    def _send_overloaded(self, err):
+        """Send a 503 response with its Retry-After delay."""
+        body = json.dumps({"errorMessage": str(err)}).encode()
+        self.send_response(503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Retry-After", str(err.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_GET(self):
         """Get requests."""
         q = urlparse(self.path)
+        key = self._cache_key(q.path)
+        if key and self._send_cached(key):
+            return
+
+        gate = admission.gates[admission.route_class(q.path)] if admission.gates else None
+        waited = 0.0
+        if gate is not None:
+            try:
+                waited = gate.acquire()
+            except admission.Overloaded as err:
+                self._send_overloaded(err)
+                return
+
         request = {
             "headers": dict(self.headers),
             "path": q.path,
             "queryStringParameters": dict(parse_qsl(q.query)),
             "httpMethod": self.command,
         }
-        response = APP(request, None)
+        t0 = time.perf_counter()
+        try:
+            response = get_app()(request, None)
+            service = time.perf_counter() - t0
+            timing = f"queue;dur={waited * 1000:.1f}, app;dur={service * 1000:.1f}"
+            self._send_app_response(response, key, timing)
+        finally:
+            # The slot is held until the response is written.
+            if gate is not None:
+                gate.release(time.perf_counter() - t0)
+
+    def _send_app_response(self, response, key, timing):
+        """Send an application response, and keep it in the shared cache."""
+        status = int(response["statusCode"])
 
-        self.send_response(int(response["statusCode"]))
+        self.send_response(status)
         for r in response["headers"]:
             self.send_header(r, response["headers"][r])
+        if key:
+            self.send_header("X-Cache", "MISS")
+        self.send_header("Server-Timing", timing)
         self.end_headers()
 
         if response.get("isBase64Encoded"):
             response["body"] = base64.b64decode(response["body"])
 
         if isinstance(response["body"], str):
-            self.wfile.write(bytes(response["body"], "utf-8"))
-        else:
-            self.wfile.write(response["body"])
+            response["body"] = bytes(response["body"], "utf-8")
+        self.wfile.write(response["body"])
+
+        if key and status in CACHED_STATUS:
+            meta = json.dumps([status, response["headers"]]).encode()
+            shmcache.shared_cache.set(key, meta, response["body"])
 
 
 @click.command(short_help="Local Server")
 @click.option("--port", type=int, default=8000, help="port")
-def run(port):
+@click.option(
+    "--io-accounting",
+    is_flag=True,
+    help="Report GDAL range requests and bytes fetched in X-IO-* headers.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Server processes (forked, sharing the socket and the tile cache).",
+)
+@click.option(
+    "--shared-cache-mb",
+    type=int,
+    default=shmcache.SHARED_CACHE_MB,
+    help="Tile cache shared by the server processes, in MB (default: disabled).",
+)
+@click.option(
+    "--admission",
+    "limits",
+    default=os.environ.get("TILER_ADMISSION"),
+    help="Concurrency and queue size by route class "
+    '(e.g "light=32:128,tiles=4:32,heavy=1:8", default: TILER_ADMISSION), '
+    "divided between the --workers processes.",
+)
+@click.option(
+    "--queue-timeout",
+    type=float,
+    default=admission.QUEUE_TIMEOUT,
+    help="Maximum queue wait before a 503, in seconds (default: 2).",
+)
+@click.option(
+    "--no-admission", is_flag=True, help="Serve every request at once."
+)
+def run(
+    port, io_accounting, workers, shared_cache_mb, limits, queue_timeout, no_admission
+):
     """Launch server."""
+    if io_accounting:
+        os.environ["TILER_IO_ACCOUNTING"] = "TRUE"
+
+    if not no_admission:
+        try:
+            server_limits = admission.parse_limits(limits)
+            admission.gates = admission.create_gates(
+                admission.split_limits(server_limits, max(workers, 1)), queue_timeout
+            )
+        except ValueError as err:
+            raise click.BadParameter(str(err), param_hint="--admission")
+
     server_address = ("", port)
     httpd = ThreadingSimpleServer(server_address, Handler)
-    click.echo(f"Starting local server at http://127.0.0.1:{port}", err=True)
-    httpd.serve_forever()
+    if shared_cache_mb:
+        shmcache.shared_cache = shmcache.SharedTileCache(shared_cache_mb)
+
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                get_app()
+                httpd.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    get_app()
+
+    click.echo(
+        f"Starting local server at http://127.0.0.1:{port} ({workers} processes)",
+        err=True,
+    )
+    try:
+        httpd.serve_forever()
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+
+@click.command(short_help="Local HTTP range server")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option("--port", type=int, default=8080, help="port")
+def range_server(directory, port):
+    """Serve files from DIRECTORY with HTTP range requests support."""
+    click.echo(f"Serving {directory} with range requests support", err=True)
+    serve(directory, port=port)
+
+
+@click.group(short_help="Dataset catalog")
+@click.option(
+    "--db",
+    default=CATALOG_PATH,
+    required=CATALOG_PATH is None,
+    help="Catalog database (default: TILER_CATALOG).",
+)
+@click.pass_context
+def catalog(ctx, db):
+    """Manage the tiler dataset catalog."""
+    from tiler.catalog import Catalog
+
+    ctx.obj = Catalog(db)
+
+
+@catalog.command(short_help="Add datasets to the catalog")
+@click.argument("paths", nargs=-1, required=True)
+@click.option(
+    "--base-url", help="Url the scanned directories are served from (e.g. s3 or http)."
+)
+@click.pass_obj
+def scan(db, paths, base_url):
+    """Add the COGs in PATHS (files, directories or urls) to the catalog."""
+    for url in db.scan(paths, base_url=base_url):
+        click.echo(url)
+    click.echo(f"{len(db)} datasets in {db.path}", err=True)
+
+
+@catalog.command(short_help="Search datasets")
+@click.option("--bbox", help="WGS84 bounds (left,bottom,right,top).")
+@click.option("--start", help="Start date or datetime.")
+@click.option("--end", help="End date or datetime.")
+@click.option("--limit", type=int, default=100, help="Maximum number of datasets.")
+@click.pass_obj
+def search(db, bbox, start, end, limit):
+    """Print the datasets intersecting a bbox and a time range (JSON lines)."""
+    if bbox:
+        bbox = tuple(map(float, bbox.split(",")))
+    for dataset in db.search(bbox=bbox, start=start, end=end, limit=limit):
+        click.echo(json.dumps(dataset))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,463 @@
+"""tiler.shmcache: tile response cache shared by the server processes.
+
+`tiler --workers N` forks N processes serving the same socket. A cache per
+process would divide its hit rate by N and multiply its memory by N: with
+`--shared-cache-mb` (`TILER_SHARED_CACHE_MB`), tile responses (`/tiles`,
+`/mosaic`) are cached once for all processes in a fixed-size shared memory
+segment (a file in /dev/shm, mapped by every process):
+
+- slab allocation: the segment is split in 1 MB pages, each page holds
+  chunks of one size class (4 KB to 1 MB, doubling). A response is stored in
+  the smallest chunk it fits in, pages are given to classes on demand, and
+  moved to a class without pages when none is free,
+- CLOCK eviction within a class: chunks read since the hand last passed
+  get a second chance, chunks being sent (pinned) are skipped,
+- a hash index of buckets of 8 entries (key digest, chunk), guarded by
+  `TILER_SHARED_CACHE_STRIPES` striped locks (bucket modulo stripes), so
+  processes only contend on the same stripe,
+- zero-copy reads: cached bodies are sent from the segment to the socket
+  with `os.sendfile` (or a memoryview of the mapping).
+
+The locks are created before the processes are forked (fork start method).
+
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+import contextlib
+import multiprocessing
+
+SHARED_CACHE_MB = int(os.environ.get("TILER_SHARED_CACHE_MB", 0))
+SHARED_CACHE_STRIPES = int(os.environ.get("TILER_SHARED_CACHE_STRIPES", 64))
+
+PAGE_SIZE = 1 << 20
+MIN_CHUNK = 4096
+# Chunk size classes: 4 KB to 1 MB.
+CLASSES = 9
+CHUNKS_PER_PAGE = PAGE_SIZE // MIN_CHUNK
+WAYS = 8
+FREE_PAGE = 255
+
+MAGIC = b"TILESHM1"
+HEADER_SIZE = 4096
+
+# Segment header: magic, pages, buckets, stripes, then counters.
+SEGMENT = struct.Struct("<8sIII")
+COUNTERS = struct.Struct("<QQQQ")  # sets, evictions, too_large, full
+COUNTERS_OFFSET = 32
+# Per class: clock hand, next fresh chunk (+1), fresh chunks left.
+CLASS = struct.Struct("<III")
+CLASSES_OFFSET = 64
+# Per stripe: hits, misses.
+STRIPE = struct.Struct("<QQ")
+STRIPES_OFFSET = 192
+# Stripe counters fill the header up to the page table.
+MAX_STRIPES = (HEADER_SIZE - STRIPES_OFFSET) // STRIPE.size
+
+# Index entry: key digest, chunk (+1, 0 is empty).
+ENTRY = struct.Struct("<16sI")
+# Chunk header: key digest, pins, reference bit, metadata and body sizes.
+CHUNK = struct.Struct("<16siBxxxII")
+
+EMPTY_DIGEST = bytes(16)
+
+
+def _align(value, size=4096):
+    return -(-value // size) * size
+
+
+def key_digest(key):
+    """Return the 16 bytes digest of a cache key."""
+    if isinstance(key, str):
+        key = key.encode()
+    return hashlib.blake2b(key, digest_size=16).digest()
+
+
+def _segment_dir(size):
+    """Return /dev/shm if it can hold `size` bytes, else the temp directory."""
+    if os.path.isdir("/dev/shm"):
+        stat = os.statvfs("/dev/shm")
+        if stat.f_bavail * stat.f_frsize >= size:
+            return "/dev/shm"
+    return None
+
+
+class CachedResponse(object):
+    """
+    Pinned cache entry: metadata and body in the shared segment.
+
+    Attributes
+    ----------
+    meta : bytes
+        Response metadata (status and headers).
+    body : memoryview
+        Response body, a view of the shared segment.
+    offset, size : int
+        Body position in the segment file (for `os.sendfile`).
+
+    """
+
+    def __init__(self, buf, offset, meta_size, body_size):
+        """Initialize entry."""
+        self.meta = buf[offset : offset + meta_size]
+        self.offset = offset + meta_size
+        self.size = body_size
+        self.body = memoryview(buf)[self.offset : self.offset + body_size]
+
+
+class SharedTileCache(object):
+    """
+    Fixed-size tile response cache in a shared memory segment.
+
+    Usage
+    -----
+    cache = SharedTileCache(256)     # before forking the server processes
+    cache.set("/tiles/8/32/22.png?url=...", meta, body)
+    with cache.open("/tiles/8/32/22.png?url=...") as entry:
+        if entry is not None:
+            cache.send(entry, sock)
+
+    Attributes
+    ----------
+    size_mb : int
+        Data size, in MB (1 MB pages).
+    stripes : int, optional
+        Number of index locks (default: TILER_SHARED_CACHE_STRIPES).
+    directory : str, optional
+        Directory of the segment file (default: /dev/shm if large enough).
+
+    """
+
+    def __init__(self, size_mb, stripes=SHARED_CACHE_STRIPES, directory=None):
+        """Create the segment and its locks."""
+        self.npages = min(max(int(size_mb), 1), FREE_PAGE * 1024)
+        self.stripes = min(max(stripes, 1), MAX_STRIPES)
+        # Twice as many index entries as 4 KB chunks.
+        self.nbuckets = max(self.npages * CHUNKS_PER_PAGE * 2 // WAYS, 64)
+        self._table = HEADER_SIZE
+        self._index = _align(self._table + self.npages)
+        self._data = _align(self._index + self.nbuckets * WAYS * ENTRY.size)
+        self.size = self._data + self.npages * PAGE_SIZE
+
+        self._file = tempfile.TemporaryFile(
+            prefix="tiler-cache-", dir=directory or _segment_dir(self.size)
+        )
+        self._file.truncate(self.size)
+        self.fd = self._file.fileno()
+        self.buf = mmap.mmap(self.fd, self.size)
+        SEGMENT.pack_into(self.buf, 0, MAGIC, self.npages, self.nbuckets, self.stripes)
+        self.buf[self._table : self._table + self.npages] = (
+            bytes([FREE_PAGE]) * self.npages
+        )
+
+        self._locks = [multiprocessing.Lock() for _ in range(self.stripes)]
+        self._alloc_lock = multiprocessing.Lock()
+
+    # Index
+
+    def _bucket(self, digest):
+        return int.from_bytes(digest[:8], "little") % self.nbuckets
+
+    def _lock(self, digest):
+        return self._bucket(digest) % self.stripes
+
+    def _find(self, digest):
+        """Return the index entry offset and chunk of a digest (stripe lock held)."""
+        offset = self._index + self._bucket(digest) * WAYS * ENTRY.size
+        for way in range(WAYS):
+            entry_digest, ref = ENTRY.unpack_from(self.buf, offset)
+            if ref and entry_digest == digest:
+                return offset, ref - 1
+            offset += ENTRY.size
+        return None, None
+
+    def _insert(self, digest, ref):
+        """Index a chunk, replacing the key or a victim entry (stripe lock held)."""
+        start = self._index + self._bucket(digest) * WAYS * ENTRY.size
+        target = None
+        for way in range(WAYS):
+            offset = start + way * ENTRY.size
+            entry_digest, entry_ref = ENTRY.unpack_from(self.buf, offset)
+            if entry_ref and entry_digest == digest:
+                target = offset
+                break
+            if not entry_ref and target is None:
+                target = offset
+        if target is None:
+            # Full bucket: the replaced chunk is reclaimed by the clock.
+            target = start + digest[8] % WAYS * ENTRY.size
+        ENTRY.pack_into(self.buf, target, digest, ref + 1)
+
+    # Chunks
+
+    def _class(self, page):
+        return self.buf[self._table + page]
+
+    def _chunk(self, ref):
+        """Return the offset and size of a chunk."""
+        page, ix = divmod(ref, CHUNKS_PER_PAGE)
+        size = MIN_CHUNK << self._class(page)
+        return self._data + page * PAGE_SIZE + ix * size, size
+
+    def _counter(self, index, value=1):
+        offset = COUNTERS_OFFSET + index * 8
+        (count,) = struct.unpack_from("<Q", self.buf, offset)
+        struct.pack_into("<Q", self.buf, offset, count + value)
+
+    def _class_state(self, cls):
+        return list(CLASS.unpack_from(self.buf, CLASSES_OFFSET + cls * CLASS.size))
+
+    def _set_class_state(self, cls, state):
+        CLASS.pack_into(self.buf, CLASSES_OFFSET + cls * CLASS.size, *state)
+
+    def _pages(self, cls):
+        table = self.buf[self._table : self._table + self.npages]
+        return [page for page, value in enumerate(table) if value == cls]
+
+    def _evict(self, ref, offset, second_chance=True):
+        """
+        Free a chunk if it is not pinned nor recently read (allocation lock held).
+
+        Returns True if the chunk is free.
+
+        """
+        digest, pins, refbit, meta_size, body_size = CHUNK.unpack_from(self.buf, offset)
+        if digest == EMPTY_DIGEST:
+            return True
+        with self._locks[self._lock(digest)]:
+            digest, pins, refbit, meta_size, body_size = CHUNK.unpack_from(
+                self.buf, offset
+            )
+            if pins > 0:
+                return False
+            entry, indexed = self._find(digest)
+            if indexed != ref:
+                entry = None
+            if entry is not None and refbit and second_chance:
+                CHUNK.pack_into(self.buf, offset, digest, pins, 0, meta_size, body_size)
+                return False
+            if entry is not None:
+                ENTRY.pack_into(self.buf, entry, EMPTY_DIGEST, 0)
+                self._counter(1)
+            CHUNK.pack_into(self.buf, offset, EMPTY_DIGEST, 0, 0, 0, 0)
+        return True
+
+    def _assign_page(self, page, cls):
+        """Give a page to a class (allocation lock held)."""
+        self.buf[self._table + page] = cls
+        size = MIN_CHUNK << cls
+        start = self._data + page * PAGE_SIZE
+        for offset in range(start, start + PAGE_SIZE, size):
+            CHUNK.pack_into(self.buf, offset, EMPTY_DIGEST, 0, 0, 0, 0)
+        hand, _, _ = self._class_state(cls)
+        first = page * CHUNKS_PER_PAGE
+        self._set_class_state(cls, [hand, first + 2, PAGE_SIZE // size - 1])
+        return first
+
+    def _steal_page(self, cls):
+        """Move a page of the largest class to `cls`, return its first chunk."""
+        counts = {}
+        for value in self.buf[self._table : self._table + self.npages]:
+            counts[value] = counts.get(value, 0) + 1
+        for victim in sorted(counts, key=counts.get, reverse=True):
+            if victim in (cls, FREE_PAGE) or counts[victim] < 2:
+                continue
+            size = MIN_CHUNK << victim
+            hand, fresh, fresh_left = self._class_state(victim)
+            for page in self._pages(victim):
+                start = self._data + page * PAGE_SIZE
+                first = page * CHUNKS_PER_PAGE
+                chunks = [
+                    (first + ix, start + ix * size) for ix in range(PAGE_SIZE // size)
+                ]
+                if any(
+                    CHUNK.unpack_from(self.buf, offset)[1] > 0 for _, offset in chunks
+                ):
+                    continue
+                for ref, offset in chunks:
+                    # Pinned since checked: try the next page.
+                    if not self._evict(ref, offset, second_chance=False):
+                        break
+                else:
+                    if fresh and first <= fresh - 1 < first + CHUNKS_PER_PAGE:
+                        self._set_class_state(victim, [hand, 0, 0])
+                    return self._assign_page(page, cls)
+        return None
+
+    def _allocate(self, cls):
+        """Return a free chunk of class `cls`, or None (allocation lock held)."""
+        hand, fresh, fresh_left = self._class_state(cls)
+        if fresh_left:
+            self._set_class_state(cls, [hand, fresh + 1, fresh_left - 1])
+            return fresh - 1
+
+        table = self.buf[self._table : self._table + self.npages]
+        free = table.find(bytes([FREE_PAGE]))
+        if free >= 0:
+            return self._assign_page(free, cls)
+
+        pages = self._pages(cls)
+        per_page = PAGE_SIZE // (MIN_CHUNK << cls)
+        total = len(pages) * per_page
+        # Two turns: reference bits cleared on the first one.
+        for _ in range(2 * total):
+            position = hand % total
+            hand = position + 1
+            page, ix = divmod(position, per_page)
+            ref = pages[page] * CHUNKS_PER_PAGE + ix
+            offset, _ = self._chunk(ref)
+            if self._evict(ref, offset):
+                self._set_class_state(cls, [hand, 0, 0])
+                return ref
+        self._set_class_state(cls, [hand, 0, 0])
+        return self._steal_page(cls)
+
+    # API
+
+    def set(self, key, meta, body):
+        """
+        Cache a response.
+
+        Attributes
+        ----------
+        key : str or bytes
+        meta : bytes
+            Response metadata (status and headers).
+        body : bytes
+
+        Returns
+        -------
+        cached : bool
+            False if the response is larger than the largest chunk, or all
+            the chunks of its class are being read.
+
+        """
+        size = CHUNK.size + len(meta) + len(body)
+        cls = max(-(-size // MIN_CHUNK) - 1, 0).bit_length()
+        if cls >= CLASSES:
+            with self._alloc_lock:
+                self._counter(2)
+            return False
+
+        digest = key_digest(key)
+        with self._alloc_lock:
+            ref = self._allocate(cls)
+            if ref is None:
+                self._counter(3)
+                return False
+            offset, _ = self._chunk(ref)
+            # Pinned (not indexed yet) while written.
+            CHUNK.pack_into(self.buf, offset, digest, 1, 0, 0, 0)
+            self._counter(0)
+
+        start = offset + CHUNK.size
+        self.buf[start : start + len(meta)] = meta
+        self.buf[start + len(meta) : start + len(meta) + len(body)] = body
+
+        with self._locks[self._lock(digest)]:
+            CHUNK.pack_into(self.buf, offset, digest, 0, 0, len(meta), len(body))
+            self._insert(digest, ref)
+        return True
+
+    @contextlib.contextmanager
+    def open(self, key):
+        """Yield the cached response of `key` (pinned), or None."""
+        digest = key_digest(key)
+        stripe = self._lock(digest)
+        lock = self._locks[stripe]
+        with lock:
+            _, ref = self._find(digest)
+            stripe_offset = STRIPES_OFFSET + stripe * STRIPE.size
+            hits, misses = STRIPE.unpack_from(self.buf, stripe_offset)
+            if ref is None:
+                STRIPE.pack_into(self.buf, stripe_offset, hits, misses + 1)
+            else:
+                STRIPE.pack_into(self.buf, stripe_offset, hits + 1, misses)
+                offset, _ = self._chunk(ref)
+                _, pins, _, meta_size, body_size = CHUNK.unpack_from(self.buf, offset)
+                CHUNK.pack_into(
+                    self.buf, offset, digest, pins + 1, 1, meta_size, body_size
+                )
+
+        if ref is None:
+            yield None
+            return
+
+        entry = CachedResponse(self.buf, offset + CHUNK.size, meta_size, body_size)
+        try:
+            yield entry
+        finally:
+            entry.body.release()
+            with lock:
+                _, pins, refbit, meta_size, body_size = CHUNK.unpack_from(
+                    self.buf, offset
+                )
+                CHUNK.pack_into(
+                    self.buf, offset, digest, pins - 1, refbit, meta_size, body_size
+                )
+
+    def get(self, key):
+        """Return the (meta, body) of a cached response, or None."""
+        with self.open(key) as entry:
+            if entry is None:
+                return None
+            return entry.meta, bytes(entry.body)
+
+    def send(self, entry, sock):
+        """Send the body of a cached response to a socket, without copy."""
+        if not hasattr(os, "sendfile"):
+            sock.sendall(entry.body)
+            return
+        offset, left = entry.offset, entry.size
+        while left:
+            sent = os.sendfile(sock.fileno(), self.fd, offset, left)
+            if not sent:
+                raise BrokenPipeError("Connection closed")
+            offset += sent
+            left -= sent
+
+    def stats(self):
+        """Return cache statistics (for all the processes)."""
+        hits = misses = 0
+        for stripe in range(self.stripes):
+            stripe_hits, stripe_misses = STRIPE.unpack_from(
+                self.buf, STRIPES_OFFSET + stripe * STRIPE.size
+            )
+            hits += stripe_hits
+            misses += stripe_misses
+        sets, evictions, too_large, full = COUNTERS.unpack_from(
+            self.buf, COUNTERS_OFFSET
+        )
+        table = self.buf[self._table : self._table + self.npages]
+        return {
+            "size_mb": self.npages,
+            "pages": {
+                f"{(MIN_CHUNK << cls) // 1024}k": table.count(bytes([cls]))
+                for cls in range(CLASSES)
+                if cls in table
+            },
+            "free_pages": table.count(bytes([FREE_PAGE])),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "sets": sets,
+            "evictions": evictions,
+            "too_large": too_large,
+            "full": full,
+        }
+
+    def close(self):
+        """Unmap the segment (in this process)."""
+        self.buf.close()
+        self._file.close()
+
+
+shared_cache = None
+
+
+def stats():
+    """Return the shared cache statistics (None if not configured)."""
+    return shared_cache.stats() if shared_cache is not None else None
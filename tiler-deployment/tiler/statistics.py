@@ -0,0 +1,125 @@
+"""tiler.statistics: precomputed band statistics.
+
+COGs written by file-to-cog store full resolution band statistics in their
+band metadata (STATISTICS_* tags). Those are in the file header, so they
+come with the cached dataset header and `/metadata` can answer without
+reading any pixel, when the requested parameters match.
+
+"""
+
+import json
+import math
+
+# Percentiles returned by `/metadata` (as `rio_tiler.main.metadata`).
+PMIN, PMAX = 2, 98
+
+
+def band_statistics(src_dst):
+    """
+    Return the precomputed statistics of a dataset, by band index (str).
+
+    Returns None if any band has no STATISTICS_* metadata.
+
+    """
+    statistics = {}
+    for ix in src_dst.indexes:
+        tags = src_dst.tags(ix)
+        if "STATISTICS_HISTOGRAM" not in tags or "STATISTICS_PERCENTILES" not in tags:
+            return None
+
+        def _value(name):
+            value = tags.get(name)
+            return float(value) if value is not None else None
+
+        statistics[str(ix)] = {
+            "min": _value("STATISTICS_MINIMUM"),
+            "max": _value("STATISTICS_MAXIMUM"),
+            "mean": _value("STATISTICS_MEAN"),
+            "std": _value("STATISTICS_STDDEV"),
+            "valid_percent": _value("STATISTICS_VALID_PERCENT"),
+            "percentiles": json.loads(tags["STATISTICS_PERCENTILES"]),
+            "histogram": json.loads(tags["STATISTICS_HISTOGRAM"]),
+        }
+    return statistics
+
+
+def _same_nodata(nodata, dataset_nodata):
+    if nodata is None:
+        return True
+    if dataset_nodata is None:
+        return False
+    if math.isnan(nodata) or math.isnan(dataset_nodata):
+        return math.isnan(nodata) and math.isnan(dataset_nodata)
+    return nodata == dataset_nodata
+
+
+def precomputed_metadata(
+    url,
+    info,
+    nodata=None,
+    indexes=None,
+    overview_level=None,
+    histogram_bins=20,
+    histogram_range=None,
+):
+    """
+    Return `/metadata` from precomputed statistics, if they match.
+
+    Statistics match when no overview level nor histogram range is
+    requested, the nodata value is the dataset one, the histogram has
+    `histogram_bins` bins and the 2nd and 98th percentiles are stored.
+
+    Attributes
+    ----------
+    url : str
+        Dataset url.
+    info : dict
+        Dataset info (`tiler.headers.dataset_info`).
+    Other attributes are the `/metadata` parameters.
+
+    Returns
+    -------
+    metadata : dict or None
+        Same structure as `rio_tiler.main.metadata`, plus mean and
+        valid_percent, None if the statistics do not match the request.
+
+    """
+    statistics = info.get("statistics")
+    if not statistics or overview_level is not None or histogram_range is not None:
+        return None
+
+    if not _same_nodata(nodata, info["nodata"]):
+        return None
+
+    indexes = indexes or range(1, info["count"] + 1)
+    bands = {}
+    for ix in indexes:
+        stats = statistics.get(str(ix))
+        if stats is None:
+            return None
+
+        counts, edges = stats["histogram"]
+        percentiles = stats["percentiles"]
+        if len(counts) != histogram_bins:
+            return None
+        if str(PMIN) not in percentiles or str(PMAX) not in percentiles:
+            return None
+
+        bands[str(ix)] = {
+            "pc": [percentiles[str(PMIN)], percentiles[str(PMAX)]],
+            "min": stats["min"],
+            "max": stats["max"],
+            "std": stats["std"],
+            "mean": stats["mean"],
+            "valid_percent": stats["valid_percent"],
+            "histogram": [counts, edges],
+        }
+
+    return {
+        "address": url,
+        "bounds": {"value": info["bounds"], "crs": "EPSG:4326"},
+        "minzoom": info["minzoom"],
+        "maxzoom": info["maxzoom"],
+        "band_descriptions": [[ix, info["band_names"][ix - 1]] for ix in indexes],
+        "statistics": bands,
+    }
@@ -0,0 +1,320 @@
+"""tiler.terrain: elevation encoding and terrain derivatives."""
+
+import os
+import math
+import threading
+
+import numpy
+
+import mercantile
+import rasterio
+from rasterio.warp import transform_bounds
+
+from rio_tiler import utils
+from rio_tiler.errors import TileOutsideBounds
+
+from .cache import LRUCache
+
+EARTH_CIRCUMFERENCE = 2 * math.pi * 6378137.0
+
+TERRAIN_MODES = ("hillshade", "slope", "aspect")
+
+# Default rescaling range (in output unit) for each terrain mode.
+TERRAIN_RANGES = {"hillshade": (0, 255), "slope": (0, 90), "aspect": (0, 360)}
+
+# A 256x256 entry is 320 KB (float32 data and uint8 mask), 1.25 MB at 512x512:
+# the cache is bounded by total size as well as by entry count.
+terrain_cache = LRUCache(
+    int(os.environ.get("TILER_TERRAIN_CACHE_SIZE", 256)),
+    maxbytes=int(os.environ.get("TILER_TERRAIN_CACHE_MB", 64)) * 2 ** 20,
+    sizeof=lambda result: result[0].nbytes + result[1].nbytes,
+)
+
+_buffers = threading.local()
+
+
+def get_buffer(shape, dtype=numpy.uint8):
+    """
+    Return a thread-local reusable array.
+
+    The array content is undefined and is overwritten by the next call
+    with the same shape and dtype in the same thread.
+
+    """
+    pool = getattr(_buffers, "pool", None)
+    if pool is None:
+        pool = _buffers.pool = {}
+
+    key = (tuple(shape), numpy.dtype(dtype).str)
+    arr = pool.get(key)
+    if arr is None:
+        arr = pool[key] = numpy.empty(shape, dtype=dtype)
+    return arr
+
+
+def mapbox_elevation_rgb(arr, baseval=-10000, interval=1, out=None):
+    """
+    Encode elevation value to RGB values compatible with Mapbox terrain-rgb.
+
+    Attributes
+    ----------
+    arr : numpy ndarray
+        Elevation array (h, w).
+    baseval : float, optional
+        Minimum elevation value (default: -10000).
+    interval : float, optional
+        Elevation interval (default: 1).
+    out : numpy ndarray, optional
+        Preallocated uint8 array (3, h, w) to write into.
+
+    Returns
+    -------
+    out : numpy ndarray
+        RGB array (3, h, w)
+
+    """
+    if out is None:
+        out = numpy.empty((3,) + arr.shape, dtype=numpy.uint8)
+
+    value = get_buffer(arr.shape, numpy.float64)
+    numpy.subtract(arr, baseval, out=value)
+    numpy.divide(value, interval, out=value)
+    numpy.around(value, out=value)
+    numpy.clip(value, 0, 256 ** 3 - 1, out=value)
+
+    ivalue = get_buffer(arr.shape, numpy.uint32)
+    numpy.copyto(ivalue, value, casting="unsafe")
+    numpy.bitwise_and(ivalue, 0xFF, out=out[2], casting="unsafe")
+    numpy.right_shift(ivalue, 8, out=ivalue)
+    numpy.bitwise_and(ivalue, 0xFF, out=out[1], casting="unsafe")
+    numpy.right_shift(ivalue, 8, out=ivalue)
+    numpy.bitwise_and(ivalue, 0xFF, out=out[0], casting="unsafe")
+    return out
+
+
+def mapzen_elevation_rgb(arr, out=None):
+    """
+    Encode elevation value to RGB values compatible with Mapzen tangram.
+
+    Attributes
+    ----------
+    arr : numpy ndarray
+        Elevation array (h, w).
+    out : numpy ndarray, optional
+        Preallocated uint8 array (3, h, w) to write into.
+
+    Returns
+    -------
+    out : numpy ndarray
+        RGB array (3, h, w)
+
+    """
+    if out is None:
+        out = numpy.empty((3,) + arr.shape, dtype=numpy.uint8)
+
+    value = get_buffer(arr.shape, numpy.float64)
+    numpy.add(arr, 32768.0, out=value)
+    numpy.clip(value, 0.0, 65535.0, out=value)
+    numpy.floor_divide(value, 256, out=out[0], casting="unsafe")
+    numpy.remainder(value, 256, out=out[1], casting="unsafe")
+    numpy.multiply(value, 256, out=value)
+    numpy.remainder(value, 256, out=out[2], casting="unsafe")
+    return out
+
+
+def _gradient(arr, xres, yres):
+    """
+    Compute x/y elevation gradients using Horn's 3x3 kernel.
+
+    `arr` must have a 1 pixel buffer on each side, the output arrays are
+    2 pixels smaller than the input in each dimension.
+
+    """
+    a = arr[:-2, :-2]
+    b = arr[:-2, 1:-1]
+    c = arr[:-2, 2:]
+    d = arr[1:-1, :-2]
+    f = arr[1:-1, 2:]
+    g = arr[2:, :-2]
+    h = arr[2:, 1:-1]
+    i = arr[2:, 2:]
+
+    dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * xres)
+    dzdy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * yres)
+    return dzdx, dzdy
+
+
+def slope(arr, xres, yres, zfactor=1):
+    """Return slope in degrees from a 1 pixel buffered elevation array."""
+    dzdx, dzdy = _gradient(arr * zfactor, xres, yres)
+    return numpy.degrees(numpy.arctan(numpy.hypot(dzdx, dzdy)))
+
+
+def aspect(arr, xres, yres, zfactor=1):
+    """Return aspect in compass degrees from a 1 pixel buffered elevation array."""
+    dzdx, dzdy = _gradient(arr * zfactor, xres, yres)
+    angle = numpy.degrees(numpy.arctan2(dzdy, -dzdx))
+    return numpy.where(angle > 90, 450 - angle, 90 - angle)
+
+
+def hillshade(arr, xres, yres, azimuth=315, altitude=45, zfactor=1):
+    """Return hillshade (0-255) from a 1 pixel buffered elevation array."""
+    dzdx, dzdy = _gradient(arr * zfactor, xres, yres)
+    slope_rad = numpy.arctan(numpy.hypot(dzdx, dzdy))
+    aspect_rad = numpy.arctan2(dzdy, -dzdx)
+
+    zenith_rad = math.radians(90 - altitude)
+    azimuth_rad = math.radians((360 - azimuth + 90) % 360)
+
+    shaded = numpy.cos(zenith_rad) * numpy.cos(slope_rad) + numpy.sin(
+        zenith_rad
+    ) * numpy.sin(slope_rad) * numpy.cos(azimuth_rad - aspect_rad)
+    return numpy.clip(255 * shaded, 0, 255)
+
+
+def buffered_tile_read(
+    address, tile_x, tile_y, tile_z, tilesize=256, buffer=1, **kwargs
+):
+    """
+    Create mercator tile with a pixel buffer on each edge in a single read.
+
+    Attributes
+    ----------
+    address : str
+        file url.
+    tile_x : int
+        Mercator tile X index.
+    tile_y : int
+        Mercator tile Y index.
+    tile_z : int
+        Mercator tile ZOOM level.
+    tilesize : int, optional (default: 256)
+        Output image size (without buffer).
+    buffer : int, optional (default: 1)
+        Number of pixels to add on each edge.
+    kwargs: dict, optional
+        These will be passed to the 'rio_tiler.utils.tile_read' function.
+
+    Returns
+    -------
+    data : numpy ndarray
+        (bands, tilesize + 2 * buffer, tilesize + 2 * buffer) array.
+    mask: numpy array
+
+    """
+    with rasterio.open(address) as src_dst:
+        bounds = transform_bounds(
+            src_dst.crs, "epsg:4326", *src_dst.bounds, densify_pts=21
+        )
+        if not utils.tile_exists(bounds, tile_z, tile_x, tile_y):
+            raise TileOutsideBounds(
+                f"Tile {tile_z}/{tile_x}/{tile_y} is outside image bounds"
+            )
+
+        left, bottom, right, top = mercantile.xy_bounds(
+            mercantile.Tile(x=tile_x, y=tile_y, z=tile_z)
+        )
+        pad = buffer * (right - left) / tilesize
+        tile_bounds = (left - pad, bottom - pad, right + pad, top + pad)
+        return utils.tile_read(src_dst, tile_bounds, tilesize + 2 * buffer, **kwargs)
+
+
+def terrain_tile(
+    address,
+    tile_x,
+    tile_y,
+    tile_z,
+    mode="hillshade",
+    tilesize=256,
+    bidx=1,
+    nodata=None,
+    azimuth=315,
+    altitude=45,
+    zfactor=1,
+    resampling_method="bilinear",
+):
+    """
+    Create a terrain derivative (hillshade, slope or aspect) mercator tile.
+
+    Results are cached per tile and parameters in `terrain_cache`.
+
+    Attributes
+    ----------
+    address : str
+        file url.
+    tile_x : int
+        Mercator tile X index.
+    tile_y : int
+        Mercator tile Y index.
+    tile_z : int
+        Mercator tile ZOOM level.
+    mode : str, optional
+        One of "hillshade", "slope" or "aspect" (default: hillshade).
+    tilesize : int, optional (default: 256)
+        Output image size.
+    bidx : int, optional
+        Elevation band index (default: 1).
+    nodata: int or float, optional
+        Custom nodata value.
+    azimuth : float, optional
+        Sun azimuth in degrees for hillshade (default: 315).
+    altitude : float, optional
+        Sun altitude in degrees for hillshade (default: 45).
+    zfactor : float, optional
+        Vertical exaggeration (default: 1).
+    resampling_method : str, optional (default: "bilinear")
+        Resampling algorithm.
+
+    Returns
+    -------
+    data : numpy ndarray
+        float32 (1, tilesize, tilesize) array.
+    mask: numpy array
+        uint8 (tilesize, tilesize) array (0 or 255).
+
+    """
+    if mode not in TERRAIN_MODES:
+        raise ValueError(f"Invalid terrain mode: {mode}")
+
+    key = (
+        address, tile_z, tile_x, tile_y, tilesize, mode, bidx,
+        nodata, azimuth, altitude, zfactor, resampling_method,
+    )
+    cached = terrain_cache.get(key)
+    if cached is not None:
+        return cached[0].copy(), cached[1]
+
+    data, mask = buffered_tile_read(
+        address,
+        tile_x,
+        tile_y,
+        tile_z,
+        tilesize=tilesize,
+        indexes=bidx,
+        nodata=nodata,
+        resampling_method=resampling_method,
+    )
+    elevation = data[0].astype(numpy.float64)
+    elevation[mask == 0] = numpy.nan
+
+    # Mercator pixel size scaled to ground distance at the tile center.
+    lat = mercantile.ul(tile_x, tile_y + 0.5, tile_z).lat
+    res = EARTH_CIRCUMFERENCE / 2 ** tile_z / tilesize * math.cos(math.radians(lat))
+
+    if mode == "hillshade":
+        arr = hillshade(
+            elevation, res, res, azimuth=azimuth, altitude=altitude, zfactor=zfactor
+        )
+    elif mode == "slope":
+        arr = slope(elevation, res, res, zfactor=zfactor)
+    else:
+        arr = aspect(elevation, res, res, zfactor=zfactor)
+
+    valid = numpy.isfinite(arr)
+    arr[~valid] = 0
+    result = (
+        arr.astype(numpy.float32)[numpy.newaxis],
+        numpy.where(valid, 255, 0).astype(numpy.uint8),
+    )
+    terrain_cache.set(key, result)
+    return result[0].copy(), result[1]